@@ -13,6 +13,7 @@ from flask_cors import CORS
 from sqlalchemy import inspect
 from datetime import datetime, date
 import os
+import logging
 
 from app.models import db, bcrypt, Admin, User, SuperAdmin
 from config import Config
@@ -25,6 +26,8 @@ scheduler = APScheduler()
 def create_app(config_class=Config):
     app = Flask(__name__, static_folder=None)
     app.config.from_object(config_class)
+    # Service loggers ([sync], [imap], ...) log at INFO; configured once here
+    logging.basicConfig(level=logging.INFO)
 
     # Init extensions
     db.init_app(app)
@@ -33,95 +36,11 @@ def create_app(config_class=Config):
     migrate.init_app(app, db)
     CORS(app)
     
-    # Scheduler
+    # Scheduler: jobs only run in the process holding the scheduler lease,
+    # started from wsgi.py / run.py or `flask run-scheduler` (not on import)
     scheduler.init_app(app)
-    scheduler.start()
-    
-    # Register Jobs
-    try:
-        from app.services.indiamart_service import scheduled_sync_job
-        # Remove existing if any (to avoid duplicates on reload)
-        if scheduler.get_job('indiamart_sync'):
-             scheduler.remove_job('indiamart_sync')
-             
-        scheduler.add_job(
-            id='indiamart_sync', 
-            func=scheduled_sync_job, 
-            args=[app], 
-            trigger='interval', 
-            minutes=15
-        )
-        
-        # Magicbricks Job (Every 10 mins)
-        from app.services.magicbricks_service import scheduled_magicbricks_job
-        if scheduler.get_job('magicbricks_sync'):
-             scheduler.remove_job('magicbricks_sync')
-             
-        scheduler.add_job(
-            id='magicbricks_sync', 
-            func=scheduled_magicbricks_job, 
-            args=[app], 
-            trigger='interval', 
-
-            minutes=10
-        )
-
-        # 99acres Job (Every 10 mins)
-        from app.services.ninety_nine_acres_service import scheduled_99acres_job
-        if scheduler.get_job('99acres_sync'):
-             scheduler.remove_job('99acres_sync')
-             
-
-        scheduler.add_job(
-            id='99acres_sync', 
-            func=scheduled_99acres_job, 
-            args=[app], 
-            trigger='interval', 
-            minutes=10
-        )
-
-        # JustDial Job
-        from app.services.justdial_service import scheduled_justdial_job
-        if scheduler.get_job('justdial_sync'):
-             scheduler.remove_job('justdial_sync')
-             
-
-        scheduler.add_job(
-            id='justdial_sync', 
-            func=scheduled_justdial_job, 
-            args=[app], 
-            trigger='interval', 
-            minutes=10
-        )
-
-        # Housing Job
-        from app.services.housing_service import scheduled_housing_job
-        if scheduler.get_job('housing_sync'):
-             scheduler.remove_job('housing_sync')
-             
-        scheduler.add_job(
-            id='housing_sync', 
-            func=scheduled_housing_job, 
-            args=[app], 
-            trigger='interval', 
-            minutes=10
-        )
-
-        # WhatsApp Template Auto-Sync (Every 30 mins)
-        from app.services.whatsapp_service import sync_all_wa_templates
-        if scheduler.get_job('wa_template_sync'):
-             scheduler.remove_job('wa_template_sync')
-             
-        scheduler.add_job(
-            id='wa_template_sync',
-            func=sync_all_wa_templates,
-            args=[app],
-            trigger='interval',
-            minutes=30
-        )
-
-    except Exception as e:
-        print(f"Scheduler Error: {e}")
+    from app.services.scheduler_leader import run_scheduler_command
+    app.cli.add_command(run_scheduler_command)
 
     # Run DB Patch
     with app.app_context():
@@ -337,6 +256,9 @@ def create_app(config_class=Config):
     from app.routes.whatsapp import bp as whatsapp_bp
     app.register_blueprint(whatsapp_bp)  # WhatsApp CRM Messaging
 
+    from app.routes.search import bp as search_bp
+    app.register_blueprint(search_bp)  # Unified search (leads, calls, WA contacts)
+
 
     # =======================================================
     # DATABASE INIT
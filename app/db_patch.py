@@ -200,6 +200,16 @@ def run_schema_patch():
                     except Exception as e:
                          print(f"❌ Failed to add auto_sync_enabled: {e}")
 
+                for col_name, col_type in (('backfill_start', 'TIMESTAMP'), ('backfill_end', 'TIMESTAMP'),
+                                           ('backfill_cursor', 'TIMESTAMP'), ('backfill_active', 'BOOLEAN DEFAULT FALSE')):
+                    if col_name not in im_cols:
+                        print(f"Adding {col_name} to indiamart_settings table...")
+                        try:
+                             conn.execute(text(f'ALTER TABLE indiamart_settings ADD COLUMN {col_name} {col_type}'))
+                             print(f"✅ Added {col_name} to indiamart_settings")
+                        except Exception as e:
+                             print(f"❌ Failed to add {col_name}: {e}")
+
             # -------------------------------------------------------------
             # MAGICBRICKS TABLES
             # -------------------------------------------------------------
@@ -377,7 +387,159 @@ def run_schema_patch():
                     except Exception as e:
                          print(f"❌ Failed to add connection_id: {e}")
 
+            # -------------------------------------------------------------
+            # EMAIL PORTAL IMAP CHECKPOINTS
+            # -------------------------------------------------------------
+            for table in ('magicbricks_settings', 'ninety_nine_acres_settings', 'justdial_settings', 'housing_settings'):
+                if table not in inspector.get_table_names():
+                    continue
+                portal_cols = [c['name'] for c in inspector.get_columns(table)]
+                for col_name, col_type in (('imap_last_uid', 'BIGINT DEFAULT 0'), ('imap_uidvalidity', 'BIGINT')):
+                    if col_name not in portal_cols:
+                        print(f"Adding {col_name} to {table} table...")
+                        try:
+                             conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {col_name} {col_type}'))
+                             print(f"✅ Added {col_name} to {table}")
+                        except Exception as e:
+                             print(f"❌ Failed to add {col_name} to {table}: {e}")
+
+            # -------------------------------------------------------------
+            # WA CONVERSATION LOCK HOLDER TYPE + EXPIRY INDEX
+            # -------------------------------------------------------------
+            if 'wa_conversation_locks' in inspector.get_table_names():
+                lock_cols = [c['name'] for c in inspector.get_columns('wa_conversation_locks')]
+                if 'holder_type' not in lock_cols:
+                    print("Adding holder_type to wa_conversation_locks table...")
+                    try:
+                        conn.execute(text("ALTER TABLE wa_conversation_locks ADD COLUMN holder_type VARCHAR(10) NOT NULL DEFAULT 'user'"))
+                        # Existing holders resolved User first, then Admin
+                        conn.execute(text('''
+                            UPDATE wa_conversation_locks SET holder_type = 'admin'
+                            WHERE agent_id NOT IN (SELECT id FROM users)
+                              AND agent_id IN (SELECT id FROM admins)
+                        '''))
+                        print("✅ Added holder_type to wa_conversation_locks")
+                    except Exception as e:
+                        print(f"❌ Failed to add holder_type to wa_conversation_locks: {e}")
+                lock_indexes = [i['name'] for i in inspector.get_indexes('wa_conversation_locks')]
+                if 'ix_wa_conversation_locks_expires_at' not in lock_indexes:
+                    try:
+                        conn.execute(text('CREATE INDEX ix_wa_conversation_locks_expires_at ON wa_conversation_locks (expires_at)'))
+                        print("✅ Added ix_wa_conversation_locks_expires_at")
+                    except Exception as e:
+                        print(f"❌ Failed to add ix_wa_conversation_locks_expires_at: {e}")
+
+            # -------------------------------------------------------------
+            # WA TEMPLATE SYNC (content hash + conditional fetch)
+            # -------------------------------------------------------------
+            for table, columns in (('wa_templates', (('content_hash', 'VARCHAR(64)'),)),
+                                   ('whatsapp_configs', (('templates_etag', 'VARCHAR(255)'),
+                                                         ('templates_synced_at', 'TIMESTAMP')))):
+                if table not in inspector.get_table_names():
+                    continue
+                existing_cols = [c['name'] for c in inspector.get_columns(table)]
+                for col_name, col_type in columns:
+                    if col_name not in existing_cols:
+                        print(f"Adding {col_name} to {table} table...")
+                        try:
+                             conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {col_name} {col_type}'))
+                             print(f"✅ Added {col_name} to {table}")
+                        except Exception as e:
+                             print(f"❌ Failed to add {col_name} to {table}: {e}")
+
+            # -------------------------------------------------------------
+            # WA CONVERSATION INBOX COLUMNS (denormalized last message)
+            # -------------------------------------------------------------
+            if 'wa_conversations' in inspector.get_table_names():
+                conv_cols = [c['name'] for c in inspector.get_columns('wa_conversations')]
+                inbox_columns = {
+                    'last_message_id': 'INTEGER',
+                    'last_message_preview': 'VARCHAR(255)',
+                    'last_message_type': 'VARCHAR(30)',
+                    'last_message_status': 'VARCHAR(20)',
+                    'contact_display_name': 'VARCHAR(255)',
+                }
+                added = False
+                for col_name, col_type in inbox_columns.items():
+                    if col_name not in conv_cols:
+                        print(f"Adding {col_name} to wa_conversations table...")
+                        try:
+                             conn.execute(text(f'ALTER TABLE wa_conversations ADD COLUMN {col_name} {col_type}'))
+                             print(f"✅ Added {col_name} to wa_conversations")
+                             added = True
+                        except Exception as e:
+                             print(f"❌ Failed to add {col_name} to wa_conversations: {e}")
+                if added:
+                    # One-off backfill from the newest message and the contact
+                    try:
+                        conn.execute(text('''
+                            UPDATE wa_conversations SET last_message_id = (
+                                SELECT m.id FROM wa_messages m WHERE m.conversation_id = wa_conversations.id
+                                ORDER BY m.created_at DESC, m.id DESC LIMIT 1
+                            )
+                        '''))
+                        conn.execute(text('''
+                            UPDATE wa_conversations SET
+                                last_message_preview = (SELECT SUBSTR(COALESCE(m.message_text, m.caption), 1, 255)
+                                                        FROM wa_messages m WHERE m.id = wa_conversations.last_message_id),
+                                last_message_type = (SELECT m.message_type FROM wa_messages m
+                                                     WHERE m.id = wa_conversations.last_message_id),
+                                last_message_status = (SELECT m.status FROM wa_messages m
+                                                       WHERE m.id = wa_conversations.last_message_id),
+                                contact_display_name = (SELECT COALESCE(c.name, c.profile_name, c.phone_number)
+                                                        FROM wa_contacts c WHERE c.id = wa_conversations.contact_id)
+                        '''))
+                        print("✅ Backfilled wa_conversations inbox columns")
+                    except Exception as e:
+                        print(f"❌ Failed to backfill wa_conversations inbox columns: {e}")
+
+            # -------------------------------------------------------------
+            # WA MESSAGE STATUS SUMMARY + STATUS LOG RETENTION
+            # -------------------------------------------------------------
+            if 'wa_messages' in inspector.get_table_names():
+                msg_cols = [c['name'] for c in inspector.get_columns('wa_messages')]
+                if 'status_timestamps' not in msg_cols:
+                    print("Adding status_timestamps to wa_messages table...")
+                    try:
+                         conn.execute(text('ALTER TABLE wa_messages ADD COLUMN status_timestamps JSON'))
+                         print("✅ Added status_timestamps to wa_messages")
+                    except Exception as e:
+                         print(f"❌ Failed to add status_timestamps to wa_messages: {e}")
+
+            if 'wa_message_status_logs' in inspector.get_table_names():
+                log_indexes = [i['name'] for i in inspector.get_indexes('wa_message_status_logs')]
+                if 'ix_wa_message_status_logs_timestamp' not in log_indexes:
+                    try:
+                        conn.execute(text('CREATE INDEX ix_wa_message_status_logs_timestamp ON wa_message_status_logs (timestamp)'))
+                        print("✅ Added ix_wa_message_status_logs_timestamp")
+                    except Exception as e:
+                        print(f"❌ Failed to add ix_wa_message_status_logs_timestamp: {e}")
+
+            # Retention pruning scans processed_emails by age
+            if 'processed_emails' in inspector.get_table_names():
+                pe_indexes = [i['name'] for i in inspector.get_indexes('processed_emails')]
+                if 'idx_processed_emails_processed_at' not in pe_indexes:
+                    try:
+                        conn.execute(text('CREATE INDEX idx_processed_emails_processed_at ON processed_emails (processed_at)'))
+                        print("✅ Added idx_processed_emails_processed_at")
+                    except Exception as e:
+                        print(f"❌ Failed to add idx_processed_emails_processed_at: {e}")
+
             conn.commit()
+
+            # -------------------------------------------------------------
+            # SEARCH - pg_trgm GIN indexes (PostgreSQL only)
+            # -------------------------------------------------------------
+            if conn.dialect.name == "postgresql":
+                try:
+                    from app.services.search_service import ensure_search_indexes
+                    ensure_search_indexes(conn)
+                    conn.commit()
+                    print("✅ Search trigram indexes ready")
+                except Exception as e:
+                    conn.rollback()
+                    print(f"❌ Failed to create search indexes: {e}")
+
             print("Schema patch complete.")
             
     except Exception as e:
@@ -240,6 +240,9 @@ class Attendance(db.Model):
 # =========================================================
 class CallHistory(db.Model):
     __tablename__ = "call_history"
+    # Monthly range partitions on timestamp on PostgreSQL (migration c9d3e5f7a1b2);
+    # months older than CALL_HISTORY_ARCHIVE_AFTER_MONTHS move to object storage
+    # and CallHistoryMonthlySummary (app/services/call_history_archive.py)
 
     id = db.Column(db.Integer, primary_key=True)
 
@@ -249,7 +252,7 @@ class CallHistory(db.Model):
     formatted_number = db.Column(db.String(100))
     call_type = db.Column(db.String(20))  # incoming/outgoing/missed/rejected
 
-    timestamp = db.Column(db.DateTime)
+    timestamp = db.Column(db.DateTime, nullable=False)   # partition key: required
     duration = db.Column(db.Integer)
     contact_name = db.Column(db.String(150))
     recording_path = db.Column(db.String(1024), nullable=True)
@@ -280,6 +283,37 @@ class CallHistory(db.Model):
         }
 
 
+# =========================================================
+# CALL HISTORY MONTHLY SUMMARY (archived months)
+# =========================================================
+class CallHistoryMonthlySummary(db.Model):
+    __tablename__ = "call_history_monthly_summaries"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False, index=True)
+    month = db.Column(db.Date, nullable=False)                  # first day of the archived month
+
+    total_calls = db.Column(db.Integer, default=0)
+    incoming_calls = db.Column(db.Integer, default=0)
+    outgoing_calls = db.Column(db.Integer, default=0)
+    missed_calls = db.Column(db.Integer, default=0)
+    rejected_calls = db.Column(db.Integer, default=0)
+
+    total_duration = db.Column(db.Integer, default=0)
+    incoming_duration = db.Column(db.Integer, default=0)
+    outgoing_duration = db.Column(db.Integer, default=0)
+
+    object_key = db.Column(db.String(255))                      # latest gzipped CSV export of the month (all users);
+                                                                # re-archived late rows add files with the same <YYYYMM>- prefix
+    archived_at = db.Column(db.DateTime, default=now)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', name='uq_call_summary_user_month'),
+    )
+
+    user = db.relationship("User", backref=db.backref("call_history_summaries", lazy="dynamic", cascade="all, delete-orphan"))
+
+
 # =========================================================
 # CALL METRICS
 # =========================================================
@@ -485,6 +519,30 @@ class FacebookConnection(db.Model):
         return decrypt_value(self.encrypted_system_token)
 
 
+class FacebookLeadForm(db.Model):
+    """Lead form names fetched from the Graph API (shared cache across processes)."""
+    __tablename__ = "facebook_lead_forms"
+
+    form_id = db.Column(db.String(100), primary_key=True)
+    name = db.Column(db.String(255), nullable=True)
+    fetched_at = db.Column(db.DateTime, default=now, nullable=False)
+
+
+class FacebookFormSync(db.Model):
+    """Per-form high-water mark of the leadgen reconciler."""
+    __tablename__ = "facebook_form_syncs"
+
+    id = db.Column(db.Integer, primary_key=True)
+    connection_id = db.Column(db.Integer, db.ForeignKey("facebook_connections.id", ondelete="CASCADE"), nullable=False)
+    form_id = db.Column(db.String(100), nullable=False)
+    leads_synced_until = db.Column(db.DateTime, nullable=True)  # created_time of the newest lead seen
+    last_checked_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('connection_id', 'form_id', name='uq_fb_form_sync'),
+    )
+
+
 # =========================================================
 # FACEBOOK PAGE INTEGRATION (Legacy/Reference)
 # =========================================================
@@ -593,6 +651,12 @@ class IndiamartSettings(db.Model):
     
     last_sync_time = db.Column(db.DateTime, nullable=True)
     auto_sync_enabled = db.Column(db.Boolean, default=True) # NEW: Auto Sync Toggle
+
+    # Historic import of [backfill_start, backfill_end]; backfill_cursor is the resume point
+    backfill_start = db.Column(db.DateTime, nullable=True)
+    backfill_end = db.Column(db.DateTime, nullable=True)
+    backfill_cursor = db.Column(db.DateTime, nullable=True)
+    backfill_active = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=now)
     updated_at = db.Column(db.DateTime, default=now, onupdate=now)
 
@@ -619,6 +683,12 @@ class IndiamartSettings(db.Model):
             "api_key": masked,
             "last_sync_time": self.last_sync_time.isoformat() if self.last_sync_time else None,
             "auto_sync_enabled": self.auto_sync_enabled,
+            "backfill": {
+                "active": bool(self.backfill_active),
+                "start": self.backfill_start.isoformat() if self.backfill_start else None,
+                "end": self.backfill_end.isoformat() if self.backfill_end else None,
+                "cursor": self.backfill_cursor.isoformat() if self.backfill_cursor else None,
+            },
             "created_at": self.created_at.isoformat()
         }
 
@@ -637,6 +707,8 @@ class MagicbricksSettings(db.Model):
     app_password = db.Column(db.String(255), nullable=False) # Encrypted
     
     last_sync_time = db.Column(db.DateTime, nullable=True)
+    imap_last_uid = db.Column(db.BigInteger, default=0)  # Highest IMAP UID already processed
+    imap_uidvalidity = db.Column(db.BigInteger, nullable=True)  # UIDVALIDITY the checkpoint belongs to
     is_active = db.Column(db.Boolean, default=True)
     
     created_at = db.Column(db.DateTime, default=now)
@@ -672,6 +744,7 @@ class ProcessedEmail(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('admin_id', 'message_id', name='uq_admin_message_id'),
+        db.Index('idx_processed_emails_processed_at', 'processed_at'),
     )
 
 
@@ -689,6 +762,8 @@ class NinetyNineAcresSettings(db.Model):
     app_password = db.Column(db.String(255), nullable=False) # Encrypted
     
     last_sync_time = db.Column(db.DateTime, nullable=True)
+    imap_last_uid = db.Column(db.BigInteger, default=0)  # Highest IMAP UID already processed
+    imap_uidvalidity = db.Column(db.BigInteger, nullable=True)  # UIDVALIDITY the checkpoint belongs to
     is_active = db.Column(db.Boolean, default=True)
     
     created_at = db.Column(db.DateTime, default=now)
@@ -729,6 +804,8 @@ class JustDialSettings(db.Model):
     app_password = db.Column(db.String(255), nullable=False) # Encrypted
     
     last_sync_time = db.Column(db.DateTime, nullable=True)
+    imap_last_uid = db.Column(db.BigInteger, default=0)  # Highest IMAP UID already processed
+    imap_uidvalidity = db.Column(db.BigInteger, nullable=True)  # UIDVALIDITY the checkpoint belongs to
     is_active = db.Column(db.Boolean, default=True)
     
     created_at = db.Column(db.DateTime, default=now)
@@ -769,6 +846,8 @@ class HousingSettings(db.Model):
     app_password = db.Column(db.String(255), nullable=False) # Encrypted
     
     last_sync_time = db.Column(db.DateTime, nullable=True)
+    imap_last_uid = db.Column(db.BigInteger, default=0)  # Highest IMAP UID already processed
+    imap_uidvalidity = db.Column(db.BigInteger, nullable=True)  # UIDVALIDITY the checkpoint belongs to
     is_active = db.Column(db.Boolean, default=True)
     
     created_at = db.Column(db.DateTime, default=now)
@@ -794,6 +873,64 @@ class HousingSettings(db.Model):
         }
 
 
+# =========================================================
+# TENANT SYNC STATE (Per Provider, Per Admin — Orchestrator Bookkeeping)
+# =========================================================
+class TenantSyncState(db.Model):
+    __tablename__ = "tenant_sync_states"
+
+    id = db.Column(db.Integer, primary_key=True)
+    provider = db.Column(db.String(30), nullable=False)   # indiamart, magicbricks, 99acres, justdial, housing
+    admin_id = db.Column(db.Integer, db.ForeignKey("admins.id"), nullable=False, index=True)
+
+    in_flight = db.Column(db.Boolean, default=False, nullable=False)
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_finished_at = db.Column(db.DateTime, nullable=True)
+    last_duration_ms = db.Column(db.Integer, nullable=True)
+    last_outcome = db.Column(db.String(20), nullable=True)  # success | error | skipped
+    last_error = db.Column(db.Text, nullable=True)
+    last_added = db.Column(db.Integer, default=0)
+    run_count = db.Column(db.Integer, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('provider', 'admin_id', name='uq_tenant_sync_provider_admin'),
+    )
+
+    def to_dict(self):
+        return {
+            "provider": self.provider,
+            "admin_id": self.admin_id,
+            "in_flight": self.in_flight,
+            "last_started_at": self.last_started_at.isoformat() if self.last_started_at else None,
+            "last_finished_at": self.last_finished_at.isoformat() if self.last_finished_at else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_outcome": self.last_outcome,
+            "last_error": self.last_error,
+            "last_added": self.last_added,
+            "run_count": self.run_count
+        }
+
+
+# =========================================================
+# SCHEDULER LEASE (Single Leader For Background Jobs)
+# =========================================================
+class SchedulerLease(db.Model):
+    __tablename__ = "scheduler_leases"
+
+    name = db.Column(db.String(50), primary_key=True)       # e.g. "scheduler"
+    holder = db.Column(db.String(255), nullable=False)      # hostname:pid:nonce of the leader
+    acquired_at = db.Column(db.DateTime, default=now)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "holder": self.holder,
+            "acquired_at": self.acquired_at.isoformat() if self.acquired_at else None,
+            "expires_at": self.expires_at.isoformat() if self.expires_at else None
+        }
+
+
 # =========================================================
 # LEAD STATUS HISTORY
 # =========================================================
@@ -821,6 +958,40 @@ class LeadStatusHistory(db.Model):
         }
 
 
+# =========================================================
+# LEAD ASSIGNMENT CURSOR (Per Admin — Round Robin State)
+# =========================================================
+class LeadAssignmentCursor(db.Model):
+    __tablename__ = "lead_assignment_cursors"
+
+    id = db.Column(db.Integer, primary_key=True)
+    admin_id = db.Column(db.Integer, db.ForeignKey("admins.id"), nullable=False, unique=True)
+
+    # round_robin | weighted | least_loaded | by_source
+    strategy = db.Column(db.String(30), nullable=False, default="round_robin")
+
+    # Monotonic counter; next agent = sequence[position % len(sequence)]
+    position = db.Column(db.BigInteger, nullable=False, default=0)
+    last_agent_id = db.Column(db.Integer, nullable=True)
+
+    # Strategy options
+    weights = db.Column(JSONAuto())            # {"<agent_id>": weight}  (weighted)
+    source_rules = db.Column(JSONAuto())       # {"<source>": [agent_id, ...]}  (by_source)
+    source_positions = db.Column(JSONAuto())   # {"<source>": position}  (by_source)
+
+    updated_at = db.Column(db.DateTime, default=now, onupdate=now)
+
+    def to_dict(self):
+        return {
+            "strategy": self.strategy,
+            "position": self.position,
+            "last_agent_id": self.last_agent_id,
+            "weights": self.weights or {},
+            "source_rules": self.source_rules or {},
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
 # =========================================================
 # WHATSAPP CONFIG (Per Admin — Encrypted Credentials)
 # =========================================================
@@ -840,6 +1011,10 @@ class WhatsAppConfig(db.Model):
     business_name       = db.Column(db.String(255), nullable=True)
     phone_display       = db.Column(db.String(30), nullable=True)   # Human-readable number
 
+    # Template sync: ETag of the last full listing, sent back as If-None-Match
+    templates_etag      = db.Column(db.String(255), nullable=True)
+    templates_synced_at = db.Column(db.DateTime, nullable=True)
+
     is_active           = db.Column(db.Boolean, default=True)
     created_at          = db.Column(db.DateTime, default=now)
     updated_at          = db.Column(db.DateTime, default=now, onupdate=now)
@@ -901,12 +1076,16 @@ class WAContact(db.Model):
     lead            = db.relationship("Lead", backref=db.backref("wa_contact", uselist=False))
     conversations   = db.relationship("WAConversation", back_populates="contact", lazy="dynamic")
 
+    @property
+    def display_name(self):
+        return self.name or self.profile_name or self.phone_number
+
     def to_dict(self):
         return {
             "id": self.id,
             "admin_id": self.admin_id,
             "phone_number": self.phone_number,
-            "name": self.name or self.profile_name or self.phone_number,
+            "name": self.display_name,
             "profile_name": self.profile_name,
             "lead_id": self.lead_id,
             "created_at": self.created_at.isoformat() if self.created_at else None,
@@ -916,6 +1095,11 @@ class WAContact(db.Model):
 # =========================================================
 # WA CONVERSATION (Thread per contact per admin)
 # =========================================================
+def message_preview(text):
+    """First 255 characters of a message body, for inbox rows."""
+    return text[:255] if text else None
+
+
 class WAConversation(db.Model):
     __tablename__ = "wa_conversations"
 
@@ -932,6 +1116,13 @@ class WAConversation(db.Model):
     last_message_at     = db.Column(db.DateTime, nullable=True, index=True)
     last_customer_msg_at = db.Column(db.DateTime, nullable=True)  # For 24h window check
 
+    # Inbox row, denormalized so the conversation list needs no per-row lookups
+    last_message_id      = db.Column(db.Integer, nullable=True)
+    last_message_preview = db.Column(db.String(255), nullable=True)
+    last_message_type    = db.Column(db.String(30), nullable=True)
+    last_message_status  = db.Column(db.String(20), nullable=True)
+    contact_display_name = db.Column(db.String(255), nullable=True)
+
     created_at      = db.Column(db.DateTime, default=now)
     updated_at      = db.Column(db.DateTime, default=now, onupdate=now)
 
@@ -955,6 +1146,54 @@ class WAConversation(db.Model):
         delta = datetime.utcnow() - self.last_customer_msg_at
         return delta.total_seconds() < 86400  # 24h in seconds
 
+    def record_message(self, msg=None):
+        """
+        Bump last_message_at and, for a saved message, copy its inbox preview
+        and publish it to the admin's live inbox stream on commit.
+        """
+        self.last_message_at = datetime.utcnow()
+        if msg is None:
+            return
+        if msg.id is None:
+            db.session.flush()
+        self.last_message_id      = msg.id
+        self.last_message_preview = message_preview(msg.message_text or msg.caption)
+        self.last_message_type    = msg.message_type
+        self.last_message_status  = msg.status
+
+        from app.services import wa_events
+        wa_events.emit(self.admin_id, "message", wa_events.message_event(msg))
+
+    def to_inbox_dict(self, contact, assigned_agent_name, lock):
+        """
+        Conversation list row built only from this row, its contact and the
+        batched lock lookup (lock: a wa_locks.active_locks() entry or None).
+        """
+        return {
+            "id": self.id,
+            "admin_id": self.admin_id,
+            "contact": dict(contact.to_dict(), name=self.contact_display_name or contact.display_name) if contact else None,
+            "assigned_agent_id": self.assigned_agent_id,
+            "assigned_agent_name": assigned_agent_name,
+            "status": self.status,
+            "unread_count": self.unread_count,
+            "last_message_at": self.last_message_at.isoformat() if self.last_message_at else None,
+            "within_24h_window": self.is_within_24h_window(),
+            "locked_by": lock["holder_id"] if lock else None,
+            "locked_by_type": lock["holder_type"] if lock else None,
+            "locked_by_name": lock["name"] if lock else None,
+            "lock_expires_at": lock["expires_at"] if lock else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "last_message": {
+                "id": self.last_message_id,
+                "conversation_id": self.id,
+                "message_type": self.last_message_type,
+                "message_text": self.last_message_preview,
+                "status": self.last_message_status,
+                "created_at": self.last_message_at.isoformat() if self.last_message_at else None,
+            } if self.last_message_id else None,
+        }
+
     def to_dict(self, include_last_message=False):
         # Treat expired locks as if there is no lock
         active_lock = self.lock if (self.lock and not self.lock.is_expired()) else None
@@ -969,6 +1208,7 @@ class WAConversation(db.Model):
             "last_message_at": self.last_message_at.isoformat() if self.last_message_at else None,
             "within_24h_window": self.is_within_24h_window(),
             "locked_by": active_lock.agent_id if active_lock else None,
+            "locked_by_type": active_lock.holder_type if active_lock else None,
             "locked_by_name": active_lock.agent.name if (active_lock and active_lock.agent) else None,
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
@@ -983,13 +1223,16 @@ class WAConversation(db.Model):
 # =========================================================
 class WAMessage(db.Model):
     __tablename__ = "wa_messages"
+    # Monthly range partitions on created_at on PostgreSQL (migration b7e2d4c9f1a3)
 
     id              = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.Integer, db.ForeignKey("wa_conversations.id"), nullable=False, index=True)
     admin_id        = db.Column(db.Integer, db.ForeignKey("admins.id"), nullable=False, index=True)
 
-    # Meta's message ID (wamid.xxx)
-    whatsapp_msg_id = db.Column(db.String(255), nullable=True, unique=True, index=True)
+    # Meta's message ID (wamid.xxx); unique per admin with created_at (the partition key on PostgreSQL).
+    # Redelivered webhooks repeat created_at (Meta's timestamp) and are dropped on insert;
+    # the same wamid with another created_at is not rejected (see migration b7e2d4c9f1a3)
+    whatsapp_msg_id = db.Column(db.String(255), nullable=True, index=True)
 
     # Direction: customer → agent or agent → customer
     sender_type     = db.Column(db.String(20), nullable=False)   # 'customer', 'agent', 'system'
@@ -1015,11 +1258,15 @@ class WAMessage(db.Model):
     status          = db.Column(db.String(20), default="sent")
     error_code      = db.Column(db.String(50), nullable=True)
     error_message   = db.Column(db.Text, nullable=True)
+    # {"sent": iso, "delivered": iso, ...}: first time each status was seen,
+    # folded from wa_message_status_logs once the message is read or failed
+    status_timestamps = db.Column(JSONAuto(), nullable=True)
 
     created_at      = db.Column(db.DateTime, default=now, index=True)
 
     __table_args__ = (
         db.Index('idx_wamsg_conv_created', 'conversation_id', 'created_at'),
+        db.UniqueConstraint('admin_id', 'whatsapp_msg_id', 'created_at', name='uq_wa_messages_admin_wamid_created'),
     )
 
     conversation    = db.relationship("WAConversation", back_populates="messages")
@@ -1044,6 +1291,7 @@ class WAMessage(db.Model):
             "status": self.status,
             "error_code": self.error_code,
             "error_message": self.error_message,
+            "status_timestamps": self.status_timestamps or {},
             "created_at": self.created_at.isoformat() if self.created_at else None,
         }
 
@@ -1054,11 +1302,14 @@ class WAMessage(db.Model):
 class WAMessageStatusLog(db.Model):
     __tablename__ = "wa_message_status_logs"
 
+    # Monthly range partitions on PostgreSQL (timestamp), where the FK is not
+    # enforced; rows are compacted into wa_messages.status_timestamps and
+    # dropped after WA_STATUS_LOG_RETENTION_DAYS (app/services/wa_retention.py)
     id          = db.Column(db.Integer, primary_key=True)
     message_id  = db.Column(db.Integer, db.ForeignKey("wa_messages.id"), nullable=False, index=True)
     status      = db.Column(db.String(20), nullable=False)   # sent, delivered, read, failed
-    timestamp   = db.Column(db.DateTime, default=now)
-    raw_payload = db.Column(db.Text, nullable=True)          # Store raw Meta status object
+    timestamp   = db.Column(db.DateTime, default=now, index=True)
+    raw_payload = db.Column(db.Text, nullable=True)          # Meta status object as compact JSON (sampled)
 
     message     = db.relationship("WAMessage", back_populates="status_logs")
 
@@ -1071,6 +1322,70 @@ class WAMessageStatusLog(db.Model):
         }
 
 
+# =========================================================
+# WA MEDIA (inbound attachments copied to object storage)
+# =========================================================
+class WAMedia(db.Model):
+    __tablename__ = "wa_media"
+
+    id              = db.Column(db.Integer, primary_key=True)
+    admin_id        = db.Column(db.Integer, db.ForeignKey("admins.id"), nullable=False)
+    media_id        = db.Column(db.String(255), nullable=False)     # Meta media ID (wa_messages.media_id)
+
+    sha256          = db.Column(db.String(64), nullable=False, index=True)
+    object_key      = db.Column(db.String(255), nullable=False)     # wa-media/<sha256[:2]>/<sha256><ext>
+    thumbnail_key   = db.Column(db.String(255), nullable=True)      # JPEG thumbnail, images only
+    mime_type       = db.Column(db.String(100), nullable=True)
+    size_bytes      = db.Column(db.Integer, nullable=True)
+
+    created_at      = db.Column(db.DateTime, default=now)
+
+    __table_args__ = (
+        db.UniqueConstraint('admin_id', 'media_id', name='uq_wamedia_admin_media'),
+    )
+
+
+# =========================================================
+# WA WEBHOOK INBOX (raw payloads waiting to be processed)
+# =========================================================
+class WAWebhookInbox(db.Model):
+    __tablename__ = "wa_webhook_inbox"
+
+    id          = db.Column(db.Integer, primary_key=True)
+    payload     = db.Column(JSONAuto(), nullable=False)          # Webhook body as received
+    status      = db.Column(db.String(20), default="pending")    # pending, processing, failed
+    attempts    = db.Column(db.Integer, default=0)
+    error       = db.Column(db.Text, nullable=True)
+    received_at = db.Column(db.DateTime, default=now)
+    claimed_at  = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('idx_wainbox_status_id', 'status', 'id'),
+    )
+
+
+# =========================================================
+# WA OUTBOX (Side effects delivered after the writing transaction commits)
+# =========================================================
+class WAOutboxEvent(db.Model):
+    __tablename__ = "wa_outbox"
+
+    id              = db.Column(db.Integer, primary_key=True)
+    admin_id        = db.Column(db.Integer, db.ForeignKey("admins.id"), nullable=False, index=True)
+    event_type      = db.Column(db.String(50), nullable=False)     # lead_assigned
+    payload         = db.Column(JSONAuto(), nullable=False)
+    status          = db.Column(db.String(20), default="pending")  # pending, processing, failed
+    attempts        = db.Column(db.Integer, default=0)
+    error           = db.Column(db.Text, nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=now)
+    claimed_at      = db.Column(db.DateTime, nullable=True)
+    created_at      = db.Column(db.DateTime, default=now)
+
+    __table_args__ = (
+        db.Index('idx_waoutbox_status_due', 'status', 'next_attempt_at'),
+    )
+
+
 # =========================================================
 # WA TEMPLATE (Approved Meta templates cache)
 # =========================================================
@@ -1091,6 +1406,7 @@ class WATemplate(db.Model):
     header_type     = db.Column(db.String(20), nullable=True)      # TEXT, IMAGE, VIDEO, DOCUMENT, NONE
     body_text       = db.Column(db.Text, nullable=True)            # Body text with {{1}} placeholders
     variable_count  = db.Column(db.Integer, default=0)            # # of {{n}} variables in body
+    content_hash    = db.Column(db.String(64), nullable=True)     # sha256 of the synced Meta fields
 
     created_at      = db.Column(db.DateTime, default=now)
     synced_at       = db.Column(db.DateTime, default=now)         # Last sync from Meta
@@ -1128,25 +1444,17 @@ class WAConversationLock(db.Model):
     conversation_id = db.Column(db.Integer, db.ForeignKey("wa_conversations.id"), nullable=False, unique=True, index=True)
     # Stored as plain int — no FK so both admin and user IDs are valid holders
     agent_id        = db.Column(db.Integer, nullable=False)
+    holder_type     = db.Column(db.String(10), nullable=False, default="user")  # 'user' or 'admin': which table agent_id is in
     locked_at       = db.Column(db.DateTime, default=now)
-    expires_at      = db.Column(db.DateTime, nullable=True)  # Auto-expire after e.g. 15 min of inactivity
+    expires_at      = db.Column(db.DateTime, nullable=True, index=True)  # Auto-expire after e.g. 15 min of inactivity
 
     conversation    = db.relationship("WAConversation", back_populates="lock")
 
     @property
     def agent(self):
-        """Resolve the lock holder — could be a User (agent) or an Admin.
-        
-        agent_id is stored without a FK so it can hold either ID type.
-        Try User first (most common), then Admin as fallback.
-        Returns None only if the ID cannot be resolved in either table.
-        """
-        holder = db.session.get(User, self.agent_id)
-        if holder:
-            return holder
-        # Fallback: lock may be held by an Admin (e.g. admin opened the conversation)
+        """Resolve the lock holder — a User (agent) or an Admin, per holder_type."""
         from app.models import Admin as _Admin
-        return db.session.get(_Admin, self.agent_id)
+        return db.session.get(_Admin if self.holder_type == "admin" else User, self.agent_id)
 
     def is_expired(self):
         if not self.expires_at:
@@ -1158,6 +1466,7 @@ class WAConversationLock(db.Model):
             "id": self.id,
             "conversation_id": self.conversation_id,
             "agent_id": self.agent_id,
+            "holder_type": self.holder_type,
             "agent_name": self.agent.name if self.agent else None,
             "locked_at": self.locked_at.isoformat() if self.locked_at else None,
             "expires_at": self.expires_at.isoformat() if self.expires_at else None,
@@ -1215,3 +1524,96 @@ class WALeadAssignConfig(db.Model):
             "lead_header_url":      self.lead_header_url,
             "updated_at":           self.updated_at.isoformat() if self.updated_at else None,
         }
+
+
+# =========================================================
+# WA CAMPAIGN (Bulk template broadcast)
+# =========================================================
+class WACampaign(db.Model):
+    """
+    One approved template broadcast to a recipient list. The dispatcher
+    (app/services/wa_campaigns.py) keeps progress as counters, bumped once
+    per sent batch.
+    """
+    __tablename__ = "wa_campaigns"
+
+    id              = db.Column(db.Integer, primary_key=True)
+    admin_id        = db.Column(db.Integer, db.ForeignKey("admins.id"), nullable=False, index=True)
+    name            = db.Column(db.String(255), nullable=False)
+
+    template_name   = db.Column(db.String(255), nullable=False)
+    params          = db.Column(JSONAuto())   # list[str] with {{placeholders}}, rendered per recipient
+    header_url      = db.Column(db.String(1000), nullable=True)
+    segment         = db.Column(JSONAuto())   # lead filters the recipients came from (None for uploads)
+
+    # draft, queued, running, completed, cancelled, failed
+    status          = db.Column(db.String(20), default="draft", index=True)
+    total_count     = db.Column(db.Integer, default=0)
+    sent_count      = db.Column(db.Integer, default=0)
+    failed_count    = db.Column(db.Integer, default=0)
+    error           = db.Column(db.Text, nullable=True)
+
+    heartbeat_at    = db.Column(db.DateTime, nullable=True)   # dispatcher liveness; stale runs are resumed
+    started_at      = db.Column(db.DateTime, nullable=True)
+    completed_at    = db.Column(db.DateTime, nullable=True)
+    created_at      = db.Column(db.DateTime, default=now)
+    updated_at      = db.Column(db.DateTime, default=now, onupdate=now)
+
+    def to_dict(self):
+        total = self.total_count or 0
+        done = (self.sent_count or 0) + (self.failed_count or 0)
+        return {
+            "id": self.id,
+            "name": self.name,
+            "template_name": self.template_name,
+            "params": self.params or [],
+            "header_url": self.header_url,
+            "segment": self.segment,
+            "status": self.status,
+            "total": total,
+            "sent": self.sent_count or 0,
+            "failed": self.failed_count or 0,
+            "pending": max(total - done, 0),
+            "progress": round(done * 100.0 / total, 1) if total else 0.0,
+            "error": self.error,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+        }
+
+
+class WACampaignRecipient(db.Model):
+    __tablename__ = "wa_campaign_recipients"
+
+    id              = db.Column(db.Integer, primary_key=True)
+    campaign_id     = db.Column(db.Integer, db.ForeignKey("wa_campaigns.id"), nullable=False)
+    lead_id         = db.Column(db.Integer, nullable=True)
+    phone           = db.Column(db.String(50), nullable=False)    # E.164 without '+'
+    name            = db.Column(db.String(255), nullable=True)
+    params          = db.Column(JSONAuto())                       # rendered body parameters
+
+    # pending, sending, sent, failed
+    status          = db.Column(db.String(20), default="pending")
+    attempts        = db.Column(db.Integer, default=0)
+    wamid           = db.Column(db.String(255), nullable=True)
+    error           = db.Column(db.Text, nullable=True)
+    sent_at         = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('campaign_id', 'phone', name='uq_wacamp_recipient_phone'),
+        db.Index('idx_wacamp_recipient_status', 'campaign_id', 'status', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "lead_id": self.lead_id,
+            "phone": self.phone,
+            "name": self.name,
+            "params": self.params or [],
+            "status": self.status,
+            "attempts": self.attempts or 0,
+            "wamid": self.wamid,
+            "error": self.error,
+            "sent_at": self.sent_at.isoformat() if self.sent_at else None,
+        }
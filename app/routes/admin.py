@@ -3,6 +3,7 @@ from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, create_access_token, get_jwt_identity, get_jwt
 from datetime import datetime, timezone, timedelta
 from ..models import db, Admin, User, Attendance, CallHistory, ActivityLog, UserRole
+from ..services.search_service import apply_search
 import re
 from sqlalchemy import func
 
@@ -438,10 +439,7 @@ def get_users():
         # Search filter
         search = request.args.get("search", "").strip()
         if search:
-            term = f"%{search}%"
-            query = query.filter(
-                (User.name.ilike(term)) | (User.email.ilike(term))
-            )
+            query = apply_search(query, search, [User.name, User.email])
 
         # Status filter
         status = request.args.get("status", "all")
@@ -4,6 +4,7 @@ from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from sqlalchemy import func, case
 from app.models import db, User, CallHistory
+from app.services.call_history_archive import archived_totals
 from datetime import datetime, timedelta
 import io
 
@@ -172,6 +173,22 @@ def admin_analytics_all_users():
         avg_inbound_duration = float(avg_in_dur or 0)
         avg_outbound_duration = float(avg_out_dur or 0)
         unique_numbers = unique_numbers or 0
+
+        # Archived months in the range only exist as per-user monthly summaries.
+        # unique_numbers stays live-only (distinct counts do not add up).
+        archived = archived_totals(user_ids, start_date, end_date)
+        if archived:
+            archived_sum = lambda field: sum(a[field] for a in archived.values())
+            in_dur = avg_inbound_duration * incoming + archived_sum("incoming_duration")
+            out_dur = avg_outbound_duration * outgoing + archived_sum("outgoing_duration")
+            total_calls += archived_sum("total_calls")
+            incoming += archived_sum("incoming_calls")
+            outgoing += archived_sum("outgoing_calls")
+            missed += archived_sum("missed_calls")
+            rejected += archived_sum("rejected_calls")
+            total_duration += archived_sum("total_duration")
+            avg_inbound_duration = in_dur / incoming if incoming else 0
+            avg_outbound_duration = out_dur / outgoing if outgoing else 0
         
         total_answered = incoming + outgoing
 
@@ -266,14 +283,15 @@ def admin_analytics_all_users():
 
         user_summary = []
         for r in summary_rows:
+            arch = archived.get(r.user_id, {})
             user_summary.append({
                 "user_id": int(r.user_id),
                 "user_name": r.user_name,
-                "incoming": int(r.incoming or 0),
-                "outgoing": int(r.outgoing or 0),
-                "missed": int(r.missed or 0),
-                "rejected": int(r.rejected or 0),
-                "total_duration_seconds": int(r.total_duration_seconds or 0),
+                "incoming": int(r.incoming or 0) + arch.get("incoming_calls", 0),
+                "outgoing": int(r.outgoing or 0) + arch.get("outgoing_calls", 0),
+                "missed": int(r.missed or 0) + arch.get("missed_calls", 0),
+                "rejected": int(r.rejected or 0) + arch.get("rejected_calls", 0),
+                "total_duration_seconds": int(r.total_duration_seconds or 0) + arch.get("total_duration", 0),
                 "last_sync": (r.last_sync.isoformat() + 'Z') if r.last_sync else None
             })
 
@@ -419,15 +437,18 @@ def download_analytics_report():
             if s: parts.append(f"{s}s")
             return " ".join(parts[:2]) if len(parts) > 2 else " ".join(parts)
 
+        # Archived months in the range come from their summaries
+        archived = archived_totals([r.id for r in summary_rows], start_date, end_date)
         for r in summary_rows:
+            arch = archived.get(r.id, {})
             last_sync_str = r.last_sync.strftime('%Y-%m-%d') if r.last_sync else "Never"
             table_data.append([
                 r.name,
-                str(int(r.incoming or 0)),
-                str(int(r.outgoing or 0)),
-                str(int(r.missed or 0)),
-                str(int(r.rejected or 0)),
-                fmt_dur(int(r.total_duration or 0)),
+                str(int(r.incoming or 0) + arch.get("incoming_calls", 0)),
+                str(int(r.outgoing or 0) + arch.get("outgoing_calls", 0)),
+                str(int(r.missed or 0) + arch.get("missed_calls", 0)),
+                str(int(r.rejected or 0) + arch.get("rejected_calls", 0)),
+                fmt_dur(int(r.total_duration or 0) + arch.get("total_duration", 0)),
                 last_sync_str
             ])
 
@@ -533,15 +554,18 @@ def admin_analytics_single_user(user_id):
             CallHistory.timestamp < end_dt
         ).first()
 
+        # Archived months in the range come from their summaries
+        arch = archived_totals([user_id], start_dt, end_dt).get(user_id, {})
+
         return jsonify({
             "user_name": user.name,
             "period": period,
-            "total_calls": int(stats.total or 0),
-            "incoming": int(stats.incoming or 0),
-            "outgoing": int(stats.outgoing or 0),
-            "missed": int(stats.missed or 0),
-            "rejected": int(stats.rejected or 0),
-            "total_duration_seconds": int(stats.duration or 0)
+            "total_calls": int(stats.total or 0) + arch.get("total_calls", 0),
+            "incoming": int(stats.incoming or 0) + arch.get("incoming_calls", 0),
+            "outgoing": int(stats.outgoing or 0) + arch.get("outgoing_calls", 0),
+            "missed": int(stats.missed or 0) + arch.get("missed_calls", 0),
+            "rejected": int(stats.rejected or 0) + arch.get("rejected_calls", 0),
+            "total_duration_seconds": int(stats.duration or 0) + arch.get("total_duration", 0)
         }), 200
 
     except Exception as e:
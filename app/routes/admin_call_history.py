@@ -4,6 +4,7 @@ from flask import Blueprint, request, jsonify, send_file
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime, timedelta
 from app.models import db, User, CallHistory
+from app.services.search_service import apply_search
 from sqlalchemy import or_, func, case
 import io
 
@@ -140,14 +141,12 @@ def all_call_history():
                      )
                  )
             else:
-                # 2. Fallback to Partial Search (Slower, but necessary for names/fragments)
-                search_term = f"%{search_clean}%"
-                query = query.filter(
-                    or_(
-                        CallHistory.phone_number.ilike(search_term),
-                        CallHistory.formatted_number.ilike(search_term),
-                        func.lower(CallHistory.contact_name).like(search_term)
-                    )
+                # 2. Partial Search (names/fragments) - served by the pg_trgm GIN indexes
+                query = apply_search(
+                    query,
+                    search_clean,
+                    [CallHistory.contact_name],
+                    [CallHistory.phone_number, CallHistory.formatted_number]
                 )
 
         # Apply call type filter
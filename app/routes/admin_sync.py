@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app.models import User, CallHistory
+from app.services.sync_orchestrator import get_sync_status
 
 bp = Blueprint("admin_sync", __name__, url_prefix="/api/admin")
 
@@ -29,3 +30,15 @@ def sync_summary():
         })
 
     return jsonify({"users": result}), 200
+
+
+@bp.route("/lead-sync-status", methods=["GET"])
+@jwt_required()
+def lead_sync_status():
+    """Per-tenant portal sync state (last run, duration, outcome) and queue depth."""
+    role = get_jwt().get("role")
+    if role not in ("admin", "super_admin"):
+        return jsonify({"error": "Admin access required"}), 403
+
+    admin_id = None if role == "super_admin" else int(get_jwt_identity())
+    return jsonify(get_sync_status(admin_id)), 200
@@ -2,6 +2,7 @@ from flask import Blueprint, jsonify
 from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from app.models import db
 from ..models import User, Admin, Attendance, CallHistory, ActivityLog, UserRole
+from ..services.call_history_archive import archived_totals
 
 admin_user_bp = Blueprint("admin_user", __name__, url_prefix="/api/admin")
 
@@ -34,8 +35,9 @@ def admin_get_user_data(user_id):
         # Attendance count
         attendance_count = Attendance.query.filter_by(user_id=user_id).count()
 
-        # Call history count
+        # Call history count (archived months are only in their summaries)
         call_count = CallHistory.query.filter_by(user_id=user_id).count()
+        call_count += archived_totals([user.id]).get(user.id, {}).get("total_calls", 0)
 
         return jsonify({
             "user": {
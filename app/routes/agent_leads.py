@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.models import db, Lead, User, now
+from app.services.search_service import apply_search
 from datetime import datetime
 
 bp = Blueprint("agent_leads", __name__, url_prefix="/api/agent")
@@ -57,7 +58,7 @@ def get_my_leads():
                  query = query.filter(Lead.status == status)
 
         if search:
-            query = query.filter(Lead.name.ilike(f"%{search}%") | Lead.phone.ilike(f"%{search}%"))
+            query = apply_search(query, search, [Lead.name], [Lead.phone])
 
         # Sort by latest
         leads = query.order_by(Lead.created_at.desc()).limit(100).all()
@@ -8,6 +8,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 
 from app.models import db, User, CallHistory, UserRole, Lead
 from app.auth_helpers import get_authorized_user
+from app.services.call_history_archive import archive_cutoff
 from sqlalchemy import func
 
 bp = Blueprint("call_history", __name__, url_prefix="/api/call-history")
@@ -131,6 +132,9 @@ def sync_call_history():
         if not isinstance(call_list, list):
             return jsonify({"error": "'call_history' must be a list"}), 400
 
+        # Months before this are archived; a phone re-sending its full log must not refill them
+        cutoff = archive_cutoff()
+
         # Load existing records (hash of key fields) to avoid duplicates
         # Key: (timestamp_iso, phone_number, call_type, duration)
         existing_hashes = set()
@@ -139,9 +143,11 @@ def sync_call_history():
             CallHistory.phone_number,
             CallHistory.call_type,
             CallHistory.duration
-        ).filter(CallHistory.user_id == user_id).all()
+        ).filter(CallHistory.user_id == user_id)
+        if cutoff:
+            existing_query = existing_query.filter(CallHistory.timestamp >= cutoff)
 
-        for r in existing_query:
+        for r in existing_query.all():
             # Normalize timestamp to ISO string (no microseconds) for comparison
             ts_str = r.timestamp.replace(microsecond=0).isoformat() if r.timestamp else ""
             key = f"{ts_str}|{r.phone_number}|{r.call_type}|{r.duration}"
@@ -157,6 +163,7 @@ def sync_call_history():
                 duration = int(entry.get("duration", 0))
                 timestamp_raw = entry.get("timestamp")
 
+                # timestamp is call_history's partition key: calls without one are refused
                 if not phone_number or not timestamp_raw:
                     errors.append({"entry": entry, "error": "Missing fields"})
                     continue
@@ -171,6 +178,8 @@ def sync_call_history():
                 if dt.tzinfo:
                     dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
                 dt = dt.replace(microsecond=0)
+                if cutoff and dt < cutoff:
+                    continue
 
                 # Generate key for duplicate check
                 ts_str = dt.isoformat()
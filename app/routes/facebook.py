@@ -6,6 +6,8 @@ import hmac
 import hashlib
 import sys
 from app.services.facebook_service import FacebookService
+from app.services.facebook_leads import lead_queue
+from app.services.sync_orchestrator import submit_tenant_sync
 
 bp = Blueprint('facebook', __name__)
 
@@ -377,12 +379,6 @@ def get_status_history(lead_id):
 
 
 # Webhook Verification & Handling
-import threading
-
-# Global Cache for Form Names to reduce API calls
-# Format: {form_id: form_name}
-FORM_CACHE = {}
-
 @bp.route('/api/facebook/webhook', methods=['GET', 'POST'])
 def handle_webhook():
     # 1. VERIFY (Get)
@@ -421,161 +417,39 @@ def handle_webhook():
                     if not lead_id or lead_id.startswith("444"): # Example test ID filter
                         continue
                         
-                    # ASYNC PROCESSING: Offload to thread to return 200 OK instantly
-                    # This is critical for high volume (1 Lakh Users)
-                    process_thread = threading.Thread(target=process_lead_strict_async, args=(current_app._get_current_object(), conn.id, lead_id, form_id))
-                    process_thread.start()
+                    # ASYNC PROCESSING: queue for the background batcher to return 200 OK instantly;
+                    # leads arriving together are fetched in shared Graph batch calls
+                    lead_queue.put(current_app._get_current_object(), conn.id, lead_id, form_id)
 
         return 'EVENT_RECEIVED', 200
     
     return 'Not a Page Event', 404
 
 
-def process_lead_strict_async(app, conn_id, lead_id, form_id):
-    """
-    Wrapper to run in thread context with app context.
-    """
-    with app.app_context():
-        try:
-            # Re-fetch connection inside thread session
-            conn = FacebookConnection.query.get(conn_id)
-            if conn:
-                process_lead_strict(conn, lead_id, form_id)
-        except Exception as e:
-            app.logger.error(f"Async Lead Processing Failed: {e}")
-
-def process_lead_strict(conn, lead_id, form_id):
+@bp.route('/api/facebook/reconcile', methods=['POST'])
+@jwt_required()
+def reconcile_leads():
     """
-    Fetch lead using SYSTEM USER TOKEN (Strict Requirement).
+    Re-read recent leads from every form of the connected page and save any
+    the webhook missed (Async).
     """
-    # 1. Deduplicate
-    existing = Lead.query.filter_by(facebook_lead_id=lead_id, admin_id=conn.admin_id).first()
-    if existing: return
-
-    # 2. Fetch from Graph API using Permanent System Token
     try:
-        sys_token = conn.get_token() # Decrypts automatically
-        
-        # Enhanced Params with Proof
-        params = {"access_token": sys_token}
-        proof = FacebookService.get_app_secret_proof(sys_token)
-        if proof:
-            params["appsecret_proof"] = proof
-            
-        url = f"https://graph.facebook.com/v24.0/{lead_id}"
-        resp = requests.get(url, params=params)
-        
-        if resp.status_code != 200:
-            current_app.logger.error(f"Lead Fetch Failed for {lead_id}: {resp.text}")
-            return
-            
-        lead_data = resp.json()
+        claims = get_jwt()
+        if claims.get('role') != 'admin':
+            return jsonify({"error": "Admin privileges required"}), 403
 
-        
-        # 3. Dynamic Field Parsing
-        name = "Unknown"
-        email = None
-        phone = None
-        
-        # Log field data for debugging new forms
-        current_app.logger.info(f"Parsing Lead Data: {lead_data.get('field_data', [])}")
-        
-        custom_fields = {}
+        admin_id = int(get_jwt_identity())
+        conn = FacebookConnection.query.filter_by(admin_id=admin_id, status='active').first()
+        if not conn:
+            return jsonify({"error": "Facebook not connected"}), 404
 
-        for f in lead_data.get("field_data", []):
-            field_name = f.get("name", "").lower()
-            field_values = f.get("values", [])
-            val = field_values[0] if field_values else None
-            
-            if not val: continue
-
-            # Smart Matching
-            if "name" in field_name and "company" not in field_name:
-                name = val
-            elif "email" in field_name:
-                email = val
-            elif "phone" in field_name or "mobile" in field_name or "contact" in field_name:
-                phone = val
-            else:
-                # Store other fields
-                custom_fields[field_name] = val
-
-        # 4. Assignment (Round Robin)
-        assigned_to = None
-        try:
-            # Get active agents for this admin
-            active_agents = User.query.filter_by(
-                admin_id=conn.admin_id, 
-                status='active',
-                is_suspended=False
-            ).order_by(User.id).all()
-
-            if active_agents:
-                # Find last assigned lead to determine sequence
-                last_lead = Lead.query.filter_by(admin_id=conn.admin_id)\
-                    .filter(Lead.assigned_to.isnot(None))\
-                    .order_by(Lead.created_at.desc())\
-                    .first()
-
-                if not last_lead or not last_lead.assigned_to:
-                    assigned_to = active_agents[0].id
-                else:
-                    last_agent_id = last_lead.assigned_to
-                    agent_ids = [a.id for a in active_agents]
-                    
-                    if last_agent_id in agent_ids:
-                        current_index = agent_ids.index(last_agent_id)
-                        next_index = (current_index + 1) % len(agent_ids)
-                        assigned_to = agent_ids[next_index]
-                    else:
-                        assigned_to = agent_ids[0]
-                
-                current_app.logger.info(f"Assigning Lead to Agent ID: {assigned_to}")
-        except Exception as e:
-            current_app.logger.error(f"Assignment Logic Failed: {e}")
-
-        # 5. Fetch Form Name (New)
-        if form_id:
-            try:
-                # 1. Check Cache First
-                if form_id in FORM_CACHE:
-                    custom_fields['form_name'] = FORM_CACHE[form_id]
-                else:
-                    # 2. Fetch from API if not in cache
-                    form_url = f"https://graph.facebook.com/v24.0/{form_id}"
-                    f_params = {"access_token": sys_token, "fields": "name"}
-                    f_resp = requests.get(form_url, params=f_params)
-                    if f_resp.status_code == 200:
-                        form_data = f_resp.json()
-                        f_name = form_data.get('name')
-                        
-                        # Update Cache
-                        custom_fields['form_name'] = f_name
-                        FORM_CACHE[form_id] = f_name
-                        
-                        current_app.logger.info(f"Fetched & Cached Form Name: {f_name}")
-            except Exception as e:
-                current_app.logger.error(f"Failed to fetch form name: {e}")
-
-        # 6. Save
-        lead = Lead(
-            admin_id=conn.admin_id,
-            facebook_lead_id=lead_id,
-            form_id=form_id,
-            name=name,
-            email=email,
-            phone=phone,
-            source="facebook",
-            status="new",
-            assigned_to=assigned_to,
-            custom_fields=custom_fields
-        )
-        db.session.add(lead)
-        db.session.commit()
-        current_app.logger.info(f"Lead Saved Successfully: {lead.id}")
-        
+        if not submit_tenant_sync(current_app._get_current_object(), "facebook_reconcile", admin_id):
+            return jsonify({"message": "Reconcile already in progress"}), 409
+
+        return jsonify({"message": "Reconcile started in background"}), 200
     except Exception as e:
-        current_app.logger.error(f"Process Lead Strict Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
 
 # Helper for sig check
 def verify_fb_signature(req):
@@ -1,8 +1,10 @@
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import db, HousingSettings, now
-from app.services.housing_service import sync_housing_leads, get_imap_connection
+from app.models import db, HousingSettings
+from app.services.housing_service import get_imap_connection
+from app.services.sync_orchestrator import submit_tenant_sync
+from app.services.imap_ingest import reset_checkpoint
 
 bp = Blueprint('housing', __name__)
 
@@ -28,6 +30,8 @@ def connect_housing():
         if not settings:
             settings = HousingSettings(admin_id=current_user_id)
             
+        if settings.email_id != email_id or settings.imap_host != imap_host:
+            reset_checkpoint(settings)  # different mailbox, UIDs start over
         settings.email_id = email_id
         settings.set_app_password(password)
         settings.imap_host = imap_host
@@ -77,7 +81,6 @@ def get_housing_status():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-import threading
 
 @bp.route('/api/housing/sync', methods=['POST'])
 @jwt_required()
@@ -85,23 +88,14 @@ def sync_housing():
     try:
         current_user_id = int(get_jwt_identity())
         
-        # Spawn Background Thread
-        thread = threading.Thread(target=run_housing_sync_async, args=(current_app._get_current_object(), current_user_id))
-        thread.start()
+        # Queue on the sync orchestrator (no-op if a run is already in flight)
+        if not submit_tenant_sync(current_app._get_current_object(), "housing", current_user_id):
+            return jsonify({"message": "Sync already in progress"}), 409
         
         return jsonify({"message": "Sync started in background"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def run_housing_sync_async(app, admin_id):
-    with app.app_context():
-        try:
-            app.logger.info(f"Starting Housing Sync for {admin_id}")
-            result = sync_housing_leads(admin_id)
-            app.logger.info(f"Housing Sync Result: {result}")
-        except Exception as e:
-            app.logger.error(f"Housing Sync Failed: {e}")
-
 @bp.route('/api/housing/disconnect', methods=['POST'])
 @jwt_required()
 def disconnect_housing():
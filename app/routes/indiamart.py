@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app.models import db, IndiamartSettings, Admin, User, now
+from app.services.sync_orchestrator import submit_tenant_sync
+from app.services.indiamart_service import start_backfill, cancel_backfill, API_UTC_OFFSET
+from datetime import datetime, timedelta
 
 
 bp = Blueprint('indiamart', __name__)
@@ -129,7 +132,6 @@ def disconnect():
 #  SYNC LEADS
 # =======================================================
 
-import threading
 
 @bp.route('/api/indiamart/sync', methods=['POST'])
 @jwt_required()
@@ -150,9 +152,9 @@ def sync_leads():
         if not admin:
             return jsonify({"error": "Admin account not found"}), 404
 
-        # Spawn Background Thread
-        thread = threading.Thread(target=run_sync_async, args=(current_app._get_current_object(), admin.id))
-        thread.start()
+        # Queue on the sync orchestrator (no-op if a run is already in flight)
+        if not submit_tenant_sync(current_app._get_current_object(), "indiamart", admin.id):
+            return jsonify({"message": "Sync already in progress"}), 409
         
         return jsonify({"message": "Sync started in background"}), 200
 
@@ -160,15 +162,66 @@ def sync_leads():
         return jsonify({"error": str(e)}), 500
 
 
-def run_sync_async(app, admin_id):
+# =======================================================
+#  BACKFILL
+# =======================================================
+
+@bp.route('/api/indiamart/backfill', methods=['POST'])
+@jwt_required()
+def backfill_leads():
     """
-    Wrapper to run sync in thread context.
+    Import a historic date range in the background.
+    Expects: { from: "YYYY-MM-DD", to: "YYYY-MM-DD" } (IST days, both inclusive)
     """
-    with app.app_context():
+    try:
+        claims = get_jwt()
+        role = claims.get('role')
+        current_id = int(get_jwt_identity())
+
+        if role != 'admin':
+            return jsonify({"error": "Admin privileges required"}), 403
+
+        settings = IndiamartSettings.query.filter_by(admin_id=current_id).first()
+        if not settings:
+            return jsonify({"error": "IndiaMART not connected"}), 404
+
+        data = request.json or {}
         try:
-            from app.services.indiamart_service import sync_admin_leads
-            app.logger.info(f"Starting Background Sync for Admin {admin_id}")
-            result = sync_admin_leads(admin_id)
-            app.logger.info(f"Background Sync Result for Admin {admin_id}: {result}")
-        except Exception as e:
-            app.logger.error(f"Background Sync Failed for Admin {admin_id}: {e}")
+            start = datetime.strptime(data.get('from', ''), '%Y-%m-%d') - API_UTC_OFFSET
+            end = datetime.strptime(data.get('to', ''), '%Y-%m-%d') + timedelta(days=1) - API_UTC_OFFSET
+            end = min(end, now())
+        except ValueError:
+            return jsonify({"error": "from and to must be dates (YYYY-MM-DD)"}), 400
+
+        try:
+            start_backfill(settings, start, end)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        submit_tenant_sync(current_app._get_current_object(), "indiamart_backfill", current_id)
+        return jsonify({"message": "Backfill started in background", "settings": settings.to_dict()}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+@bp.route('/api/indiamart/backfill', methods=['DELETE'])
+@jwt_required()
+def stop_backfill():
+    try:
+        claims = get_jwt()
+        role = claims.get('role')
+        current_id = int(get_jwt_identity())
+
+        if role != 'admin':
+            return jsonify({"error": "Admin privileges required"}), 403
+
+        settings = IndiamartSettings.query.filter_by(admin_id=current_id).first()
+        if settings and settings.backfill_active:
+            cancel_backfill(settings)
+
+        return jsonify({"message": "Backfill stopped"}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
@@ -1,8 +1,10 @@
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models import db, Admin, JustDialSettings, now
-from app.services.justdial_service import sync_justdial_leads, get_imap_connection
+from app.models import db, JustDialSettings
+from app.services.justdial_service import get_imap_connection
+from app.services.sync_orchestrator import submit_tenant_sync
+from app.services.imap_ingest import reset_checkpoint
 
 bp = Blueprint('justdial', __name__)
 
@@ -24,6 +26,8 @@ def connect_justdial():
         if not settings:
             settings = JustDialSettings(admin_id=current_user_id)
             
+        if settings.email_id != email_id or settings.imap_host != "imap.gmail.com":
+            reset_checkpoint(settings)  # different mailbox, UIDs start over
         settings.email_id = email_id
         settings.set_app_password(password)
         settings.imap_host = "imap.gmail.com" # Default
@@ -58,7 +62,6 @@ def get_justdial_status():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-import threading
 
 @bp.route('/api/justdial/sync', methods=['POST'])
 @jwt_required()
@@ -66,23 +69,14 @@ def sync_justdial():
     try:
         current_user_id = int(get_jwt_identity())
         
-        # Spawn Background Thread
-        thread = threading.Thread(target=run_jd_sync_async, args=(current_app._get_current_object(), current_user_id))
-        thread.start()
+        # Queue on the sync orchestrator (no-op if a run is already in flight)
+        if not submit_tenant_sync(current_app._get_current_object(), "justdial", current_user_id):
+            return jsonify({"message": "Sync already in progress"}), 409
         
         return jsonify({"message": "Sync started in background"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def run_jd_sync_async(app, admin_id):
-    with app.app_context():
-        try:
-            app.logger.info(f"Starting JustDial Sync for {admin_id}")
-            result = sync_justdial_leads(admin_id)
-            app.logger.info(f"JustDial Sync Result: {result}")
-        except Exception as e:
-            app.logger.error(f"JustDial Sync Failed: {e}")
-
 @bp.route('/api/justdial/disconnect', methods=['POST'])
 @jwt_required()
 def disconnect_justdial():
@@ -1,8 +1,10 @@
 
 from flask import Blueprint, request, jsonify, current_app
-from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
-from app.models import db, NinetyNineAcresSettings, Admin, now
-from app.services.ninety_nine_acres_service import sync_99acres_leads, get_imap_connection
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.models import db, NinetyNineAcresSettings
+from app.services.ninety_nine_acres_service import get_imap_connection
+from app.services.sync_orchestrator import submit_tenant_sync
+from app.services.imap_ingest import reset_checkpoint
 
 bp = Blueprint('ninety_nine_acres', __name__)
 
@@ -46,6 +48,8 @@ def connect_99acres():
         if not settings:
             settings = NinetyNineAcresSettings(admin_id=current_id)
             
+        if settings.email_id != email_id or settings.imap_host != imap_host:
+            reset_checkpoint(settings)  # different mailbox, UIDs start over
         settings.email_id = email_id
         settings.imap_host = imap_host
         settings.set_app_password(app_password)
@@ -62,7 +66,6 @@ def connect_99acres():
     except Exception as e:
         return jsonify({"error": f"Connection failed: {str(e)}"}), 400
 
-import threading
 
 @bp.route('/api/99acres/sync', methods=['POST'])
 @jwt_required()
@@ -73,23 +76,14 @@ def sync_99acres():
     current_id = int(get_jwt_identity())
     
     try:
-        # Spawn Background Thread
-        thread = threading.Thread(target=run_99acres_sync_async, args=(current_app._get_current_object(), current_id))
-        thread.start()
+        # Queue on the sync orchestrator (no-op if a run is already in flight)
+        if not submit_tenant_sync(current_app._get_current_object(), "99acres", current_id):
+            return jsonify({"message": "Sync already in progress"}), 409
 
         return jsonify({"message": "Sync started in background"}), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def run_99acres_sync_async(app, admin_id):
-    with app.app_context():
-        try:
-            app.logger.info(f"Starting 99acres Sync for {admin_id}")
-            result = sync_99acres_leads(admin_id)
-            app.logger.info(f"99acres Sync Result: {result}")
-        except Exception as e:
-            app.logger.error(f"99acres Sync Failed: {e}")
-
 @bp.route('/api/99acres/disconnect', methods=['POST'])
 @jwt_required()
 def disconnect_mb():
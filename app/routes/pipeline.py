@@ -5,6 +5,9 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime, timedelta
 from sqlalchemy import func, case, or_
 from app.models import db, Lead, User, CallHistory, CallMetrics, Admin
+from app.services.search_service import apply_search
+from app.services.lead_assignment import STRATEGIES, get_assignment_config, update_assignment_config
+from app.services import wa_outbox
 
 pipeline_bp = Blueprint("pipeline", __name__, url_prefix="/api/pipeline")
 
@@ -228,14 +231,10 @@ def pipeline_leads():
     if source_filter and source_filter.lower() != "all":
         query = query.filter(func.lower(Lead.source) == source_filter.lower())
 
-    # Search Filter (Name or Phone)
+    # Search Filter (Name or Phone) - trigram indexed, phone digits aware
     search = request.args.get("search")
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(or_(
-            Lead.name.ilike(search_term),
-            Lead.phone.ilike(search_term)
-        ))
+        query = apply_search(query, search, [Lead.name], [Lead.phone])
 
     # Date Filter
     start_date = request.args.get("start_date")
@@ -606,17 +605,11 @@ def create_lead():
             custom_fields=custom_fields
         )
         db.session.add(lead)
-        db.session.commit()
+        db.session.flush()
 
-        # ── Auto-WhatsApp on assignment ──────────────────────────────
-        if lead.assigned_to:
-            try:
-                from app.routes.whatsapp import send_lead_assignment_whatsapp
-                agent = User.query.get(lead.assigned_to)
-                send_lead_assignment_whatsapp(admin_id, lead, agent)
-            except Exception as _wa_err:
-                current_app.logger.warning(f"[LeadAssign WA] create trigger error: {_wa_err}")
-        # ─────────────────────────────────────────────────────────────
+        # Auto-WhatsApp on assignment: staged with the lead, sent in the background
+        wa_outbox.enqueue_lead_assignments(admin_id, [(lead.id, lead.assigned_to)])
+        db.session.commit()
 
         return jsonify({"message": "Lead created", "lead": lead.to_dict()}), 201
     except Exception as e:
@@ -662,21 +655,11 @@ def update_lead_details(lead_id):
             lead.custom_fields = cf
 
         lead.updated_at = datetime.utcnow()
-        db.session.commit()
 
-        # ── Auto-WhatsApp on reassignment ────────────────────────────
-        if (
-            "assigned_to" in data
-            and lead.assigned_to
-            and lead.assigned_to != old_assigned_to
-        ):
-            try:
-                from app.routes.whatsapp import send_lead_assignment_whatsapp
-                agent = User.query.get(lead.assigned_to)
-                send_lead_assignment_whatsapp(admin_id, lead, agent)
-            except Exception as _wa_err:
-                current_app.logger.warning(f"[LeadAssign WA] update trigger error: {_wa_err}")
-        # ─────────────────────────────────────────────────────────────
+        # Auto-WhatsApp on reassignment: staged with the update, sent in the background
+        if "assigned_to" in data and lead.assigned_to != old_assigned_to:
+            wa_outbox.enqueue_lead_assignments(admin_id, [(lead.id, lead.assigned_to)])
+        db.session.commit()
 
         return jsonify({"message": "Lead updated", "lead": lead.to_dict()}), 200
     except Exception as e:
@@ -704,3 +687,46 @@ def delete_lead(lead_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
+
+
+@pipeline_bp.route("/assignment-config", methods=["GET"])
+@jwt_required()
+def get_lead_assignment_config():
+    """Current auto-assignment strategy for portal/Facebook leads."""
+    if not admin_required():
+        return jsonify({"error": "Admin access only"}), 403
+
+    admin_id = int(get_jwt_identity())
+    return jsonify({
+        "config": get_assignment_config(admin_id),
+        "strategies": sorted(STRATEGIES.keys())
+    }), 200
+
+
+@pipeline_bp.route("/assignment-config", methods=["PUT"])
+@jwt_required()
+def update_lead_assignment_config():
+    """
+    Body: { "strategy": "weighted", "weights": {"12": 2, "15": 1},
+            "source_rules": {"facebook": [12, 15]} }
+    """
+    if not admin_required():
+        return jsonify({"error": "Admin access only"}), 403
+
+    admin_id = int(get_jwt_identity())
+    data = request.get_json() or {}
+
+    try:
+        config = update_assignment_config(
+            admin_id,
+            strategy=data.get("strategy"),
+            weights=data.get("weights"),
+            source_rules=data.get("source_rules")
+        )
+        return jsonify({"message": "Assignment config saved", "config": config}), 200
+    except (ValueError, TypeError) as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
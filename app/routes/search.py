@@ -0,0 +1,54 @@
+from flask import Blueprint, jsonify, request, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
+from app.models import db, User
+from app.services.search_service import unified_search, SEARCH_TYPES, MIN_TERM_LENGTH
+
+bp = Blueprint("search", __name__, url_prefix="/api/search")
+
+
+# =========================================================
+# UNIFIED SEARCH (Leads, Calls, WhatsApp Contacts)
+# =========================================================
+@bp.route("", methods=["GET"])
+@jwt_required()
+def search():
+    """
+    GET /api/search?q=<term>&types=leads,calls,contacts&limit=10
+
+    Admins search across their whole tenant. Agents only see their own
+    leads and calls.
+    """
+    claims = get_jwt()
+    role = claims.get("role")
+    identity = int(get_jwt_identity())
+
+    if role == "admin":
+        admin_id = identity
+        agent_id = None
+    elif role == "user":
+        user = db.session.get(User, identity)
+        if not user or not user.is_active:
+            return jsonify({"error": "User not found or inactive"}), 403
+        admin_id = user.admin_id
+        agent_id = user.id
+    else:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    term = (request.args.get("q") or "").strip()
+    if len(term) < MIN_TERM_LENGTH:
+        return jsonify({"error": f"Search term must be at least {MIN_TERM_LENGTH} characters"}), 400
+
+    types = [t.strip() for t in request.args.get("types", ",".join(SEARCH_TYPES)).split(",")]
+    types = [t for t in types if t in SEARCH_TYPES] or list(SEARCH_TYPES)
+
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), 50)
+    except ValueError:
+        limit = 10
+
+    try:
+        results = unified_search(admin_id, term, types=types, limit=limit, agent_id=agent_id)
+        return jsonify({"query": term, "results": results}), 200
+    except Exception as e:
+        current_app.logger.error(f"Search failed for admin {admin_id}: {e}")
+        return jsonify({"error": "Search failed"}), 500
@@ -1,20 +1,26 @@
 # app/routes/whatsapp.py
 """
 WhatsApp CRM Messaging — Blueprint
-Handles: config, template management, send, inbox, webhook
+Handles: config, template management, send, inbox, webhook, broadcast campaigns,
+conversation locks, media
 Brandmo API Base: https://crmpi.brandmo.in/api/meta/v19.0
 """
 
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from datetime import datetime, timedelta
-from sqlalchemy import nulls_last
+import csv
+import io
+import json
+import time
+from sqlalchemy import nulls_last, func, tuple_
 import requests as _ext_requests
 from ..models import (
     db, Admin, User,
     WhatsAppConfig, WATemplate, WAContact, WAConversation, WAMessage,
-    WAMessageStatusLog, WAConversationLock, WALeadAssignConfig,
+    WALeadAssignConfig, WACampaign, WACampaignRecipient,
 )
+from ..services import wa_campaigns, wa_events, wa_inbox, wa_locks, wa_media, wa_tenants
 
 bp = Blueprint("whatsapp", __name__, url_prefix="/api/whatsapp")
 
@@ -46,6 +52,22 @@ def get_wa_config(admin_id):
     """Return WhatsAppConfig or None."""
     return WhatsAppConfig.query.filter_by(admin_id=admin_id).first()
 
+def get_wa_tenant_or_err(admin_id):
+    """
+    Return (tenant, None) from the routing cache, or (None, error response)
+    explaining why WhatsApp cannot send; only that path reads the config row.
+    """
+    tenant = wa_tenants.get(admin_id)
+    if tenant:
+        return tenant, None
+    cfg = get_wa_config(admin_id)
+    if not cfg or not cfg.is_active:
+        return None, (jsonify({"error": "WhatsApp not connected"}), 400)
+    return None, (jsonify({
+        "error": "WhatsApp configuration is incomplete.",
+        "missing_fields": get_wa_config_missing_fields(cfg),
+    }), 400)
+
 def get_wa_config_missing_fields(cfg):
     """Return a list of missing required WhatsApp config fields."""
     missing = []
@@ -84,6 +106,9 @@ def get_or_create_contact(admin_id, phone, profile_name=None, lead_id=None):
     elif profile_name and not contact.profile_name:
         contact.profile_name = profile_name
         contact.name = profile_name
+        WAConversation.query.filter_by(contact_id=contact.id).update(
+            {"contact_display_name": contact.display_name}, synchronize_session=False
+        )
     return contact
 
 def get_or_create_conversation(admin_id, contact_id):
@@ -95,7 +120,9 @@ def get_or_create_conversation(admin_id, contact_id):
     conv = WAConversation.query.filter_by(admin_id=admin_id, contact_id=contact_id).first()
     if not conv:
         try:
-            conv = WAConversation(admin_id=admin_id, contact_id=contact_id, status="open")
+            contact = db.session.get(WAContact, contact_id)
+            conv = WAConversation(admin_id=admin_id, contact_id=contact_id, status="open",
+                                  contact_display_name=contact.display_name if contact else None)
             db.session.add(conv)
             db.session.flush()
         except IntegrityError:
@@ -145,11 +172,13 @@ def save_config():
     if not cfg:
         cfg = WhatsAppConfig(admin_id=admin.id)
         db.session.add(cfg)
+    previous_phone_id = cfg.phone_number_id
 
     cfg.set_token(access_token)
     cfg.phone_number_id = phone_number_id
     cfg.waba_id         = waba_id
     cfg.is_active       = True
+    cfg.templates_etag  = None   # next sync fetches the full listing
 
     # Optional fields
     if data.get("business_name"):
@@ -160,6 +189,7 @@ def save_config():
         cfg.verify_token = data["verify_token"]
 
     db.session.commit()
+    wa_tenants.invalidate(admin.id, previous_phone_id, phone_number_id)
     return jsonify({"message": "WhatsApp config saved", "config": cfg.to_dict()}), 200
 
 
@@ -176,6 +206,7 @@ def disconnect_config():
     if cfg:
         cfg.is_active = False
         db.session.commit()
+        wa_tenants.invalidate(admin.id, cfg.phone_number_id)
     return jsonify({"message": "WhatsApp disconnected"}), 200
 
 
@@ -228,8 +259,8 @@ def sync_templates():
     try:
         from app.services.whatsapp_service import BrandmoService
         svc = BrandmoService(cfg)
-        count = svc.sync_templates()
-        return jsonify({"message": f"Synced {count} templates", "synced": count}), 200
+        result = svc.sync_templates()
+        return jsonify(dict(result, message=f"Synced {result['synced']} templates")), 200
     except _ext_requests.HTTPError as e:
         body = ""
         try:
@@ -322,7 +353,9 @@ def create_template():
             synced_at=datetime.utcnow(),
         )
         db.session.add(tmpl)
+        cfg.templates_etag = None   # local rows changed: next sync must not trust a 304
         db.session.commit()
+        wa_tenants.invalidate(admin.id)
 
         return jsonify({"message": "Template submitted for review", "template": tmpl.to_dict()}), 201
     except _ext_requests.HTTPError as e:
@@ -376,7 +409,10 @@ def delete_template(template_id):
             current_app.logger.warning(f"API delete failed (deleting locally anyway): {e}")
 
     db.session.delete(tmpl)
+    if cfg:
+        cfg.templates_etag = None   # local rows changed: next sync must not trust a 304
     db.session.commit()
+    wa_tenants.invalidate(admin.id)
     return jsonify({"message": "Template deleted"}), 200
 
 
@@ -397,15 +433,9 @@ def send_template():
     if err:
         return err
 
-    cfg = get_wa_config(admin.id)
-    if not cfg or not cfg.is_active:
-        return jsonify({"error": "WhatsApp not connected"}), 400
-    missing = get_wa_config_missing_fields(cfg)
-    if missing:
-        return jsonify({
-            "error": "WhatsApp configuration is incomplete.",
-            "missing_fields": missing,
-        }), 400
+    tenant, err = get_wa_tenant_or_err(admin.id)
+    if err:
+        return err
 
     data          = request.get_json() or {}
     phone         = normalize_phone((data.get("phone") or "").strip())
@@ -418,18 +448,14 @@ def send_template():
         return jsonify({"error": "phone and template_name are required"}), 400
 
     # Validate template exists and is approved
-    tmpl = WATemplate.query.filter_by(
-        admin_id=admin.id,
-        name=template_name,
-    ).first()
+    tmpl = tenant.template(template_name)
     if not tmpl:
         return jsonify({"error": f"Template '{template_name}' not found. Please sync templates first."}), 404
     if tmpl.status.upper() != "APPROVED":
         return jsonify({"error": f"Template status is '{tmpl.status}'. Only APPROVED templates can be sent."}), 400
 
     try:
-        from app.services.whatsapp_service import BrandmoService
-        svc    = BrandmoService(cfg)
+        svc    = tenant.client
         result = svc.send_template(phone, template_name, tmpl.language or language, parameters, header)
 
         # Extract wamid from Brandmo response
@@ -461,7 +487,7 @@ def send_template():
                 status          = "sent",
             )
             db.session.add(msg)
-        conv.last_message_at = datetime.utcnow()
+        conv.record_message(msg if wamid else None)
         db.session.commit()
 
         return jsonify({
@@ -503,32 +529,51 @@ def list_conversations():
     if err:
         return err
 
-    status = request.args.get("status", "open")
-    q = WAConversation.query.filter_by(admin_id=admin.id)
-    if status != "all":
-        q = q.filter_by(status=status)
-    q = q.order_by(nulls_last(WAConversation.last_message_at.desc()))
-
+    status   = request.args.get("status", "open")
     page     = max(1, int(request.args.get("page", 1)))
     per_page = min(int(request.args.get("per_page", 30)), 100)
-    pag      = q.paginate(page=page, per_page=per_page, error_out=False)
-
-    items = []
-    for conv in pag.items:
-        d = conv.to_dict(include_last_message=True)
-        items.append(d)
+    items, total = inbox_page(admin.id, status, page, per_page)
 
     return jsonify({
         "conversations": items,
         "meta": {
-            "page":     pag.page,
-            "per_page": pag.per_page,
-            "total":    pag.total,
-            "pages":    pag.pages,
+            "page":     page,
+            "per_page": per_page,
+            "total":    total,
+            "pages":    -(-total // per_page),
         },
     }), 200
 
 
+def inbox_page(admin_id, status, page, per_page):
+    """
+    One page of the conversation list in two queries: the page itself (with
+    contact, assigned agent name and the total count as a window column) and
+    the active locks of its conversations.
+    """
+    q = db.session.query(
+        WAConversation, WAContact, User.name, func.count().over()
+    ).outerjoin(WAContact, WAContact.id == WAConversation.contact_id).outerjoin(
+        User, User.id == WAConversation.assigned_agent_id
+    ).filter(WAConversation.admin_id == admin_id)
+    if status != "all":
+        q = q.filter(WAConversation.status == status)
+    rows = q.order_by(nulls_last(WAConversation.last_message_at.desc())).offset(
+        (page - 1) * per_page
+    ).limit(per_page).all()
+
+    if rows:
+        total = rows[0][3]
+    else:
+        # Past the last page: only here is a separate count needed
+        count_q = WAConversation.query.filter_by(admin_id=admin_id)
+        total = (count_q if status == "all" else count_q.filter_by(status=status)).count()
+
+    locks = wa_locks.active_locks(admin_id, [conv.id for conv, *_ in rows])
+    items = [conv.to_inbox_dict(contact, agent_name, locks.get(conv.id)) for conv, contact, agent_name, _ in rows]
+    return items, total
+
+
 # ─────────────────────────────────────────────
 # 8. MESSAGES — FOR A CONVERSATION
 # ─────────────────────────────────────────────
@@ -536,6 +581,22 @@ def list_conversations():
 @bp.route("/conversations/<int:conv_id>/messages", methods=["GET"])
 @jwt_required()
 def list_messages(conv_id):
+    """
+    Message timeline, newest first in pages, returned oldest → newest.
+
+    ?limit=N          the newest N messages (default 50, max 200)
+    ?before=<cursor>  the N messages before cursors.before of an earlier page
+    ?after=<cursor>   delta sync: messages stored since cursors.after of an
+                      earlier response, including late ones with older timestamps
+                      (default limit 200)
+
+    Pages are keyset queries on (conversation_id, created_at, id); no COUNT.
+    Message ids are not committed in order (a drainer may commit a lower id
+    after a higher one is visible), so a delta re-reads the ids of the last
+    WA_MESSAGES_DELTA_OVERLAP_SECONDS; clients merge messages by id. The newest page first looks back WA_MESSAGES_HOT_DAYS only, so on
+    PostgreSQL it reads the recent monthly partitions; quiet conversations
+    fall back to the unbounded query.
+    """
     if not admin_required():
         return jsonify({"error": "Admin role required"}), 403
     admin, err = get_admin_or_err()
@@ -546,34 +607,112 @@ def list_messages(conv_id):
     if not conv:
         return jsonify({"error": "Conversation not found"}), 404
 
-    page     = max(1, int(request.args.get("page", 1)))
-    per_page = min(int(request.args.get("per_page", 50)), 200)
-
-    q = (
-        WAMessage.query
-        .filter_by(conversation_id=conv_id)
-        .order_by(WAMessage.created_at.asc())
-    )
-    pag      = q.paginate(page=page, per_page=per_page, error_out=False)
-    messages = [m.to_dict() for m in pag.items]
-
-    # Mark as read AFTER fetching so unread is only cleared if query succeeded
-    if conv.unread_count > 0:
-        conv.unread_count = 0
-        db.session.commit()
-
+    before = request.args.get("before")
+    after = request.args.get("after")
+    # A delta re-reads its overlap, so it takes the largest page by default
+    limit = min(max(1, int(request.args.get("limit") or request.args.get("per_page") or (200 if after else 50))), 200)
+
+    q = WAMessage.query.filter(WAMessage.conversation_id == conv_id)
+    if after:
+        delta = decode_delta_cursor(after)
+        if not delta:
+            return jsonify({"error": "Invalid after cursor"}), 400
+        rows = q.filter(WAMessage.id > delta[0]).order_by(WAMessage.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        after_cursor = next_delta_cursor(delta, rows, has_more)
+        rows.sort(key=lambda m: (m.created_at, m.id))
+    else:
+        if before:
+            cursor = decode_timeline_cursor(before)
+            if not cursor:
+                return jsonify({"error": "Invalid before cursor"}), 400
+            q = q.filter(tuple_(WAMessage.created_at, WAMessage.id) < tuple_(*cursor))
+        order = (WAMessage.created_at.desc(), WAMessage.id.desc())
+        rows = None
+        if not before:
+            hot_since = datetime.utcnow() - timedelta(days=current_app.config.get("WA_MESSAGES_HOT_DAYS", 30))
+            rows = q.filter(WAMessage.created_at >= hot_since).order_by(*order).limit(limit + 1).all()
+            if len(rows) <= limit:
+                rows = None   # the page may continue past the hot window
+        if rows is None:
+            rows = q.order_by(*order).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    # Only the newest page counts as reading; the UPDATE is skipped when nothing is unread
+    if not before and (conv.unread_count or 0) > 0:
+        reset = WAConversation.query.filter(
+            WAConversation.id == conv.id, WAConversation.unread_count > 0
+        ).update({"unread_count": 0}, synchronize_session=False)
+        if reset:
+            db.session.commit()
+
+    # Older pages never move the delta cursor. The newest page's delta starts at
+    # its oldest id, so a lower id committed late is still picked up.
+    if not after:
+        after_cursor = None
+        if rows and not before:
+            after_cursor = encode_delta_cursor(min(m.id for m in rows), max(m.id for m in rows), int(time.time()))
     return jsonify({
         "conversation": conv.to_dict(),
-        "messages":     messages,
-        "meta": {
-            "page":     pag.page,
-            "per_page": pag.per_page,
-            "total":    pag.total,
-            "pages":    pag.pages,
+        "messages":     [m.to_dict() for m in rows],
+        "has_more":     has_more,
+        "cursors": {
+            "before": encode_timeline_cursor(rows[0]) if (has_more and not after) else None,
+            "after":  after_cursor,
         },
     }), 200
 
 
+def encode_timeline_cursor(msg):
+    return f"{msg.created_at.isoformat()}_{msg.id}"
+
+
+def decode_timeline_cursor(value):
+    """'<created_at iso>_<id>' -> (datetime, id), or None if malformed."""
+    try:
+        created_at, msg_id = value.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(msg_id)
+    except (ValueError, AttributeError):
+        return None
+
+
+def encode_delta_cursor(floor_id, seen_id, seen_at):
+    return f"{floor_id}_{seen_id}_{seen_at}"
+
+
+def decode_delta_cursor(value):
+    """
+    '<floor id>_<seen id>_<seen at>' -> ints, or None if malformed. The delta
+    returns ids above floor; seen id was the highest id visible at `seen at`
+    (epoch seconds). A bare '<id>' (older clients) is taken as settled.
+    """
+    try:
+        parts = [int(p) for p in value.split("_")]
+    except (ValueError, AttributeError):
+        return None
+    if len(parts) == 1:
+        return parts[0], parts[0], 0
+    return tuple(parts) if len(parts) == 3 else None
+
+
+def next_delta_cursor(delta, rows, has_more):
+    """
+    Moves the floor up to `seen id` once every id below it has had
+    WA_MESSAGES_DELTA_OVERLAP_SECONDS to commit; until then the same ids are
+    re-read. rows: this delta's messages in id order.
+    """
+    floor_id, seen_id, seen_at = delta
+    now = int(time.time())
+    if now - seen_at < current_app.config.get("WA_MESSAGES_DELTA_OVERLAP_SECONDS", 30):
+        return encode_delta_cursor(floor_id, seen_id, seen_at)
+    if has_more and rows[-1].id < seen_id:
+        # A long backlog below seen id: it is settled, page through it
+        return encode_delta_cursor(rows[-1].id, seen_id, seen_at)
+    return encode_delta_cursor(seen_id, max([seen_id] + [m.id for m in rows]), now)
+
+
 # ─────────────────────────────────────────────
 # 9. SEND TEXT / TEMPLATE IN CONVERSATION
 # ─────────────────────────────────────────────
@@ -595,15 +734,9 @@ def send_in_conversation(conv_id):
     if not conv:
         return jsonify({"error": "Conversation not found"}), 404
 
-    cfg = get_wa_config(admin.id)
-    if not cfg or not cfg.is_active:
-        return jsonify({"error": "WhatsApp not connected"}), 400
-    missing = get_wa_config_missing_fields(cfg)
-    if missing:
-        return jsonify({
-            "error": "WhatsApp configuration is incomplete.",
-            "missing_fields": missing,
-        }), 400
+    tenant, err = get_wa_tenant_or_err(admin.id)
+    if err:
+        return err
 
     data      = request.get_json() or {}
     msg_type  = data.get("type", "text")
@@ -621,18 +754,16 @@ def send_in_conversation(conv_id):
         }), 400
 
     # Enforce conversation lock expiry before allowing send
-    if conv.lock and not conv.lock.is_expired():
-        from flask_jwt_extended import get_jwt_identity as _get_id
-        current_actor_id = int(_get_id())
-        if conv.lock.agent_id != current_actor_id:
-            return jsonify({
-                "error": "Conversation is locked by another agent.",
-                "locked_by": conv.lock.agent_id,
-            }), 409
+    lock = wa_locks.active_locks(admin.id, [conv.id]).get(conv.id)
+    if lock and (lock["holder_id"], lock["holder_type"]) != (admin.id, "admin"):
+        return jsonify({
+            "error": "Conversation is locked by another agent.",
+            "locked_by": lock["holder_id"],
+            "locked_by_name": lock["name"],
+        }), 409
 
     try:
-        from app.services.whatsapp_service import BrandmoService
-        svc = BrandmoService(cfg)
+        svc = tenant.client
         wamid = None
         msg = None
         body_preview = ""
@@ -654,7 +785,7 @@ def send_in_conversation(conv_id):
             if not template_name:
                 return jsonify({"error": "template_name is required"}), 400
 
-            tmpl = WATemplate.query.filter_by(admin_id=admin.id, name=template_name).first()
+            tmpl = tenant.template(template_name)
             if not tmpl:
                 return jsonify({"error": "Template not found"}), 404
             if tmpl.status.upper() != "APPROVED":
@@ -706,7 +837,7 @@ def send_in_conversation(conv_id):
             )
             db.session.add(msg)
 
-        conv.last_message_at = datetime.utcnow()
+        conv.record_message(msg)
         db.session.commit()
 
         return jsonify({
@@ -818,165 +949,25 @@ def webhook_verify():
 @bp.route("/webhook", methods=["POST"])
 def webhook_receive():
     """
-    Receive and process WhatsApp events from Brandmo/Meta.
-    Handles: incoming messages, status updates (sent/delivered/read/failed).
-    Routes events to the right admin by phone_number_id.
+    Receive WhatsApp events from Brandmo/Meta.
+    The raw payload is appended to the durable inbox and processed in
+    batches by the inbox drainer (messages, status updates, routing to the
+    right admin by phone_number_id), so Brandmo gets its 200 at once.
     """
     data = request.get_json(silent=True) or {}
-
-    try:
-        for entry in data.get("entry", []):
-            for change in entry.get("changes", []):
-                val = change.get("value", {})
-
-                # --- Metadata: identify admin by phone_number_id ---
-                metadata = val.get("metadata", {})
-                phone_number_id = metadata.get("phone_number_id")
-
-                cfg = None
-                if phone_number_id:
-                    cfg = WhatsAppConfig.query.filter_by(
-                        phone_number_id=phone_number_id,
-                        is_active=True,
-                    ).first()
-
-                admin_id = cfg.admin_id if cfg else None
-
-                # --- INCOMING MESSAGES ---
-                for msg_obj in val.get("messages", []):
-                    _handle_inbound_message(admin_id, msg_obj, val)
-
-                # --- STATUS UPDATES ---
-                for status_obj in val.get("statuses", []):
-                    _handle_status_update(status_obj)
-
+    if not data.get("entry"):
         return jsonify({"status": "ok"}), 200
 
-    except Exception as e:
-        current_app.logger.exception("Webhook processing error")
-        # Always return 200 to Brandmo — returning 5xx causes automatic retries
-        # which would re-process the same events and cause duplicate messages.
-        return jsonify({"status": "ok", "warning": "internal processing error"}), 200
-
-
-def _handle_inbound_message(admin_id, msg_obj, val):
-    """Process one incoming message object from the webhook payload."""
-    if not admin_id:
-        return
-
-    wamid        = msg_obj.get("id")
-    from_phone   = msg_obj.get("from")
-    timestamp_ts = int(msg_obj.get("timestamp", 0))
-    msg_type     = msg_obj.get("type", "text")
-
-    # Deduplicate — scoped to admin_id so cross-admin wamid collision doesn't suppress a valid inbound
-    if wamid and WAMessage.query.filter_by(whatsapp_msg_id=wamid, admin_id=admin_id).first():
-        return
-
-    # Profile name
-    profile_name = None
-    contacts_list = val.get("contacts", [])
-    if contacts_list:
-        profile_name = contacts_list[0].get("profile", {}).get("name")
-
-    # Extract text
-    message_text  = None
-    media_id      = None
-    media_mime    = None
-    media_filename = None
-
-    if msg_type == "text":
-        message_text = msg_obj.get("text", {}).get("body")
-    elif msg_type in ("image", "video", "audio", "document", "sticker"):
-        media_info    = msg_obj.get(msg_type, {})
-        media_id      = media_info.get("id")
-        media_mime    = media_info.get("mime_type")
-        media_filename = media_info.get("filename")
-        message_text  = media_info.get("caption")
-    elif msg_type == "interactive":
-        interactive = msg_obj.get("interactive", {})
-        itype = interactive.get("type")
-        if itype == "button_reply":
-            message_text = interactive.get("button_reply", {}).get("title")
-        elif itype == "list_reply":
-            message_text = interactive.get("list_reply", {}).get("title")
-    elif msg_type == "location":
-        loc = msg_obj.get("location", {})
-        message_text = f"📍 {loc.get('name', 'Location')}: {loc.get('latitude')},{loc.get('longitude')}"
-
-    # Upsert contact & conversation
-    contact = get_or_create_contact(admin_id, from_phone, profile_name)
-    conv    = get_or_create_conversation(admin_id, contact.id)
-
-    msg_dt = datetime.utcfromtimestamp(timestamp_ts) if timestamp_ts else datetime.utcnow()
-
-    # Update 24h window
-    conv.last_customer_msg_at = msg_dt
-    conv.last_message_at      = msg_dt
-    conv.unread_count         = (conv.unread_count or 0) + 1
-    if conv.status == "closed":
-        conv.status = "open"
-
-    msg = WAMessage(
-        conversation_id = conv.id,
-        admin_id        = admin_id,
-        whatsapp_msg_id = wamid,
-        sender_type     = "customer",
-        message_type    = msg_type,
-        message_text    = message_text,
-        media_id        = media_id,
-        media_mime_type = media_mime,
-        media_filename  = media_filename,
-        status          = "received",
-        created_at      = msg_dt,
-    )
-    db.session.add(msg)
-    try:
-        db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        from flask import current_app as _app
-        _app.logger.error(f"[Webhook] Failed to save inbound message {wamid}: {e}")
-
-
-def _handle_status_update(status_obj):
-    """Update WAMessage delivery status from webhook."""
-    wamid     = status_obj.get("id")
-    status    = status_obj.get("status")  # sent / delivered / read / failed
-    timestamp = status_obj.get("timestamp")
-
-    if not wamid or not status:
-        return
-
-    msg = WAMessage.query.filter_by(whatsapp_msg_id=wamid).first()
-    if not msg:
-        return
-
-    # Status precedence: failed > read > delivered > sent
-    precedence = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
-    current_p  = precedence.get(msg.status, 0)
-    new_p      = precedence.get(status, 0)
-
-    if new_p >= current_p:
-        msg.status = status
-        if status == "failed":
-            error_data    = status_obj.get("errors", [{}])[0]
-            msg.error_code    = str(error_data.get("code", ""))
-            msg.error_message = error_data.get("message", "")
-
-    # Always log
-    log = WAMessageStatusLog(
-        message_id  = msg.id,
-        status      = status,
-        timestamp   = datetime.utcfromtimestamp(int(timestamp)) if timestamp else datetime.utcnow(),
-        raw_payload = str(status_obj),
-    )
-    db.session.add(log)
     try:
-        db.session.commit()
-    except Exception as e:
+        wa_inbox.enqueue(data)
+    except Exception:
         db.session.rollback()
-        current_app.logger.error(f"[Webhook] Failed to save status update for {wamid}: {e}")
+        current_app.logger.exception("Webhook enqueue error")
+        # Nothing was stored, so let Brandmo retry the delivery
+        return jsonify({"status": "error"}), 500
+
+    wa_inbox.drainer.notify(current_app._get_current_object())
+    return jsonify({"status": "ok"}), 200
 
 
 # ─────────────────────────────────────────────────────────
@@ -1064,24 +1055,27 @@ def _get_best_lead_phone(lead) -> str:
         if normalized:
             return normalized
     return ""
-def send_lead_assignment_whatsapp(admin_id, lead, agent):
+def send_lead_assignment_whatsapp(admin_id, lead, agent, targets=None):
     """
-    Non-blocking. Call this after a lead is assigned to an agent.
+    Delivers a lead_assigned outbox event (see wa_outbox); lead saves only
+    stage the event.
 
     Sends:
       • agent_template → agent.phone  (notify agent of new lead)
       • lead_template  → lead.phone   (welcome message to lead)
+    targets limits the sides sent ("agent", "lead"), so a retry resends
+    only the side that failed.
 
-    All failures are silently logged — never raises, never blocks lead save.
+    All failures are logged and reported per side — never raises.
 
     Returns dict with results or None if not configured/enabled.
     """
     try:
         # 1. Load config
-        cfg_wa   = WhatsAppConfig.query.filter_by(admin_id=admin_id, is_active=True).first()
-        cfg_auto = WALeadAssignConfig.query.filter_by(admin_id=admin_id).first()
+        tenant   = wa_tenants.get(admin_id)
+        cfg_auto = WALeadAssignConfig.query.filter_by(admin_id=admin_id).first() if tenant else None
 
-        if not cfg_wa or not cfg_auto or not cfg_auto.is_enabled:
+        if not tenant or not cfg_auto or not cfg_auto.is_enabled:
             return None  # Not set up — skip silently
 
         # Check admin subscription
@@ -1089,8 +1083,7 @@ def send_lead_assignment_whatsapp(admin_id, lead, agent):
         if not admin or not admin.is_active or admin.is_expired():
             return None
 
-        from app.services.whatsapp_service import BrandmoService
-        svc = BrandmoService(cfg_wa)
+        svc = tenant.client
 
         # Build substitution context
         context = {
@@ -1105,12 +1098,11 @@ def send_lead_assignment_whatsapp(admin_id, lead, agent):
 
         # ── Send to AGENT ──────────────────────────────────
         agent_phone_e164 = normalize_phone(agent.phone) if (agent and agent.phone) else ""
-        if cfg_auto.agent_template_name and agent and agent_phone_e164:
+        if targets is not None and "agent" not in targets:
+            results["agent"] = {"status": "skipped", "reason": "not requested (already sent)"}
+        elif cfg_auto.agent_template_name and agent and agent_phone_e164:
             try:
-                tmpl = WATemplate.query.filter_by(
-                    admin_id=admin_id,
-                    name=cfg_auto.agent_template_name,
-                ).first()
+                tmpl = tenant.template(cfg_auto.agent_template_name)
                 if tmpl and tmpl.status.upper() == "APPROVED":
                     params  = _resolve_params(cfg_auto.agent_params, context)
                     
@@ -1148,7 +1140,7 @@ def send_lead_assignment_whatsapp(admin_id, lead, agent):
                             status          = "sent",
                         )
                         db.session.add(msg)
-                    conv.last_message_at = datetime.utcnow()
+                    conv.record_message(msg if wamid else None)
                     db.session.commit()
                     results["agent"] = {"status": "sent", "wamid": wamid}
                 else:
@@ -1166,12 +1158,11 @@ def send_lead_assignment_whatsapp(admin_id, lead, agent):
 
         # ── Send to LEAD ───────────────────────────────────
         lead_phone_e164 = _get_best_lead_phone(lead)
-        if cfg_auto.lead_template_name and lead_phone_e164:
+        if targets is not None and "lead" not in targets:
+            results["lead"] = {"status": "skipped", "reason": "not requested (already sent)"}
+        elif cfg_auto.lead_template_name and lead_phone_e164:
             try:
-                tmpl = WATemplate.query.filter_by(
-                    admin_id=admin_id,
-                    name=cfg_auto.lead_template_name,
-                ).first()
+                tmpl = tenant.template(cfg_auto.lead_template_name)
                 if tmpl and tmpl.status.upper() == "APPROVED":
                     params  = _resolve_params(cfg_auto.lead_params, context)
                     
@@ -1210,7 +1201,7 @@ def send_lead_assignment_whatsapp(admin_id, lead, agent):
                             status          = "sent",
                         )
                         db.session.add(msg)
-                    conv.last_message_at = datetime.utcnow()
+                    conv.record_message(msg if wamid else None)
                     db.session.commit()
                     results["lead"] = {"status": "sent", "wamid": wamid}
                 else:
@@ -1303,3 +1294,294 @@ def save_lead_assign_config():
     return jsonify({"message": "Config saved", "config": cfg.to_dict()}), 200
 
 
+
+
+# ─────────────────────────────────────────────
+# 13. LIVE INBOX EVENTS (Server-Sent Events)
+# ─────────────────────────────────────────────
+
+@bp.route("/events", methods=["GET"])
+@jwt_required()
+def stream_events():
+    """
+    text/event-stream of the admin's inbox events (message / status / lock /
+    resync). Resumes after the Last-Event-ID header (or ?last_event_id=).
+    """
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    admin_id = admin.id
+    # The stream outlives the request's DB work: release the session first
+    db.session.remove()
+    try:
+        stream = wa_events.open_stream(current_app._get_current_object(), admin_id, last_event_id)
+    except wa_events.StreamLimitReached:
+        # Every stream slot of this worker is taken; the client retries (likely on another worker)
+        retry_ms = current_app.config.get("WA_EVENTS_RETRY_MS", 3000)
+        return Response(f"retry: {retry_ms}\n\n", status=503, mimetype="text/event-stream", headers={
+            "Retry-After": str(max(retry_ms // 1000, 1)),
+            "Cache-Control": "no-cache",
+        })
+    return Response(stream, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",   # no proxy buffering (nginx)
+    })
+
+
+# ─────────────────────────────────────────────
+# 14. BROADCAST CAMPAIGNS
+# ─────────────────────────────────────────────
+
+@bp.route("/campaigns", methods=["POST"])
+@jwt_required()
+def create_campaign():
+    """
+    JSON body: { name, template_name, parameters: [...], header_url?,
+                 segment?: {status, source, assigned_to, created_from, created_to},
+                 recipients?: [{phone, name, ...}], start?: bool }
+    or multipart with a CSV `file` (phone, name, any {{column}}) and the same
+    fields as form values (parameters as a JSON list).
+    Parameters take {{lead_name}}, {{lead_phone}}, {{lead_source}},
+    {{lead_status}}, {{lead_location}} or, for uploads, any column name.
+    """
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    tenant, err = get_wa_tenant_or_err(admin.id)
+    if err:
+        return err
+
+    upload = request.files.get("file")
+    if upload:
+        data = request.form.to_dict()
+        try:
+            data["parameters"] = json.loads(data.get("parameters") or "[]")
+        except ValueError:
+            return jsonify({"error": "parameters must be a JSON list"}), 400
+        data["start"] = data.get("start", "").lower() in ("1", "true", "yes")
+    else:
+        data = request.get_json() or {}
+
+    name          = (data.get("name") or "").strip()
+    template_name = (data.get("template_name") or "").strip()
+    parameters    = data.get("parameters") or []
+    segment       = data.get("segment")
+    if not name or not template_name:
+        return jsonify({"error": "name and template_name are required"}), 400
+    if not isinstance(parameters, list):
+        return jsonify({"error": "parameters must be a list"}), 400
+
+    tmpl = tenant.template(template_name)
+    if not tmpl:
+        return jsonify({"error": f"Template '{template_name}' not found. Please sync templates first."}), 404
+    if tmpl.status.upper() != "APPROVED":
+        return jsonify({"error": f"Template status is '{tmpl.status}'. Only APPROVED templates can be sent."}), 400
+
+    if upload:
+        rows = csv.DictReader(io.StringIO(upload.read().decode("utf-8-sig", errors="replace")))
+        recipients, segment = wa_campaigns.recipients_from_upload(rows), None
+    elif data.get("recipients"):
+        recipients, segment = wa_campaigns.recipients_from_upload(data["recipients"]), None
+    elif isinstance(segment, dict):
+        recipients = wa_campaigns.recipients_from_leads(admin.id, segment)
+    else:
+        return jsonify({"error": "Provide a lead segment, a recipients list or a CSV file"}), 400
+
+    try:
+        campaign, skipped = wa_campaigns.create_campaign(
+            admin.id, name, template_name, [str(p) for p in parameters], recipients,
+            header_url=(data.get("header_url") or "").strip() or None, segment=segment,
+            max_recipients=current_app.config.get("WA_CAMPAIGN_MAX_RECIPIENTS", 100000),
+        )
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+
+    if data.get("start"):
+        campaign.status = "queued"
+        db.session.commit()
+        wa_campaigns.dispatcher.notify(current_app._get_current_object())
+
+    return jsonify({"message": "Campaign created", "campaign": campaign.to_dict(), "skipped": skipped}), 201
+
+
+@bp.route("/campaigns", methods=["GET"])
+@jwt_required()
+def list_campaigns():
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    campaigns = WACampaign.query.filter_by(admin_id=admin.id).order_by(WACampaign.id.desc()).limit(50).all()
+    return jsonify({"campaigns": [c.to_dict() for c in campaigns]}), 200
+
+
+@bp.route("/campaigns/<int:campaign_id>", methods=["GET"])
+@jwt_required()
+def get_campaign(campaign_id):
+    """Progress counters; ?recipients=<status> also lists up to 100 recipients in that status."""
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    campaign = WACampaign.query.filter_by(id=campaign_id, admin_id=admin.id).first()
+    if not campaign:
+        return jsonify({"error": "Campaign not found"}), 404
+
+    result = {"campaign": campaign.to_dict()}
+    recipient_status = request.args.get("recipients")
+    if recipient_status:
+        rows = WACampaignRecipient.query.filter_by(campaign_id=campaign.id, status=recipient_status) \
+            .order_by(WACampaignRecipient.id).limit(100).all()
+        result["recipients"] = [r.to_dict() for r in rows]
+    return jsonify(result), 200
+
+
+@bp.route("/campaigns/<int:campaign_id>/start", methods=["POST"])
+@jwt_required()
+def start_campaign(campaign_id):
+    """Queues a draft campaign, or resumes a cancelled / failed one from its pending recipients."""
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    queued = WACampaign.query.filter(
+        WACampaign.id == campaign_id, WACampaign.admin_id == admin.id,
+        WACampaign.status.in_(["draft", "cancelled", "failed"])
+    ).update({"status": "queued", "error": None, "completed_at": None}, synchronize_session=False)
+    db.session.commit()
+    if not queued:
+        return jsonify({"error": "Campaign not found or already running"}), 409
+
+    wa_campaigns.dispatcher.notify(current_app._get_current_object())
+    return jsonify({"message": "Campaign queued"}), 200
+
+
+@bp.route("/campaigns/<int:campaign_id>/cancel", methods=["POST"])
+@jwt_required()
+def cancel_campaign(campaign_id):
+    """Stops a campaign after the batch in flight; unsent recipients stay pending."""
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    cancelled = WACampaign.query.filter(
+        WACampaign.id == campaign_id, WACampaign.admin_id == admin.id,
+        WACampaign.status.in_(["draft", "queued", "running"])
+    ).update({"status": "cancelled", "completed_at": datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    if not cancelled:
+        return jsonify({"error": "Campaign not found or already finished"}), 409
+    return jsonify({"message": "Campaign cancelled"}), 200
+
+
+# ─────────────────────────────────────────────
+# 15. CONVERSATION LOCKS
+# ─────────────────────────────────────────────
+
+@bp.route("/conversations/<int:conv_id>/lock", methods=["POST"])
+@jwt_required()
+def lock_conversation(conv_id):
+    """Takes the reply lock, or renews it (call again before it expires)."""
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    if not db.session.query(WAConversation.id).filter_by(id=conv_id, admin_id=admin.id).first():
+        return jsonify({"error": "Conversation not found"}), 404
+
+    acquired, lock = wa_locks.acquire(admin.id, conv_id, admin.id, "admin")
+    db.session.commit()
+    if not acquired:
+        return jsonify({
+            "error": "Conversation is locked by another agent.",
+            "locked_by": lock["holder_id"] if lock else None,
+            "locked_by_name": lock["name"] if lock else None,
+            "expires_at": lock["expires_at"] if lock else None,
+        }), 409
+    return jsonify({"locked": True, "expires_at": lock["expires_at"]}), 200
+
+
+@bp.route("/conversations/<int:conv_id>/lock", methods=["DELETE"])
+@jwt_required()
+def unlock_conversation(conv_id):
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    released = wa_locks.release(admin.id, conv_id, admin.id, "admin")
+    db.session.commit()
+    return jsonify({"released": released}), 200
+
+
+@bp.route("/conversations/locks", methods=["GET"])
+@jwt_required()
+def conversation_locks():
+    """?ids=1,2,3 → active locks of those conversations, keyed by id."""
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    try:
+        ids = [int(i) for i in (request.args.get("ids") or "").split(",") if i.strip()]
+    except ValueError:
+        return jsonify({"error": "ids must be a comma-separated list of conversation ids"}), 400
+    if len(ids) > 200:
+        return jsonify({"error": "At most 200 ids per request"}), 400
+    return jsonify({"locks": wa_locks.active_locks(admin.id, ids)}), 200
+
+
+# ─────────────────────────────────────────────
+# 16. MEDIA — PRESIGNED URLS FOR ATTACHMENTS
+# ─────────────────────────────────────────────
+
+@bp.route("/messages/<int:msg_id>/media", methods=["GET"])
+@jwt_required()
+def message_media(msg_id):
+    """
+    Short-lived URL (plus thumbnail_url for images) of a message's attachment.
+    Inbound media is copied from WhatsApp to storage on first access.
+    """
+    if not admin_required():
+        return jsonify({"error": "Admin role required"}), 403
+    admin, err = get_admin_or_err()
+    if err:
+        return err
+
+    msg = WAMessage.query.filter_by(id=msg_id, admin_id=admin.id).first()
+    if not msg or not (msg.media_id or msg.media_url):
+        return jsonify({"error": "Media not found"}), 404
+    if not msg.media_id:
+        # Sent by link: already public
+        return jsonify({"url": msg.media_url, "thumbnail_url": None,
+                        "mime_type": msg.media_mime_type, "size_bytes": None}), 200
+
+    try:
+        return jsonify(wa_media.media_payload(wa_media.media_for_message(msg))), 200
+    except wa_media.MediaUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    except (_ext_requests.RequestException, ValueError) as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Media {msg.media_id} download failed: {e}")
+        return jsonify({"error": "Could not fetch the media from WhatsApp. It may have expired."}), 502
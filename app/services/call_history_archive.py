@@ -0,0 +1,242 @@
+# app/services/call_history_archive.py
+"""
+call_history partitions and archive tier.
+
+On PostgreSQL call_history is range partitioned by month on timestamp
+(migration c9d3e5f7a1b2), so analytics over a date range only scan the
+months in it. A daily job creates the partitions of the coming months and,
+when CALL_HISTORY_ARCHIVE_AFTER_MONTHS is set, archives older months:
+  1. the month's rows are exported as gzipped CSV to object storage (Wasabi),
+     call-history-archive/<YYYY>/<YYYYMM>-<archived at>.csv.gz
+  2. per-user totals are added to call_history_monthly_summaries
+  3. the month's partition is detached and dropped (a plain DELETE elsewhere),
+     in the same transaction as 2.
+
+Analytics add archived_totals() for the archived months in their range to
+their live aggregates. Device
+syncs skip calls older than archive_cutoff(), so an archived month is not
+filled again by a phone re-sending its full log.
+"""
+
+import io
+import csv
+import gzip
+import logging
+import datetime
+import tempfile
+import threading
+
+from flask import current_app
+from sqlalchemy import text, func, case
+from app.models import db, CallHistory, CallHistoryMonthlySummary, now
+from app.utils import partitions
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_PREFIX = "call-history-archive"
+EXPORT_COLUMNS = ("id", "user_id", "phone_number", "formatted_number", "call_type", "timestamp",
+                  "duration", "contact_name", "recording_path", "created_at")
+SUMMARY_FIELDS = ("total_calls", "incoming_calls", "outgoing_calls", "missed_calls", "rejected_calls",
+                  "total_duration", "incoming_duration", "outgoing_duration")
+
+_lock = threading.Lock()
+_storage = None
+
+
+class ArchiveUnavailable(Exception):
+    """Object storage is not configured, so nothing can be archived."""
+
+
+class ArchivedRangeError(ValueError):
+    """A date range starts or ends inside an archived month (only whole-month totals are kept)."""
+
+
+def _storage_client():
+    config = current_app.config
+    if not (config.get("WASABI_ACCESS_KEY") and config.get("WASABI_SECRET_KEY") and config.get("WASABI_BUCKET_NAME")):
+        raise ArchiveUnavailable("Object storage is not configured")
+    global _storage
+    with _lock:
+        if _storage is None:
+            import boto3
+            _storage = boto3.client(
+                "s3",
+                endpoint_url=config.get("WASABI_ENDPOINT_URL"),
+                aws_access_key_id=config["WASABI_ACCESS_KEY"],
+                aws_secret_access_key=config["WASABI_SECRET_KEY"],
+                region_name=config.get("WASABI_REGION", "us-east-1"),
+            )
+        return _storage
+
+
+def archive_cutoff():
+    """Start of the oldest month still kept in call_history, or None if archiving is off."""
+    months = current_app.config.get("CALL_HISTORY_ARCHIVE_AFTER_MONTHS", 0)
+    return partitions.month_start(now(), -months) if months else None
+
+
+# =========================================================
+# EXPORT + SUMMARY
+# =========================================================
+def _in_month(start, end):
+    return (CallHistory.timestamp >= start, CallHistory.timestamp < end)
+
+
+def export_month(start, end):
+    """Gzipped CSV of the month's rows in a spooled temp file (rewound) and the row count."""
+    spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    exported = 0
+    with gzip.GzipFile(fileobj=spool, mode="wb") as gz:
+        out = io.TextIOWrapper(gz, encoding="utf-8", newline="")
+        writer = csv.writer(out)
+        writer.writerow(EXPORT_COLUMNS)
+        rows = db.session.query(*(getattr(CallHistory, c) for c in EXPORT_COLUMNS)).filter(
+            *_in_month(start, end)
+        ).order_by(CallHistory.id).yield_per(5000)
+        for row in rows:
+            writer.writerow([v.isoformat() if isinstance(v, datetime.datetime) else v for v in row])
+            exported += 1
+        out.flush()
+        out.detach()   # closing the wrapper would close the gzip stream early
+    spool.seek(0)
+    return spool, exported
+
+
+def month_summaries(start, end):
+    """{user_id: {field: value}} of the month, one GROUP BY."""
+    call_type = func.lower(CallHistory.call_type)
+    duration = func.coalesce(CallHistory.duration, 0)
+    rows = db.session.query(
+        CallHistory.user_id,
+        func.count(CallHistory.id),
+        func.sum(case((call_type == "incoming", 1), else_=0)),
+        func.sum(case((call_type == "outgoing", 1), else_=0)),
+        func.sum(case((call_type == "missed", 1), else_=0)),
+        func.sum(case((call_type == "rejected", 1), else_=0)),
+        func.sum(duration),
+        func.sum(case((call_type == "incoming", duration), else_=0)),
+        func.sum(case((call_type == "outgoing", duration), else_=0)),
+    ).filter(*_in_month(start, end)).group_by(CallHistory.user_id).all()
+    return {r[0]: dict(zip(SUMMARY_FIELDS, (int(v or 0) for v in r[1:]))) for r in rows}
+
+
+# =========================================================
+# ARCHIVE
+# =========================================================
+def archive_month(start):
+    """
+    Exports, summarizes and removes one month of call_history. A month
+    archived before (late rows) is added to the existing summaries.
+    Returns the number of rows archived.
+    """
+    end = partitions.month_start(start, 1)
+    storage = _storage_client()
+    archived_at = now()
+    key = f"{ARCHIVE_PREFIX}/{start:%Y}/{start:%Y%m}-{archived_at:%Y%m%d%H%M%S%f}.csv.gz"
+
+    spool, exported = export_month(start, end)
+    with spool:
+        if exported:
+            storage.upload_fileobj(spool, current_app.config["WASABI_BUCKET_NAME"], key,
+                                   ExtraArgs={"ContentType": "text/csv", "ContentEncoding": "gzip"})
+
+    month = start.date()
+    existing = {s.user_id: s for s in CallHistoryMonthlySummary.query.filter_by(month=month)}
+    for user_id, totals in month_summaries(start, end).items():
+        summary = existing.get(user_id)
+        if summary is None:
+            summary = CallHistoryMonthlySummary(user_id=user_id, month=month,
+                                                **{f: 0 for f in SUMMARY_FIELDS})
+            db.session.add(summary)
+        for field, value in totals.items():
+            setattr(summary, field, (getattr(summary, field) or 0) + value)
+        summary.object_key = key
+        summary.archived_at = archived_at
+
+    table = CallHistory.__tablename__
+    if partitions.is_partitioned(db.session, table):
+        name = partitions.monthly_partitions(db.session, table).get(start)
+        if name:
+            db.session.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            db.session.execute(text(f"DROP TABLE {name}"))
+    # Rows outside a monthly partition (DEFAULT partition, or no partitioning)
+    CallHistory.query.filter(*_in_month(start, end)).delete(synchronize_session=False)
+    db.session.commit()
+    if exported:
+        logger.info(f"[call-archive] archived {exported} calls of {start:%Y-%m} to {key}")
+    return exported
+
+
+def archive_old_months(months, today):
+    """Archives every month older than `months` months before today. Returns the rows archived."""
+    cutoff = partitions.month_start(today, -months)
+    archived = 0
+    oldest = db.session.query(func.min(CallHistory.timestamp)).scalar()
+    start = partitions.month_start(oldest) if oldest else cutoff
+    while start < cutoff:
+        end = partitions.month_start(start, 1)
+        if db.session.query(CallHistory.id).filter(*_in_month(start, end)).first():
+            archived += archive_month(start)
+        start = end
+
+    # Empty partitions left behind (e.g. created by the migration)
+    table = CallHistory.__tablename__
+    if partitions.is_partitioned(db.session, table):
+        for start, name in sorted(partitions.monthly_partitions(db.session, table).items()):
+            if start >= cutoff:
+                break
+            db.session.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            db.session.execute(text(f"DROP TABLE {name}"))
+            db.session.commit()
+    return archived
+
+
+def archived_totals(user_ids, start=None, end=None):
+    """
+    {user_id: {field: value}} summed over the archived months inside
+    [start, end) (all of them by default), one query. Raises
+    ArchivedRangeError if start or end falls inside an archived month.
+    """
+    if not user_ids:
+        return {}
+    cutoff = archive_cutoff()
+    for edge in (start, end):
+        if edge and cutoff and edge < cutoff and edge != partitions.month_start(edge):
+            raise ArchivedRangeError(
+                f"{edge:%Y-%m-%d %H:%M} falls inside an archived month; "
+                f"ranges before {cutoff:%Y-%m-%d} must start and end on a month boundary"
+            )
+
+    s = CallHistoryMonthlySummary
+    query = db.session.query(
+        s.user_id, *(func.coalesce(func.sum(getattr(s, f)), 0) for f in SUMMARY_FIELDS)
+    ).filter(s.user_id.in_(user_ids))
+    if start:
+        first = partitions.month_start(start, 0 if start == partitions.month_start(start) else 1)
+        query = query.filter(s.month >= first.date())
+    if end:
+        query = query.filter(s.month < partitions.month_start(end).date())
+    rows = query.group_by(s.user_id).all()
+    return {r[0]: dict(zip(SUMMARY_FIELDS, (int(v) for v in r[1:]))) for r in rows}
+
+
+def maintain_call_history_job(app):
+    """APScheduler Job: creates upcoming partitions and archives old months."""
+    with app.app_context():
+        try:
+            created = partitions.ensure_monthly_partitions(
+                db.session, CallHistory.__tablename__,
+                app.config.get("CALL_HISTORY_PARTITION_MONTHS_AHEAD", 3), now()
+            )
+            if created:
+                logger.info(f"[call-archive] created {created} call_history partitions")
+            months = app.config.get("CALL_HISTORY_ARCHIVE_AFTER_MONTHS", 0)
+            if months:
+                archive_old_months(months, now())
+        except ArchiveUnavailable as e:
+            logger.warning(f"[call-archive] archiving skipped: {e}")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[call-archive] maintenance failed: {e}")
+        finally:
+            db.session.remove()
@@ -0,0 +1,141 @@
+import re
+import html
+
+# name -> EmailLeadParser, filled in by each portal service module on import
+PARSERS = {}
+
+# Building blocks shared by the portal specs
+COLON = r":\s*"                 # "Label: value"
+OPTIONAL_SEP = r"\s*[:\-]?\s*"  # "Label : value", "Label - value", "Label value"
+REQUIRED_SEP = r"\s*[:\-]+\s*"  # "Label : value", "Label - value"
+
+PHONE_PREFIX = r"(?:\+91-?)?"
+PHONE_FALLBACK_RE = re.compile(r"[0-9]{10}")
+
+
+def register_parser(name, parser):
+    PARSERS[name] = parser
+    return parser
+
+
+class LeadField:
+    """
+    One labelled value in a portal email.
+
+    labels: regex alternation of the label text, e.g. r"Name|Customer Name"
+    value:  regex for the captured value (default: rest of the line)
+    prefix: regex skipped between the separator and the value (e.g. +91-)
+    """
+
+    def __init__(self, name, labels, value=r".*", prefix="", sep=None):
+        self.name = name
+        self.labels = labels
+        self.value = value
+        self.prefix = prefix
+        self.sep = sep
+
+
+def _first_char_guard(fields):
+    """(?=[cC...]) over the first letter of every label, or "" if one is not a plain letter."""
+    chars = set()
+    for field in fields:
+        for label in field.labels.split("|"):
+            if not label[:1].isalnum():
+                return ""
+            chars.update((label[0].lower(), label[0].upper()))
+    return f"(?=[{''.join(sorted(chars))}])"
+
+
+class EmailLeadParser:
+    """
+    Declarative, precompiled parser for a portal's lead emails.
+
+    All fields are compiled into one case-insensitive alternation. Each
+    alternative consumes only its label and separator and captures the value
+    in a lookahead, so one finditer() pass over the body finds every field
+    (first occurrence wins, like a per-field re.search) even when values
+    share a line, e.g. "Name : A | Mobile : 98...". Labels must start at a
+    word boundary.
+    """
+
+    def __init__(self, source, category, fields, sep=OPTIONAL_SEP, markers=(),
+                 phone_fallback=True, split_pipes=False):
+        self.source = source
+        self.category = category
+        self.fields = fields
+        self.markers = markers
+        self.phone_fallback = phone_fallback
+        self.split_pipes = split_pipes
+        self.sep = sep
+        alternation = "|".join(
+            f"(?:{f.labels}){f.sep if f.sep is not None else sep}(?={f.prefix}(?P<{f.name}>{f.value}))"
+            for f in fields
+        )
+        # Labels start at a word boundary; checking the possible first letters
+        # up front lets the scan skip most positions without trying each branch
+        self.pattern = re.compile(rf"\b{_first_char_guard(fields)}(?:{alternation})", re.IGNORECASE)
+
+    def scan(self, text):
+        """{field: raw value} for the first occurrence of every field."""
+        found = {}
+        remaining = len(self.fields)
+        for match in self.pattern.finditer(text):
+            name = match.lastgroup
+            if name in found:
+                continue
+            found[name] = match.group(name)
+            remaining -= 1
+            if not remaining:
+                break
+        return found
+
+    def parse(self, body):
+        """
+        Returns {"source", "category", <field>: value, ...} or None when the
+        body is not a lead (missing marker, or neither phone nor email).
+        """
+        text = (body or "").replace("\r", "").strip()
+
+        if self.markers and not any(marker in text for marker in self.markers):
+            return None
+
+        data = {"source": self.source, "category": self.category}
+        for name, val in self.scan(text).items():
+            val = val.strip()
+            if name == "phone":
+                val = val.replace("-", "").replace(" ", "")[-10:]  # Last 10 digits
+            elif self.split_pipes:
+                val = val.split("|")[0].strip()
+            data[name] = val
+
+        if not data.get("phone") and self.phone_fallback:
+            phone_match = PHONE_FALLBACK_RE.search(text)
+            if phone_match:
+                data["phone"] = phone_match.group(0)
+
+        if not data.get("phone") and not data.get("email"):
+            return None
+        return data
+
+
+# =========================================================
+# HTML BODIES
+# =========================================================
+_HTML_DROP_RE = re.compile(r"<(script|style|head)\b.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+_HTML_CELL_RE = re.compile(r"\s*:?\s*</t[dh]>\s*<t[dh]\b[^>]*>\s*", re.IGNORECASE)
+_HTML_BREAK_RE = re.compile(r"<br\s*/?>|</(?:p|div|tr|li|table|h[1-6])\s*>", re.IGNORECASE)
+_HTML_TAG_RE = re.compile(r"<[^>]+>")
+_BLANKS_RE = re.compile(r"[ \t\xa0]+")
+
+
+def html_to_text(markup):
+    """
+    Flattens an HTML email into "Label: value" lines: table cells on the
+    same row are joined with ": ", block elements become line breaks.
+    """
+    text = _HTML_DROP_RE.sub("", markup)
+    text = _HTML_CELL_RE.sub(": ", text)
+    text = _HTML_BREAK_RE.sub("\n", text)
+    text = html.unescape(_HTML_TAG_RE.sub("", text))
+    lines = (_BLANKS_RE.sub(" ", line).strip() for line in text.split("\n"))
+    return "\n".join(line for line in lines if line)
@@ -0,0 +1,399 @@
+import json
+import time
+import logging
+import datetime
+import threading
+
+import requests
+from flask import current_app
+from app.models import db, FacebookConnection, FacebookLeadForm, FacebookFormSync, Lead, now
+from app.services.facebook_service import FacebookService
+from app.services.lead_ingestor import LeadIngestor
+from app.services.sync_orchestrator import register_provider, run_provider
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+GRAPH_BATCH_LIMIT = 50  # requests per Graph batch call
+LEAD_FIELDS = "id,created_time,form_id,field_data"
+PAGE_SIZE = 100
+
+_form_cache = None
+_form_cache_lock = threading.Lock()
+
+
+# =========================================================
+# GRAPH BATCH
+# =========================================================
+def graph_batch(access_token, relative_urls):
+    """
+    GETs every relative URL through Graph batch requests (GRAPH_BATCH_LIMIT
+    per call). Returns a list aligned with relative_urls of
+    (status code, parsed body); (None, None) for a request Graph dropped.
+    """
+    results = []
+    proof = FacebookService.get_app_secret_proof(access_token)
+    for i in range(0, len(relative_urls), GRAPH_BATCH_LIMIT):
+        chunk = relative_urls[i:i + GRAPH_BATCH_LIMIT]
+        data = {
+            "access_token": access_token,
+            "include_headers": "false",
+            "batch": json.dumps([{"method": "GET", "relative_url": url} for url in chunk]),
+        }
+        if proof:
+            data["appsecret_proof"] = proof
+
+        resp = requests.post(FacebookService.BASE_URL, data=data, timeout=30)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Graph batch failed: {resp.status_code} {resp.text[:300]}")
+
+        for item in resp.json():
+            if not item:
+                results.append((None, None))
+                continue
+            try:
+                body = json.loads(item.get("body") or "null")
+            except ValueError:
+                body = None
+            results.append((item.get("code"), body))
+    return results
+
+
+def graph_pages(access_token, path, params=None):
+    """Yields the data list of every page of a Graph edge, following the paging cursors."""
+    params = dict(params or {}, access_token=access_token, limit=PAGE_SIZE)
+    proof = FacebookService.get_app_secret_proof(access_token)
+    if proof:
+        params["appsecret_proof"] = proof
+
+    url = f"{FacebookService.BASE_URL}/{path}"
+    while url:
+        resp = requests.get(url, params=params, timeout=30)
+        if resp.status_code != 200:
+            raise RuntimeError(f"Graph GET {path} failed: {resp.status_code} {resp.text[:300]}")
+        body = resp.json()
+        yield body.get("data", [])
+        # paging.next already carries every query parameter
+        url, params = body.get("paging", {}).get("next"), None
+
+
+def parse_graph_time(value):
+    """Graph created_time ("2026-01-01T10:00:00+0000") -> naive UTC, or None."""
+    try:
+        ts = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+    except (TypeError, ValueError):
+        return None
+    return ts.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+
+# =========================================================
+# FORM NAMES (memory -> facebook_lead_forms -> Graph)
+# =========================================================
+def form_cache():
+    global _form_cache
+    with _form_cache_lock:
+        if _form_cache is None:
+            config = current_app.config
+            _form_cache = TTLCache(
+                maxsize=config.get("FB_FORM_CACHE_MAX_ENTRIES", 5000),
+                ttl=config.get("FB_FORM_CACHE_TTL_HOURS", 24) * 3600
+            )
+        return _form_cache
+
+
+def cached_form_names(form_ids):
+    """{form_id: name} for forms known within the TTL; one query for the memory misses."""
+    cache = form_cache()
+    names, missing = {}, []
+    for form_id in form_ids:
+        name = cache.get(form_id)
+        if name is None:
+            missing.append(form_id)
+        else:
+            names[form_id] = name
+
+    if missing:
+        fresh_after = now() - datetime.timedelta(seconds=cache.ttl)
+        for row in FacebookLeadForm.query.filter(
+            FacebookLeadForm.form_id.in_(missing),
+            FacebookLeadForm.fetched_at >= fresh_after
+        ).all():
+            names[row.form_id] = row.name
+            cache.set(row.form_id, row.name)
+    return names
+
+
+def store_form_names(names):
+    """Saves freshly fetched names to memory and facebook_lead_forms (committed by the caller)."""
+    if not names:
+        return
+    cache = form_cache()
+    existing = {f.form_id: f for f in FacebookLeadForm.query.filter(FacebookLeadForm.form_id.in_(list(names))).all()}
+    for form_id, name in names.items():
+        row = existing.get(form_id)
+        if row is None:
+            db.session.add(FacebookLeadForm(form_id=form_id, name=name, fetched_at=now()))
+        else:
+            row.name = name
+            row.fetched_at = now()
+        cache.set(form_id, name)
+
+
+# =========================================================
+# LEADS
+# =========================================================
+def parse_lead(lead_data, form_id, form_name=None):
+    """Graph leadgen object -> normalized lead dict for LeadIngestor."""
+    name = "Unknown"
+    email = None
+    phone = None
+    custom_fields = {}
+
+    for f in lead_data.get("field_data", []):
+        field_name = f.get("name", "").lower()
+        field_values = f.get("values", [])
+        val = field_values[0] if field_values else None
+
+        if not val:
+            continue
+
+        # Smart Matching
+        if "name" in field_name and "company" not in field_name:
+            name = val
+        elif "email" in field_name:
+            email = val
+        elif "phone" in field_name or "mobile" in field_name or "contact" in field_name:
+            phone = val
+        else:
+            # Store other fields
+            custom_fields[field_name] = val
+
+    if form_name:
+        custom_fields["form_name"] = form_name
+
+    return {
+        "facebook_lead_id": lead_data.get("id"),
+        "form_id": form_id or lead_data.get("form_id"),
+        "name": name,
+        "email": email,
+        "phone": phone,
+        "custom_fields": custom_fields
+    }
+
+
+def process_leads(conn, refs):
+    """
+    Fetches and saves leads for one connection.
+
+    refs: [(leadgen_id, form_id), ...]. Already saved ids are dropped with
+    one IN query; the rest, plus any form names not cached, are fetched in
+    Graph batch calls and ingested in one LeadIngestor batch.
+    """
+    refs = list(dict.fromkeys((lead_id, form_id) for lead_id, form_id in refs if lead_id))
+    if refs:
+        seen = {
+            r[0] for r in db.session.query(Lead.facebook_lead_id).filter(
+                Lead.admin_id == conn.admin_id,
+                Lead.facebook_lead_id.in_([lead_id for lead_id, _ in refs])
+            ).all()
+        }
+        refs = [(lead_id, form_id) for lead_id, form_id in refs if lead_id not in seen]
+    if not refs:
+        return {"added": 0, "duplicates": 0, "lead_ids": [], "results": []}
+
+    form_ids = list(dict.fromkeys(form_id for _, form_id in refs if form_id))
+    form_names = cached_form_names(form_ids)
+    missing_forms = [form_id for form_id in form_ids if form_id not in form_names]
+
+    urls = [f"{lead_id}?fields={LEAD_FIELDS}" for lead_id, _ in refs]
+    urls += [f"{form_id}?fields=name" for form_id in missing_forms]
+    responses = graph_batch(conn.get_token(), urls)
+
+    fetched_forms = {}
+    for form_id, (code, body) in zip(missing_forms, responses[len(refs):]):
+        if code == 200 and body:
+            fetched_forms[form_id] = body.get("name")
+        else:
+            logger.warning(f"[facebook] form {form_id} lookup failed: {code} {body}")
+    store_form_names(fetched_forms)
+    form_names.update(fetched_forms)
+
+    items = []
+    for (lead_id, form_id), (code, body) in zip(refs, responses):
+        if code != 200 or not body:
+            logger.error(f"[facebook] lead fetch failed for {lead_id}: {code} {body}")
+            continue
+        items.append(parse_lead(body, form_id, form_names.get(form_id or body.get("form_id"))))
+
+    # Dedupe + round-robin assignment + insert (commits the form names too)
+    result = LeadIngestor(conn.admin_id, "facebook").ingest(items)
+    logger.info(
+        f"[facebook] admin {conn.admin_id}: {result['added']} saved, "
+        f"{result['duplicates']} duplicates from {len(refs)} webhook leads"
+    )
+    return result
+
+
+# =========================================================
+# RECONCILER (recovers leads the webhook missed)
+# =========================================================
+def reconcile_form(conn, token, form_id):
+    """
+    Pages /{form_id}/leads created after the form's high-water mark (minus
+    FB_RECONCILE_OVERLAP_MINUTES), drops ids already saved with one IN
+    query and ingests the rest in one batch with the new high-water mark.
+    """
+    config = current_app.config
+    state = FacebookFormSync.query.filter_by(connection_id=conn.id, form_id=form_id).first()
+    if not state:
+        state = FacebookFormSync(connection_id=conn.id, form_id=form_id)
+        db.session.add(state)
+
+    if state.leads_synced_until:
+        since = state.leads_synced_until - datetime.timedelta(minutes=config.get("FB_RECONCILE_OVERLAP_MINUTES", 15))
+    else:
+        since = now() - datetime.timedelta(hours=config.get("FB_RECONCILE_LOOKBACK_HOURS", 72))
+    since_ts = int(since.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+    leads = {}
+    filtering = json.dumps([{"field": "time_created", "operator": "GREATER_THAN", "value": since_ts}])
+    for page in graph_pages(token, f"{form_id}/leads", {"fields": LEAD_FIELDS, "filtering": filtering}):
+        for lead in page:
+            if lead.get("id"):
+                leads[lead["id"]] = lead
+
+    seen = set()
+    if leads:
+        seen = {
+            r[0] for r in db.session.query(Lead.facebook_lead_id).filter(
+                Lead.admin_id == conn.admin_id,
+                Lead.facebook_lead_id.in_(list(leads))
+            ).all()
+        }
+
+    form_name = cached_form_names([form_id]).get(form_id)
+    items = []
+    for lead_id, lead in leads.items():
+        created_at = parse_graph_time(lead.get("created_time"))
+        if created_at and (not state.leads_synced_until or created_at > state.leads_synced_until):
+            state.leads_synced_until = created_at
+        if lead_id in seen:
+            continue
+        item = parse_lead(lead, form_id, form_name)
+        if created_at:
+            item["created_at"] = created_at
+        items.append(item)
+
+    state.last_checked_at = now()
+    # Commits the high-water mark with the recovered leads
+    result = LeadIngestor(conn.admin_id, "facebook").ingest(items)
+    if result["added"]:
+        logger.warning(f"[facebook] admin {conn.admin_id} form {form_id}: recovered {result['added']} missed leads")
+    return {"fetched": len(leads), "added": result["added"]}
+
+
+def reconcile_admin_leads(admin_id):
+    """Orchestrator sync: reconciles every lead form of the admin's connected page."""
+    try:
+        conn = FacebookConnection.query.filter_by(admin_id=admin_id, status='active').first()
+        if not conn or not conn.page_id:
+            return {"message": "Facebook not connected", "status": "skipped"}
+
+        token = conn.get_token()
+        forms = {}
+        for page in graph_pages(token, f"{conn.page_id}/leadgen_forms", {"fields": "id,name"}):
+            for form in page:
+                forms[form["id"]] = form.get("name")
+        store_form_names(forms)
+        db.session.commit()
+
+        added = fetched = 0
+        for form_id in forms:
+            totals = reconcile_form(conn, token, form_id)
+            added += totals["added"]
+            fetched += totals["fetched"]
+
+        return {"message": "Reconcile complete", "forms": len(forms), "total_fetched": fetched,
+                "added": added, "status": "success"}
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"[facebook] reconcile failed for admin {admin_id}: {e}")
+        return {"error": str(e), "status": "error"}
+
+
+def scheduled_reconcile_job(app):
+    """APScheduler Job: reconciles every active Facebook connection through the orchestrator."""
+    run_provider(app, "facebook_reconcile")
+
+
+# =========================================================
+# WEBHOOK COALESCING
+# =========================================================
+class LeadFetchQueue:
+    """
+    Collects webhook leadgen ids for up to FB_LEAD_BATCH_WINDOW_MS (or until
+    GRAPH_BATCH_LIMIT are waiting) and processes them per connection in
+    one background thread, so a burst shares Graph batch calls.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._pending = []   # (conn_id, lead_id, form_id)
+        self._app = None
+        self._worker = None
+
+    def put(self, app, conn_id, lead_id, form_id):
+        with self._cond:
+            self._app = app
+            self._pending.append((conn_id, lead_id, form_id))
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="fb-lead-batch", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+
+    def _take(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            app = self._app
+            deadline = time.monotonic() + app.config.get("FB_LEAD_BATCH_WINDOW_MS", 500) / 1000
+            while len(self._pending) < GRAPH_BATCH_LIMIT:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending = self._pending, []
+            return app, batch
+
+    def _run(self):
+        while True:
+            app, batch = self._take()
+            self.flush(app, batch)
+
+    def flush(self, app, batch):
+        by_conn = {}
+        for conn_id, lead_id, form_id in batch:
+            by_conn.setdefault(conn_id, []).append((lead_id, form_id))
+
+        with app.app_context():
+            for conn_id, refs in by_conn.items():
+                try:
+                    conn = db.session.get(FacebookConnection, conn_id)
+                    if conn:
+                        process_leads(conn, refs)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"[facebook] processing {len(refs)} leads for connection {conn_id} failed: {e}")
+            db.session.remove()
+
+
+lead_queue = LeadFetchQueue()
+
+
+register_provider(
+    "facebook_reconcile",
+    settings_model=FacebookConnection,
+    enabled_column=(FacebookConnection.status == 'active'),
+    sync=reconcile_admin_leads
+)
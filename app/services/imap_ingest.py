@@ -0,0 +1,460 @@
+import re
+import time
+import email
+import atexit
+import datetime
+import select
+import imaplib
+import logging
+import threading
+from contextlib import contextmanager
+
+from flask import current_app
+from app.models import db, now
+from app.services.lead_ingestor import ingest_email_leads
+from app.services import processed_email_cache
+from app.services.sync_orchestrator import list_tenants, submit_tenant_sync, PROVIDERS
+
+logger = logging.getLogger(__name__)
+
+UID_RE = re.compile(rb"UID (\d+)")
+
+# provider name -> connect(settings) for portals that read leads from a mailbox
+MAILBOXES = {}
+
+# A watcher that is not refreshed within this window stops on its own
+# (e.g. the process lost the scheduler lease)
+WATCHER_TTL_SECONDS = 900
+
+
+def register_mailbox(name, connect):
+    """Marks an orchestrator provider as IMAP based (enables IDLE watchers)."""
+    MAILBOXES[name] = connect
+
+
+def uid_set(uids):
+    """[1, 2, 3, 7, 9, 10] -> "1:3,7,9:10" (one FETCH for the whole batch)."""
+    uids = sorted(set(uids))
+    ranges = []
+    start = prev = None
+    for uid in uids:
+        if start is None:
+            start = prev = uid
+        elif uid == prev + 1:
+            prev = uid
+        else:
+            ranges.append(f"{start}:{prev}" if prev != start else str(start))
+            start = prev = uid
+    if start is not None:
+        ranges.append(f"{start}:{prev}" if prev != start else str(start))
+    return ",".join(ranges)
+
+
+def reset_checkpoint(settings):
+    """Call when the mailbox behind a settings row changes."""
+    settings.imap_last_uid = 0
+    settings.imap_uidvalidity = None
+
+
+# =========================================================
+# CONNECTION POOL
+# =========================================================
+class ImapPool:
+    """
+    Authenticated IMAP connections kept per mailbox between polls.
+
+    A connection is checked out by one sync at a time, NOOP-checked if it
+    sat unused for a while, and dropped on any error so the next checkout
+    reconnects.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}      # key -> (conn, last_used)
+        self._key_locks = {}
+
+    @staticmethod
+    def key(settings):
+        # app_password is the stored ciphertext: a new password means a new key
+        return (settings.imap_host, settings.email_id, settings.app_password)
+
+    @contextmanager
+    def connection(self, settings, connect):
+        config = current_app.config
+        key = self.key(settings)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            conn = self._checkout(
+                key,
+                noop_after=config.get("IMAP_POOL_NOOP_AFTER_SECONDS", 60),
+                max_idle=config.get("IMAP_POOL_MAX_IDLE_SECONDS", 1500)
+            )
+            if conn is None:
+                conn = connect(settings)
+            try:
+                yield conn
+            except Exception:
+                _logout(conn)
+                raise
+            with self._lock:
+                self._entries[key] = (conn, time.monotonic())
+
+    def _checkout(self, key, noop_after, max_idle):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+
+        conn, last_used = entry
+        idle = time.monotonic() - last_used
+        if idle > max_idle:
+            _logout(conn)
+            return None
+        if idle > noop_after:
+            try:
+                conn.noop()
+            except Exception:
+                _logout(conn)
+                return None
+        return conn
+
+    def close_idle(self, max_idle):
+        """Logs out connections unused for more than max_idle seconds."""
+        cutoff = time.monotonic() - max_idle
+        with self._lock:
+            stale = [k for k, (_, used) in self._entries.items() if used < cutoff]
+            conns = [self._entries.pop(k)[0] for k in stale]
+        for conn in conns:
+            _logout(conn)
+        return len(conns)
+
+    def close_all(self):
+        with self._lock:
+            conns = [c for c, _ in self._entries.values()]
+            self._entries.clear()
+        for conn in conns:
+            _logout(conn)
+
+
+def _logout(conn):
+    try:
+        conn.logout()
+    except Exception:
+        pass
+
+
+pool = ImapPool()
+atexit.register(pool.close_all)
+
+
+# =========================================================
+# INCREMENTAL FETCH
+# =========================================================
+# Only the headers build_lead/dedupe need plus the text body. PEEK leaves
+# \Seen untouched, so a human reading the mailbox changes nothing for us.
+FETCH_PARTS = (
+    "(UID BODY.PEEK[HEADER.FIELDS (MESSAGE-ID SUBJECT FROM DATE MIME-VERSION "
+    "CONTENT-TYPE CONTENT-TRANSFER-ENCODING)] BODY.PEEK[TEXT])"
+)
+
+SEQ_RE = re.compile(rb"^\d+ \(")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def select_code(mail, code):
+    """Integer response code (UIDNEXT, UIDVALIDITY) from the last SELECT."""
+    _, data = mail.response(code)
+    try:
+        return int(data[-1]) if data and data[-1] else None
+    except (TypeError, ValueError):
+        return None
+
+
+def imap_date(value):
+    """SEARCH date (locale independent): 19-Oct-2026."""
+    return f"{value.day:02d}-{MONTHS[value.month - 1]}-{value.year}"
+
+
+def search_new_uids(mail, criteria, last_uid, since=None):
+    """UIDs above the checkpoint matching criteria, oldest first."""
+    args = [f"UID {last_uid + 1}:*"]
+    if since is not None:
+        args.append(f"SINCE {imap_date(since)}")
+    status, data = mail.uid("SEARCH", None, *args, criteria)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"UID SEARCH failed: {data}")
+    # "n:*" always matches the highest UID, even when it is below n
+    uids = {int(u) for u in (data[0] or b"").split()}
+    return sorted(u for u in uids if u > last_uid)
+
+
+def fetch_messages(mail, uids):
+    """
+    One UID FETCH for the whole batch (headers + text body only).
+    Returns [(uid, email.message.Message)] in UID order.
+    """
+    status, data = mail.uid("FETCH", uid_set(uids), FETCH_PARTS)
+    if status != "OK":
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+
+    # Each message arrives as one or more (prefix, literal) tuples followed
+    # by a closing bytes item; UID may sit in any of them.
+    parts, current = [], None
+    for item in data:
+        prefix = item[0] if isinstance(item, tuple) else item
+        if not isinstance(prefix, bytes):
+            continue
+        if SEQ_RE.match(prefix) or current is None:
+            current = {"uid": None, "header": b"", "text": b""}
+            parts.append(current)
+        match = UID_RE.search(prefix)
+        if match:
+            current["uid"] = int(match.group(1))
+        if isinstance(item, tuple):
+            section = prefix.upper()
+            if b"HEADER" in section:
+                current["header"] = item[1]
+            elif b"TEXT" in section:
+                current["text"] = item[1]
+            else:  # full message (RFC822 / BODY[])
+                current["header"], current["text"] = item[1], b""
+
+    messages = {}
+    for part in parts:
+        if part["uid"] is None:
+            continue
+        try:
+            raw = part["header"]
+            if part["text"]:
+                raw = raw.rstrip(b"\r\n") + b"\r\n\r\n" + part["text"]
+            messages[part["uid"]] = email.message_from_bytes(raw)
+        except Exception as e:
+            logger.error(f"Failed to parse email UID {part['uid']}: {e}")
+    return sorted(messages.items())
+
+
+def sync_mailbox(settings, source, lead_source, criteria, build_lead, connect):
+    """
+    One incremental pass over a portal mailbox.
+
+    Every UID above settings.imap_last_uid matching criteria is fetched in
+    batches of IMAP_BATCH_SIZE (one FETCH each), parsed with build_lead and
+    ingested; the checkpoint is committed with each batch's leads. A changed
+    UIDVALIDITY restarts the scan, limited to mail since the last sync.
+    """
+    config = current_app.config
+    batch_size = config.get("IMAP_BATCH_SIZE", 100)
+    lookback_days = config.get("IMAP_INITIAL_LOOKBACK_DAYS", 1)
+
+    totals = {"added": 0, "duplicates": 0, "ignored": 0, "skipped": 0, "lead_ids": [], "results": []}
+    with pool.connection(settings, connect) as mail:
+        mail.select("inbox", readonly=True)
+        uidvalidity = select_code(mail, "UIDVALIDITY")
+        next_uid = select_code(mail, "UIDNEXT")
+
+        if settings.imap_uidvalidity and uidvalidity and settings.imap_uidvalidity != uidvalidity:
+            logger.warning(
+                f"[imap] {source} admin {settings.admin_id}: UIDVALIDITY changed "
+                f"({settings.imap_uidvalidity} -> {uidvalidity}), rescanning"
+            )
+            settings.imap_last_uid = 0
+        settings.imap_uidvalidity = uidvalidity
+        last_uid = settings.imap_last_uid or 0
+
+        uids = []
+        if next_uid is None or next_uid > last_uid + 1:
+            since = None
+            if not last_uid:
+                # No checkpoint yet: start from the last sync, not the whole mailbox
+                since = settings.last_sync_time or (now() - datetime.timedelta(days=lookback_days))
+            uids = search_new_uids(mail, criteria, last_uid, since=since)
+        if uids:
+            processed_email_cache.warm(settings.admin_id)
+
+        for i in range(0, len(uids), batch_size):
+            batch = uids[i:i + batch_size]
+            messages = [
+                (msg.get("Message-ID") or f"uid:{settings.email_id}:{uidvalidity}:{uid}", msg)
+                for uid, msg in fetch_messages(mail, batch)
+            ]
+            settings.imap_last_uid = batch[-1]
+            settings.last_sync_time = now()
+            result = ingest_email_leads(settings.admin_id, source, lead_source, messages, build_lead)
+            for key in ("added", "duplicates", "ignored", "skipped"):
+                totals[key] += result.get(key, 0)
+            totals["lead_ids"].extend(result["lead_ids"])
+            totals["results"].extend(result["results"])
+
+    if not uids:
+        settings.last_sync_time = now()
+        db.session.commit()
+
+    totals["last_uid"] = settings.imap_last_uid
+    return totals
+
+
+# =========================================================
+# IDLE PUSH
+# =========================================================
+def idle_wait(mail, timeout, stop_event=None):
+    """
+    Runs one IDLE cycle on a selected mailbox. Returns True as soon as the
+    server reports new mail (EXISTS), False after timeout seconds or when
+    stop_event is set.
+    """
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    line = mail.readline()
+    if not line.startswith(b"+"):
+        mail.tagged_commands.pop(tag, None)
+        raise imaplib.IMAP4.error(f"IDLE rejected: {line!r}")
+
+    new_mail = False
+    deadline = time.monotonic() + timeout
+    try:
+        while not new_mail and time.monotonic() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                break
+            pending = getattr(mail.sock, "pending", None)
+            if not (pending and pending()):
+                readable, _, _ = select.select([mail.sock], [], [], min(1.0, max(deadline - time.monotonic(), 0)))
+                if not readable:
+                    continue
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed during IDLE")
+            if line.rstrip().upper().endswith(b"EXISTS"):
+                new_mail = True
+
+        mail.send(b"DONE\r\n")
+        while True:
+            line = mail.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("connection closed after IDLE")
+            if line.startswith(tag):
+                break
+    finally:
+        mail.tagged_commands.pop(tag, None)
+
+    return new_mail
+
+
+class MailboxWatcher(threading.Thread):
+    """
+    Holds a dedicated IDLE connection for one tenant mailbox and queues a
+    tenant sync on the orchestrator whenever new mail lands. The regular
+    interval job stays in place as a safety net.
+    """
+
+    def __init__(self, app, provider, admin_id):
+        super().__init__(name=f"imap-idle-{provider}-{admin_id}", daemon=True)
+        self.app = app
+        self.provider = provider
+        self.admin_id = admin_id
+        self.expires_at = time.monotonic() + WATCHER_TTL_SECONDS
+        self.unsupported = False
+        self._stop_event = threading.Event()
+
+    def keep_alive(self):
+        self.expires_at = time.monotonic() + WATCHER_TTL_SECONDS
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _running(self):
+        return not self._stop_event.is_set() and time.monotonic() < self.expires_at
+
+    def _connect(self):
+        with self.app.app_context():
+            try:
+                model = PROVIDERS[self.provider]["settings_model"]
+                settings = model.query.filter_by(admin_id=self.admin_id).first()
+                if not settings:
+                    return None
+                mail = MAILBOXES[self.provider](settings)
+            finally:
+                db.session.remove()
+
+        if "IDLE" not in mail.capabilities:
+            _logout(mail)
+            self.unsupported = True
+            logger.info(f"[imap] {self.provider} admin {self.admin_id}: server has no IDLE, polling only")
+            return None
+        mail.select("inbox", readonly=True)
+        return mail
+
+    def run(self):
+        idle_timeout = self.app.config.get("IMAP_IDLE_TIMEOUT_SECONDS", 300)
+        mail = None
+        try:
+            while self._running():
+                try:
+                    if mail is None:
+                        mail = self._connect()
+                        if mail is None:
+                            return
+                    remaining = self.expires_at - time.monotonic()
+                    if idle_wait(mail, min(idle_timeout, max(remaining, 0)), self._stop_event):
+                        submit_tenant_sync(self.app, self.provider, self.admin_id)
+                except Exception as e:
+                    logger.warning(f"[imap] IDLE {self.provider} admin {self.admin_id} failed: {e}")
+                    if mail is not None:
+                        _logout(mail)
+                        mail = None
+                    self._stop_event.wait(30)
+        finally:
+            if mail is not None:
+                _logout(mail)
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def refresh_mailbox_watchers(app):
+    """
+    APScheduler job (runs in the scheduler lease holder only): keeps one IDLE
+    watcher per enabled portal mailbox, up to IMAP_IDLE_MAX_WATCHERS, and
+    closes idle pooled connections. Mailboxes above the cap are left to the
+    interval poll (UID checkpoint), and at most IMAP_IDLE_STARTS_PER_RUN
+    watchers log in per run so a new leader does not open every mailbox at once.
+    """
+    max_watchers = app.config.get("IMAP_IDLE_MAX_WATCHERS", 50)
+    starts_left = app.config.get("IMAP_IDLE_STARTS_PER_RUN", 10)
+
+    if app.config.get("IMAP_IDLE_ENABLED", True):
+        with app.app_context():
+            try:
+                wanted = {(name, admin_id) for name in MAILBOXES for admin_id in list_tenants(name)}
+            finally:
+                db.session.remove()
+    else:
+        wanted = set()
+
+    with _watchers_lock:
+        for key in list(_watchers):
+            watcher = _watchers[key]
+            if key not in wanted or (not watcher.is_alive() and not watcher.unsupported):
+                watcher.stop()
+                del _watchers[key]
+
+        # Watchers that found no IDLE support hold no thread or connection
+        active = sum(1 for w in _watchers.values() if w.is_alive())
+        for key in sorted(wanted):
+            if key in _watchers:
+                _watchers[key].keep_alive()
+            elif active < max_watchers and starts_left > 0:
+                watcher = MailboxWatcher(app, *key)
+                watcher.start()
+                _watchers[key] = watcher
+                active += 1
+                starts_left -= 1
+        polled = len(wanted) - len(_watchers)
+
+    if polled:
+        logger.info(f"[imap] {polled} mailbox(es) without an IDLE watcher, left to the interval poll")
+
+    pool.close_idle(app.config.get("IMAP_POOL_MAX_IDLE_SECONDS", 1500))
+    return len(wanted)
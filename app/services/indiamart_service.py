@@ -1,144 +1,206 @@
 from app.models import db, IndiamartSettings, Lead, User, now
+from app.services.lead_ingestor import LeadIngestor
+from app.services.sync_orchestrator import register_provider, run_provider
+from app.utils.rate_limit import get_bucket
+from collections import deque
+from flask import current_app
 import requests
 import datetime
 import logging
 
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.indiamart.com/wservce/crm/crmListing/v2/"
+API_TIME_FORMAT = "%d-%b-%Y %H:%M:%S"     # Python strftime %b is Jan, Feb...
+QUERY_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+API_UTC_OFFSET = datetime.timedelta(hours=5, minutes=30)  # the API speaks IST
+
+CHECKPOINT_OVERLAP = datetime.timedelta(minutes=5)  # re-read a little before the checkpoint
+MIN_WINDOW = datetime.timedelta(minutes=10)         # capped windows are not split below this
+
+
+class RateLimited(Exception):
+    pass
+
+
+def to_api_time(ts):
+    return (ts + API_UTC_OFFSET).strftime(API_TIME_FORMAT)
+
+
+def parse_query_time(value):
+    """IndiaMART QUERY_TIME (IST) -> naive UTC, or None."""
+    try:
+        return datetime.datetime.strptime(value, QUERY_TIME_FORMAT) - API_UTC_OFFSET
+    except (TypeError, ValueError):
+        return None
+
+
+def time_slices(start, end, width):
+    """Consecutive [start, end) windows no wider than width."""
+    slices = []
+    while start < end:
+        slices.append((start, min(start + width, end)))
+        start += width
+    return slices
+
+
+def rate_bucket(settings):
+    """One token bucket per IndiaMART key, shared by regular syncs and backfills."""
+    config = current_app.config
+    interval = config.get("INDIAMART_CALL_INTERVAL_SECONDS", 300)
+    return get_bucket(
+        f"indiamart:{settings.mobile_number}",
+        rate=1.0 / interval,
+        capacity=config.get("INDIAMART_CALL_BURST", 2)
+    )
+
+
+# =========================================================
+# API
+# =========================================================
+def fetch_window(settings, api_key, start, end):
+    """
+    One crmListing call for [start, end]. Returns the RESPONSE rows ([] when
+    IndiaMART reports no data). Raises RateLimited on a rate-limit reply.
+    """
+    params = {
+        "glusr_mobile": settings.mobile_number,
+        "glusr_mobile_key": api_key,
+        "start_time": to_api_time(start),
+        "end_time": to_api_time(end),
+    }
+    resp = requests.post(API_URL, json=params, timeout=30)
+
+    if resp.status_code == 429:
+        raise RateLimited(resp.text)
+    if resp.status_code != 200:
+        raise RuntimeError(f"IndiaMART API Error: {resp.status_code} {resp.text[:200]}")
+
+    data = resp.json()
+    if data.get("STATUS") != "SUCCESS":
+        code = str(data.get("CODE", ""))
+        message = str(data.get("MESSAGE", ""))
+        # Handle "No Data Found" gracefully
+        if code == "204" or code == "404" or "No Data Found" in message:
+            return []
+        if code == "429":
+            raise RateLimited(message)
+        raise RuntimeError(f"IndiaMART Error: {message}")
+
+    return data.get("RESPONSE") or []
+
+
+def to_lead(item, keep_query_time=False):
+    query_id = item.get("UNIQUE_QUERY_ID")
+    lead = {
+        "facebook_lead_id": f"IM_{query_id}",
+        "name": item.get("SENDER_NAME"),
+        "email": item.get("SENDER_EMAIL"),
+        "phone": item.get("SENDER_MOBILE"),
+        "custom_fields": {
+            "subject": item.get("SUBJECT"),
+            "message": item.get("QUERY_MESSAGE"),
+            "company": item.get("SENDER_COMPANY"),
+            "city": item.get("SENDER_CITY"),
+            "state": item.get("SENDER_STATE"),
+            "indiamart_id": query_id
+        }
+    }
+    if keep_query_time:
+        created_at = parse_query_time(item.get("QUERY_TIME"))
+        if created_at:
+            lead["created_at"] = created_at
+    return lead
+
+
+def pull_range(settings, start, end, set_checkpoint, reserve=0, keep_query_time=False):
+    """
+    Fetches [start, end] window by window, oldest first.
+
+    Each window is at most INDIAMART_WINDOW_HOURS wide; a window returning
+    INDIAMART_MAX_RESULTS_PER_CALL rows may be truncated and is split in
+    half. Every call takes a token from the key's bucket; when none is left
+    the pull stops and the next run resumes from the checkpoint.
+
+    set_checkpoint(window_end) stages the checkpoint, which is committed
+    with that window's leads.
+    """
+    config = current_app.config
+    width = datetime.timedelta(hours=config.get("INDIAMART_WINDOW_HOURS", 168))
+    cap = config.get("INDIAMART_MAX_RESULTS_PER_CALL", 500)
+
+    api_key = settings.get_api_key()
+    if not api_key:
+        raise RuntimeError("Invalid API configuration (Encryption Error)")
+
+    bucket = rate_bucket(settings)
+    windows = deque(time_slices(start, end, width))
+    totals = {"added": 0, "duplicates": 0, "total_fetched": 0, "calls": 0, "complete": False}
+
+    while windows:
+        if not bucket.try_acquire(reserve=reserve):
+            logger.info(f"[indiamart] admin {settings.admin_id}: call budget used, resuming next run")
+            return totals
+
+        window_start, window_end = windows.popleft()
+        totals["calls"] += 1
+        try:
+            rows = fetch_window(settings, api_key, window_start, window_end)
+        except RateLimited:
+            bucket.drain()
+            logger.warning(f"[indiamart] admin {settings.admin_id}: rate limited by IndiaMART")
+            return totals
+
+        if len(rows) >= cap and window_end - window_start > MIN_WINDOW:
+            middle = window_start + (window_end - window_start) / 2
+            windows.extendleft([(middle, window_end), (window_start, middle)])
+            continue
+
+        # Dedupe, assign and insert in one batch (commits the checkpoint with the leads)
+        set_checkpoint(window_end)
+        result = LeadIngestor(settings.admin_id, "indiamart").ingest(
+            [to_lead(row, keep_query_time) for row in rows]
+        )
+        totals["added"] += result["added"]
+        totals["duplicates"] += result["duplicates"]
+        totals["total_fetched"] += len(rows)
+
+    totals["complete"] = True
+    return totals
+
+
+# =========================================================
+# REGULAR SYNC
+# =========================================================
 def sync_admin_leads(admin_id):
     """
-    Syncs leads for a specific admin from IndiaMART.
+    Syncs leads for a specific admin from IndiaMART, from the persisted
+    checkpoint (last_sync_time) up to now.
     Returns a dict with result stats or error.
     """
-    logger = logging.getLogger(__name__)
-    
     try:
         settings = IndiamartSettings.query.filter_by(admin_id=admin_id).first()
         if not settings:
             return {"error": "IndiaMART not connected", "status": "skipped"}
 
-        # Decrypt API Key
-        glusr_mobile_key = settings.get_api_key()
-        if not glusr_mobile_key:
-             return {'error': 'Invalid API configuration (Encryption Error)', "status": "error"}
-        
-        # Prepare API Request
-        api_url = "https://api.indiamart.com/wservce/crm/crmListing/v2/"
-        
-        params = {
-            "glusr_mobile": settings.mobile_number,
-            "glusr_mobile_key": glusr_mobile_key,
-        }
-        
-        # Incremental Sync: Use last_sync_time if available
+        end = now()
         if settings.last_sync_time:
             # Add small buffer to avoid missing leads on the boundary
-            start_time = settings.last_sync_time - datetime.timedelta(minutes=5)
-            # Python strftime %b is Jan, Feb...
-            params["start_time"] = start_time.strftime("%d-%b-%Y %H:%M:%S")
-            params["end_time"] = now().strftime("%d-%b-%Y %H:%M:%S")
-
-        logger.info(f"Syncing IndiaMART for Admin {admin_id} with params: {params}")
-
-        # Call IndiaMART
-        resp = requests.post(api_url, json=params, timeout=30)
-        
-        if resp.status_code != 200:
-            return {"error": f"IndiaMART API Error: {resp.status_code}", "details": resp.text, "status": "error"}
-
-        data = resp.json()
-        
-        if data.get("STATUS") != "SUCCESS":
-             # Handle "No Data Found" gracefully
-             if data.get("CODE") == "404" or "No Data Found" in str(data.get("MESSAGE", "")):
-                  # Update sync time anyway so we don't keep polling old range forever
-                  settings.last_sync_time = now()
-                  db.session.commit()
-                  return {"message": "No new leads found", "count": 0, "status": "success"}
-             
-             return {"error": f"IndiaMART Error: {data.get('MESSAGE')}", "status": "error"}
-
-        leads_list = data.get("RESPONSE", [])
-        added_count = 0
-        
-        for item in leads_list:
-            # Extract Fields
-            query_id = item.get("UNIQUE_QUERY_ID")
-            sender_name = item.get("SENDER_NAME")
-            sender_mobile = item.get("SENDER_MOBILE")
-            sender_email = item.get("SENDER_EMAIL")
-            subject = item.get("SUBJECT")
-            message = item.get("QUERY_MESSAGE")
-            sender_company = item.get("SENDER_COMPANY")
-            sender_city = item.get("SENDER_CITY")
-            sender_state = item.get("SENDER_STATE")
-            
-            im_id = f"IM_{query_id}"
-            
-            existing = Lead.query.filter_by(facebook_lead_id=im_id, admin_id=admin_id).first()
-            if existing:
-                continue
-                
-            # ---------------------------------------------------------
-            # ASSIGNMENT LOGIC
-            # ---------------------------------------------------------
-            assigned_user_id = None
-            try:
-                active_agents = User.query.filter_by(
-                    admin_id=admin_id, 
-                    status='active',
-                    is_suspended=False
-                ).order_by(User.id).all()
-
-                if active_agents:
-                    last_lead = Lead.query.filter_by(admin_id=admin_id)\
-                        .filter(Lead.assigned_to.isnot(None))\
-                        .order_by(Lead.created_at.desc())\
-                        .first()
-
-                    if not last_lead or not last_lead.assigned_to:
-                        assigned_user_id = active_agents[0].id
-                    else:
-                        last_agent_id = last_lead.assigned_to
-                        agent_ids = [agent.id for agent in active_agents]
-                        if last_agent_id in agent_ids:
-                            current_index = agent_ids.index(last_agent_id)
-                            next_index = (current_index + 1) % len(agent_ids)
-                            assigned_user_id = agent_ids[next_index]
-                        else:
-                            assigned_user_id = active_agents[0].id
-            except Exception:
-                pass # Assignment failed, leave unassigned
-
-            # Create Lead
-            new_lead = Lead(
-                admin_id=admin_id,
-                facebook_lead_id=im_id, 
-                name=sender_name,
-                email=sender_email,
-                phone=sender_mobile,
-                source="indiamart",
-                status="new",
-                assigned_to=assigned_user_id,
-                custom_fields={
-                    "subject": subject,
-                    "message": message,
-                    "company": sender_company,
-                    "city": sender_city,
-                    "state": sender_state,
-                    "indiamart_id": query_id
-                },
-                created_at=now()
-            )
-            
-            db.session.add(new_lead)
-            added_count += 1
-            
-        settings.last_sync_time = now()
-        db.session.commit()
-        
+            start = settings.last_sync_time - CHECKPOINT_OVERLAP
+        else:
+            start = end - datetime.timedelta(hours=current_app.config.get("INDIAMART_INITIAL_LOOKBACK_HOURS", 24))
+
+        def set_checkpoint(window_end):
+            settings.last_sync_time = window_end
+
+        totals = pull_range(settings, start, end, set_checkpoint)
+        logger.info(f"[indiamart] admin {admin_id}: +{totals['added']} leads in {totals['calls']} calls")
+
         return {
-            "message": "Sync complete",
-            "added": added_count,
-            "total_fetched": len(leads_list),
+            "message": "Sync complete" if totals["complete"] else "Sync partially complete, resuming next run",
+            "added": totals["added"],
+            "total_fetched": totals["total_fetched"],
+            "pending": not totals["complete"],
             "status": "success"
         }
 
@@ -147,34 +209,91 @@ def sync_admin_leads(admin_id):
         logger.error(f"IndiaMART Sync Exception: {e}")
         return {"error": str(e), "status": "error"}
 
+
 def scheduled_sync_job(app):
     """
-    Background job to sync leads for all enabled admins.
-    Requires 'app' context since it runs in a background thread.
+    APScheduler Job: fans every enabled IndiaMART tenant out to the sync
+    orchestrator (bounded pool, per-provider cap, in-flight tenants skipped).
     """
-    with app.app_context():
-        logger = logging.getLogger(__name__)
-        logger.info("Running IndiaMART Scheduled Sync...")
-        
-        # Find all admins with auto-sync enabled
-        # Join with Admin table to ensure admin is active? 
-        # For now, just check settings.
-        settings_list = IndiamartSettings.query.filter_by(auto_sync_enabled=True).all()
-        
-        count = 0
-        for setting in settings_list:
-            try:
-                # Check if admin is active?
-                admin = Admin.query.get(setting.admin_id)
-                if not admin or not admin.is_active:
-                    continue
-                
-                # Run Sync
-                result = sync_admin_leads(setting.admin_id)
-                if result.get("status") == "success" and result.get("added", 0) > 0:
-                     count += result.get("added")
-                     logger.info(f"Auto-Sync for Admin {setting.admin_id}: +{result.get('added')} leads")
-            except Exception as e:
-                logger.error(f"Auto-Sync Failed for Admin {setting.admin_id}: {e}")
-        
-        logger.info(f"IndiaMART Scheduled Sync Complete. Total Leads Added: {count}")
+    run_provider(app, "indiamart")
+
+
+# =========================================================
+# BACKFILL
+# =========================================================
+def start_backfill(settings, start, end):
+    """
+    Schedules a historic import of [start, end]. Runs as its own provider,
+    so it never holds up the regular sync, and only spends call budget the
+    regular sync leaves unused.
+    """
+    max_days = current_app.config.get("INDIAMART_BACKFILL_MAX_DAYS", 365)
+    if start >= end:
+        raise ValueError("Backfill start must be before end")
+    if end > now():
+        raise ValueError("Backfill end cannot be in the future")
+    if start < now() - datetime.timedelta(days=max_days):
+        raise ValueError(f"Backfill can go back at most {max_days} days")
+
+    settings.backfill_start = start
+    settings.backfill_end = end
+    settings.backfill_cursor = start
+    settings.backfill_active = True
+    db.session.commit()
+
+
+def cancel_backfill(settings):
+    settings.backfill_active = False
+    db.session.commit()
+
+
+def sync_admin_backfill(admin_id):
+    """Continues a pending backfill from backfill_cursor."""
+    try:
+        settings = IndiamartSettings.query.filter_by(admin_id=admin_id).first()
+        if not settings or not settings.backfill_active:
+            return {"message": "No backfill pending", "status": "skipped"}
+
+        def set_checkpoint(window_end):
+            settings.backfill_cursor = window_end
+
+        totals = pull_range(
+            settings, settings.backfill_cursor or settings.backfill_start, settings.backfill_end,
+            set_checkpoint, reserve=1, keep_query_time=True
+        )
+        if totals["complete"]:
+            settings.backfill_active = False
+            db.session.commit()
+            logger.info(f"[indiamart] admin {admin_id}: backfill finished")
+
+        return {
+            "message": "Backfill complete" if totals["complete"] else "Backfill in progress",
+            "added": totals["added"],
+            "total_fetched": totals["total_fetched"],
+            "status": "success"
+        }
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"IndiaMART Backfill Exception: {e}")
+        return {"error": str(e), "status": "error"}
+
+
+def scheduled_backfill_job(app):
+    """APScheduler Job: advances every pending IndiaMART backfill."""
+    run_provider(app, "indiamart_backfill")
+
+
+register_provider(
+    "indiamart",
+    settings_model=IndiamartSettings,
+    enabled_column=IndiamartSettings.auto_sync_enabled,
+    sync=sync_admin_leads
+)
+
+register_provider(
+    "indiamart_backfill",
+    settings_model=IndiamartSettings,
+    enabled_column=IndiamartSettings.backfill_active,
+    sync=sync_admin_backfill
+)
@@ -1,18 +1,17 @@
 
 import imaplib
-import email
-import re
-import datetime
-from email.header import decode_header
-from app.models import db, JustDialSettings, ProcessedEmail, Lead, Admin, now
-from app.utils.security import decrypt_value
-from sqlalchemy.exc import IntegrityError
+from app.models import db, JustDialSettings
+from app.services.lead_ingestor import ingest_email_leads, email_text_body, single_email_result
+from app.services.sync_orchestrator import register_provider, run_provider
+from app.services.imap_ingest import sync_mailbox, register_mailbox
+from app.services.email_lead_parser import EmailLeadParser, LeadField, register_parser, OPTIONAL_SEP, PHONE_PREFIX
 import logging
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# IMAP SEARCH criteria for JustDial lead mails
+SEARCH_CRITERIA = '(OR FROM "justdial" SUBJECT "justdial")'
+
 def get_imap_connection(settings):
     """
     Connect to IMAP server using settings
@@ -29,159 +28,53 @@ def get_imap_connection(settings):
         logger.error(f"IMAP Connection Failed for {settings.email_id}: {e}")
         raise e
 
+# JustDial lead mails, often pipe separated: "Name : A | Mobile : 98... | Area : ..."
+PARSER = register_parser("justdial", EmailLeadParser(
+    source="JUSTDIAL",
+    category="BUSINESS",
+    sep=OPTIONAL_SEP,
+    split_pipes=True,
+    fields=[
+        LeadField("name", r"Name|Caller Name|Sender"),
+        LeadField("phone", r"Mobile|Phone|Contact|Mobile No", value=r"\d+", prefix=PHONE_PREFIX),
+        LeadField("email", r"Email|Email ID"),
+        LeadField("location", r"Area|Location|City"),
+        LeadField("category", r"Category|Requirement"),
+    ]
+))
+
 def parse_justdial_email_body(body):
     """
-    Parses JustDial email body using Regex.
+    Parses JustDial email body.
     Expected format often includes labels.
     """
-    # Normalize
-    text = body.replace("\r", "").strip()
-    
-    data = {
-        "source": "JUSTDIAL",
-        "category": "BUSINESS"
-    }
+    return PARSER.parse(body)
 
-    # Common Patterns
-    # JustDial Email structure varies but often:
-    # Name : John Doe | Mobile : 9876543210 | Area : ...
-    
-    patterns = {
-        "name": r"(?:Name|Caller Name|Sender)\s*[:\-]?\s*(.*)",
-        "phone": r"(?:Mobile|Phone|Contact|Mobile No)\s*[:\-]?\s*(?:\+91-?)?(\d+)",
-        "email": r"(?:Email|Email ID)\s*[:\-]?\s*(.*)",
-        "location": r"(?:Area|Location|City)\s*[:\-]?\s*(.*)",
-        "category": r"(?:Category|Requirement)\s*[:\-]?\s*(.*)",
+def build_lead(email_message):
+    """
+    Parses a JustDial email into a normalized lead dict for LeadIngestor.
+    Returns None if the email is not a lead.
+    """
+    lead_data = parse_justdial_email_body(email_text_body(email_message))
+    if not lead_data:
+        return None
+
+    return {
+        "name": lead_data.get("name") or "Unknown JD Caller",
+        "email": lead_data.get("email"),
+        "phone": lead_data.get("phone"),
+        "location": lead_data.get("location"),
+        "requirement": lead_data.get("category"), # Store Category in Requirement
+        "custom_fields": {"raw_subject": email_message.get("Subject")}
     }
 
-    found_any = False
-    for key, pattern in patterns.items():
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            val = match.group(1).strip()
-            # Clean up phone
-            if key == "phone":
-                val = val.replace("-", "").replace(" ", "")[-10:] # Last 10 digits
-            
-            # Clean up others (sometimes JD emails have pipes | as separators)
-            if key != "phone":
-                 val = val.split("|")[0].strip()
-            
-            data[key] = val
-            found_any = True
-
-    # Fallback for phone
-    if not data.get("phone"):
-         phone_match = re.search(r"[0-9]{10}", text)
-         if phone_match:
-             data["phone"] = phone_match.group(0)
-             found_any = True
-
-    # Basic Validation
-    if not data.get("phone") and not data.get("email"):
-        return None 
-
-    return data
-
 def process_single_email(admin_id, msg_id, email_message):
     """
     Parses and saves a single email
     """
     try:
-        # Check Deduplication by Message-ID
-        existing = ProcessedEmail.query.filter_by(admin_id=admin_id, message_id=msg_id).first()
-        if existing:
-            return {"status": "skipped", "reason": "duplicate_msg_id"}
-
-        # Get Body(Prefer Text)
-        body = ""
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-                if content_type == "text/plain" and "attachment" not in content_disposition:
-                    body = part.get_payload(decode=True).decode()
-                    break 
-        else:
-            body = email_message.get_payload(decode=True).decode()
-
-        # Parse
-        lead_data = parse_justdial_email_body(body)
-        if not lead_data:
-            return {"status": "ignored", "reason": "parsing_failed_or_not_lead"}
-
-        # Business Logic Deduplication
-        today_start = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        duplicate_lead = Lead.query.filter(
-            Lead.admin_id == admin_id,
-            Lead.phone == lead_data.get("phone"),
-            Lead.source == "justdial",
-            Lead.created_at >= today_start
-        ).first()
-
-        if duplicate_lead:
-             # Mark processed
-            pe = ProcessedEmail(admin_id=admin_id, message_id=msg_id, lead_source="JUSTDIAL")
-            db.session.add(pe)
-            db.session.commit()
-            return {"status": "skipped", "reason": "duplicate_lead_today"}
-
-        # Create Lead
-        new_lead = Lead(
-            admin_id=admin_id,
-            name=lead_data.get("name") or "Unknown JD Caller",
-            email=lead_data.get("email"),
-            phone=lead_data.get("phone"),
-            source="justdial",
-            status="new",
-            location=lead_data.get("location"),
-            requirement=lead_data.get("category"), # Store Category in Requirement
-            custom_fields={"raw_subject": email_message.get("Subject")}
-        )
-
-        # ---------------------------------------------------------
-        # AGENT ASSIGNMENT LOGIC (ROUND ROBIN)
-        # ---------------------------------------------------------
-        assigned_user_id = None
-        try:
-            from app.models import User 
-            active_agents = User.query.filter_by(
-                admin_id=admin_id, 
-                status='active',
-                is_suspended=False
-            ).order_by(User.id).all()
-
-            if active_agents:
-                last_lead = Lead.query.filter_by(admin_id=admin_id)\
-                    .filter(Lead.assigned_to.isnot(None))\
-                    .order_by(Lead.created_at.desc())\
-                    .first()
-
-                if not last_lead or not last_lead.assigned_to:
-                    assigned_user_id = active_agents[0].id
-                else:
-                    last_agent_id = last_lead.assigned_to
-                    agent_ids = [agent.id for agent in active_agents]
-                    
-                    if last_agent_id in agent_ids:
-                        current_index = agent_ids.index(last_agent_id)
-                        next_index = (current_index + 1) % len(agent_ids)
-                        assigned_user_id = agent_ids[next_index]
-                    else:
-                        assigned_user_id = agent_ids[0]
-        except Exception as e:
-            logger.error(f"Error in assignment logic for JustDial lead: {e}")
-        
-        if assigned_user_id:
-            new_lead.assigned_to = assigned_user_id
-        
-        db.session.add(new_lead)
-        
-        pe = ProcessedEmail(admin_id=admin_id, message_id=msg_id, lead_source="JUSTDIAL")
-        db.session.add(pe)
-        
-        db.session.commit()
-        return {"status": "success", "lead_id": new_lead.id}
+        result = ingest_email_leads(admin_id, "justdial", "JUSTDIAL", [(msg_id, email_message)], build_lead)
+        return single_email_result(result)
 
     except Exception as e:
         db.session.rollback()
@@ -196,58 +89,27 @@ def sync_justdial_leads(admin_id):
     if not settings or not settings.email_id:
         return {"status": "error", "message": "JustDial not configured"}
 
-    mail = None
-    count = 0
     try:
-        mail = get_imap_connection(settings)
-        mail.select("inbox")
-
-        # Search for UNSEEN emails from JustDial
-        # Often from "noreply@justdial.com" or Subject "Justdial"
-        status, messages = mail.search(None, '(UNSEEN (OR FROM "justdial" SUBJECT "justdial"))')
-        
-        email_ids = messages[0].split()
-        
-        for eid in email_ids[-50:]: 
-            status, msg_data = mail.fetch(eid, "(RFC822)")
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    try:
-                        msg = email.message_from_bytes(response_part[1])
-                        msg_id = msg.get("Message-ID") or f"no_id_{eid.decode()}"
-                        
-                        result = process_single_email(admin_id, msg_id, msg)
-                        
-                        if result["status"] == "success":
-                            count += 1
-                    except Exception as e:
-                        logger.error(f"Failed to parse email ID {eid}: {e}")
-
-        settings.last_sync_time = now()
-        db.session.commit()
-        
-        return {"status": "success", "added": count}
+        # Every mail above the stored UID checkpoint, fetched in batches on a pooled connection
+        result = sync_mailbox(settings, "justdial", "JUSTDIAL", SEARCH_CRITERIA, build_lead, get_imap_connection)
+        return {"status": "success", "added": result["added"]}
 
     except Exception as e:
+        db.session.rollback()
         return {"status": "error", "message": str(e)}
-    finally:
-        if mail:
-            try:
-                mail.close()
-                mail.logout()
-            except:
-                pass
 
 def scheduled_justdial_job(app):
     """
-    Job to run periodically
+    APScheduler Job: fans every enabled JustDial tenant out to the sync
+    orchestrator (bounded pool, per-provider cap, in-flight tenants skipped).
     """
-    with app.app_context():
-        settings_list = JustDialSettings.query.filter_by(is_active=True).all()
-        print(f"[{datetime.datetime.now()}] Starting JustDial Scheduled Sync for {len(settings_list)} accounts...")
-        for setting in settings_list:
-            try:
-                print(f"Syncing JustDial for Admin ID: {setting.admin_id}")
-                sync_justdial_leads(setting.admin_id)
-            except Exception as e:
-                print(f"Error syncing JustDial for Admin {setting.admin_id}: {e}")
+    run_provider(app, "justdial")
+
+
+register_provider(
+    "justdial",
+    settings_model=JustDialSettings,
+    enabled_column=JustDialSettings.is_active,
+    sync=sync_justdial_leads
+)
+register_mailbox("justdial", get_imap_connection)
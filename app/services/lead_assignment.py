@@ -0,0 +1,258 @@
+import heapq
+import logging
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app.models import db, Lead, User, LeadAssignmentCursor, now
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STRATEGY = "round_robin"
+
+# Leads in these statuses no longer count towards an agent's load
+CLOSED_STATUSES = [
+    "converted", "won", "closed", "lost", "junk",
+    "wrong number", "invalid", "not interested"
+]
+
+# name -> callable(cursor, agent_ids, count, source, admin_id) -> [agent_id, ...]
+STRATEGIES = {}
+
+
+def register_strategy(name):
+    """Decorator to plug a new assignment strategy into the service."""
+    def decorator(fn):
+        STRATEGIES[name] = fn
+        return fn
+    return decorator
+
+
+def get_active_agent_ids(admin_id):
+    """Active, non-suspended agents of an admin in a stable order."""
+    rows = db.session.query(User.id).filter(
+        User.admin_id == admin_id,
+        User.status == 'active',
+        User.is_suspended == False
+    ).order_by(User.id).all()
+    return [r[0] for r in rows]
+
+
+# =========================================================
+# STRATEGIES
+# =========================================================
+@register_strategy("round_robin")
+def _round_robin(cursor, agent_ids, count, source, admin_id):
+    start = cursor.position or 0
+    cursor.position = start + count
+    return [agent_ids[(start + i) % len(agent_ids)] for i in range(count)]
+
+
+def _weighted_sequence(agent_ids, weights):
+    """
+    Smooth weighted round robin (same interleaving nginx uses), expanded into
+    one cycle so the cursor position indexes straight into it.
+    """
+    weights = weights or {}
+    w = {a: max(int(weights.get(str(a), 1) or 0), 0) for a in agent_ids}
+    w = {a: v for a, v in w.items() if v > 0}
+    if not w:
+        return list(agent_ids)
+
+    total = sum(w.values())
+    current = {a: 0 for a in w}
+    sequence = []
+    for _ in range(total):
+        for a in w:
+            current[a] += w[a]
+        best = max(w, key=lambda a: (current[a], -a))
+        current[best] -= total
+        sequence.append(best)
+    return sequence
+
+
+@register_strategy("weighted")
+def _weighted(cursor, agent_ids, count, source, admin_id):
+    sequence = _weighted_sequence(agent_ids, cursor.weights)
+    start = cursor.position or 0
+    cursor.position = start + count
+    return [sequence[(start + i) % len(sequence)] for i in range(count)]
+
+
+@register_strategy("least_loaded")
+def _least_loaded(cursor, agent_ids, count, source, admin_id):
+    # One grouped query for the current open load of every agent
+    rows = db.session.query(Lead.assigned_to, func.count(Lead.id)).filter(
+        Lead.admin_id == admin_id,
+        Lead.assigned_to.in_(agent_ids),
+        func.lower(func.coalesce(Lead.status, "new")).notin_(CLOSED_STATUSES)
+    ).group_by(Lead.assigned_to).all()
+    load = dict(rows)
+
+    heap = [(load.get(a, 0), i, a) for i, a in enumerate(agent_ids)]
+    heapq.heapify(heap)
+
+    result = []
+    for _ in range(count):
+        current_load, order, agent_id = heapq.heappop(heap)
+        result.append(agent_id)
+        heapq.heappush(heap, (current_load + 1, order, agent_id))
+
+    cursor.position = (cursor.position or 0) + count
+    return result
+
+
+@register_strategy("by_source")
+def _by_source(cursor, agent_ids, count, source, admin_id):
+    rules = cursor.source_rules or {}
+    pool = [a for a in (rules.get((source or "").lower()) or []) if a in agent_ids]
+    if not pool:
+        # No rule for this source (or its agents are inactive): plain round robin
+        return _round_robin(cursor, agent_ids, count, source, admin_id)
+
+    key = source.lower()
+    positions = dict(cursor.source_positions or {})
+    start = positions.get(key, 0)
+    positions[key] = start + count
+    cursor.source_positions = positions
+    return [pool[(start + i) % len(pool)] for i in range(count)]
+
+
+# =========================================================
+# CURSOR
+# =========================================================
+def _initial_position(admin_id, agent_ids):
+    """
+    Continue from the agent who received the most recent lead so switching
+    to the persisted cursor does not restart the rotation.
+    """
+    last_agent_id = db.session.query(Lead.assigned_to).filter(
+        Lead.admin_id == admin_id,
+        Lead.assigned_to.isnot(None)
+    ).order_by(Lead.created_at.desc()).limit(1).scalar()
+
+    if last_agent_id in agent_ids:
+        return agent_ids.index(last_agent_id) + 1
+    return 0
+
+
+def _lock_cursor(admin_id, agent_ids):
+    """
+    Returns the admin's cursor row locked with SELECT ... FOR UPDATE.
+    The lock is held until the caller commits, so concurrent ingests for
+    the same admin are serialized and never hand out the same slot.
+    """
+    cursor = LeadAssignmentCursor.query.filter_by(admin_id=admin_id).with_for_update().first()
+    if cursor:
+        return cursor
+
+    try:
+        with db.session.begin_nested():
+            cursor = LeadAssignmentCursor(
+                admin_id=admin_id,
+                strategy=DEFAULT_STRATEGY,
+                position=_initial_position(admin_id, agent_ids)
+            )
+            db.session.add(cursor)
+    except IntegrityError:
+        # Another worker created it first; lock theirs
+        cursor = LeadAssignmentCursor.query.filter_by(admin_id=admin_id).with_for_update().first()
+    return cursor
+
+
+def assign_leads(admin_id, count, source=None):
+    """
+    Picks owners for `count` new leads in one go.
+
+    Returns a list of agent ids (length == count), or a list of None when
+    the admin has no active agents. Does not commit: the cursor update is
+    part of the caller's lead-insert transaction.
+    """
+    if count <= 0:
+        return []
+
+    agent_ids = get_active_agent_ids(admin_id)
+    if not agent_ids:
+        return [None] * count
+
+    cursor = _lock_cursor(admin_id, agent_ids)
+    strategy = STRATEGIES.get(cursor.strategy) or STRATEGIES[DEFAULT_STRATEGY]
+
+    assigned = strategy(cursor, agent_ids, count, source, admin_id)
+    cursor.last_agent_id = assigned[-1]
+    cursor.updated_at = now()
+    db.session.flush()
+    return assigned
+
+
+def assign_lead(admin_id, source=None):
+    """
+    Single-lead convenience wrapper around assign_leads(). Runs in a
+    savepoint, so a failure leaves the lead unassigned without aborting the
+    caller's transaction.
+    """
+    try:
+        with db.session.begin_nested():
+            return assign_leads(admin_id, 1, source=source)[0]
+    except Exception as e:
+        logger.error(f"Lead assignment failed for admin {admin_id}: {e}")
+        return None
+
+
+def get_assignment_config(admin_id):
+    cursor = LeadAssignmentCursor.query.filter_by(admin_id=admin_id).first()
+    if not cursor:
+        return {
+            "strategy": DEFAULT_STRATEGY,
+            "position": 0,
+            "last_agent_id": None,
+            "weights": {},
+            "source_rules": {},
+            "updated_at": None
+        }
+    return cursor.to_dict()
+
+
+def update_assignment_config(admin_id, strategy=None, weights=None, source_rules=None):
+    """
+    Validates and saves the admin's strategy options. Raises ValueError on
+    bad input. Commits.
+    """
+    if strategy is not None and strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}'. Allowed: {', '.join(sorted(STRATEGIES))}")
+
+    agent_ids = set(get_active_agent_ids(admin_id))
+
+    if weights is not None:
+        if not isinstance(weights, dict):
+            raise ValueError("weights must be an object of {agent_id: weight}")
+        clean = {}
+        for agent_id, weight in weights.items():
+            if int(agent_id) not in agent_ids:
+                raise ValueError(f"Agent {agent_id} is not an active agent")
+            if int(weight) < 0:
+                raise ValueError("weights must be >= 0")
+            clean[str(int(agent_id))] = int(weight)
+        weights = clean
+
+    if source_rules is not None:
+        if not isinstance(source_rules, dict):
+            raise ValueError("source_rules must be an object of {source: [agent_id, ...]}")
+        clean = {}
+        for src, ids in source_rules.items():
+            ids = [int(a) for a in (ids or [])]
+            unknown = [a for a in ids if a not in agent_ids]
+            if unknown:
+                raise ValueError(f"Agents {unknown} are not active agents")
+            clean[src.lower()] = ids
+        source_rules = clean
+
+    cursor = _lock_cursor(admin_id, sorted(agent_ids))
+    if strategy is not None:
+        cursor.strategy = strategy
+    if weights is not None:
+        cursor.weights = weights
+    if source_rules is not None:
+        cursor.source_rules = source_rules
+    cursor.updated_at = now()
+    db.session.commit()
+    return cursor.to_dict()
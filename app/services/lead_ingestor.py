@@ -0,0 +1,369 @@
+import re
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import insert, or_, and_
+from sqlalchemy.exc import IntegrityError
+from app.models import db, Lead, LeadStatusHistory, ProcessedEmail, now
+from app.services.lead_assignment import assign_leads
+from app.services.email_lead_parser import html_to_text
+from app.services import processed_email_cache, wa_outbox
+
+logger = logging.getLogger(__name__)
+
+# Columns a normalized lead dict may carry (anything else is ignored)
+LEAD_FIELDS = (
+    "facebook_lead_id", "form_id", "name", "email", "phone", "status",
+    "assigned_to", "property_type", "location", "budget", "requirement",
+    "custom_fields", "created_at"
+)
+
+# Post-insert hooks run off the request/sync thread
+_hook_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="lead-hooks")
+
+# callable(admin_id, lead_ids) - executed inside an app context
+POST_INSERT_HOOKS = []
+
+
+def register_post_insert_hook(fn):
+    POST_INSERT_HOOKS.append(fn)
+    return fn
+
+
+def normalize_phone(phone):
+    """Digits only, last 10 (drops +91 / leading 0). None if empty."""
+    if not phone:
+        return None
+    digits = re.sub(r"\D", "", str(phone))
+    if not digits:
+        return None
+    return digits[-10:]
+
+
+def _day_start(ts):
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# =========================================================
+# INGESTOR
+# =========================================================
+class LeadIngestor:
+    """
+    Shared write path for every lead source (portals, Facebook).
+
+    Usage:
+        result = LeadIngestor(admin_id, "99acres").ingest([{...}, {...}])
+
+    Each item is a normalized lead dict (keys from LEAD_FIELDS). An optional
+    "_ref" key is echoed back in the result so callers can map outcomes to
+    their own ids (e.g. email Message-ID).
+
+    ingest() commits the current session, so callers may stage related rows
+    (ProcessedEmail, settings.last_sync_time) and have them saved atomically
+    with the leads.
+    """
+
+    def __init__(self, admin_id, source, dedupe_phone_per_day=True):
+        self.admin_id = admin_id
+        self.source = source.lower()
+        self.dedupe_phone_per_day = dedupe_phone_per_day
+
+    # -----------------------------------------------------
+    # Dedupe
+    # -----------------------------------------------------
+    def _existing_keys(self, items):
+        """
+        One query for both dedupe rules:
+          (admin_id, facebook_lead_id)  and
+          (admin_id, normalized phone, source, day)
+        """
+        external_ids = {i["facebook_lead_id"] for i in items if i.get("facebook_lead_id")}
+        phones = set()
+        days = []
+        if self.dedupe_phone_per_day:
+            for i in items:
+                if i.get("phone"):
+                    phones.add(i["phone"])
+                    if i.get("_phone"):
+                        phones.add(i["_phone"])
+                    days.append(_day_start(i["created_at"]))
+
+        conditions = []
+        if external_ids:
+            conditions.append(Lead.facebook_lead_id.in_(external_ids))
+        if phones:
+            conditions.append(and_(
+                Lead.source == self.source,
+                Lead.phone.in_(phones),
+                Lead.created_at >= min(days)
+            ))
+        if not conditions:
+            return set(), set()
+
+        rows = db.session.query(Lead.facebook_lead_id, Lead.phone, Lead.created_at).filter(
+            Lead.admin_id == self.admin_id,
+            or_(*conditions)
+        ).all()
+
+        seen_ids = {r.facebook_lead_id for r in rows if r.facebook_lead_id}
+        seen_phone_days = {
+            (normalize_phone(r.phone), _day_start(r.created_at).date())
+            for r in rows if r.phone and r.created_at
+        }
+        return seen_ids, seen_phone_days
+
+    def _split_new(self, items):
+        seen_ids, seen_phone_days = self._existing_keys(items)
+
+        new_items, duplicates = [], []
+        for item in items:
+            ext_id = item.get("facebook_lead_id")
+            phone_day = None
+            if self.dedupe_phone_per_day and item.get("_phone"):
+                phone_day = (item["_phone"], item["created_at"].date())
+
+            if (ext_id and ext_id in seen_ids) or (phone_day and phone_day in seen_phone_days):
+                duplicates.append(item)
+                continue
+
+            # Also dedupe inside the batch itself
+            if ext_id:
+                seen_ids.add(ext_id)
+            if phone_day:
+                seen_phone_days.add(phone_day)
+            new_items.append(item)
+
+        return new_items, duplicates
+
+    # -----------------------------------------------------
+    # Insert
+    # -----------------------------------------------------
+    def _prepare(self, item):
+        item = dict(item)
+        item.setdefault("created_at", now())
+        item["_phone"] = normalize_phone(item.get("phone"))
+        item["_preassigned"] = bool(item.get("assigned_to"))
+        return item
+
+    def _row(self, item):
+        row = {k: item.get(k) for k in LEAD_FIELDS}
+        row["admin_id"] = self.admin_id
+        row["source"] = self.source
+        row["status"] = row["status"] or "new"
+        row["updated_at"] = row["created_at"]
+        return row
+
+    def _insert(self, new_items):
+        """Assign owners in bulk, then one multi-row INSERT ... RETURNING id."""
+        unassigned = [i for i in new_items if not i["_preassigned"]]
+        for item, agent_id in zip(unassigned, assign_leads(self.admin_id, len(unassigned), source=self.source)):
+            item["assigned_to"] = agent_id
+
+        stmt = insert(Lead).returning(Lead.id, sort_by_parameter_order=True)
+        result = db.session.execute(stmt, [self._row(i) for i in new_items])
+        return [r[0] for r in result]
+
+    def ingest(self, items):
+        """
+        Returns {"added", "duplicates", "lead_ids", "results"} where results
+        is aligned with the input: {"ref", "status": inserted|duplicate, "lead_id"}.
+        """
+        items = [self._prepare(i) for i in items]
+        if not items:
+            db.session.commit()
+            return {"added": 0, "duplicates": 0, "lead_ids": [], "results": []}
+
+        lead_ids = []
+        new_items, duplicates = [], []
+        for attempt in range(2):
+            new_items, duplicates = self._split_new(items)
+            if not new_items:
+                break
+            try:
+                with db.session.begin_nested():
+                    lead_ids = self._insert(new_items)
+                break
+            except IntegrityError:
+                # A concurrent ingest inserted one of these ids; dedupe again
+                if attempt:
+                    raise
+                logger.warning(f"Lead ingest race for admin {self.admin_id} ({self.source}), retrying")
+
+        # Lead-assignment WhatsApp events commit with the leads
+        wa_outbox.enqueue_lead_assignments(
+            self.admin_id, [(lead_id, item.get("assigned_to")) for item, lead_id in zip(new_items, lead_ids)]
+        )
+        db.session.commit()
+
+        for item, lead_id in zip(new_items, lead_ids):
+            item["_lead_id"] = lead_id
+
+        results = []
+        for item in items:
+            if item.get("_lead_id"):
+                results.append({"ref": item.get("_ref"), "status": "inserted", "lead_id": item["_lead_id"]})
+            else:
+                results.append({"ref": item.get("_ref"), "status": "duplicate", "lead_id": None})
+
+        if lead_ids:
+            dispatch_post_insert_hooks(self.admin_id, lead_ids)
+
+        return {
+            "added": len(lead_ids),
+            "duplicates": len(duplicates),
+            "lead_ids": lead_ids,
+            "results": results
+        }
+
+
+# =========================================================
+# EMAIL PORTALS (Magicbricks, 99acres, JustDial, Housing)
+# =========================================================
+def ingest_email_leads(admin_id, source, lead_source, messages, build_lead):
+    """
+    messages: [(message_id, email.message.Message), ...]
+    build_lead: callable(email_message) -> normalized lead dict or None
+
+    Skips already processed Message-IDs (checked against the tenant's
+    in-memory filter, confirmed with at most one IN query), records the new
+    ones in processed_emails and ingests the parsed leads in one batch.
+    Message-IDs recorded meanwhile (another process) are skipped by the
+    INSERT ... ON CONFLICT DO NOTHING instead of failing the batch.
+    """
+    message_ids = list(dict.fromkeys(mid for mid, _ in messages))
+    already = processed_email_cache.find_processed(admin_id, message_ids)
+
+    items, ignored, skipped, queued = [], 0, 0, set()
+    for msg_id, email_message in messages:
+        if msg_id in already or msg_id in queued:
+            skipped += 1
+            continue
+        try:
+            lead = build_lead(email_message)
+        except Exception as e:
+            logger.error(f"Failed to parse {lead_source} email {msg_id}: {e}")
+            lead = None
+        if not lead:
+            ignored += 1
+            continue
+
+        lead["_ref"] = msg_id
+        items.append(lead)
+        queued.add(msg_id)
+
+    if queued:
+        claimed = _record_processed(admin_id, lead_source, queued)
+        skipped += len(queued) - len(claimed)
+        items = [i for i in items if i["_ref"] in claimed]
+
+    result = LeadIngestor(admin_id, source).ingest(items)
+    processed_email_cache.remember(admin_id, queued)
+    result.update({"ignored": ignored, "skipped": skipped})
+    return result
+
+
+def _record_processed(admin_id, lead_source, message_ids):
+    """
+    Stages processed_emails rows for message_ids, skipping ids already
+    recorded. Returns the set of ids inserted by this call.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        dialect_insert = None
+
+    ts = now()
+    rows = [{"admin_id": admin_id, "message_id": mid, "lead_source": lead_source, "processed_at": ts}
+            for mid in sorted(message_ids)]
+    if dialect_insert is None:
+        db.session.execute(insert(ProcessedEmail), rows)
+        return set(message_ids)
+    stmt = dialect_insert(ProcessedEmail).on_conflict_do_nothing().returning(ProcessedEmail.message_id)
+    return {r[0] for r in db.session.execute(stmt, rows)}
+
+
+def email_text_body(email_message):
+    """
+    First non-attachment text/plain part, decoded. Falls back to the
+    text/html part (flattened to text) for HTML-only mails.
+    """
+    html_part = None
+    parts = email_message.walk() if email_message.is_multipart() else [email_message]
+    for part in parts:
+        if part.is_multipart() or "attachment" in str(part.get("Content-Disposition")):
+            continue
+        content_type = part.get_content_type()
+        if content_type == "text/plain":
+            return _decode_part(part)
+        if content_type == "text/html" and html_part is None:
+            html_part = part
+
+    if html_part is not None:
+        return html_to_text(_decode_part(html_part))
+    if not email_message.is_multipart():
+        return _decode_part(email_message)
+    return ""
+
+
+def _decode_part(part):
+    payload = part.get_payload(decode=True)
+    if not payload:
+        return ""
+    try:
+        return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+    except LookupError:  # unknown charset label
+        return payload.decode("utf-8", errors="replace")
+
+
+# =========================================================
+# POST-INSERT HOOKS
+# =========================================================
+def dispatch_post_insert_hooks(admin_id, lead_ids):
+    """Runs the registered hooks for freshly inserted leads in the background."""
+    if not POST_INSERT_HOOKS:
+        return None
+    try:
+        app = current_app._get_current_object()
+    except RuntimeError:
+        logger.warning("No app context; skipping lead post-insert hooks")
+        return None
+    return _hook_executor.submit(_run_hooks, app, admin_id, list(lead_ids))
+
+
+def _run_hooks(app, admin_id, lead_ids):
+    with app.app_context():
+        for hook in list(POST_INSERT_HOOKS):
+            try:
+                hook(admin_id, lead_ids)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Lead hook {hook.__name__} failed for admin {admin_id}: {e}")
+        db.session.remove()
+
+
+@register_post_insert_hook
+def record_initial_status(admin_id, lead_ids):
+    """Opening entry in lead_status_history for every new lead."""
+    rows = db.session.query(Lead.id, Lead.status).filter(Lead.id.in_(lead_ids)).all()
+    if not rows:
+        return
+    db.session.execute(insert(LeadStatusHistory), [
+        {"lead_id": lead_id, "old_status": None, "new_status": status or "new", "created_at": now()}
+        for lead_id, status in rows
+    ])
+    db.session.commit()
+
+
+def single_email_result(result):
+    """Maps an ingest_email_leads() result for one message to the legacy status dict."""
+    if result.get("skipped"):
+        return {"status": "skipped", "reason": "duplicate_msg_id"}
+    if result.get("ignored"):
+        return {"status": "ignored", "reason": "parsing_failed_or_not_lead"}
+    if result.get("duplicates"):
+        return {"status": "skipped", "reason": "duplicate_lead_today"}
+    return {"status": "success", "lead_id": result["lead_ids"][0] if result["lead_ids"] else None}
@@ -1,18 +1,17 @@
 
 import imaplib
-import email
-import re
-import datetime
-from email.header import decode_header
-from app.models import db, MagicbricksSettings, ProcessedEmail, Lead, Admin, now
-from app.utils.security import decrypt_value
-from sqlalchemy.exc import IntegrityError
+from app.models import db, MagicbricksSettings
+from app.services.lead_ingestor import ingest_email_leads, email_text_body, single_email_result
+from app.services.sync_orchestrator import register_provider, run_provider
+from app.services.imap_ingest import sync_mailbox, register_mailbox
+from app.services.email_lead_parser import EmailLeadParser, LeadField, register_parser, COLON, PHONE_PREFIX
 import logging
 
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# IMAP SEARCH criteria for Magicbricks lead mails
+SEARCH_CRITERIA = '(SUBJECT "Buyer Lead")'
+
 def get_imap_connection(settings):
     """
     Connect to IMAP server using settings
@@ -29,162 +28,59 @@ def get_imap_connection(settings):
         logger.error(f"IMAP Connection Failed for {settings.email_id}: {e}")
         raise e
 
+# Magicbricks "Label: value" lead mails
+PARSER = register_parser("magicbricks", EmailLeadParser(
+    source="MAGICBRICKS",
+    category="REAL_ESTATE",
+    sep=COLON,
+    markers=("Magicbricks", "Buyer Lead"),
+    phone_fallback=False,
+    fields=[
+        LeadField("name", r"Buyer Name"),
+        LeadField("phone", r"Contact Number", value=r"\d+", prefix=PHONE_PREFIX),
+        LeadField("email", r"Email ID"),
+        LeadField("property_type", r"Property Type"),
+        LeadField("purpose", r"Purpose"),  # Rent/Buy
+        LeadField("location", r"Location"),
+        LeadField("budget", r"Budget"),
+        LeadField("requirement", r"Requirement"),
+    ]
+))
+
 def parse_email_body(body):
     """
-    Parses Magicbricks email body using Regex.
+    Parses Magicbricks email body.
     Returns dict or None.
     """
-    # Normalize
-    text = body.replace("\r", "").strip()
-    
-    # Required Markers (Validation)
-    if "Magicbricks" not in text and "Buyer Lead" not in text:
-        return None
+    return PARSER.parse(body)
 
-    data = {
-        "source": "MAGICBRICKS",
-        "category": "REAL_ESTATE"
-    }
+def build_lead(email_message):
+    """
+    Parses a Magicbricks email into a normalized lead dict for LeadIngestor.
+    Returns None if the email is not a lead.
+    """
+    lead_data = parse_email_body(email_text_body(email_message))
+    if not lead_data:
+        return None
 
-    # Regex Patterns (Case Insensitive)
-    patterns = {
-        "name": r"Buyer Name:\s*(.*)",
-        "phone": r"Contact Number:\s*(?:\+91-?)?(\d+)",
-        "email": r"Email ID:\s*(.*)",
-        "property_type": r"Property Type:\s*(.*)",
-        "purpose": r"Purpose:\s*(.*)", # Rent/Buy
-        "location": r"Location:\s*(.*)",
-        "budget": r"Budget:\s*(.*)",
-        "requirement": r"Requirement:\s*(.*)"
+    return {
+        "name": lead_data.get("name") or "Unknown Buyer",
+        "email": lead_data.get("email"),
+        "phone": lead_data.get("phone"),
+        "property_type": lead_data.get("property_type"),
+        "location": lead_data.get("location"),
+        "budget": lead_data.get("budget"),
+        "requirement": lead_data.get("requirement"),
+        "custom_fields": {"purpose": lead_data.get("purpose")}
     }
 
-    for key, pattern in patterns.items():
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            val = match.group(1).strip()
-            # Clean up
-            if key == "phone":
-                val = val.replace("-", "").replace(" ", "")[-10:] # Last 10 digits
-            data[key] = val
-
-    # Basic Validation
-    if not data.get("phone") and not data.get("email"):
-        return None # Useless lead
-
-    return data
-
 def process_single_email(admin_id, msg_id, email_message):
     """
     Parses and saves a single email
     """
     try:
-        # Check Deduplication by Message-ID
-        existing = ProcessedEmail.query.filter_by(admin_id=admin_id, message_id=msg_id).first()
-        if existing:
-            return {"status": "skipped", "reason": "duplicate_msg_id"}
-
-        # Get Body
-        body = ""
-        if email_message.is_multipart():
-            for part in email_message.walk():
-                content_type = part.get_content_type()
-                content_disposition = str(part.get("Content-Disposition"))
-                if content_type == "text/plain" and "attachment" not in content_disposition:
-                    body = part.get_payload(decode=True).decode()
-                    break # Prefer text/plain
-        else:
-            body = email_message.get_payload(decode=True).decode()
-
-        # Parse
-        lead_data = parse_email_body(body)
-        if not lead_data:
-            return {"status": "ignored", "reason": "parsing_failed_or_not_lead"}
-
-        # Business Logic Deduplication (Phone + Property + Today)
-        # Prevents same user spamming same requirement
-        today_start = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        duplicate_lead = Lead.query.filter(
-            Lead.admin_id == admin_id,
-            Lead.phone == lead_data.get("phone"),
-            Lead.source == "MAGICBRICKS",
-            Lead.created_at >= today_start
-        ).first()
-
-        if duplicate_lead:
-            # Mark processed but don't create lead
-            pe = ProcessedEmail(admin_id=admin_id, message_id=msg_id)
-            db.session.add(pe)
-            db.session.commit()
-            return {"status": "skipped", "reason": "duplicate_lead_today"}
-
-        # Create Lead
-        new_lead = Lead(
-            admin_id=admin_id,
-            name=lead_data.get("name") or "Unknown Buyer",
-            email=lead_data.get("email"),
-            phone=lead_data.get("phone"),
-            source="magicbricks",
-            status="new",
-            property_type=lead_data.get("property_type"),
-            location=lead_data.get("location"),
-            budget=lead_data.get("budget"),
-            requirement=lead_data.get("requirement"),
-            custom_fields={"purpose": lead_data.get("purpose")}
-        )
-
-        # ---------------------------------------------------------
-        # AGENT ASSIGNMENT LOGIC (ROUND ROBIN)
-        # ---------------------------------------------------------
-        assigned_user_id = None
-        try:
-            # 1. Get all active users (users) for this Admin
-            from app.models import User 
-            
-            active_agents = User.query.filter_by(
-                admin_id=admin_id, 
-                status='active',
-                is_suspended=False
-            ).order_by(User.id).all()
-
-            if active_agents:
-                # 2. Find the last assigned lead for this admin to determine sequence
-                last_lead = Lead.query.filter_by(admin_id=admin_id)\
-                    .filter(Lead.assigned_to.isnot(None))\
-                    .order_by(Lead.created_at.desc())\
-                    .first()
-
-                if not last_lead or not last_lead.assigned_to:
-                    # No previous assignment, assign to first agent
-                    assigned_user_id = active_agents[0].id
-                else:
-                    # Find index of last agent
-                    last_agent_id = last_lead.assigned_to
-                    
-                    # Check if last agent is still in the active list
-                    agent_ids = [agent.id for agent in active_agents]
-                    
-                    if last_agent_id in agent_ids:
-                        current_index = agent_ids.index(last_agent_id)
-                        next_index = (current_index + 1) % len(agent_ids)
-                        assigned_user_id = agent_ids[next_index]
-                    else:
-                        # Last agent removed/inactive, start over
-                        assigned_user_id = agent_ids[0]
-            
-        except Exception as e:
-            logger.error(f"Error in assignment logic for MB lead: {e}")
-        
-        if assigned_user_id:
-            new_lead.assigned_to = assigned_user_id
-        
-        db.session.add(new_lead)
-        
-        # Mark Processed
-        pe = ProcessedEmail(admin_id=admin_id, message_id=msg_id)
-        db.session.add(pe)
-        
-        db.session.commit()
-        return {"status": "success", "lead_id": new_lead.id}
+        result = ingest_email_leads(admin_id, "magicbricks", "MAGICBRICKS", [(msg_id, email_message)], build_lead)
+        return single_email_result(result)
 
     except Exception as e:
         db.session.rollback()
@@ -199,70 +95,27 @@ def sync_magicbricks_leads(admin_id):
     if not settings or not settings.email_id:
         return {"status": "error", "message": "Magicbricks not configured"}
 
-    mail = None
-    count = 0
     try:
-        mail = get_imap_connection(settings)
-        mail.select("inbox")
-
-        # Search for UNSEEN emails from Magicbricks
-        # Refining search to avoid fetching everything
-        # SEARCH UNSEEN FROM "leads@magicbricks.com" (or similar)
-        # For generalized solution, search SUBJECT "Buyer Lead"
-        status, messages = mail.search(None, '(UNSEEN SUBJECT "Buyer Lead")')
-        
-        email_ids = messages[0].split()
-        
-        # Limit to last 50 to prevent timeouts if inbox is huge
-        for eid in email_ids[-50:]: 
-            status, msg_data = mail.fetch(eid, "(RFC822)")
-            for response_part in msg_data:
-                if isinstance(response_part, tuple):
-                    try:
-                        msg = email.message_from_bytes(response_part[1])
-                        
-                        # Extract Message-ID
-                        msg_id = msg.get("Message-ID") or f"no_id_{eid.decode()}"
-                        
-                        # Process
-                        result = process_single_email(admin_id, msg_id, msg)
-                        
-                        if result["status"] == "success":
-                            count += 1
-                    except Exception as e:
-                        logger.error(f"Failed to parse email ID {eid}: {e}")
-
-        settings.last_sync_time = now()
-        db.session.commit()
-        
-        return {"status": "success", "added": count}
+        # Every mail above the stored UID checkpoint, fetched in batches on a pooled connection
+        result = sync_mailbox(settings, "magicbricks", "MAGICBRICKS", SEARCH_CRITERIA, build_lead, get_imap_connection)
+        return {"status": "success", "added": result["added"]}
 
     except Exception as e:
+        db.session.rollback()
         return {"status": "error", "message": str(e)}
-    finally:
-        if mail:
-            try:
-                mail.close()
-                mail.logout()
-            except:
-                pass
 
 def scheduled_magicbricks_job(app):
     """
-    APScheduler Job
+    APScheduler Job: fans every enabled Magicbricks tenant out to the sync
+    orchestrator (bounded pool, per-provider cap, in-flight tenants skipped).
     """
-    with app.app_context():
-        logger.info("Starting Magicbricks Scheduled Sync...")
-        settings_list = MagicbricksSettings.query.filter_by(is_active=True).all()
-        
-        total = 0
-        for s in settings_list:
-            try:
-                # Check subscription status etc if needed
-                res = sync_magicbricks_leads(s.admin_id)
-                if res.get("status") == "success":
-                    total += res.get("added", 0)
-            except Exception as e:
-                logger.error(f"Auto-sync failed for admin {s.admin_id}: {e}")
-                
-        logger.info(f"Magicbricks Sync Complete. Added {total} leads.")
+    run_provider(app, "magicbricks")
+
+
+register_provider(
+    "magicbricks",
+    settings_model=MagicbricksSettings,
+    enabled_column=MagicbricksSettings.is_active,
+    sync=sync_magicbricks_leads
+)
+register_mailbox("magicbricks", get_imap_connection)
@@ -0,0 +1,174 @@
+import math
+import hashlib
+import logging
+import datetime
+import threading
+
+from flask import current_app
+from app.models import db, ProcessedEmail, now
+
+logger = logging.getLogger(__name__)
+
+# Rows committed by another process may carry a processed_at slightly older
+# than our last refresh; re-read this much history on every refresh.
+REFRESH_OVERLAP = datetime.timedelta(minutes=10)
+MIN_CAPACITY = 10000
+ERROR_RATE = 0.01
+
+_lock = threading.Lock()
+_tenants = {}   # admin_id -> RecentMessageIds
+
+
+class BloomFilter:
+    """
+    Fixed-size bloom filter over strings. No false negatives; about
+    error_rate false positives while holding at most capacity items.
+    """
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class RecentMessageIds:
+    """
+    A tenant's processed Message-IDs: every row still in processed_emails,
+    including rows past the retention horizon the prune has not reached yet.
+    """
+
+    def __init__(self, admin_id):
+        self.admin_id = admin_id
+        self.bloom = None
+        self.loaded_through = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Full load on first use (or when over capacity), otherwise only rows since the last load."""
+        with self.lock:
+            full = self.bloom is None or self.bloom.count > self.bloom.capacity
+
+            started = now()
+            q = db.session.query(ProcessedEmail.message_id).filter(ProcessedEmail.admin_id == self.admin_id)
+            if not full:
+                q = q.filter(ProcessedEmail.processed_at >= self.loaded_through - REFRESH_OVERLAP)
+            rows = q.all()
+
+            if full:
+                self.bloom = BloomFilter(max(MIN_CAPACITY, len(rows) * 2))
+            for (message_id,) in rows:
+                self.bloom.add(message_id)
+            self.loaded_through = started
+            return len(rows)
+
+    def candidates(self, message_ids):
+        with self.lock:
+            return [mid for mid in message_ids if mid in self.bloom]
+
+    def add(self, message_ids):
+        with self.lock:
+            for mid in message_ids:
+                self.bloom.add(mid)
+
+
+def retention_horizon():
+    return now() - datetime.timedelta(days=current_app.config.get("PROCESSED_EMAIL_RETENTION_DAYS", 90))
+
+
+def warm(admin_id):
+    """
+    Loads / refreshes the tenant's in-memory Message-ID filter. Called at
+    the start of every mailbox sync so mail recorded by other processes
+    since the last pass is picked up.
+    """
+    with _lock:
+        tenant = _tenants.get(admin_id)
+        if tenant is None:
+            tenant = _tenants[admin_id] = RecentMessageIds(admin_id)
+    return tenant.refresh()
+
+
+def find_processed(admin_id, message_ids):
+    """
+    Subset of message_ids already in processed_emails. With a warm filter
+    only the ids it flags are confirmed, in one IN query (none if the whole
+    batch is new); otherwise every id is checked in one IN query.
+    """
+    tenant = _tenants.get(admin_id)
+    if tenant is not None and tenant.bloom is not None:
+        message_ids = tenant.candidates(message_ids)
+    if not message_ids:
+        return set()
+    return {
+        r[0] for r in db.session.query(ProcessedEmail.message_id).filter(
+            ProcessedEmail.admin_id == admin_id,
+            ProcessedEmail.message_id.in_(message_ids)
+        ).all()
+    }
+
+
+def remember(admin_id, message_ids):
+    """Adds newly recorded ids to a warm filter (no-op for cold tenants)."""
+    tenant = _tenants.get(admin_id)
+    if tenant is not None and tenant.bloom is not None:
+        tenant.add(message_ids)
+
+
+def forget(admin_id=None):
+    """Drops one tenant's filter, or all of them."""
+    with _lock:
+        if admin_id is None:
+            _tenants.clear()
+        else:
+            _tenants.pop(admin_id, None)
+
+
+# =========================================================
+# RETENTION
+# =========================================================
+def prune_processed_emails(app):
+    """
+    Scheduler job: deletes processed_emails rows older than
+    PROCESSED_EMAIL_RETENTION_DAYS in chunks. Older mail is never re-read
+    (the IMAP UID checkpoint and the SINCE bound on rescans cover it).
+    """
+    with app.app_context():
+        try:
+            horizon = retention_horizon()
+            chunk = app.config.get("PROCESSED_EMAIL_PRUNE_CHUNK", 5000)
+            deleted = 0
+            while True:
+                ids = [r[0] for r in db.session.query(ProcessedEmail.id).filter(
+                    ProcessedEmail.processed_at < horizon
+                ).limit(chunk).all()]
+                if not ids:
+                    break
+                ProcessedEmail.query.filter(ProcessedEmail.id.in_(ids)).delete(synchronize_session=False)
+                db.session.commit()
+                deleted += len(ids)
+            if deleted:
+                logger.info(f"[processed_emails] pruned {deleted} rows older than {horizon:%Y-%m-%d}")
+            return deleted
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[processed_emails] prune failed: {e}")
+            return 0
+        finally:
+            db.session.remove()
@@ -0,0 +1,209 @@
+import os
+import uuid
+import socket
+import atexit
+import logging
+import datetime
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import or_, case
+from sqlalchemy.exc import IntegrityError
+from app.models import db, SchedulerLease, now
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "scheduler"
+
+# (job id, "module:function", interval minutes) - every job gets args=[app]
+JOBS = [
+    ("indiamart_sync", "app.services.indiamart_service:scheduled_sync_job", 15),
+    ("indiamart_backfill", "app.services.indiamart_service:scheduled_backfill_job", 5),
+    ("magicbricks_sync", "app.services.magicbricks_service:scheduled_magicbricks_job", 10),
+    ("99acres_sync", "app.services.ninety_nine_acres_service:scheduled_99acres_job", 10),
+    ("justdial_sync", "app.services.justdial_service:scheduled_justdial_job", 10),
+    ("housing_sync", "app.services.housing_service:scheduled_housing_job", 10),
+    ("facebook_reconcile", "app.services.facebook_leads:scheduled_reconcile_job", 30),
+    ("wa_inbox_drain", "app.services.wa_inbox:drain_inbox_job", 1),
+    ("wa_outbox_drain", "app.services.wa_outbox:drain_outbox_job", 1),
+    ("wa_campaign_dispatch", "app.services.wa_campaigns:dispatch_campaigns_job", 1),
+    ("wa_lock_sweep", "app.services.wa_locks:sweep_expired_locks_job", 5),
+    ("wa_media_prefetch", "app.services.wa_media:prefetch_media_job", 5),
+    ("wa_storage_maintenance", "app.services.wa_retention:maintain_wa_storage_job", 60),
+    ("wa_template_sync", "app.services.whatsapp_service:sync_all_wa_templates", 30),
+    ("imap_idle_watch", "app.services.imap_ingest:refresh_mailbox_watchers", 5),
+    ("processed_email_prune", "app.services.processed_email_cache:prune_processed_emails", 1440),
+    ("call_history_maintenance", "app.services.call_history_archive:maintain_call_history_job", 1440),
+]
+
+_leader = None
+_leader_lock = threading.Lock()
+
+
+def default_holder():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# =========================================================
+# LEASE
+# =========================================================
+def acquire_lease(holder, ttl_seconds, name=LEASE_NAME):
+    """
+    Takes or renews the lease. Succeeds if nobody holds it, we already hold
+    it, or the current holder let it expire. Returns True if we hold it.
+    """
+    current = now()
+    expires_at = current + datetime.timedelta(seconds=ttl_seconds)
+
+    updated = SchedulerLease.query.filter(
+        SchedulerLease.name == name,
+        or_(SchedulerLease.holder == holder, SchedulerLease.expires_at < current)
+    ).update({
+        "acquired_at": case((SchedulerLease.holder == holder, SchedulerLease.acquired_at), else_=current),
+        "holder": holder,
+        "expires_at": expires_at,
+    }, synchronize_session=False)
+    db.session.commit()
+    if updated:
+        return True
+
+    if db.session.get(SchedulerLease, name):
+        return False  # held by a live leader
+
+    try:
+        db.session.add(SchedulerLease(name=name, holder=holder, acquired_at=current, expires_at=expires_at))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def release_lease(holder, name=LEASE_NAME):
+    """Drops the lease if we hold it so another process can take over at once."""
+    SchedulerLease.query.filter_by(name=name, holder=holder).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def get_lease(name=LEASE_NAME):
+    lease = db.session.get(SchedulerLease, name)
+    return lease.to_dict() if lease else None
+
+
+# =========================================================
+# JOBS
+# =========================================================
+def register_jobs(app):
+    """Adds the interval jobs (replacing any existing ones with the same id)."""
+    from app import scheduler
+
+    for job_id, func, minutes in JOBS:
+        if scheduler.get_job(job_id):
+            scheduler.remove_job(job_id)
+        scheduler.add_job(id=job_id, func=func, args=[app], trigger='interval', minutes=minutes)
+
+
+class SchedulerLeader(threading.Thread):
+    """
+    Keeps the APScheduler paused unless this process holds the scheduler
+    lease. Renews every third of the TTL; if a renewal fails the jobs are
+    paused before the lease can expire and be taken by another process.
+    """
+
+    def __init__(self, app, holder=None):
+        super().__init__(name="scheduler-leader", daemon=True)
+        self.app = app
+        self.holder = holder or default_holder()
+        self.ttl = app.config.get("SCHEDULER_LEASE_SECONDS", 60)
+        self.is_leader = False
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.tick()
+            self._stop_event.wait(max(self.ttl // 3, 1))
+        self.step_down()
+
+    def tick(self):
+        from app import scheduler
+
+        with self.app.app_context():
+            try:
+                held = acquire_lease(self.holder, self.ttl)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"[scheduler] lease renewal failed: {e}")
+                held = False
+            finally:
+                db.session.remove()
+
+        if held and not self.is_leader:
+            logger.info(f"[scheduler] {self.holder} acquired the lease, starting jobs")
+            scheduler.resume()
+        elif not held and self.is_leader:
+            logger.warning(f"[scheduler] {self.holder} lost the lease, pausing jobs")
+            scheduler.pause()
+        self.is_leader = held
+        return held
+
+    def step_down(self):
+        from app import scheduler
+
+        if self.is_leader:
+            scheduler.pause()
+            self.is_leader = False
+        with self.app.app_context():
+            try:
+                release_lease(self.holder)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"[scheduler] lease release failed: {e}")
+            finally:
+                db.session.remove()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_scheduler(app):
+    """
+    Registers the jobs, starts APScheduler paused and begins competing for
+    the lease. Safe to call more than once per process.
+    """
+    global _leader
+    from app import scheduler
+
+    with _leader_lock:
+        if _leader is not None:
+            return _leader
+
+        register_jobs(app)
+        if not scheduler.running:
+            scheduler.start(paused=True)
+
+        _leader = SchedulerLeader(app)
+        _leader.start()
+        atexit.register(_shutdown)
+        return _leader
+
+
+def _shutdown():
+    if _leader is not None and _leader.is_alive():
+        _leader.stop()
+        _leader.join(timeout=5)
+
+
+@click.command("run-scheduler")
+@with_appcontext
+def run_scheduler_command():
+    """Run the background jobs in this process (only while holding the lease)."""
+    leader = start_scheduler(current_app._get_current_object())
+    click.echo(f"Scheduler running as {leader.holder} (lease '{LEASE_NAME}', ttl {leader.ttl}s)")
+    try:
+        while leader.is_alive():
+            leader.join(timeout=1)
+    except KeyboardInterrupt:
+        click.echo("Stopping scheduler...")
+        _shutdown()
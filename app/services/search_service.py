@@ -0,0 +1,278 @@
+import re
+import logging
+
+from sqlalchemy import or_, case, func, literal, text
+from app.models import db, Lead, User, CallHistory, WAContact
+
+logger = logging.getLogger(__name__)
+
+# Minimum term length before we hit the database. pg_trgm can only use the
+# GIN index for terms of 3+ characters; shorter ones would scan the tables.
+MIN_TERM_LENGTH = 3
+
+# Digits-only searches shorter than this are treated as plain text.
+MIN_PHONE_DIGITS = 3
+
+# (index name, table, column) - created by migration a4f1c2d9e8b7 and by
+# db_patch on startup. Only used on PostgreSQL.
+TRIGRAM_INDEXES = [
+    ("ix_leads_name_trgm", "leads", "name"),
+    ("ix_leads_phone_trgm", "leads", "phone"),
+    ("ix_leads_email_trgm", "leads", "email"),
+    ("ix_leads_location_trgm", "leads", "location"),
+    ("ix_call_history_contact_name_trgm", "call_history", "contact_name"),
+    ("ix_call_history_phone_number_trgm", "call_history", "phone_number"),
+    ("ix_call_history_formatted_number_trgm", "call_history", "formatted_number"),
+    ("ix_users_name_trgm", "users", "name"),
+    ("ix_users_email_trgm", "users", "email"),
+    ("ix_wa_contacts_name_trgm", "wa_contacts", "name"),
+    ("ix_wa_contacts_profile_name_trgm", "wa_contacts", "profile_name"),
+    ("ix_wa_contacts_phone_number_trgm", "wa_contacts", "phone_number"),
+]
+
+# (index name, table, column) - trigram indexes on the digits of phone columns,
+# so a digit search matches numbers stored as '+91 98765 43210' or '98765-43210'.
+PHONE_DIGIT_INDEXES = [
+    ("ix_leads_phone_digits_trgm", "leads", "phone"),
+    ("ix_call_history_phone_number_digits_trgm", "call_history", "phone_number"),
+    ("ix_call_history_formatted_number_digits_trgm", "call_history", "formatted_number"),
+    ("ix_wa_contacts_phone_number_digits_trgm", "wa_contacts", "phone_number"),
+]
+
+# Characters stripped from phone columns where regexp_replace is unavailable (SQLite)
+PHONE_SEPARATORS = (" ", "-", "+", "(", ")", ".", "/")
+
+
+def is_postgres():
+    return db.engine.dialect.name == "postgresql"
+
+
+def ensure_search_indexes(conn):
+    """
+    Creates the pg_trgm extension and GIN trigram indexes if missing.
+    No-op on other databases (SQLite in tests).
+    """
+    if conn.dialect.name != "postgresql":
+        return
+
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for index_name, table, column in TRIGRAM_INDEXES:
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {index_name} "
+            f"ON {table} USING gin ({column} gin_trgm_ops)"
+        ))
+    for index_name, table, column in PHONE_DIGIT_INDEXES:
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {index_name} "
+            f"ON {table} USING gin ((regexp_replace({column}, '\\D', '', 'g')) gin_trgm_ops)"
+        ))
+
+
+def normalize_term(term):
+    """Strips surrounding whitespace and collapses inner runs of spaces."""
+    if not term:
+        return ""
+    return re.sub(r"\s+", " ", term.strip())
+
+
+def escape_like(value):
+    """Escapes LIKE wildcards so user input is matched literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def phone_digits(term):
+    """
+    Returns the digit string if the term looks like a phone number
+    (e.g. '+91 98765', '98765-43'), otherwise None.
+    """
+    if not term or re.search(r"[A-Za-z@]", term):
+        return None
+    digits = re.sub(r"\D", "", term)
+    if len(digits) < MIN_PHONE_DIGITS:
+        return None
+    # Stored numbers are mostly the last 10 digits; drop a leading 91 country code
+    if len(digits) > 10 and digits.startswith("91"):
+        digits = digits[-10:]
+    return digits
+
+
+def digits_only(col):
+    """
+    The column with everything but digits removed. On PostgreSQL this is the
+    expression of the PHONE_DIGIT_INDEXES; elsewhere common separators are
+    stripped with replace().
+    """
+    if is_postgres():
+        return func.regexp_replace(col, r"\D", "", "g")
+    for separator in PHONE_SEPARATORS:
+        col = func.replace(col, separator, "")
+    return col
+
+
+def text_filter(term, text_columns, phone_columns=()):
+    """
+    Builds the WHERE clause for a search term.
+
+    ILIKE '%term%' is served by the gin_trgm_ops indexes on PostgreSQL and
+    falls back to a scan on SQLite. Phone-like terms are also matched on the
+    digits of the stored number, so '+91 98765' finds '9876543210' and
+    '98765' finds '98765-43210'.
+    """
+    term = normalize_term(term)
+    if not term:
+        return None
+
+    pattern = f"%{escape_like(term)}%"
+    conditions = [col.ilike(pattern, escape="\\") for col in text_columns]
+    conditions += [col.ilike(pattern, escape="\\") for col in phone_columns]
+
+    digits = phone_digits(term)
+    if digits:
+        conditions += [digits_only(col).like(f"%{digits}%") for col in phone_columns]
+
+    return or_(*conditions)
+
+
+def rank_expression(term, text_columns, phone_columns=()):
+    """
+    Portable ranking: exact > prefix (incl. phone digit prefix) > contains.
+    On PostgreSQL pg_trgm similarity() is added as a tie-breaker.
+    """
+    term = normalize_term(term)
+    lowered = term.lower()
+    digits = phone_digits(term)
+
+    whens = []
+    for col in text_columns:
+        whens.append((func.lower(col) == lowered, 100))
+    for col in phone_columns:
+        if digits:
+            number = digits_only(col)
+            whens.append((number == digits, 100))
+            whens.append((number.like(f"{digits}%"), 80))
+            whens.append((number.like(f"91{digits}%"), 80))
+    for col in text_columns:
+        whens.append((func.lower(col).like(f"{escape_like(lowered)}%", escape="\\"), 60))
+
+    rank = case(*whens, else_=10) if whens else literal(10)
+
+    if is_postgres():
+        similarities = [func.coalesce(func.similarity(col, term), 0) for col in text_columns]
+        if similarities:
+            best = similarities[0] if len(similarities) == 1 else func.greatest(*similarities)
+            rank = rank + best
+
+    return rank
+
+
+def apply_search(query, term, text_columns, phone_columns=()):
+    """Adds the search filter to an existing query; unchanged if term is empty."""
+    condition = text_filter(term, text_columns, phone_columns)
+    if condition is None:
+        return query
+    return query.filter(condition)
+
+
+# =========================================================
+# UNIFIED SEARCH
+# =========================================================
+def search_leads(admin_id, term, limit=10, assigned_to=None):
+    text_cols = [Lead.name, Lead.email, Lead.location]
+    phone_cols = [Lead.phone]
+
+    rank = rank_expression(term, text_cols, phone_cols).label("rank")
+    query = db.session.query(Lead, rank).filter(Lead.admin_id == admin_id)
+    if assigned_to is not None:
+        query = query.filter(Lead.assigned_to == assigned_to)
+
+    query = apply_search(query, term, text_cols, phone_cols)
+    rows = query.order_by(rank.desc(), Lead.created_at.desc()).limit(limit).all()
+
+    return [{
+        "type": "lead",
+        "id": lead.id,
+        "name": lead.name,
+        "phone": lead.phone,
+        "email": lead.email,
+        "location": lead.location,
+        "status": lead.status,
+        "source": lead.source,
+        "assigned_to": lead.assigned_to,
+        "created_at": (lead.created_at.isoformat() + "Z") if lead.created_at else None,
+        "score": float(score or 0),
+    } for lead, score in rows]
+
+
+def search_calls(admin_id, term, limit=10, user_id=None):
+    text_cols = [CallHistory.contact_name]
+    phone_cols = [CallHistory.phone_number, CallHistory.formatted_number]
+
+    rank = rank_expression(term, text_cols, phone_cols).label("rank")
+    query = (
+        db.session.query(CallHistory, User.name, rank)
+        .join(User, CallHistory.user_id == User.id)
+        .filter(User.admin_id == admin_id)
+    )
+    if user_id is not None:
+        query = query.filter(CallHistory.user_id == user_id)
+
+    query = apply_search(query, term, text_cols, phone_cols)
+    rows = query.order_by(rank.desc(), CallHistory.timestamp.desc()).limit(limit).all()
+
+    return [{
+        "type": "call",
+        "id": call.id,
+        "user_id": call.user_id,
+        "user_name": user_name,
+        "contact_name": call.contact_name,
+        "phone_number": call.phone_number,
+        "call_type": call.call_type,
+        "duration": call.duration,
+        "timestamp": (call.timestamp.isoformat() + "Z") if call.timestamp else None,
+        "score": float(score or 0),
+    } for call, user_name, score in rows]
+
+
+def search_wa_contacts(admin_id, term, limit=10):
+    text_cols = [WAContact.name, WAContact.profile_name]
+    phone_cols = [WAContact.phone_number]
+
+    rank = rank_expression(term, text_cols, phone_cols).label("rank")
+    query = db.session.query(WAContact, rank).filter(WAContact.admin_id == admin_id)
+
+    query = apply_search(query, term, text_cols, phone_cols)
+    rows = query.order_by(rank.desc(), WAContact.updated_at.desc()).limit(limit).all()
+
+    return [{
+        "type": "wa_contact",
+        "id": contact.id,
+        "name": contact.name or contact.profile_name,
+        "profile_name": contact.profile_name,
+        "phone_number": contact.phone_number,
+        "lead_id": contact.lead_id,
+        "score": float(score or 0),
+    } for contact, score in rows]
+
+
+SEARCH_TYPES = ("leads", "calls", "contacts")
+
+
+def unified_search(admin_id, term, types=SEARCH_TYPES, limit=10, agent_id=None):
+    """
+    Tenant-scoped search across leads, call history and WhatsApp contacts.
+    When agent_id is given the results are limited to that agent's own
+    leads and calls (WhatsApp contacts are admin-only).
+    """
+    term = normalize_term(term)
+    results = {}
+    if len(term) < MIN_TERM_LENGTH:
+        return results
+
+    if "leads" in types:
+        results["leads"] = search_leads(admin_id, term, limit, assigned_to=agent_id)
+    if "calls" in types:
+        results["calls"] = search_calls(admin_id, term, limit, user_id=agent_id)
+    if "contacts" in types and agent_id is None:
+        results["contacts"] = search_wa_contacts(admin_id, term, limit)
+
+    return results
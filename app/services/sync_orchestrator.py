@@ -0,0 +1,251 @@
+import time
+import datetime
+import logging
+import importlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from app.models import db, Admin, TenantSyncState, now
+
+logger = logging.getLogger(__name__)
+
+# name -> provider dict, filled in by each portal service module on import
+PROVIDERS = {}
+
+# Modules that register the built-in providers (imported lazily on first use)
+PROVIDER_MODULES = {
+    "indiamart": "app.services.indiamart_service",
+    "indiamart_backfill": "app.services.indiamart_service",
+    "magicbricks": "app.services.magicbricks_service",
+    "99acres": "app.services.ninety_nine_acres_service",
+    "justdial": "app.services.justdial_service",
+    "housing": "app.services.housing_service",
+    "facebook_reconcile": "app.services.facebook_leads",
+    "wa_templates": "app.services.whatsapp_service",
+}
+
+_lock = threading.Lock()
+_executor = None
+_queues = {}        # provider -> {"cap", "running", "pending": deque}
+_active = set()     # (provider, admin_id) queued or running in this process
+
+
+def register_provider(name, settings_model, enabled_column, sync, max_concurrency=None):
+    """
+    Registers a lead portal with the orchestrator.
+
+    settings_model / enabled_column select the tenants to sync
+    (e.g. MagicbricksSettings, MagicbricksSettings.is_active).
+    sync(admin_id) must return a dict with a "status" key.
+    """
+    PROVIDERS[name] = {
+        "name": name,
+        "settings_model": settings_model,
+        "enabled_column": enabled_column,
+        "sync": sync,
+        "max_concurrency": max_concurrency,
+    }
+
+
+def _get_provider(name):
+    if name not in PROVIDERS and name in PROVIDER_MODULES:
+        importlib.import_module(PROVIDER_MODULES[name])
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown sync provider '{name}'")
+    return PROVIDERS[name]
+
+
+def _get_executor(app):
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get("SYNC_MAX_WORKERS", 8),
+                thread_name_prefix="tenant-sync"
+            )
+        return _executor
+
+
+def _get_queue(app, name):
+    q = _queues.get(name)
+    if q is None:
+        cap = PROVIDERS[name]["max_concurrency"] or app.config.get("SYNC_PROVIDER_CONCURRENCY", 4)
+        q = _queues[name] = {"cap": cap, "running": 0, "pending": deque()}
+    return q
+
+
+def list_tenants(name):
+    """Admin ids with the provider enabled and an active admin account."""
+    provider = _get_provider(name)
+    model = provider["settings_model"]
+    rows = (
+        db.session.query(model.admin_id)
+        .join(Admin, Admin.id == model.admin_id)
+        .filter(provider["enabled_column"] == True, Admin.is_active == True)
+        .order_by(model.admin_id)
+        .all()
+    )
+    return [r[0] for r in rows]
+
+
+# =========================================================
+# DISPATCH
+# =========================================================
+def run_provider(app, name):
+    """
+    Scheduler entry point: fan every enabled tenant of a provider out to the
+    shared pool. Returns immediately; tenants still running from the last
+    cycle are skipped.
+    """
+    with app.app_context():
+        admin_ids = list_tenants(name)
+        db.session.remove()
+
+    queued = sum(1 for admin_id in admin_ids if submit_tenant_sync(app, name, admin_id))
+    logger.info(f"[sync] {name}: queued {queued}/{len(admin_ids)} tenants")
+    return queued
+
+
+def submit_tenant_sync(app, name, admin_id):
+    """
+    Queues one tenant. Returns False if that tenant is already queued or
+    running in this process.
+    """
+    _get_provider(name)
+
+    key = (name, admin_id)
+    with _lock:
+        if key in _active:
+            return False
+        _active.add(key)
+        _get_queue(app, name)["pending"].append(admin_id)
+
+    _pump(app, name)
+    return True
+
+
+def _pump(app, name):
+    """Starts queued tenants while the provider is under its concurrency cap."""
+    to_start = []
+    with _lock:
+        q = _get_queue(app, name)
+        while q["pending"] and q["running"] < q["cap"]:
+            to_start.append(q["pending"].popleft())
+            q["running"] += 1
+
+    executor = _get_executor(app)
+    for admin_id in to_start:
+        future = executor.submit(_run_tenant, app, name, admin_id)
+        future.add_done_callback(lambda _f, a=admin_id: _on_done(app, name, a))
+
+
+def _on_done(app, name, admin_id):
+    with _lock:
+        _queues[name]["running"] -= 1
+        _active.discard((name, admin_id))
+    _pump(app, name)
+
+
+# =========================================================
+# PER-TENANT RUN + BOOKKEEPING
+# =========================================================
+def _claim(app, name, admin_id):
+    """
+    Marks the tenant in flight in tenant_sync_states. Fails if another
+    process has a run in flight that is not yet stale.
+    """
+    stale_before = now() - datetime.timedelta(minutes=app.config.get("SYNC_STALE_AFTER_MINUTES", 30))
+
+    claimed = TenantSyncState.query.filter(
+        TenantSyncState.provider == name,
+        TenantSyncState.admin_id == admin_id,
+        or_(TenantSyncState.in_flight == False, TenantSyncState.last_started_at < stale_before)
+    ).update({"in_flight": True, "last_started_at": now()}, synchronize_session=False)
+    db.session.commit()
+    if claimed:
+        return True
+
+    if TenantSyncState.query.filter_by(provider=name, admin_id=admin_id).first():
+        return False  # exists and is in flight elsewhere
+
+    try:
+        db.session.add(TenantSyncState(
+            provider=name, admin_id=admin_id, in_flight=True, last_started_at=now(), run_count=0
+        ))
+        db.session.commit()
+        return True
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+
+def _release(name, admin_id, outcome, error, added, duration_ms):
+    state = TenantSyncState.query.filter_by(provider=name, admin_id=admin_id).first()
+    if not state:
+        return
+    state.in_flight = False
+    state.last_finished_at = now()
+    state.last_duration_ms = duration_ms
+    state.last_outcome = outcome
+    state.last_error = (error or None) and str(error)[:2000]
+    state.last_added = added
+    state.run_count = (state.run_count or 0) + 1
+    db.session.commit()
+
+
+def _run_tenant(app, name, admin_id):
+    with app.app_context():
+        try:
+            if not _claim(app, name, admin_id):
+                logger.info(f"[sync] {name} admin {admin_id}: previous run still in flight, skipping")
+                return
+
+            started = time.monotonic()
+            outcome, error, added = "error", None, 0
+            try:
+                result = PROVIDERS[name]["sync"](admin_id) or {}
+                status = result.get("status")
+                if status == "success":
+                    outcome = "success"
+                elif status == "skipped":
+                    outcome = "skipped"
+                else:
+                    error = result.get("error") or result.get("message") or "Unknown error"
+                added = result.get("added", 0) or 0
+            except Exception as e:
+                db.session.rollback()
+                error = str(e)
+                logger.error(f"[sync] {name} admin {admin_id} failed: {e}")
+            finally:
+                duration_ms = int((time.monotonic() - started) * 1000)
+                _release(name, admin_id, outcome, error, added, duration_ms)
+
+            if added:
+                logger.info(f"[sync] {name} admin {admin_id}: +{added} leads in {duration_ms} ms")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[sync] {name} admin {admin_id} bookkeeping failed: {e}")
+        finally:
+            db.session.remove()
+
+
+# =========================================================
+# STATUS
+# =========================================================
+def get_sync_status(admin_id=None):
+    """Persisted per-tenant state plus this process's queue depth."""
+    query = TenantSyncState.query
+    if admin_id is not None:
+        query = query.filter_by(admin_id=admin_id)
+    states = [s.to_dict() for s in query.order_by(TenantSyncState.provider, TenantSyncState.admin_id).all()]
+
+    with _lock:
+        queues = {
+            name: {"cap": q["cap"], "running": q["running"], "pending": len(q["pending"])}
+            for name, q in _queues.items()
+        }
+
+    return {"tenants": states, "queues": queues}
@@ -0,0 +1,442 @@
+# app/services/wa_campaigns.py
+"""
+WhatsApp broadcast campaigns.
+
+A campaign sends one approved template to a recipient list built from a
+lead segment or an uploaded list; template parameters are rendered per
+recipient when the campaign is created. A dispatcher thread (woken when a
+campaign is started) and a scheduler job (resuming runs a dead process
+left behind) claim campaigns and send their recipients batch by batch:
+  - sends run on a thread pool, each taking a token from the WABA's
+    bucket (WA_CAMPAIGN_RATE_PER_SECOND)
+  - throttled sends (HTTP 429 / Meta rate-limit codes) drain the bucket
+    and are retried with exponential backoff
+  - each batch is written back in one transaction: recipient rows, the
+    messages and inbox rows, and the campaign's progress counters
+
+Only one run per admin is claimed at a time, so the per-process bucket is
+the whole budget of that admin's WABA.
+"""
+
+import time
+import logging
+import datetime
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import or_, and_, func, exists, update, insert, bindparam, String
+from sqlalchemy.orm import aliased
+from app.models import db, Admin, Lead, WACampaign, WACampaignRecipient, WAConversation, WAMessage, now, message_preview
+from app.services import wa_events, wa_inbox, wa_tenants
+from app.utils.rate_limit import get_bucket
+
+logger = logging.getLogger(__name__)
+
+# Meta error codes for throughput / spam / pair rate limits
+THROTTLE_CODES = {4, 80007, 130429, 131048, 131056}
+SEGMENT_FILTERS = ("status", "source", "assigned_to", "created_from", "created_to")
+INSERT_CHUNK = 1000
+INTERRUPTED = "Interrupted while sending; not retried to avoid a duplicate message"
+
+SendResult = namedtuple("SendResult", "id status wamid error attempts")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# =========================================================
+# RECIPIENTS
+# =========================================================
+def segment_query(admin_id, segment):
+    """Leads matching the segment filters (status / source / assigned_to accept a value or a list)."""
+    unknown = set(segment) - set(SEGMENT_FILTERS)
+    if unknown:
+        raise ValueError(f"Unknown segment filters: {', '.join(sorted(unknown))}")
+
+    query = db.session.query(
+        Lead.id, Lead.name, Lead.phone, Lead.source, Lead.status, Lead.location, Lead.custom_fields
+    ).filter(Lead.admin_id == admin_id)
+    for key in ("status", "source", "assigned_to"):
+        value = segment.get(key)
+        if value in (None, "", []):
+            continue
+        query = query.filter(getattr(Lead, key).in_(value if isinstance(value, list) else [value]))
+    if segment.get("created_from"):
+        query = query.filter(Lead.created_at >= _segment_date(segment, "created_from"))
+    if segment.get("created_to"):
+        query = query.filter(Lead.created_at <= _segment_date(segment, "created_to"))
+    return query.order_by(Lead.id)
+
+
+def _segment_date(segment, key):
+    try:
+        return datetime.datetime.fromisoformat(str(segment[key]))
+    except ValueError:
+        raise ValueError(f"{key} must be an ISO date")
+
+
+def recipients_from_leads(admin_id, segment):
+    from app.routes.whatsapp import _get_best_lead_phone
+
+    for lead in segment_query(admin_id, segment).yield_per(INSERT_CHUNK):
+        yield {
+            "lead_id": lead.id,
+            "phone": _get_best_lead_phone(lead),
+            "name": lead.name,
+            "context": {
+                "lead_name":     lead.name or "",
+                "lead_phone":    lead.phone or "",
+                "lead_source":   lead.source or "",
+                "lead_status":   lead.status or "",
+                "lead_location": lead.location or "",
+            },
+        }
+
+
+def recipients_from_upload(rows):
+    """rows: dicts with a phone (or mobile) column; every column is a {{placeholder}}."""
+    from app.routes.whatsapp import normalize_phone
+
+    for row in rows:
+        row = {str(k).strip(): (v or "").strip() if isinstance(v, str) else v for k, v in row.items() if k}
+        raw_phone = row.get("phone") or row.get("mobile") or ""
+        context = dict(row, lead_name=row.get("name") or "", lead_phone=raw_phone)
+        yield {"lead_id": None, "phone": normalize_phone(raw_phone), "name": row.get("name") or None, "context": context}
+
+
+def create_campaign(admin_id, name, template_name, params, recipients, header_url=None, segment=None,
+                    max_recipients=None):
+    """
+    Stores a draft campaign with its rendered recipients (no commit on error).
+    Recipients without a valid phone and repeated phones are skipped.
+    Returns (campaign, skipped).
+    """
+    from app.routes.whatsapp import _resolve_params
+
+    campaign = WACampaign(admin_id=admin_id, name=name, template_name=template_name, params=params or [],
+                          header_url=header_url, segment=segment, status="draft",
+                          total_count=0, sent_count=0, failed_count=0)
+    db.session.add(campaign)
+    db.session.flush()
+
+    rows, seen, skipped = [], set(), 0
+    for r in recipients:
+        if not r["phone"] or r["phone"] in seen:
+            skipped += 1
+            continue
+        seen.add(r["phone"])
+        if max_recipients and len(seen) > max_recipients:
+            raise ValueError(f"A campaign can have at most {max_recipients} recipients")
+        rows.append({
+            "campaign_id": campaign.id,
+            "lead_id":     r["lead_id"],
+            "phone":       r["phone"],
+            "name":        (r["name"] or "")[:255] or None,
+            "params":      _resolve_params(params, r["context"]),
+            "status":      "pending",
+            "attempts":    0,
+        })
+    if not rows:
+        raise ValueError("No recipients with a valid phone number")
+
+    for i in range(0, len(rows), INSERT_CHUNK):
+        db.session.execute(insert(WACampaignRecipient), rows[i:i + INSERT_CHUNK])
+    campaign.total_count = len(rows)
+    db.session.commit()
+    return campaign, skipped
+
+
+# =========================================================
+# SENDING (pool threads: HTTP only, no DB)
+# =========================================================
+def _get_executor(config):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=config.get("WA_CAMPAIGN_WORKERS", 8),
+                thread_name_prefix="wa-campaign"
+            )
+        return _executor
+
+
+def header_payload(tmpl, header_url):
+    if header_url and tmpl.header_type in ("IMAGE", "VIDEO", "DOCUMENT"):
+        kind = tmpl.header_type.lower()
+        return {"type": kind, kind: {"link": header_url}}
+    return None
+
+
+def render_body(body_text, params):
+    for i, value in enumerate(params or [], start=1):
+        body_text = body_text.replace(f"{{{{{i}}}}}", value)
+    return body_text
+
+
+def is_throttled(response):
+    if response is None:
+        return False
+    if response.status_code == 429:
+        return True
+    try:
+        return (response.json().get("error") or {}).get("code") in THROTTLE_CODES
+    except (ValueError, AttributeError):
+        return False
+
+
+def _error_text(e):
+    try:
+        return e.response.json().get("error", {}).get("message", e.response.text)
+    except Exception:
+        return str(e)
+
+
+def send_one(app, client, tmpl, header, recipient, bucket, max_retries, backoff):
+    """Sends one recipient's template, retrying throttled calls. Returns a SendResult."""
+    attempts = 0
+    while True:
+        bucket.acquire()
+        attempts += 1
+        try:
+            with app.app_context():
+                result = client.send_template(recipient.phone, tmpl.name, tmpl.language or "en",
+                                              recipient.params or [], header=header)
+        except requests.HTTPError as e:
+            if attempts <= max_retries and is_throttled(e.response):
+                bucket.drain()   # every sender on this WABA backs off
+                time.sleep(backoff * 2 ** (attempts - 1))
+                continue
+            return SendResult(recipient.id, "failed", None, _error_text(e)[:2000], attempts)
+        except Exception as e:
+            return SendResult(recipient.id, "failed", None, str(e)[:2000], attempts)
+        wamid = (result.get("messages") or [{}])[0].get("id")
+        return SendResult(recipient.id, "sent", wamid, None, attempts)
+
+
+# =========================================================
+# DISPATCH
+# =========================================================
+def claim_campaign(stale_seconds):
+    """
+    Marks the oldest queued campaign (or a running one whose dispatcher went
+    quiet) as running and returns its id, or None.
+
+    An admin runs one campaign at a time. Two dispatchers could each see no
+    live run and claim two of an admin's campaigns, so the claim locks the
+    admin row (SELECT ... FOR UPDATE) and re-checks for a live run in the
+    UPDATE itself.
+    """
+    stale_before = now() - datetime.timedelta(seconds=stale_seconds)
+    claimable = or_(
+        WACampaign.status == "queued",
+        and_(WACampaign.status == "running",
+             or_(WACampaign.heartbeat_at.is_(None), WACampaign.heartbeat_at < stale_before))
+    )
+    other = aliased(WACampaign)
+    live_run = exists().where(
+        other.admin_id == WACampaign.admin_id, other.id != WACampaign.id,
+        other.status == "running", other.heartbeat_at >= stale_before
+    )
+    candidates = db.session.query(WACampaign.id, WACampaign.admin_id).filter(claimable, ~live_run) \
+        .order_by(WACampaign.id).limit(10).all()
+
+    for campaign_id, admin_id in candidates:
+        db.session.query(Admin.id).filter(Admin.id == admin_id).with_for_update().first()
+        ts = now()
+        claimed = WACampaign.query.filter(WACampaign.id == campaign_id, claimable, ~live_run).update({
+            "status": "running",
+            "heartbeat_at": ts,
+            "started_at": func.coalesce(WACampaign.started_at, ts),
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return campaign_id
+    db.session.commit()
+    return None
+
+
+def claim_recipients(campaign_id, limit):
+    rows = db.session.query(
+        WACampaignRecipient.id, WACampaignRecipient.phone, WACampaignRecipient.name, WACampaignRecipient.params
+    ).filter(
+        WACampaignRecipient.campaign_id == campaign_id, WACampaignRecipient.status == "pending"
+    ).order_by(WACampaignRecipient.id).limit(limit).all()
+    if rows:
+        WACampaignRecipient.query.filter(WACampaignRecipient.id.in_([r.id for r in rows])).update(
+            {"status": "sending"}, synchronize_session=False
+        )
+    db.session.commit()
+    return rows
+
+
+def _fail_interrupted(campaign_id):
+    """Recipients a dead dispatcher left mid-send may have received the message: fail, do not resend."""
+    count = WACampaignRecipient.query.filter_by(campaign_id=campaign_id, status="sending").update(
+        {"status": "failed", "error": INTERRUPTED}, synchronize_session=False
+    )
+    if count:
+        WACampaign.query.filter_by(id=campaign_id).update(
+            {"failed_count": func.coalesce(WACampaign.failed_count, 0) + count}, synchronize_session=False
+        )
+        logger.warning(f"[wa-campaign] {campaign_id}: {count} interrupted sends marked failed")
+    db.session.commit()
+
+
+def _record_messages(admin_id, tmpl, delivered, ts):
+    """Saves sent templates as conversation messages, so receipts and replies land in the inbox."""
+    contacts = wa_inbox.upsert_contacts({(admin_id, r.phone): r.name for r, _ in delivered})
+    display_names = {(admin_id, contact_id): name for (contact_id, name) in contacts.values()}
+    conv_ids = wa_inbox.upsert_conversations(display_names)
+
+    rows = [{
+        "conversation_id": conv_ids[(admin_id, contacts[(admin_id, r.phone)][0])],
+        "admin_id":        admin_id,
+        "whatsapp_msg_id": res.wamid,
+        "sender_type":     "system",
+        "message_type":    "template",
+        "message_text":    render_body(tmpl.body_text or tmpl.name, r.params),
+        "template_name":   tmpl.name,
+        "status":          "sent",
+        "created_at":      ts,
+    } for r, res in delivered]
+    saved = db.session.execute(
+        insert(WAMessage).returning(WAMessage.id, WAMessage.conversation_id, WAMessage.message_text), rows
+    ).all()
+
+    conv = WAConversation.__table__.c
+    db.session.execute(
+        update(WAConversation.__table__).where(conv.id == bindparam("b_id")).values(
+            last_message_id=bindparam("b_msg_id"),
+            last_message_preview=bindparam("b_preview", type_=String),
+            last_message_type="template",
+            last_message_status="sent",
+            last_message_at=ts,
+            updated_at=ts,
+        ),
+        [{"b_id": row.conversation_id, "b_msg_id": row.id, "b_preview": message_preview(row.message_text)}
+         for row in {row.conversation_id: row for row in saved}.values()]
+    )
+
+
+def record_batch(campaign_id, admin_id, tmpl, batch, results):
+    """Writes one sent batch back in a single transaction."""
+    ts = now()
+    db.session.execute(update(WACampaignRecipient), [
+        {"id": res.id, "status": res.status, "wamid": res.wamid, "error": res.error,
+         "attempts": res.attempts, "sent_at": ts if res.status == "sent" else None}
+        for res in results
+    ])
+    delivered = [(r, res) for r, res in zip(batch, results) if res.wamid]
+    if delivered:
+        _record_messages(admin_id, tmpl, delivered, ts)
+
+    sent = sum(1 for res in results if res.status == "sent")
+    WACampaign.query.filter_by(id=campaign_id).update({
+        "sent_count": func.coalesce(WACampaign.sent_count, 0) + sent,
+        "failed_count": func.coalesce(WACampaign.failed_count, 0) + len(results) - sent,
+        "heartbeat_at": ts,
+    }, synchronize_session=False)
+    wa_events.emit(admin_id, "campaign", {"campaign_id": campaign_id, "status": "running"})
+    db.session.commit()
+
+
+def _finish(campaign_id, admin_id, status, error=None):
+    WACampaign.query.filter(WACampaign.id == campaign_id, WACampaign.status == "running").update(
+        {"status": status, "error": error, "completed_at": now()}, synchronize_session=False
+    )
+    wa_events.emit(admin_id, "campaign", {"campaign_id": campaign_id, "status": status})
+    db.session.commit()
+
+
+def run_campaign(app, campaign_id):
+    """Sends a claimed campaign's pending recipients until done or cancelled."""
+    config = app.config
+    campaign = db.session.get(WACampaign, campaign_id)
+    admin_id = campaign.admin_id
+    tenant = wa_tenants.get(admin_id)
+    tmpl = tenant.template(campaign.template_name) if tenant else None
+    if not tmpl or (tmpl.status or "").upper() != "APPROVED":
+        reason = "WhatsApp not connected" if not tenant else \
+            f"Template '{campaign.template_name}' is missing or not APPROVED"
+        _finish(campaign_id, admin_id, "failed", reason)
+        return
+
+    header = header_payload(tmpl, campaign.header_url)
+    batch_size = config.get("WA_CAMPAIGN_BATCH_SIZE", 200)
+    max_retries = config.get("WA_CAMPAIGN_MAX_RETRIES", 5)
+    backoff = config.get("WA_CAMPAIGN_RETRY_BACKOFF_SECONDS", 2)
+    bucket = get_bucket(
+        f"wa-waba:{tenant.client.waba_id}",
+        rate=config.get("WA_CAMPAIGN_RATE_PER_SECOND", 20),
+        capacity=config.get("WA_CAMPAIGN_BURST", 20)
+    )
+    pool = _get_executor(config)
+    _fail_interrupted(campaign_id)
+
+    def send(recipient):
+        return send_one(app, tenant.client, tmpl, header, recipient, bucket, max_retries, backoff)
+
+    while True:
+        batch = claim_recipients(campaign_id, batch_size)
+        if not batch:
+            break
+        results = list(pool.map(send, batch))
+        record_batch(campaign_id, admin_id, tmpl, batch, results)
+        if db.session.query(WACampaign.status).filter_by(id=campaign_id).scalar() != "running":
+            logger.info(f"[wa-campaign] {campaign_id}: stopped (cancelled)")
+            return
+
+    _finish(campaign_id, admin_id, "completed")
+    logger.info(f"[wa-campaign] {campaign_id}: completed")
+
+
+def dispatch(app):
+    """Runs claimable campaigns until none is left. Returns how many were run."""
+    stale_seconds = app.config.get("WA_CAMPAIGN_STALE_SECONDS", 300)
+    ran = 0
+    with app.app_context():
+        try:
+            while True:
+                campaign_id = claim_campaign(stale_seconds)
+                if campaign_id is None:
+                    break
+                run_campaign(app, campaign_id)
+                ran += 1
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[wa-campaign] dispatch failed: {e}")
+        finally:
+            db.session.remove()
+    return ran
+
+
+def dispatch_campaigns_job(app):
+    """APScheduler Job: starts queued campaigns and resumes runs whose process died."""
+    dispatch(app)
+
+
+class CampaignDispatcher:
+    """Per-process dispatch thread, woken when a campaign is started."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def notify(self, app):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(app,), name="wa-campaigns", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self, app):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            dispatch(app)
+
+
+dispatcher = CampaignDispatcher()
@@ -0,0 +1,308 @@
+# app/services/wa_events.py
+"""
+Real-time WhatsApp inbox events, streamed to admins as Server-Sent Events.
+
+Writers call emit() while they hold the SQLAlchemy session; events are
+published only if that transaction commits:
+  - PostgreSQL (WA_EVENTS_PG_NOTIFY): pg_notify() runs inside the
+    transaction, so every worker's LISTEN thread receives the event on
+    commit and hands it to its local subscribers
+  - otherwise (SQLite, fan-out disabled): delivered in-process after commit
+
+Event types: "message" (new inbound/outbound message), "status" (delivery
+receipt), "lock" (conversation lock taken/released), "campaign" (broadcast
+progress) and "resync" (the stream lost events; the client should reload
+over REST).
+
+Each worker keeps a short per-admin replay buffer so a reconnecting stream
+resumes after its Last-Event-ID.
+"""
+
+import os
+import json
+import time
+import uuid
+import queue
+import select
+import logging
+import threading
+from collections import defaultdict, deque
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, select as sa_select, func
+from sqlalchemy.orm import Session
+from app.models import db
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "wa_events"
+NOTIFY_MAX_BYTES = 7900   # Postgres rejects NOTIFY payloads of 8000 bytes or more
+SESSION_KEY = "wa_events"
+
+
+def new_event(admin_id, event_type, data):
+    return {
+        "id": f"{int(time.time() * 1000):x}-{uuid.uuid4().hex[:8]}",
+        "admin_id": admin_id,
+        "type": event_type,
+        "data": data,
+    }
+
+
+def format_sse(evt):
+    return f"id: {evt['id']}\nevent: {evt['type']}\ndata: {json.dumps(evt['data'], default=str)}\n\n"
+
+
+class Subscriber:
+    """One open stream: a bounded queue of events for one admin."""
+
+    def __init__(self, admin_id, maxsize):
+        self.admin_id = admin_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def push(self, evt):
+        try:
+            self.queue.put_nowait(evt)
+        except queue.Full:
+            self.overflowed = True   # the stream sends "resync" instead of the dropped events
+
+
+class StreamLimitReached(Exception):
+    """This process already serves WA_EVENTS_MAX_STREAMS streams."""
+
+
+class EventBus:
+    """In-process pub/sub with a per-admin replay buffer."""
+
+    def __init__(self, backlog=500):
+        self.backlog = backlog
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)   # admin_id -> {Subscriber}
+        self._recent = {}                      # admin_id -> deque of events
+        self._open = 0                         # subscribers across all admins
+
+    def subscribe(self, admin_id, last_event_id=None, maxsize=1000, limit=None):
+        """
+        Returns (subscriber, replay). replay lists the buffered events after
+        last_event_id, or is None when that id is no longer buffered.
+        Raises StreamLimitReached when `limit` subscribers are already open.
+        """
+        sub = Subscriber(admin_id, maxsize)
+        with self._lock:
+            if limit is not None and self._open >= limit:
+                raise StreamLimitReached()
+            self._subscribers[admin_id].add(sub)
+            self._open += 1
+            recent = list(self._recent.get(admin_id, ()))
+        if not last_event_id:
+            return sub, []
+        for i, evt in enumerate(recent):
+            if evt["id"] == last_event_id:
+                return sub, recent[i + 1:]
+        return sub, None
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.admin_id)
+            if subs and sub in subs:
+                subs.discard(sub)
+                self._open -= 1
+                if not subs:
+                    del self._subscribers[sub.admin_id]
+
+    def deliver(self, evt):
+        admin_id = evt["admin_id"]
+        with self._lock:
+            recent = self._recent.get(admin_id)
+            if recent is None:
+                recent = self._recent[admin_id] = deque(maxlen=self.backlog)
+            recent.append(evt)
+            subs = list(self._subscribers.get(admin_id, ()))
+        for sub in subs:
+            sub.push(evt)
+
+
+bus = EventBus()
+
+
+# =========================================================
+# PUBLISHING (tied to the session's transaction)
+# =========================================================
+def emit(admin_id, event_type, data):
+    """Queues an event on the current session; it is published on commit."""
+    session = db.session()
+    if not session.in_transaction():
+        session.begin()   # so a rollback() before any SQL still discards the event
+    session.info.setdefault(SESSION_KEY, []).append(new_event(admin_id, event_type, data))
+
+
+def _pg_fanout(session):
+    if not has_app_context() or not current_app.config.get("WA_EVENTS_PG_NOTIFY", True):
+        return False
+    return session.get_bind().dialect.name == "postgresql"
+
+
+def _notify_payload(evt):
+    payload = json.dumps(evt, default=str, separators=(",", ":"))
+    if len(payload.encode()) <= NOTIFY_MAX_BYTES:
+        return payload
+    # Too big for NOTIFY: keep the routing fields, clients reload the rest
+    data = {k: evt["data"][k] for k in ("conversation_id", "message_id") if k in evt["data"]}
+    return json.dumps(dict(evt, data=dict(data, truncated=True)), separators=(",", ":"))
+
+
+@event.listens_for(Session, "before_commit")
+def _notify_before_commit(session):
+    events = session.info.get(SESSION_KEY)
+    if events and _pg_fanout(session):
+        for evt in events:
+            session.execute(sa_select(func.pg_notify(CHANNEL, _notify_payload(evt))))
+        session.info[SESSION_KEY] = []   # LISTEN threads deliver them, including our own
+
+
+@event.listens_for(Session, "after_commit")
+def _deliver_after_commit(session):
+    for evt in session.info.pop(SESSION_KEY, None) or ():
+        bus.deliver(evt)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_after_rollback(session, previous_transaction):
+    # Fires on every rollback(); a savepoint rollback leaves the outer transaction's events
+    if not session.in_transaction():
+        session.info.pop(SESSION_KEY, None)
+
+
+# =========================================================
+# POSTGRES LISTEN (one thread per worker)
+# =========================================================
+class PgListener:
+    """LISTENs on the events channel and delivers notifications to the local bus."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_started(self, app):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(app,), daemon=True, name="wa-events-listen")
+                self._thread.start()
+
+    def _run(self, app):
+        while True:
+            raw = None
+            try:
+                with app.app_context():
+                    raw = db.engine.raw_connection()
+                raw.detach()   # held for the process lifetime, not a pool slot
+                conn = raw.driver_connection
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {CHANNEL}")
+                logger.info(f"[wa-events] listening on {CHANNEL} (pid {os.getpid()})")
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notice = conn.notifies.pop(0)
+                        try:
+                            bus.deliver(json.loads(notice.payload))
+                        except ValueError:
+                            logger.warning(f"[wa-events] bad payload: {notice.payload[:200]}")
+            except Exception as e:
+                logger.warning(f"[wa-events] listener error, reconnecting: {e}")
+                time.sleep(5)
+            finally:
+                if raw is not None:
+                    try:
+                        raw.close()
+                    except Exception:
+                        pass
+
+
+listener = PgListener()
+
+
+# =========================================================
+# STREAM
+# =========================================================
+class Stream:
+    """
+    The SSE response body. close() (called by the WSGI server) frees the
+    subscriber even if the client left before the first chunk was sent.
+    """
+
+    def __init__(self, sub, chunks):
+        self.sub = sub
+        self._chunks = chunks
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def close(self):
+        self._chunks.close()
+        bus.unsubscribe(self.sub)
+
+
+def open_stream(app, admin_id, last_event_id=None):
+    """
+    Subscribes an admin and returns the SSE Stream for the response. Each
+    stream holds a worker thread for up to WA_EVENTS_STREAM_SECONDS, so a
+    process serves at most WA_EVENTS_MAX_STREAMS (StreamLimitReached above).
+    """
+    config = app.config
+    sub, replay = bus.subscribe(admin_id, last_event_id, config.get("WA_EVENTS_QUEUE_SIZE", 1000),
+                                limit=config.get("WA_EVENTS_MAX_STREAMS", 16))
+    try:
+        with app.app_context():
+            if config.get("WA_EVENTS_PG_NOTIFY", True) and db.engine.dialect.name == "postgresql":
+                listener.ensure_started(app)
+    except Exception:
+        bus.unsubscribe(sub)
+        raise
+    keepalive = config.get("WA_EVENTS_KEEPALIVE_SECONDS", 15)
+    lifetime = config.get("WA_EVENTS_STREAM_SECONDS", 300)
+
+    def generate():
+        try:
+            yield f"retry: {config.get('WA_EVENTS_RETRY_MS', 3000)}\n\n"
+            if replay is None:
+                yield format_sse(new_event(admin_id, "resync", {"reason": "gap"}))
+            for evt in replay or ():
+                yield format_sse(evt)
+
+            # Streams end after `lifetime` so workers are recycled; clients resume via Last-Event-ID
+            deadline = time.monotonic() + lifetime
+            while time.monotonic() < deadline:
+                if sub.overflowed:
+                    sub.overflowed = False
+                    yield format_sse(new_event(admin_id, "resync", {"reason": "overflow"}))
+                try:
+                    evt = sub.queue.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(evt)
+        finally:
+            bus.unsubscribe(sub)
+
+    return Stream(sub, generate())
+
+
+def message_event(msg):
+    """Compact "message" payload for a WAMessage (or a row with the same fields)."""
+    created_at = msg.created_at
+    return {
+        "conversation_id": msg.conversation_id,
+        "message_id": msg.id,
+        "sender_type": msg.sender_type,
+        "message_type": msg.message_type,
+        "preview": (msg.message_text or "")[:255] or None,
+        "status": msg.status,
+        "created_at": created_at.isoformat() if created_at else None,
+    }
@@ -0,0 +1,529 @@
+# app/services/wa_inbox.py
+"""
+WhatsApp webhook inbox.
+
+The webhook only appends the raw payload to wa_webhook_inbox; a drainer
+thread (woken by the webhook) and a scheduler job claim pending rows in
+batches and apply them with set-based writes:
+  - admins routed by phone_number_id through the wa_tenants cache
+  - contacts / conversations upserted with multi-row INSERT ... ON CONFLICT DO NOTHING
+  - messages and status logs inserted in multi-row statements
+  - status receipts coalesced per wamid and applied with one UPDATE
+  - conversation counters and inbox preview applied once per conversation
+"""
+
+import json
+import random
+import logging
+import datetime
+import threading
+
+from flask import current_app
+from sqlalchemy import (
+    or_, and_, case, func, select, update, insert, bindparam, values, column, Integer, String, Text
+)
+from app.models import (
+    db, WAContact, WAConversation, WAMessage, WAMessageStatusLog, WAWebhookInbox, now, message_preview
+)
+from app.services import wa_events, wa_tenants
+
+logger = logging.getLogger(__name__)
+
+# Status precedence: failed > read > delivered > sent
+STATUS_PRECEDENCE = {"sent": 1, "delivered": 2, "read": 3, "failed": 4}
+MEDIA_TYPES = ("image", "video", "audio", "document", "sticker")
+
+
+def enqueue(payload):
+    """Stores one webhook body; returns the inbox row id."""
+    row = WAWebhookInbox(payload=payload, status="pending", attempts=0, received_at=now())
+    db.session.add(row)
+    db.session.commit()
+    return row.id
+
+
+# =========================================================
+# CLAIM / DRAIN
+# =========================================================
+def claim_batch(limit, stale_seconds):
+    """
+    Marks up to `limit` pending rows (or rows whose claim went stale) as
+    processing and returns them oldest first. SKIP LOCKED keeps concurrent
+    drainers on disjoint rows.
+    """
+    stale_before = now() - datetime.timedelta(seconds=stale_seconds)
+    ids = [r[0] for r in db.session.query(WAWebhookInbox.id).filter(or_(
+        WAWebhookInbox.status == "pending",
+        and_(WAWebhookInbox.status == "processing", WAWebhookInbox.claimed_at < stale_before)
+    )).order_by(WAWebhookInbox.id).limit(limit).with_for_update(skip_locked=True).all()]
+    if not ids:
+        db.session.commit()
+        return []
+
+    WAWebhookInbox.query.filter(WAWebhookInbox.id.in_(ids)).update({
+        "status": "processing",
+        "claimed_at": now(),
+        "attempts": func.coalesce(WAWebhookInbox.attempts, 0) + 1,
+    }, synchronize_session=False)
+    db.session.commit()
+    return WAWebhookInbox.query.filter(WAWebhookInbox.id.in_(ids)).order_by(WAWebhookInbox.id).all()
+
+
+def drain(app):
+    """Processes inbox batches until none are pending. Returns the number of payloads handled."""
+    config = app.config
+    batch_size = config.get("WA_INBOX_BATCH_SIZE", 500)
+    stale_seconds = config.get("WA_INBOX_STALE_SECONDS", 300)
+    handled = 0
+
+    with app.app_context():
+        try:
+            while True:
+                rows = claim_batch(batch_size, stale_seconds)
+                if not rows:
+                    break
+                process_rows(rows, config.get("WA_INBOX_MAX_ATTEMPTS", 5))
+                handled += len(rows)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[wa-inbox] drain failed: {e}")
+        finally:
+            db.session.remove()
+    return handled
+
+
+def drain_inbox_job(app):
+    """APScheduler Job: picks up payloads no web process drained (e.g. after a restart)."""
+    drain(app)
+
+
+def process_rows(rows, max_attempts):
+    """
+    Applies a claimed batch and deletes it in one transaction. If the batch
+    fails, rows are retried one by one so a bad payload cannot hold up the
+    rest; a row failing max_attempts times is parked as 'failed'.
+    """
+    ids = [row.id for row in rows]
+    payloads = [row.payload for row in rows]
+    attempts = {row.id: row.attempts or 0 for row in rows}
+    try:
+        apply_payloads(payloads)
+        WAWebhookInbox.query.filter(WAWebhookInbox.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        return
+    except Exception as e:
+        db.session.rollback()
+        if len(ids) == 1:
+            # Left claimed, it is retried once the claim goes stale (WA_INBOX_STALE_SECONDS)
+            status = "failed" if attempts[ids[0]] >= max_attempts else "processing"
+            WAWebhookInbox.query.filter_by(id=ids[0]).update(
+                {"status": status, "error": str(e)[:2000]}, synchronize_session=False
+            )
+            db.session.commit()
+            logger.error(f"[wa-inbox] payload {ids[0]} failed (attempt {attempts[ids[0]]}): {e}")
+            return
+        logger.warning(f"[wa-inbox] batch of {len(ids)} failed, retrying one by one: {e}")
+
+    for row_id, payload in zip(ids, payloads):
+        process_rows([_Claimed(row_id, payload, attempts[row_id])], max_attempts)
+
+
+class _Claimed:
+    """Plain stand-in for an inbox row after the session was rolled back."""
+
+    def __init__(self, id, payload, attempts):
+        self.id = id
+        self.payload = payload
+        self.attempts = attempts
+
+
+class InboxDrainer:
+    """Per-process drain thread, woken by the webhook after each enqueue."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def notify(self, app):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(app,), name="wa-inbox", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self, app):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            drain(app)
+
+
+drainer = InboxDrainer()
+
+
+# =========================================================
+# APPLY
+# =========================================================
+def extract_content(msg_obj):
+    """(message_text, media_id, media_mime, media_filename) of one inbound message."""
+    msg_type = msg_obj.get("type", "text")
+    message_text = media_id = media_mime = media_filename = None
+
+    if msg_type == "text":
+        message_text = msg_obj.get("text", {}).get("body")
+    elif msg_type in MEDIA_TYPES:
+        media_info     = msg_obj.get(msg_type, {})
+        media_id       = media_info.get("id")
+        media_mime     = media_info.get("mime_type")
+        media_filename = media_info.get("filename")
+        message_text   = media_info.get("caption")
+    elif msg_type == "interactive":
+        interactive = msg_obj.get("interactive", {})
+        itype = interactive.get("type")
+        if itype == "button_reply":
+            message_text = interactive.get("button_reply", {}).get("title")
+        elif itype == "list_reply":
+            message_text = interactive.get("list_reply", {}).get("title")
+    elif msg_type == "location":
+        loc = msg_obj.get("location", {})
+        message_text = f"📍 {loc.get('name', 'Location')}: {loc.get('latitude')},{loc.get('longitude')}"
+
+    return message_text, media_id, media_mime, media_filename
+
+
+def apply_payloads(payloads):
+    """Applies every message and status event of the payloads (no commit)."""
+    changes = []
+    for data in payloads:
+        for entry in (data or {}).get("entry", []):
+            for change in entry.get("changes", []):
+                changes.append(change.get("value", {}))
+
+    # --- Identify admins by phone_number_id (cached routes, one query for misses) ---
+    phone_ids = {v.get("metadata", {}).get("phone_number_id") for v in changes} - {None}
+    admin_by_phone_id = wa_tenants.admin_ids_for_phones(phone_ids) if phone_ids else {}
+
+    inbound, statuses = [], []
+    for val in changes:
+        admin_id = admin_by_phone_id.get(val.get("metadata", {}).get("phone_number_id"))
+        if admin_id:
+            contacts_list = val.get("contacts", [])
+            profile_name = contacts_list[0].get("profile", {}).get("name") if contacts_list else None
+            inbound.extend((admin_id, msg_obj, profile_name) for msg_obj in val.get("messages", []))
+            statuses.extend((admin_id, status_obj) for status_obj in val.get("statuses", []))
+
+    added = apply_inbound(inbound)
+    updated = apply_statuses(statuses)
+    return {"messages": added, "statuses": updated}
+
+
+def _insert_ignore(model):
+    """Multi-row INSERT that skips rows hitting a unique constraint."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(model)
+    return dialect_insert(model).on_conflict_do_nothing()
+
+
+def upsert_contacts(profiles):
+    """
+    profiles: {(admin_id, phone): profile_name}
+    -> {(admin_id, phone): (contact_id, display name)}
+    """
+    def load(keys):
+        admins = {a for a, _ in keys}
+        phones = {p for _, p in keys}
+        rows = db.session.query(
+            WAContact.id, WAContact.admin_id, WAContact.phone_number, WAContact.name, WAContact.profile_name
+        ).filter(WAContact.admin_id.in_(admins), WAContact.phone_number.in_(phones)).all()
+        return {(r.admin_id, r.phone_number): r for r in rows if (r.admin_id, r.phone_number) in keys}
+
+    keys = set(profiles)
+    found = load(keys)
+    missing = keys - set(found)
+    if missing:
+        ts = now()
+        db.session.execute(_insert_ignore(WAContact), [
+            {"admin_id": a, "phone_number": p, "profile_name": profiles[(a, p)], "name": profiles[(a, p)],
+             "created_at": ts, "updated_at": ts}
+            for a, p in sorted(missing)
+        ])
+        found.update(load(missing))
+
+    # Fill in profile names for contacts first seen without one
+    named = [
+        {"id": row.id, "profile_name": profiles[key], "name": profiles[key]}
+        for key, row in found.items() if profiles[key] and not row.profile_name
+    ]
+    if named:
+        db.session.execute(update(WAContact), named)
+    renamed = {n["id"]: n["name"] for n in named}
+    return {
+        key: (row.id, renamed.get(row.id) or row.name or row.profile_name or row.phone_number)
+        for key, row in found.items()
+    }
+
+
+def upsert_conversations(keys):
+    """keys: {(admin_id, contact_id): contact display name} -> {(admin_id, contact_id): conversation_id}"""
+    def load(wanted):
+        rows = db.session.query(WAConversation.id, WAConversation.admin_id, WAConversation.contact_id).filter(
+            WAConversation.contact_id.in_({c for _, c in wanted})
+        ).all()
+        return {(r.admin_id, r.contact_id): r.id for r in rows if (r.admin_id, r.contact_id) in wanted}
+
+    found = load(set(keys))
+    missing = set(keys) - set(found)
+    if missing:
+        ts = now()
+        db.session.execute(_insert_ignore(WAConversation), [
+            {"admin_id": a, "contact_id": c, "status": "open", "unread_count": 0,
+             "contact_display_name": keys[(a, c)], "created_at": ts, "updated_at": ts}
+            for a, c in sorted(missing)
+        ])
+        found.update(load(missing))
+    return found
+
+
+def _newer(col, value):
+    return case((or_(col.is_(None), col < value), value), else_=col)
+
+
+def _if_latest(at_col, at, col, value):
+    """value when `at` is not older than the stored at_col, else the column unchanged."""
+    return case((or_(at_col.is_(None), at_col <= at), value), else_=col)
+
+
+def apply_inbound(inbound):
+    """inbound: [(admin_id, msg_obj, profile_name)] -> number of messages saved."""
+    # Deduplicate per tenant against the DB (one IN query) and inside the batch:
+    # a wamid seen under another admin does not drop this admin's message
+    keys = {(a, m.get("id")) for a, m, _ in inbound if m.get("id")}
+    seen = set()
+    if keys:
+        seen = {(r.admin_id, r.whatsapp_msg_id) for r in db.session.query(
+            WAMessage.admin_id, WAMessage.whatsapp_msg_id
+        ).filter(
+            WAMessage.whatsapp_msg_id.in_({wamid for _, wamid in keys}),
+            WAMessage.admin_id.in_({a for a, _ in keys}),
+        ).all()}
+
+    fresh = []
+    for admin_id, msg_obj, profile_name in inbound:
+        wamid = msg_obj.get("id")
+        if wamid:
+            if (admin_id, wamid) in seen:
+                continue
+            seen.add((admin_id, wamid))
+        fresh.append((admin_id, msg_obj, profile_name))
+    if not fresh:
+        return 0
+
+    profiles = {}
+    for admin_id, msg_obj, profile_name in fresh:
+        key = (admin_id, msg_obj.get("from"))
+        profiles[key] = profiles.get(key) or profile_name
+    contacts = upsert_contacts(profiles)
+    contact_ids = {key: contact_id for key, (contact_id, _) in contacts.items()}
+    display_names = {(a, contact_id): name for (a, _), (contact_id, name) in contacts.items()}
+    conv_ids = upsert_conversations(display_names)
+    names = {conv_ids[key]: name for key, name in display_names.items()}
+
+    rows = []
+    for admin_id, msg_obj, _ in fresh:
+        timestamp_ts = int(msg_obj.get("timestamp", 0))
+        message_text, media_id, media_mime, media_filename = extract_content(msg_obj)
+        rows.append({
+            "conversation_id": conv_ids[(admin_id, contact_ids[(admin_id, msg_obj.get("from"))])],
+            "admin_id":        admin_id,
+            "whatsapp_msg_id": msg_obj.get("id"),
+            "sender_type":     "customer",
+            "message_type":    msg_obj.get("type", "text"),
+            "message_text":    message_text,
+            "media_id":        media_id,
+            "media_mime_type": media_mime,
+            "media_filename":  media_filename,
+            "status":          "received",
+            "created_at":      datetime.datetime.utcfromtimestamp(timestamp_ts) if timestamp_ts else now(),
+        })
+
+    # Rows a concurrent drainer already inserted are skipped and not counted
+    saved = db.session.execute(
+        _insert_ignore(WAMessage).returning(
+            WAMessage.id, WAMessage.admin_id, WAMessage.conversation_id, WAMessage.created_at,
+            WAMessage.sender_type, WAMessage.message_type, WAMessage.message_text, WAMessage.status
+        ), rows
+    ).all()
+    for row in saved:
+        wa_events.emit(row.admin_id, "message", wa_events.message_event(row))
+
+    # --- Conversation counters and inbox row, once per conversation ---
+    per_conv = {}
+    for row in saved:
+        count, latest = per_conv.get(row.conversation_id, (0, row))
+        if (row.created_at, row.id) >= (latest.created_at, latest.id):
+            latest = row
+        per_conv[row.conversation_id] = (count + 1, latest)
+
+    conv = WAConversation.__table__.c
+    at = bindparam("b_latest")
+    db.session.execute(
+        update(WAConversation.__table__).where(conv.id == bindparam("b_id")).values(
+            unread_count=func.coalesce(conv.unread_count, 0) + bindparam("b_count"),
+            last_customer_msg_at=_newer(conv.last_customer_msg_at, at),
+            last_message_id=_if_latest(conv.last_message_at, at, conv.last_message_id, bindparam("b_msg_id")),
+            last_message_preview=_if_latest(conv.last_message_at, at, conv.last_message_preview,
+                                            bindparam("b_preview", type_=String)),
+            last_message_type=_if_latest(conv.last_message_at, at, conv.last_message_type, bindparam("b_type")),
+            last_message_status=_if_latest(conv.last_message_at, at, conv.last_message_status, "received"),
+            last_message_at=_newer(conv.last_message_at, at),
+            contact_display_name=bindparam("b_name", type_=String),
+            status=case((conv.status == "closed", "open"), else_=conv.status),
+            updated_at=now(),
+        ),
+        [{"b_id": conv_id, "b_count": count, "b_latest": latest.created_at, "b_msg_id": latest.id,
+          "b_preview": message_preview(latest.message_text), "b_type": latest.message_type,
+          "b_name": names[conv_id]}
+         for conv_id, (count, latest) in per_conv.items()]
+    )
+    return len(saved)
+
+
+def _precedence(status_col):
+    return case(STATUS_PRECEDENCE, value=status_col, else_=0)
+
+
+def _status_update(rows):
+    """
+    Applies coalesced statuses {id, created_at, status, error_code,
+    error_message} in one statement. A status never overwrites one of higher
+    precedence already stored, so a concurrent drainer cannot move a message
+    backwards.
+    """
+    msgs = WAMessage.__table__
+    if db.session.get_bind().dialect.name == "postgresql":
+        # UPDATE wa_messages ... FROM (VALUES ...) AS v: one round trip for the batch
+        v = values(
+            column("id", Integer), column("status", String), column("error_code", String),
+            column("error_message", Text), name="v",
+        ).data([(r["id"], r["status"], r["error_code"], r["error_message"]) for r in rows])
+        stmt = update(msgs).where(msgs.c.id == v.c.id, _precedence(v.c.status) >= _precedence(msgs.c.status))
+        created = [r.get("created_at") for r in rows]
+        if None not in created:
+            # Constant bounds let the planner skip monthly partitions outside the batch
+            stmt = stmt.where(msgs.c.created_at.between(min(created), max(created)))
+        db.session.execute(
+            stmt.values(
+                status=v.c.status,
+                error_code=func.coalesce(v.c.error_code, msgs.c.error_code),
+                error_message=func.coalesce(v.c.error_message, msgs.c.error_message),
+            )
+        )
+        return
+
+    # SQLite has no column aliases on VALUES in FROM: same statement, executemany
+    db.session.execute(
+        update(msgs)
+        .where(msgs.c.id == bindparam("b_id"),
+               _precedence(bindparam("b_status")) >= _precedence(msgs.c.status))
+        .values(
+            status=bindparam("b_status"),
+            error_code=func.coalesce(bindparam("b_error_code", type_=String), msgs.c.error_code),
+            error_message=func.coalesce(bindparam("b_error_message", type_=Text), msgs.c.error_message),
+        ),
+        [{"b_id": r["id"], "b_status": r["status"], "b_error_code": r["error_code"],
+          "b_error_message": r["error_message"]} for r in rows],
+    )
+
+
+def _raw_payload(status_obj, sample_rate):
+    """Compact JSON of the Meta status object; failures are always kept, the rest sampled."""
+    if status_obj.get("status") != "failed" and (sample_rate <= 0 or random.random() >= sample_rate):
+        return None
+    return json.dumps(status_obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def apply_statuses(statuses):
+    """
+    [(admin_id, status_obj)] delivery receipts in arrival order -> number of
+    status events logged.
+
+    Receipts are coalesced per (admin_id, wamid) down to the highest-precedence
+    one (the latest wins a tie), applied with a single UPDATE, and every
+    distinct event is logged with one bulk INSERT. A wamid only matches
+    messages of the admin whose phone number the receipt came in on.
+    """
+    statuses = [(a, s) for a, s in statuses if s.get("id") and s.get("status")]
+    if not statuses:
+        return 0
+
+    known = {
+        (r.admin_id, r.whatsapp_msg_id): r for r in db.session.query(
+            WAMessage.whatsapp_msg_id, WAMessage.id, WAMessage.admin_id, WAMessage.conversation_id,
+            WAMessage.status, WAMessage.created_at
+        ).filter(
+            WAMessage.admin_id.in_({a for a, _ in statuses}),
+            WAMessage.whatsapp_msg_id.in_({s["id"] for _, s in statuses}),
+        ).all()
+    }
+    sample_rate = current_app.config.get("WA_STATUS_RAW_SAMPLE_RATE", 1.0)
+
+    winners, logs, seen = {}, [], set()
+    for admin_id, status_obj in statuses:
+        key, status = (admin_id, status_obj["id"]), status_obj["status"]
+        if key not in known:
+            continue
+        timestamp = status_obj.get("timestamp")
+        ts = datetime.datetime.utcfromtimestamp(int(timestamp)) if timestamp else now()
+
+        rank = (STATUS_PRECEDENCE.get(status, 0), ts)
+        if key not in winners or rank >= winners[key][0]:
+            winners[key] = (rank, status_obj)
+
+        # Meta redelivers receipts; the same event is logged once
+        if (key, status, ts) in seen:
+            continue
+        seen.add((key, status, ts))
+        logs.append({
+            "message_id":  known[key].id,
+            "status":      status,
+            "timestamp":   ts,
+            "raw_payload": _raw_payload(status_obj, sample_rate),
+        })
+
+    rows = []
+    for key, (_, status_obj) in winners.items():
+        error_code = error_message = None
+        if status_obj["status"] == "failed":
+            error_data = (status_obj.get("errors") or [{}])[0]
+            error_code = str(error_data.get("code", ""))
+            error_message = error_data.get("message", "")
+        msg = known[key]
+        rows.append({"id": msg.id, "created_at": msg.created_at, "status": status_obj["status"],
+                     "error_code": error_code, "error_message": error_message})
+
+        if STATUS_PRECEDENCE.get(status_obj["status"], 0) >= STATUS_PRECEDENCE.get(msg.status, 0):
+            wa_events.emit(msg.admin_id, "status", {
+                "conversation_id": msg.conversation_id, "message_id": msg.id,
+                "status": status_obj["status"], "error_code": error_code,
+            })
+
+    if rows:
+        _status_update(rows)
+        # Inbox rows showing one of these messages pick up its new status
+        convs = WAConversation.__table__
+        db.session.execute(
+            update(convs).where(convs.c.last_message_id.in_([r["id"] for r in rows])).values(
+                last_message_status=select(WAMessage.status).where(
+                    WAMessage.id == convs.c.last_message_id
+                ).scalar_subquery()
+            )
+        )
+    if logs:
+        db.session.execute(insert(WAMessageStatusLog), logs)
+    return len(logs)
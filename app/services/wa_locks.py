@@ -0,0 +1,177 @@
+# app/services/wa_locks.py
+"""
+WhatsApp conversation locks (one agent replies to a conversation at a time).
+
+Taking, renewing and taking over an expired lock is one statement:
+  INSERT ... ON CONFLICT (conversation_id) DO UPDATE ...
+  WHERE <same holder> OR wa_conversation_locks.expires_at < now
+so two agents racing for a conversation cannot both win. The holder's
+table is stored in holder_type ('user' or 'admin'), so its name is one
+join away. Expired locks are ignored by every read and deleted by a
+scheduler job; taking, releasing and expiry are published as "lock" events.
+"""
+
+import logging
+import datetime
+
+from flask import current_app
+from sqlalchemy import and_, or_, case, delete
+from app.models import db, Admin, User, WAConversation, WAConversationLock, now
+from app.services import wa_events
+
+logger = logging.getLogger(__name__)
+
+HOLDER_TYPES = ("user", "admin")
+SWEEP_BATCH_SIZE = 500
+
+
+def _upsert():
+    if db.session.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    return dialect_insert(WAConversationLock)
+
+
+def _holder_name(holder_id, holder_type):
+    model = Admin if holder_type == "admin" else User
+    return db.session.query(model.name).filter(model.id == holder_id).scalar()
+
+
+def _lock_event(admin_id, conversation_id, action, lock=None):
+    wa_events.emit(admin_id, "lock", dict({
+        "conversation_id": conversation_id,
+        "action": action,   # taken / released / expired
+        "holder_id": None, "holder_type": None, "name": None, "expires_at": None,
+    }, **(lock or {})))
+
+
+# =========================================================
+# ACQUIRE / RELEASE
+# =========================================================
+def acquire(admin_id, conversation_id, holder_id, holder_type, ttl_seconds=None):
+    """
+    Takes the lock, or renews it if the holder already has it (no commit).
+    Returns (True, lock) on success, else (False, lock of the current holder).
+    """
+    if holder_type not in HOLDER_TYPES:
+        raise ValueError(f"Unknown lock holder type '{holder_type}'")
+    ttl_seconds = ttl_seconds or current_app.config.get("WA_LOCK_TTL_SECONDS", 900)
+    ts = now()
+    expires_at = ts + datetime.timedelta(seconds=ttl_seconds)
+
+    table = WAConversationLock.__table__
+    stmt = _upsert().values(
+        conversation_id=conversation_id, agent_id=holder_id, holder_type=holder_type,
+        locked_at=ts, expires_at=expires_at,
+    )
+    same_holder = and_(table.c.agent_id == stmt.excluded.agent_id,
+                       table.c.holder_type == stmt.excluded.holder_type)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.conversation_id],
+        set_={
+            "agent_id": stmt.excluded.agent_id,
+            "holder_type": stmt.excluded.holder_type,
+            "locked_at": case((same_holder, table.c.locked_at), else_=stmt.excluded.locked_at),
+            "expires_at": stmt.excluded.expires_at,
+        },
+        where=or_(same_holder, table.c.expires_at < stmt.excluded.locked_at),
+    ).returning(table.c.locked_at)
+
+    row = db.session.execute(stmt).first()
+    if row is None:
+        return False, active_locks(admin_id, [conversation_id]).get(conversation_id)
+
+    lock = {"holder_id": holder_id, "holder_type": holder_type,
+            "name": None, "expires_at": expires_at.isoformat()}
+    if row.locked_at == ts:   # newly taken rather than renewed
+        lock["name"] = _holder_name(holder_id, holder_type)
+        _lock_event(admin_id, conversation_id, "taken", lock)
+    return True, lock
+
+
+def release(admin_id, conversation_id, holder_id, holder_type):
+    """Drops the lock if this holder has it (no commit). Returns True if released."""
+    released = WAConversationLock.query.filter_by(
+        conversation_id=conversation_id, agent_id=holder_id, holder_type=holder_type
+    ).delete(synchronize_session=False)
+    if released:
+        _lock_event(admin_id, conversation_id, "released")
+    return bool(released)
+
+
+# =========================================================
+# BULK STATE (inbox pages)
+# =========================================================
+def active_locks(admin_id, conversation_ids):
+    """
+    {conversation_id: {"holder_id", "holder_type", "name", "expires_at"}} for
+    the unexpired locks among the admin's conversations, in one query.
+    """
+    if not conversation_ids:
+        return {}
+    lock = WAConversationLock
+    rows = db.session.query(
+        lock.conversation_id, lock.agent_id, lock.holder_type, lock.expires_at,
+        db.func.coalesce(User.name, Admin.name)
+    ).join(WAConversation, WAConversation.id == lock.conversation_id).outerjoin(
+        User, and_(lock.holder_type == "user", User.id == lock.agent_id)
+    ).outerjoin(
+        Admin, and_(lock.holder_type == "admin", Admin.id == lock.agent_id)
+    ).filter(
+        WAConversation.admin_id == admin_id,
+        lock.conversation_id.in_(conversation_ids),
+        or_(lock.expires_at.is_(None), lock.expires_at >= now()),
+    ).all()
+    return {
+        conv_id: {
+            "holder_id": holder_id,
+            "holder_type": holder_type,
+            "name": name,
+            "expires_at": expires_at.isoformat() if expires_at else None,
+        }
+        for conv_id, holder_id, holder_type, expires_at, name in rows
+    }
+
+
+# =========================================================
+# SWEEPER
+# =========================================================
+def sweep_expired(limit=SWEEP_BATCH_SIZE):
+    """Deletes up to `limit` expired locks and publishes them as expired. Returns the count."""
+    ts = now()
+    owners = dict(db.session.query(WAConversationLock.id, WAConversation.admin_id).join(
+        WAConversation, WAConversation.id == WAConversationLock.conversation_id
+    ).filter(WAConversationLock.expires_at < ts).order_by(WAConversationLock.id).limit(limit).all())
+    if not owners:
+        return 0
+
+    # Re-checks expiry, so a lock renewed since the SELECT survives
+    deleted = db.session.execute(
+        delete(WAConversationLock)
+        .where(WAConversationLock.id.in_(list(owners)), WAConversationLock.expires_at < ts)
+        .returning(WAConversationLock.id, WAConversationLock.conversation_id)
+    ).all()
+    for lock_id, conversation_id in deleted:
+        _lock_event(owners[lock_id], conversation_id, "expired")
+    db.session.commit()
+    return len(owners)
+
+
+def sweep_expired_locks_job(app):
+    """APScheduler Job: deletes expired conversation locks."""
+    with app.app_context():
+        swept = 0
+        try:
+            while True:
+                n = sweep_expired()
+                swept += n
+                if n < SWEEP_BATCH_SIZE:
+                    break
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[wa-locks] sweep failed: {e}")
+        finally:
+            db.session.remove()
+        if swept:
+            logger.info(f"[wa-locks] swept {swept} expired locks")
@@ -0,0 +1,294 @@
+# app/services/wa_media.py
+"""
+WhatsApp media proxy.
+
+Inbound attachments arrive as Meta media ids, which only the tenant's token
+can fetch (and which expire after ~30 days). The first view of one downloads
+it once, through a pooled HTTP session, into object storage (Wasabi) under a
+content-addressed key, wa-media/<sha256[:2]>/<sha256><ext>, so identical
+files are stored once. Images also get a JPEG thumbnail, rendered in a
+process pool so Pillow does not compete with request threads for the GIL.
+
+Views get presigned URLs, cached per key for most of their lifetime. A
+scheduler job warms media of recent messages in open conversations, so
+agents rarely wait for the first download.
+"""
+
+import io
+import logging
+import datetime
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+from sqlalchemy import and_
+from sqlalchemy.exc import IntegrityError
+from app.models import db, WAConversation, WAMedia, WAMessage, now
+from app.services import wa_tenants
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif")
+
+_lock = threading.Lock()
+_storage = None
+_session = None
+_thumbnailer = None
+_prefetcher = None
+_urls = None
+_failed = None
+_downloads = {}   # (admin_id, media_id) -> [lock, threads using it], so one process downloads a file once
+
+
+class MediaUnavailable(Exception):
+    """Media cannot be fetched right now (storage or WhatsApp not configured)."""
+
+
+# =========================================================
+# SHARED CLIENTS (created on first use)
+# =========================================================
+def _storage_client():
+    config = current_app.config
+    if not (config.get("WASABI_ACCESS_KEY") and config.get("WASABI_SECRET_KEY") and config.get("WASABI_BUCKET_NAME")):
+        raise MediaUnavailable("Media storage is not configured")
+    global _storage
+    with _lock:
+        if _storage is None:
+            import boto3
+            _storage = boto3.client(
+                "s3",
+                endpoint_url=config.get("WASABI_ENDPOINT_URL"),
+                aws_access_key_id=config["WASABI_ACCESS_KEY"],
+                aws_secret_access_key=config["WASABI_SECRET_KEY"],
+                region_name=config.get("WASABI_REGION", "us-east-1"),
+            )
+        return _storage
+
+
+def _http():
+    """Pooled session for media downloads (keeps connections to the CDN open)."""
+    global _session
+    with _lock:
+        if _session is None:
+            pool_size = current_app.config.get("WA_MEDIA_HTTP_POOL_SIZE", 10)
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def _get_thumbnailer():
+    global _thumbnailer
+    with _lock:
+        if _thumbnailer is None:
+            # spawn: forking a process that runs request and scheduler threads is unsafe
+            _thumbnailer = ProcessPoolExecutor(
+                max_workers=current_app.config.get("WA_MEDIA_THUMBNAIL_PROCESSES", 2),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _thumbnailer
+
+
+def _caches():
+    global _urls, _failed
+    with _lock:
+        if _urls is None:
+            _urls = TTLCache(maxsize=current_app.config.get("WA_MEDIA_URL_CACHE_MAX_ENTRIES", 10000))
+            _failed = TTLCache(maxsize=10000, ttl=3600)
+        return _urls, _failed
+
+
+# =========================================================
+# THUMBNAILS (run in the process pool)
+# =========================================================
+def render_thumbnail(data, max_side):
+    """JPEG bytes of an image scaled to fit max_side x max_side."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.thumbnail((max_side, max_side))
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=80)
+        return out.getvalue()
+
+
+def _thumbnail(data):
+    size = current_app.config.get("WA_MEDIA_THUMBNAIL_SIZE", 320)
+    try:
+        return _get_thumbnailer().submit(render_thumbnail, data, size).result(timeout=30)
+    except Exception as e:
+        logger.warning(f"[wa-media] thumbnail failed: {e}")
+        return None
+
+
+# =========================================================
+# DOWNLOAD + STORE
+# =========================================================
+def object_key(digest, mime_type):
+    ext = mimetypes.guess_extension(mime_type or "") or ""
+    return f"wa-media/{digest[:2]}/{digest}{ext}"
+
+
+def _store(admin_id, media_id, fallback_mime):
+    tenant = wa_tenants.get(admin_id)
+    if not tenant:
+        raise MediaUnavailable("WhatsApp not connected")
+    storage = _storage_client()
+    bucket = current_app.config["WASABI_BUCKET_NAME"]
+
+    info = tenant.client.get_media(media_id)
+    mime_type = (info.get("mime_type") or fallback_mime or "application/octet-stream").split(";")[0].strip()
+    spool, digest, size = tenant.client.download_media(
+        info["url"], session=_http(), max_bytes=current_app.config.get("WA_MEDIA_MAX_BYTES"))
+
+    with spool:
+        stored = db.session.query(WAMedia.object_key, WAMedia.thumbnail_key).filter_by(sha256=digest).first()
+        if stored:
+            key, thumbnail_key = stored   # same file already stored (another message or tenant)
+        else:
+            key, thumbnail_key = object_key(digest, mime_type), None
+            storage.upload_fileobj(spool, bucket, key, ExtraArgs={"ContentType": mime_type})
+            if mime_type in THUMBNAIL_TYPES:
+                spool.seek(0)
+                thumb = _thumbnail(spool.read())
+                if thumb:
+                    thumbnail_key = f"wa-media/thumbs/{digest[:2]}/{digest}.jpg"
+                    storage.put_object(Bucket=bucket, Key=thumbnail_key, Body=thumb, ContentType="image/jpeg")
+
+    row = WAMedia(admin_id=admin_id, media_id=media_id, sha256=digest, object_key=key,
+                  thumbnail_key=thumbnail_key, mime_type=mime_type, size_bytes=size)
+    try:
+        db.session.add(row)
+        db.session.commit()
+        return row
+    except IntegrityError:
+        db.session.rollback()   # another process stored it first
+        return WAMedia.query.filter_by(admin_id=admin_id, media_id=media_id).one()
+
+
+def media_for_message(msg):
+    """The stored WAMedia of a message, downloading it on first access."""
+    row = WAMedia.query.filter_by(admin_id=msg.admin_id, media_id=msg.media_id).first()
+    if row:
+        return row
+
+    key = (msg.admin_id, msg.media_id)
+    with _lock:
+        entry = _downloads.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            row = WAMedia.query.filter_by(admin_id=msg.admin_id, media_id=msg.media_id).first()
+            return row or _store(msg.admin_id, msg.media_id, msg.media_mime_type)
+    finally:
+        # The entry lives while any thread still holds or waits on its lock
+        with _lock:
+            entry[1] -= 1
+            if not entry[1]:
+                _downloads.pop(key, None)
+
+
+# =========================================================
+# PRESIGNED URLS
+# =========================================================
+def presigned_url(key):
+    """GET URL for a stored object, reused until shortly before it expires."""
+    urls, _ = _caches()
+    url = urls.get(key)
+    if url:
+        return url
+    expires_in = current_app.config.get("WA_MEDIA_URL_TTL_SECONDS", 3600)
+    url = _storage_client().generate_presigned_url(
+        "get_object", Params={"Bucket": current_app.config["WASABI_BUCKET_NAME"], "Key": key}, ExpiresIn=expires_in
+    )
+    urls.set(key, url, ttl=expires_in * 0.8)
+    return url
+
+
+def media_payload(row):
+    return {
+        "url": presigned_url(row.object_key),
+        "thumbnail_url": presigned_url(row.thumbnail_key) if row.thumbnail_key else None,
+        "mime_type": row.mime_type,
+        "size_bytes": row.size_bytes,
+    }
+
+
+# =========================================================
+# PREFETCH
+# =========================================================
+def pending_prefetch(limit, hours):
+    """Ids of recent inbound media messages in open conversations not stored yet."""
+    since = now() - datetime.timedelta(hours=hours)
+    rows = db.session.query(WAMessage.id, WAMessage.admin_id, WAMessage.media_id).join(
+        WAConversation, WAConversation.id == WAMessage.conversation_id
+    ).outerjoin(
+        WAMedia, and_(WAMedia.admin_id == WAMessage.admin_id, WAMedia.media_id == WAMessage.media_id)
+    ).filter(
+        WAConversation.status == "open",
+        WAMessage.sender_type == "customer",
+        WAMessage.media_id.isnot(None),
+        WAMessage.created_at >= since,
+        WAMedia.id.is_(None),
+    ).order_by(WAMessage.id.desc()).limit(limit).all()
+    _, failed = _caches()
+    return [msg_id for msg_id, admin_id, media_id in rows if (admin_id, media_id) not in failed]
+
+
+def _prefetch_one(app, msg_id):
+    with app.app_context():
+        key = None
+        try:
+            msg = db.session.get(WAMessage, msg_id)
+            key = (msg.admin_id, msg.media_id)
+            media_for_message(msg)
+            return True
+        except Exception as e:
+            db.session.rollback()
+            if key:
+                _caches()[1].set(key, True)   # skip it for an hour
+            logger.warning(f"[wa-media] prefetch of message {msg_id} failed: {e}")
+            return False
+        finally:
+            db.session.remove()
+
+
+def _get_prefetcher(app):
+    global _prefetcher
+    with _lock:
+        if _prefetcher is None:
+            _prefetcher = ThreadPoolExecutor(
+                max_workers=app.config.get("WA_MEDIA_PREFETCH_WORKERS", 4),
+                thread_name_prefix="wa-media"
+            )
+        return _prefetcher
+
+
+def prefetch(app):
+    """Downloads one batch of not-yet-stored media. Returns the number stored."""
+    with app.app_context():
+        try:
+            _storage_client()
+        except MediaUnavailable:
+            return 0
+        msg_ids = pending_prefetch(app.config.get("WA_MEDIA_PREFETCH_BATCH", 50),
+                                   app.config.get("WA_MEDIA_PREFETCH_HOURS", 24))
+        db.session.remove()
+
+    pool = _get_prefetcher(app)
+    return sum(pool.map(lambda msg_id: _prefetch_one(app, msg_id), msg_ids))
+
+
+def prefetch_media_job(app):
+    """APScheduler Job: warms media of open conversations."""
+    stored = prefetch(app)
+    if stored:
+        logger.info(f"[wa-media] prefetched {stored} attachments")
@@ -0,0 +1,205 @@
+# app/services/wa_outbox.py
+"""
+WhatsApp outbox.
+
+Writers stage events (e.g. "lead_assigned") as wa_outbox rows in their own
+transaction, so an event exists exactly when the change that caused it was
+committed. Delivery happens off the request: a dispatcher thread (woken
+when such a transaction commits) and a scheduler job (retries, and events
+left by a restart) claim due rows, run the event's handler and delete it.
+
+A failing event is retried with exponential backoff
+(WA_OUTBOX_RETRY_SECONDS, doubled per attempt) and parked as 'failed'
+after WA_OUTBOX_MAX_ATTEMPTS. Delivery is at-least-once.
+"""
+
+import logging
+import datetime
+import threading
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, or_, and_, func, insert
+from sqlalchemy.orm import Session
+from app.models import db, Lead, User, WALeadAssignConfig, WAOutboxEvent, now
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEY = "wa_outbox_wake"
+
+
+class RetryLater(Exception):
+    """Raised by a handler that completed part of an event; payload is what is left to do."""
+
+    def __init__(self, payload, message):
+        super().__init__(message)
+        self.payload = payload
+
+
+# =========================================================
+# STAGING (inside the writer's transaction)
+# =========================================================
+def enqueue_lead_assignments(admin_id, assignments):
+    """
+    assignments: [(lead_id, agent_id)]. Stages one lead_assigned event per
+    assigned lead when auto-WhatsApp is enabled for the admin (no commit).
+    Returns the number staged.
+    """
+    assignments = [(lead_id, agent_id) for lead_id, agent_id in assignments if agent_id]
+    if not assignments:
+        return 0
+    enabled = db.session.query(WALeadAssignConfig.id).filter_by(admin_id=admin_id, is_enabled=True).first()
+    if not enabled:
+        return 0
+
+    ts = now()
+    db.session.execute(insert(WAOutboxEvent), [
+        {"admin_id": admin_id, "event_type": "lead_assigned", "status": "pending", "attempts": 0,
+         "payload": {"lead_id": lead_id, "agent_id": agent_id, "targets": ["agent", "lead"]},
+         "next_attempt_at": ts, "created_at": ts}
+        for lead_id, agent_id in assignments
+    ])
+    db.session.info[SESSION_KEY] = True
+    return len(assignments)
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session):
+    if session.info.pop(SESSION_KEY, None) and has_app_context():
+        dispatcher.notify(current_app._get_current_object())
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_after_rollback(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(SESSION_KEY, None)
+
+
+# =========================================================
+# HANDLERS
+# =========================================================
+def deliver_lead_assigned(admin_id, payload):
+    """Sends the assignment templates; a side that failed is retried on its own."""
+    from app.routes.whatsapp import send_lead_assignment_whatsapp
+
+    lead = db.session.get(Lead, payload["lead_id"])
+    if not lead or lead.assigned_to != payload["agent_id"]:
+        return   # deleted or reassigned since; a newer assignment has its own event
+    agent = db.session.get(User, payload["agent_id"])
+
+    results = send_lead_assignment_whatsapp(admin_id, lead, agent, targets=payload.get("targets"))
+    failed = {side: r.get("detail") for side, r in (results or {}).items() if r.get("status") == "error"}
+    if failed:
+        raise RetryLater(dict(payload, targets=sorted(failed)),
+                         "; ".join(f"{side}: {detail}" for side, detail in sorted(failed.items())))
+
+
+HANDLERS = {
+    "lead_assigned": deliver_lead_assigned,
+}
+
+
+# =========================================================
+# CLAIM / DRAIN
+# =========================================================
+def claim_batch(limit, stale_seconds):
+    """
+    Marks up to `limit` due rows (or rows whose claim went stale) as
+    processing and returns them as (id, admin_id, event_type, payload, attempts).
+    """
+    ts = now()
+    stale_before = ts - datetime.timedelta(seconds=stale_seconds)
+    ids = [r[0] for r in db.session.query(WAOutboxEvent.id).filter(or_(
+        and_(WAOutboxEvent.status == "pending", WAOutboxEvent.next_attempt_at <= ts),
+        and_(WAOutboxEvent.status == "processing", WAOutboxEvent.claimed_at < stale_before)
+    )).order_by(WAOutboxEvent.id).limit(limit).with_for_update(skip_locked=True).all()]
+    if not ids:
+        db.session.commit()
+        return []
+
+    WAOutboxEvent.query.filter(WAOutboxEvent.id.in_(ids)).update({
+        "status": "processing",
+        "claimed_at": ts,
+        "attempts": func.coalesce(WAOutboxEvent.attempts, 0) + 1,
+    }, synchronize_session=False)
+    db.session.commit()
+    return db.session.query(
+        WAOutboxEvent.id, WAOutboxEvent.admin_id, WAOutboxEvent.event_type,
+        WAOutboxEvent.payload, WAOutboxEvent.attempts
+    ).filter(WAOutboxEvent.id.in_(ids)).order_by(WAOutboxEvent.id).all()
+
+
+def process_row(row, max_attempts, retry_seconds):
+    """Runs one claimed event; deletes it when done, else schedules the retry."""
+    try:
+        HANDLERS[row.event_type](row.admin_id, row.payload)
+        WAOutboxEvent.query.filter_by(id=row.id).delete(synchronize_session=False)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        payload = e.payload if isinstance(e, RetryLater) else row.payload
+        parked = row.attempts >= max_attempts
+        WAOutboxEvent.query.filter_by(id=row.id).update({
+            "status": "failed" if parked else "pending",
+            "payload": payload,
+            "error": str(e)[:2000],
+            "next_attempt_at": now() + datetime.timedelta(seconds=retry_seconds * 2 ** (row.attempts - 1)),
+        }, synchronize_session=False)
+        db.session.commit()
+        log = logger.error if parked else logger.warning
+        log(f"[wa-outbox] {row.event_type} {row.id} failed (attempt {row.attempts}): {e}")
+        return False
+
+
+def drain(app):
+    """Delivers due events until none are left. Returns the number delivered."""
+    config = app.config
+    batch_size = config.get("WA_OUTBOX_BATCH_SIZE", 100)
+    stale_seconds = config.get("WA_OUTBOX_STALE_SECONDS", 300)
+    max_attempts = config.get("WA_OUTBOX_MAX_ATTEMPTS", 6)
+    retry_seconds = config.get("WA_OUTBOX_RETRY_SECONDS", 30)
+    delivered = 0
+
+    with app.app_context():
+        try:
+            while True:
+                rows = claim_batch(batch_size, stale_seconds)
+                if not rows:
+                    break
+                delivered += sum(process_row(row, max_attempts, retry_seconds) for row in rows)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[wa-outbox] drain failed: {e}")
+        finally:
+            db.session.remove()
+    return delivered
+
+
+def drain_outbox_job(app):
+    """APScheduler Job: retries due events and picks up ones no process delivered."""
+    drain(app)
+
+
+class OutboxDispatcher:
+    """Per-process delivery thread, woken after a transaction that staged events commits."""
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def notify(self, app):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, args=(app,), name="wa-outbox", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self, app):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            drain(app)
+
+
+dispatcher = OutboxDispatcher()
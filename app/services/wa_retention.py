@@ -0,0 +1,164 @@
+# app/services/wa_retention.py
+"""
+WhatsApp message storage upkeep.
+
+On PostgreSQL wa_messages (created_at) and wa_message_status_logs (timestamp)
+are range partitioned by month (migration b7e2d4c9f1a3), so timeline pages,
+which are bounded by created_at, only touch the recent partitions. This job:
+  - creates the partitions of the coming months ahead of time
+  - compacts the status logs of read/failed messages into
+    wa_messages.status_timestamps ({status: first seen}) and deletes them
+  - summarizes and then drops (or, with WA_STATUS_LOG_ARCHIVE, detaches)
+    status-log partitions older than WA_STATUS_LOG_RETENTION_DAYS
+
+Elsewhere (SQLite) the tables are plain and old logs are deleted in chunks.
+"""
+
+import logging
+import datetime
+
+from sqlalchemy import text, update, delete, bindparam, func
+from app.models import db, WAMessage, WAMessageStatusLog, now
+from app.utils import partitions
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("read", "failed")
+PARTITIONED_TABLES = ("wa_messages", "wa_message_status_logs")
+PRUNE_CHUNK = 5000
+
+
+# =========================================================
+# PARTITIONS (PostgreSQL only)
+# =========================================================
+def ensure_partitions(months_ahead):
+    """Creates missing partitions from this month to months_ahead. Returns the number created."""
+    return sum(partitions.ensure_monthly_partitions(db.session, table, months_ahead, now())
+               for table in PARTITIONED_TABLES)
+
+
+# =========================================================
+# STATUS LOG COMPACTION
+# =========================================================
+def compact_status_logs(before, terminal_only=True, limit=1000):
+    """
+    Folds the status logs older than `before` of up to `limit` messages into
+    wa_messages.status_timestamps and deletes them. With terminal_only, only
+    messages that are read or failed. Returns the number of messages summarized.
+    """
+    log = WAMessageStatusLog
+    q = db.session.query(log.message_id).filter(log.timestamp < before)
+    if terminal_only:
+        q = q.join(WAMessage, WAMessage.id == log.message_id).filter(WAMessage.status.in_(TERMINAL_STATUSES))
+    msg_ids = [r[0] for r in q.distinct().limit(limit).all()]
+    if not msg_ids:
+        return 0
+
+    firsts, max_log_id = {}, 0
+    for msg_id, status, first_at, last_id in db.session.query(
+        log.message_id, log.status, func.min(log.timestamp), func.max(log.id)
+    ).filter(log.message_id.in_(msg_ids), log.timestamp < before).group_by(log.message_id, log.status):
+        firsts.setdefault(msg_id, {})[status] = first_at.isoformat()
+        max_log_id = max(max_log_id, last_id)
+
+    rows = []
+    for msg_id, created_at, summary in db.session.query(
+        WAMessage.id, WAMessage.created_at, WAMessage.status_timestamps
+    ).filter(WAMessage.id.in_(msg_ids)):
+        merged = dict(summary or {})
+        for status, first_at in firsts.get(msg_id, {}).items():
+            # A receipt logged after an earlier compaction never moves "first seen" forward
+            if status not in merged or first_at < merged[status]:
+                merged[status] = first_at
+        rows.append({"b_id": msg_id, "b_created_at": created_at, "b_summary": merged})
+
+    if rows:
+        msgs = WAMessage.__table__
+        stmt = update(msgs).where(msgs.c.id == bindparam("b_id"))
+        if partitions.is_partitioned(db.session, "wa_messages"):
+            stmt = stmt.where(msgs.c.created_at == bindparam("b_created_at"))   # one partition per row
+        db.session.execute(stmt.values(status_timestamps=bindparam("b_summary")), rows)
+
+    # Logs of these messages inserted since the aggregate have a higher id and stay
+    db.session.execute(delete(log).where(
+        log.message_id.in_(msg_ids), log.timestamp < before, log.id <= max_log_id
+    ))
+    db.session.commit()
+    return len(msg_ids)
+
+
+def compact_all(before, terminal_only=True, batch_size=1000):
+    compacted = 0
+    while True:
+        n = compact_status_logs(before, terminal_only=terminal_only, limit=batch_size)
+        compacted += n
+        if n < batch_size:
+            return compacted
+
+
+# =========================================================
+# RETENTION
+# =========================================================
+def prune_status_logs(horizon, archive=False, batch_size=1000):
+    """
+    Summarizes every status log older than horizon, then removes them: whole
+    monthly partitions on PostgreSQL (dropped, or detached when archiving),
+    chunked DELETEs elsewhere. Returns (messages summarized, partitions or rows removed).
+    """
+    summarized = compact_all(horizon, terminal_only=False, batch_size=batch_size)
+
+    table = WAMessageStatusLog.__tablename__
+    if partitions.is_partitioned(db.session, table):
+        removed = 0
+        for start, name in sorted(partitions.monthly_partitions(db.session, table).items()):
+            if partitions.month_start(start, 1) > horizon:
+                break
+            if archive:
+                db.session.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            else:
+                db.session.execute(text(f"DROP TABLE {name}"))
+            db.session.commit()
+            removed += 1
+            logger.info(f"[wa-retention] {'detached' if archive else 'dropped'} {name}")
+        return summarized, removed
+
+    # Rows summarized above are gone; this catches logs of deleted messages
+    log = WAMessageStatusLog
+    removed = 0
+    while True:
+        ids = [r[0] for r in db.session.query(log.id).filter(log.timestamp < horizon).limit(PRUNE_CHUNK).all()]
+        if not ids:
+            break
+        log.query.filter(log.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        removed += len(ids)
+    return summarized, removed
+
+
+def maintain_wa_storage_job(app):
+    """APScheduler Job: partitions ahead, status-log compaction and retention."""
+    with app.app_context():
+        try:
+            config = app.config
+            ts = now()
+            batch_size = config.get("WA_STATUS_COMPACT_BATCH", 1000)
+            created = ensure_partitions(config.get("WA_PARTITION_MONTHS_AHEAD", 3))
+            compacted = compact_all(
+                ts - datetime.timedelta(minutes=config.get("WA_STATUS_COMPACT_AFTER_MINUTES", 60)),
+                batch_size=batch_size,
+            )
+            summarized, removed = prune_status_logs(
+                ts - datetime.timedelta(days=config.get("WA_STATUS_LOG_RETENTION_DAYS", 90)),
+                archive=config.get("WA_STATUS_LOG_ARCHIVE", False),
+                batch_size=batch_size,
+            )
+            if created or compacted or summarized or removed:
+                logger.info(
+                    f"[wa-retention] {created} partitions created, {compacted + summarized} messages "
+                    f"summarized, {removed} old status-log partitions/rows removed"
+                )
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"[wa-retention] maintenance failed: {e}")
+        finally:
+            db.session.remove()
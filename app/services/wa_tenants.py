@@ -0,0 +1,115 @@
+# app/services/wa_tenants.py
+"""
+WhatsApp tenant routing cache.
+
+Webhook routing and outbound sends need, per tenant, the admin behind a
+phone_number_id, a BrandmoService built from the decrypted token and the
+synced templates. They are kept in process memory and dropped by
+invalidate() whenever the config or the templates change; the TTL bounds
+how long another worker can keep serving an entry it did not invalidate.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+
+from flask import current_app
+from app.models import db, WhatsAppConfig, WATemplate
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Detached snapshot of a WATemplate row: the send paths only read these fields
+TemplateInfo = namedtuple("TemplateInfo", "id name language status body_text header_type")
+
+_NOT_CONNECTED = object()   # cached miss, so unconfigured admins cost no query either
+_MISSING = object()
+
+_tenants = None   # admin_id -> Tenant | _NOT_CONNECTED
+_phones = None    # phone_number_id -> admin_id | _NOT_CONNECTED
+_cache_lock = threading.Lock()
+
+
+class Tenant:
+    """An active, complete WhatsApp config with its ready-to-use client."""
+
+    def __init__(self, admin_id, phone_number_id, client, templates):
+        self.admin_id = admin_id
+        self.phone_number_id = phone_number_id
+        self.client = client
+        self.templates = templates   # name -> TemplateInfo
+
+    def template(self, name):
+        return self.templates.get(name)
+
+
+def _caches():
+    global _tenants, _phones
+    with _cache_lock:
+        if _tenants is None:
+            config = current_app.config
+            size = config.get("WA_TENANT_CACHE_MAX_ENTRIES", 10000)
+            ttl = config.get("WA_TENANT_CACHE_TTL_SECONDS", 600)
+            _tenants = TTLCache(maxsize=size, ttl=ttl)
+            _phones = TTLCache(maxsize=size, ttl=ttl)
+        return _tenants, _phones
+
+
+def _load(admin_id):
+    from app.services.whatsapp_service import BrandmoService
+
+    cfg = WhatsAppConfig.query.filter_by(admin_id=admin_id, is_active=True).first()
+    if not cfg:
+        return _NOT_CONNECTED
+    try:
+        client = BrandmoService(cfg)
+    except ValueError:
+        return _NOT_CONNECTED   # incomplete config; callers explain it from the row
+
+    templates = {}
+    for t in WATemplate.query.filter_by(admin_id=admin_id).order_by(WATemplate.id).all():
+        templates.setdefault(t.name, TemplateInfo(t.id, t.name, t.language, t.status, t.body_text, t.header_type))
+    return Tenant(admin_id, cfg.phone_number_id, client, templates)
+
+
+def get(admin_id):
+    """Tenant for an admin with an active, complete config, else None."""
+    tenants, _ = _caches()
+    tenant = tenants.get(admin_id, _MISSING)
+    if tenant is _MISSING:
+        tenant = _load(admin_id)
+        tenants.set(admin_id, tenant)
+    return None if tenant is _NOT_CONNECTED else tenant
+
+
+def admin_ids_for_phones(phone_number_ids):
+    """{phone_number_id: admin_id} for active configs; one query for the memory misses."""
+    _, phones = _caches()
+    routes, missing = {}, []
+    for phone_id in phone_number_ids:
+        admin_id = phones.get(phone_id, _MISSING)
+        if admin_id is _MISSING:
+            missing.append(phone_id)
+        elif admin_id is not _NOT_CONNECTED:
+            routes[phone_id] = admin_id
+
+    if missing:
+        found = dict(db.session.query(WhatsAppConfig.phone_number_id, WhatsAppConfig.admin_id).filter(
+            WhatsAppConfig.phone_number_id.in_(missing),
+            WhatsAppConfig.is_active == True
+        ).all())
+        for phone_id in missing:
+            phones.set(phone_id, found.get(phone_id, _NOT_CONNECTED))
+        routes.update(found)
+    return routes
+
+
+def invalidate(admin_id, *phone_number_ids):
+    """Drops an admin's cached tenant and the given phone_number_id routes (old and new)."""
+    tenants, phones = _caches()
+    tenant = tenants.pop(admin_id)
+    if isinstance(tenant, Tenant):
+        phones.pop(tenant.phone_number_id)
+    for phone_id in phone_number_ids:
+        if phone_id:
+            phones.pop(phone_id)
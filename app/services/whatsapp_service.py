@@ -5,10 +5,15 @@ Base URL: https://crmpi.brandmo.in/api/meta
 Version:  v19.0
 """
 
-import requests
 import re
+import json
+import hashlib
+import tempfile
+import requests
 from datetime import datetime
 from flask import current_app
+from app.models import db, Admin, WhatsAppConfig
+from app.services.sync_orchestrator import register_provider, run_provider
 
 
 class BrandmoService:
@@ -16,10 +21,11 @@ class BrandmoService:
 
     def __init__(self, config):
         """
-        config: WhatsAppConfig model instance.
+        config: WhatsAppConfig model instance. Only plain values are kept, so
+        the service can outlive the session (see wa_tenants).
         Resolves base_url and version from Flask app config.
         """
-        self.config = config
+        self.admin_id = config.admin_id
         try:
             base_url = current_app.config.get("BRANDMO_BASE_URL", "https://crmpi.brandmo.in/api/meta")
             version  = current_app.config.get("BRANDMO_API_VERSION", "v19.0")
@@ -244,24 +250,117 @@ class BrandmoService:
         r.raise_for_status()
         return self._json_or_raise(r, "send_media")
 
+    # ------------------------------------------------------------------
+    # INBOUND MEDIA (download by Meta media ID)
+    # ------------------------------------------------------------------
+    def get_media(self, media_id: str) -> dict:
+        """Media metadata: {"url", "mime_type", "sha256", "file_size"}. The url needs our token."""
+        r = self._request("GET", media_id, headers=self._headers(), timeout=20)
+        r.raise_for_status()
+        return self._json_or_raise(r, "get_media")
+
+    def download_media(self, url: str, session=None, max_bytes: int = None):
+        """
+        Streams a media URL from get_media() into a spooled temp file.
+        Returns (file rewound to 0, sha256 hex digest, size in bytes).
+        """
+        r = (session or requests).get(url, headers={"Authorization": f"Bearer {self.token}"},
+                                      stream=True, timeout=60)
+        with r:
+            r.raise_for_status()
+            digest = hashlib.sha256()
+            size = 0
+            spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                size += len(chunk)
+                if max_bytes and size > max_bytes:
+                    spool.close()
+                    raise ValueError(f"Media is larger than {max_bytes} bytes")
+                digest.update(chunk)
+                spool.write(chunk)
+        spool.seek(0)
+        return spool, digest.hexdigest(), size
+
     # ------------------------------------------------------------------
     # SYNC TEMPLATES FROM BRANDMO → DB
     # ------------------------------------------------------------------
-    def sync_templates(self) -> int:
+    def sync_templates(self) -> dict:
         """
-        Fetch all approved templates from Brandmo, upsert into wa_templates.
-        Returns count of templates synced.
+        Fetch all templates from Brandmo and apply the difference to wa_templates:
+        rows are compared on a content hash, only new/changed ones are written
+        (in bulk) and templates no longer listed upstream are deleted.
+        The listing is requested with If-None-Match; a 304 means nothing changed.
+        Returns {"synced", "added", "updated", "deleted", "not_modified"}.
         """
-        from app.models import db, WATemplate
+        from sqlalchemy import insert, update
+        from app.models import WATemplate
+
+        existing = {
+            (t.name, t.language): t
+            for t in db.session.query(WATemplate.id, WATemplate.name, WATemplate.language, WATemplate.content_hash)
+                               .filter_by(admin_id=self.admin_id)
+        }
+        etag = db.session.query(WhatsAppConfig.templates_etag).filter_by(admin_id=self.admin_id).scalar()
+
+        templates_data, new_etag = self._fetch_templates(etag)
+        now = datetime.utcnow()
+        if templates_data is None:
+            WhatsAppConfig.query.filter_by(admin_id=self.admin_id).update(
+                {"templates_synced_at": now}, synchronize_session=False)
+            db.session.commit()
+            return {"synced": len(existing), "added": 0, "updated": 0, "deleted": 0, "not_modified": True}
+
+        upstream = {}
+        for t in templates_data:
+            row = self._template_row(t)
+            if row:
+                upstream[(row["name"], row["language"])] = row
+
+        inserts, updates = [], []
+        for key, row in upstream.items():
+            current = existing.get(key)
+            if current is None:
+                inserts.append(dict(row, admin_id=self.admin_id, created_at=now, synced_at=now))
+            elif current.content_hash != row["content_hash"]:
+                updates.append(dict(row, id=current.id, synced_at=now))
+        removed = [t.id for key, t in existing.items() if key not in upstream]
+
+        if inserts:
+            db.session.execute(insert(WATemplate), inserts)
+        if updates:
+            db.session.execute(update(WATemplate), updates)
+        if removed:
+            WATemplate.query.filter(WATemplate.id.in_(removed)).delete(synchronize_session=False)
+        WhatsAppConfig.query.filter_by(admin_id=self.admin_id).update(
+            {"templates_etag": new_etag, "templates_synced_at": now}, synchronize_session=False)
+        db.session.commit()
 
+        if inserts or updates or removed:
+            from app.services import wa_tenants
+            wa_tenants.invalidate(self.admin_id)
+        return {"synced": len(upstream), "added": len(inserts), "updated": len(updates),
+                "deleted": len(removed), "not_modified": False}
+
+    def _fetch_templates(self, etag=None):
+        """
+        All pages of message_templates. Returns (templates, etag), or
+        (None, etag) when Brandmo answers the conditional request with 304.
+        Only a single-page listing keeps its ETag: it then covers every template.
+        """
         url = f"{self.base}/{self.waba_id}/message_templates"
         params = {"limit": 200}
+        headers = self._headers()
+        if etag:
+            headers["If-None-Match"] = etag
         templates_data = []
-        count = 0
+        first_etag = None
+        pages = 0
 
         # Paginate through all templates
         while url:
-            r = self._request("GET", url, headers=self._headers(), params=params, timeout=30)
+            r = self._request("GET", url, headers=headers, params=params, timeout=30)
+            if r.status_code == 304 and pages == 0:
+                return None, etag
 
             # Log raw response for debugging if it's not JSON
             if not r.content:
@@ -299,73 +398,57 @@ class BrandmoService:
                     response=r,
                 )
 
+            if pages == 0:
+                first_etag = r.headers.get("ETag")
+            pages += 1
             templates_data.extend(data.get("data", []))
             paging = data.get("paging", {})
             next_url = paging.get("next")
             # Stop if next page url is same (avoid infinite loop) or absent
             url = next_url if next_url and next_url != url else None
             params = {}  # next URL already includes params
+            headers = self._headers()
 
-        for t in templates_data:
-            name       = t.get("name")
-            language   = t.get("language", "en")
-            category   = t.get("category")
-            status     = t.get("status", "APPROVED")
-            template_id = t.get("id")
-            components  = t.get("components", [])
-
-            if not name:
-                continue
-
-            # Parse body text and variable count
-            body_text      = None
-            variable_count = 0
-            header_type    = None
-
-            for comp in components:
-                comp_type = comp.get("type", "").upper()
-                if comp_type == "BODY":
-                    body_text = comp.get("text", "")
-                    variable_count = len(re.findall(r"\{\{\d+\}\}", body_text or ""))
-                elif comp_type == "HEADER":
-                    header_type = comp.get("format", "TEXT").upper()
-
-            # Upsert (admin_id + name + language must be unique)
-            existing = WATemplate.query.filter_by(
-                admin_id=self.config.admin_id,
-                name=name,
-                language=language,
-            ).first()
-
-            now = datetime.utcnow()
-            if existing:
-                existing.template_id    = template_id
-                existing.category       = category
-                existing.status         = status
-                existing.components     = components
-                existing.header_type    = header_type
-                existing.body_text      = body_text
-                existing.variable_count = variable_count
-                existing.synced_at      = now
-            else:
-                tmpl = WATemplate(
-                    admin_id       = self.config.admin_id,
-                    template_id    = template_id,
-                    name           = name,
-                    language       = language,
-                    category       = category,
-                    status         = status,
-                    components     = components,
-                    header_type    = header_type,
-                    body_text      = body_text,
-                    variable_count = variable_count,
-                    synced_at      = now,
-                )
-                db.session.add(tmpl)
-            count += 1
+        return templates_data, (first_etag if pages == 1 else None)
 
-        db.session.commit()
-        return count
+    @staticmethod
+    def _template_row(t: dict):
+        """wa_templates column values for one Meta template, or None without a name."""
+        name = t.get("name")
+        if not name:
+            return None
+        components = t.get("components", [])
+
+        # Parse body text and variable count
+        body_text      = None
+        variable_count = 0
+        header_type    = None
+
+        for comp in components:
+            comp_type = comp.get("type", "").upper()
+            if comp_type == "BODY":
+                body_text = comp.get("text", "")
+                variable_count = len(re.findall(r"\{\{\d+\}\}", body_text or ""))
+            elif comp_type == "HEADER":
+                header_type = comp.get("format", "TEXT").upper()
+
+        row = {
+            "template_id":    t.get("id"),
+            "name":           name,
+            "language":       t.get("language", "en"),
+            "category":       t.get("category"),
+            "status":         t.get("status", "APPROVED"),
+            "components":     components,
+            "header_type":    header_type,
+            "body_text":      body_text,
+            "variable_count": variable_count,
+        }
+        canonical = json.dumps(
+            [row["template_id"], row["category"], row["status"], components],
+            sort_keys=True, separators=(",", ":"), default=str,
+        )
+        row["content_hash"] = hashlib.sha256(canonical.encode()).hexdigest()
+        return row
 
     # ------------------------------------------------------------------
     # CREATE TEMPLATE VIA BRANDMO API
@@ -401,24 +484,40 @@ class BrandmoService:
 # ------------------------------------------------------------------
 # GLOBAL SCHEDULED SYNC TASK
 # ------------------------------------------------------------------
+def sync_admin_templates(admin_id):
+    """Orchestrator sync for one admin (see sync_orchestrator.register_provider)."""
+    # SaaS: skip expired admins — don't waste API calls on lapsed subscriptions
+    admin = db.session.get(Admin, admin_id)
+    if not admin or admin.is_expired():
+        return {"status": "skipped", "message": "Subscription expired"}
+    cfg = WhatsAppConfig.query.filter_by(admin_id=admin_id, is_active=True).first()
+    if not cfg:
+        return {"status": "skipped", "message": "WhatsApp not connected"}
+    try:
+        svc = BrandmoService(cfg)
+    except ValueError as e:
+        return {"status": "skipped", "message": str(e)}
+
+    stats = svc.sync_templates()
+    if not stats["not_modified"]:
+        current_app.logger.info(
+            f"[WA Sync] Admin {admin_id}: {stats['synced']} templates "
+            f"(+{stats['added']} ~{stats['updated']} -{stats['deleted']})"
+        )
+    return {"status": "success", "added": stats["added"]}
+
+
 def sync_all_wa_templates(app):
     """
-    APScheduler job: sync templates for every admin that has WhatsApp configured.
-    Called from app/__init__.py on a schedule.
+    APScheduler job: sync templates for every admin that has WhatsApp configured,
+    fanned out to the shared sync pool (at most SYNC_PROVIDER_CONCURRENCY at once).
     """
-    with app.app_context():
-        from app.models import WhatsAppConfig, Admin
-        configs = WhatsAppConfig.query.filter_by(is_active=True).all()
-        for cfg in configs:
-            try:
-                # SaaS: skip expired admins — don't waste API calls on lapsed subscriptions
-                admin = Admin.query.get(cfg.admin_id)
-                if not admin or not admin.is_active or admin.is_expired():
-                    continue
-                svc = BrandmoService(cfg)
-                if not svc.token or not svc.waba_id:
-                    continue
-                n = svc.sync_templates()
-                print(f"[WA Sync] Admin {cfg.admin_id}: synced {n} templates")
-            except Exception as e:
-                print(f"[WA Sync] Admin {cfg.admin_id} error: {e}")
+    run_provider(app, "wa_templates")
+
+
+register_provider(
+    "wa_templates",
+    settings_model=WhatsAppConfig,
+    enabled_column=(WhatsAppConfig.is_active == True),
+    sync=sync_admin_templates
+)
@@ -0,0 +1,66 @@
+import re
+import logging
+import datetime
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+def month_start(day, offset=0):
+    """First instant of the month of `day`, shifted by `offset` months."""
+    month = day.year * 12 + day.month - 1 + offset
+    return datetime.datetime(month // 12, month % 12 + 1, 1)
+
+
+def is_partitioned(session, table):
+    """True for a declaratively partitioned PostgreSQL table."""
+    if session.get_bind().dialect.name != "postgresql":
+        return False
+    return session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :t"
+    ), {"t": table}).first() is not None
+
+
+def monthly_partitions(session, table):
+    """{month start: partition name} of the table's attached <table>_pYYYYMM partitions."""
+    names = session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :t"
+    ), {"t": table}).scalars()
+    pattern = re.compile(rf"^{table}_p(\d{{4}})(\d{{2}})$")
+    found = {}
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            found[datetime.datetime(int(match.group(1)), int(match.group(2)), 1)] = name
+    return found
+
+
+def ensure_monthly_partitions(session, table, months_ahead, today):
+    """
+    Creates the missing partitions of `table` from today's month to
+    months_ahead months later (commits each). Returns the number created.
+    """
+    if not is_partitioned(session, table):
+        return 0
+    existing = monthly_partitions(session, table)
+    created = 0
+    for offset in range(months_ahead + 1):
+        start = month_start(today, offset)
+        if start in existing:
+            continue
+        end = month_start(start, 1)
+        name = f"{table}_p{start:%Y%m}"
+        try:
+            session.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            ))
+            session.commit()
+            created += 1
+        except Exception as e:
+            # e.g. rows of that month already sit in the DEFAULT partition
+            session.rollback()
+            logger.warning(f"[partitions] could not create {name}: {e}")
+    return created
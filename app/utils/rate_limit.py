@@ -0,0 +1,62 @@
+import time
+import threading
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: holds up to `capacity` tokens and refills at
+    `rate` tokens per second.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        current = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (current - self.updated) * self.rate)
+        self.updated = current
+
+    def try_acquire(self, reserve=0):
+        """
+        Takes a token if one is available right now. reserve leaves that many
+        tokens for higher-priority callers (background backfills pass 1).
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= 1 + reserve:
+                self.tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        """Blocks until a token is available, then takes it."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def drain(self):
+        """Empties the bucket, e.g. after the remote side reported a rate-limit hit."""
+        with self.lock:
+            self.tokens = 0
+            self.updated = time.monotonic()
+
+
+def get_bucket(key, rate, capacity=1):
+    """Process-wide bucket per key (e.g. one per API credential)."""
+    with _buckets_lock:
+        bucket = _buckets.get(key)
+        if bucket is None or bucket.rate != rate or bucket.capacity != capacity:
+            bucket = _buckets[key] = TokenBucket(rate, capacity)
+        return bucket
@@ -15,6 +15,19 @@ def _get_fernet_key():
     key = hashlib.sha256(secret.encode()).digest()
     return base64.urlsafe_b64encode(key)
 
+_fernets = {}
+
+def _get_fernet():
+    """
+    Fernet for the current SECRET_KEY, built once per key so every
+    encrypt/decrypt skips the key derivation.
+    """
+    secret = current_app.config.get('SECRET_KEY', 'default-dev-secret-key-change-in-prod')
+    f = _fernets.get(secret)
+    if f is None:
+        f = _fernets[secret] = Fernet(_get_fernet_key())
+    return f
+
 def encrypt_value(value):
     """
     Encrypts a string value. Returns the encrypted hash string.
@@ -22,7 +35,7 @@ def encrypt_value(value):
     if not value:
         return None
     try:
-        f = Fernet(_get_fernet_key())
+        f = _get_fernet()
         return f.encrypt(value.encode()).decode()
     except Exception as e:
         current_app.logger.error(f"Encryption failed: {e}")
@@ -35,7 +48,7 @@ def decrypt_value(token):
     if not token:
         return None
     try:
-        f = Fernet(_get_fernet_key())
+        f = _get_fernet()
         return f.decrypt(token.encode()).decode()
     except Exception as e:
         current_app.logger.error(f"Decryption failed: {e}")
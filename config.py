@@ -9,9 +9,11 @@ class Config:
     SQLALCHEMY_DATABASE_URI = _base_db_url
     
     # Connection Pooling for High Concurrency (100k users ready)
+    # Per gunicorn worker: 32 request threads (render.yaml) + 10 scheduler threads
+    # + the sync / campaign / media / hook pools (~22) + the LISTEN and drainer threads
     SQLALCHEMY_ENGINE_OPTIONS = {
         "pool_size": 20,
-        "max_overflow": 40,
+        "max_overflow": 50,
         "pool_recycle": 1800,
         "pool_pre_ping": True,
     }
@@ -28,6 +30,11 @@ class Config:
     FACEBOOK_VERIFY_TOKEN = os.environ.get("FACEBOOK_VERIFY_TOKEN", "nxtcall_fb_webhook_2026")
     FACEBOOK_APP_ID = os.environ.get("FACEBOOK_APP_ID", "1537220340728257")
     FACEBOOK_APP_SECRET = os.environ.get("FACEBOOK_APP_SECRET", "774f3a44a2590515de08680001d7bbaf")
+    FB_LEAD_BATCH_WINDOW_MS   = int(os.environ.get("FB_LEAD_BATCH_WINDOW_MS", 500))     # webhook leads wait this long to share a Graph batch call
+    FB_FORM_CACHE_TTL_HOURS   = int(os.environ.get("FB_FORM_CACHE_TTL_HOURS", 24))      # re-fetch a form name after this
+    FB_FORM_CACHE_MAX_ENTRIES = int(os.environ.get("FB_FORM_CACHE_MAX_ENTRIES", 5000))  # in-memory form names per process
+    FB_RECONCILE_LOOKBACK_HOURS  = int(os.environ.get("FB_RECONCILE_LOOKBACK_HOURS", 72))   # first reconcile of a form looks back this far
+    FB_RECONCILE_OVERLAP_MINUTES = int(os.environ.get("FB_RECONCILE_OVERLAP_MINUTES", 15))  # re-read before the high-water mark
 
 
 
@@ -41,5 +48,74 @@ class Config:
     BRANDMO_BASE_URL       = os.environ.get("BRANDMO_BASE_URL",       "https://crmpi.brandmo.in/api/meta")
     BRANDMO_API_VERSION    = os.environ.get("BRANDMO_API_VERSION",    "v19.0")
     WA_WEBHOOK_VERIFY_TOKEN = os.environ.get("WA_WEBHOOK_VERIFY_TOKEN", "nxtcall_wa_webhook_2026")
+    WA_INBOX_BATCH_SIZE     = int(os.environ.get("WA_INBOX_BATCH_SIZE", 500))     # webhook payloads processed per transaction
+    WA_INBOX_MAX_ATTEMPTS   = int(os.environ.get("WA_INBOX_MAX_ATTEMPTS", 5))     # a payload failing this often is parked as 'failed'
+    WA_INBOX_STALE_SECONDS  = int(os.environ.get("WA_INBOX_STALE_SECONDS", 300))  # claimed rows older than this are retried
+    WA_STATUS_RAW_SAMPLE_RATE = float(os.environ.get("WA_STATUS_RAW_SAMPLE_RATE", 1.0))  # share of non-failed receipts whose raw JSON is kept
+    WA_TENANT_CACHE_TTL_SECONDS = int(os.environ.get("WA_TENANT_CACHE_TTL_SECONDS", 600))     # phone_number_id routes / clients held in memory
+    WA_TENANT_CACHE_MAX_ENTRIES = int(os.environ.get("WA_TENANT_CACHE_MAX_ENTRIES", 10000))
+    WA_EVENTS_PG_NOTIFY     = os.environ.get("WA_EVENTS_PG_NOTIFY", "true").lower() == "true"   # fan inbox events out to every worker via LISTEN/NOTIFY
+    WA_EVENTS_KEEPALIVE_SECONDS = int(os.environ.get("WA_EVENTS_KEEPALIVE_SECONDS", 15))
+    WA_EVENTS_STREAM_SECONDS    = int(os.environ.get("WA_EVENTS_STREAM_SECONDS", 300))    # streams reconnect (with Last-Event-ID) after this
+    WA_EVENTS_QUEUE_SIZE        = int(os.environ.get("WA_EVENTS_QUEUE_SIZE", 1000))      # per stream; overflow sends "resync"
+    WA_EVENTS_MAX_STREAMS       = int(os.environ.get("WA_EVENTS_MAX_STREAMS", 16))       # open streams per worker (each holds a thread); more get 503
+    WA_OUTBOX_BATCH_SIZE        = int(os.environ.get("WA_OUTBOX_BATCH_SIZE", 100))        # outbox events claimed per round
+    WA_OUTBOX_MAX_ATTEMPTS      = int(os.environ.get("WA_OUTBOX_MAX_ATTEMPTS", 6))        # then parked as 'failed'
+    WA_OUTBOX_RETRY_SECONDS     = int(os.environ.get("WA_OUTBOX_RETRY_SECONDS", 30))      # first retry delay, doubled per attempt
+    WA_OUTBOX_STALE_SECONDS     = int(os.environ.get("WA_OUTBOX_STALE_SECONDS", 300))     # claimed events older than this are retried
+    WA_CAMPAIGN_RATE_PER_SECOND = float(os.environ.get("WA_CAMPAIGN_RATE_PER_SECOND", 20))   # broadcast sends per second per WABA
+    WA_CAMPAIGN_BURST           = int(os.environ.get("WA_CAMPAIGN_BURST", 20))
+    WA_CAMPAIGN_WORKERS         = int(os.environ.get("WA_CAMPAIGN_WORKERS", 8))            # concurrent send calls per process
+    WA_CAMPAIGN_BATCH_SIZE      = int(os.environ.get("WA_CAMPAIGN_BATCH_SIZE", 200))       # recipients sent between progress commits
+    WA_CAMPAIGN_MAX_RETRIES     = int(os.environ.get("WA_CAMPAIGN_MAX_RETRIES", 5))        # retries of a throttled send
+    WA_CAMPAIGN_RETRY_BACKOFF_SECONDS = float(os.environ.get("WA_CAMPAIGN_RETRY_BACKOFF_SECONDS", 2))  # doubled per retry
+    WA_CAMPAIGN_STALE_SECONDS   = int(os.environ.get("WA_CAMPAIGN_STALE_SECONDS", 300))    # a run without progress this long is resumed elsewhere
+    WA_CAMPAIGN_MAX_RECIPIENTS  = int(os.environ.get("WA_CAMPAIGN_MAX_RECIPIENTS", 100000))
+    WA_LOCK_TTL_SECONDS         = int(os.environ.get("WA_LOCK_TTL_SECONDS", 900))          # conversation reply lock lifetime; renewed by the holder
+    WA_MEDIA_URL_TTL_SECONDS    = int(os.environ.get("WA_MEDIA_URL_TTL_SECONDS", 3600))    # presigned media URL lifetime (cached for 80% of it)
+    WA_MEDIA_MAX_BYTES          = int(os.environ.get("WA_MEDIA_MAX_BYTES", 100 * 1024 * 1024))
+    WA_MEDIA_HTTP_POOL_SIZE     = int(os.environ.get("WA_MEDIA_HTTP_POOL_SIZE", 10))       # kept-alive connections for media downloads
+    WA_MEDIA_THUMBNAIL_SIZE     = int(os.environ.get("WA_MEDIA_THUMBNAIL_SIZE", 320))      # longest side, px
+    WA_MEDIA_THUMBNAIL_PROCESSES = int(os.environ.get("WA_MEDIA_THUMBNAIL_PROCESSES", 2))
+    WA_MEDIA_PREFETCH_HOURS     = int(os.environ.get("WA_MEDIA_PREFETCH_HOURS", 24))       # warm media of messages this recent
+    WA_MEDIA_PREFETCH_BATCH     = int(os.environ.get("WA_MEDIA_PREFETCH_BATCH", 50))
+    WA_MEDIA_PREFETCH_WORKERS   = int(os.environ.get("WA_MEDIA_PREFETCH_WORKERS", 4))
+    WA_MESSAGES_HOT_DAYS        = int(os.environ.get("WA_MESSAGES_HOT_DAYS", 30))          # newest timeline page looks only this far back first
+    WA_MESSAGES_DELTA_OVERLAP_SECONDS = int(os.environ.get("WA_MESSAGES_DELTA_OVERLAP_SECONDS", 30))  # ?after= deltas re-read ids this recent (late commits)
+    WA_STATUS_COMPACT_AFTER_MINUTES = int(os.environ.get("WA_STATUS_COMPACT_AFTER_MINUTES", 60))  # read/failed messages' logs are folded after this
+    WA_STATUS_COMPACT_BATCH     = int(os.environ.get("WA_STATUS_COMPACT_BATCH", 1000))     # messages summarized per commit
+    WA_STATUS_LOG_RETENTION_DAYS = int(os.environ.get("WA_STATUS_LOG_RETENTION_DAYS", 90))   # older status logs are summarized and dropped
+    WA_STATUS_LOG_ARCHIVE       = os.environ.get("WA_STATUS_LOG_ARCHIVE", "false").lower() == "true"  # detach old partitions instead of dropping them
+    WA_PARTITION_MONTHS_AHEAD   = int(os.environ.get("WA_PARTITION_MONTHS_AHEAD", 3))      # monthly partitions created ahead of time (PostgreSQL)
 
+    # Call History Partitions / Archive
+    CALL_HISTORY_PARTITION_MONTHS_AHEAD = int(os.environ.get("CALL_HISTORY_PARTITION_MONTHS_AHEAD", 3))  # monthly partitions created ahead (PostgreSQL)
+    CALL_HISTORY_ARCHIVE_AFTER_MONTHS   = int(os.environ.get("CALL_HISTORY_ARCHIVE_AFTER_MONTHS", 0))    # older months go to object storage + summaries; 0 = keep all
 
+    # Lead Portal Sync Orchestrator
+    SYNC_MAX_WORKERS          = int(os.environ.get("SYNC_MAX_WORKERS", 8))           # shared thread pool size
+    SYNC_PROVIDER_CONCURRENCY = int(os.environ.get("SYNC_PROVIDER_CONCURRENCY", 4))  # max tenants per provider at once
+    SYNC_STALE_AFTER_MINUTES  = int(os.environ.get("SYNC_STALE_AFTER_MINUTES", 30))  # in-flight flag older than this is ignored
+
+    # Background Scheduler (single leader via the scheduler_leases row)
+    SCHEDULER_IN_WEB        = os.environ.get("SCHEDULER_IN_WEB", "true").lower() == "true"  # web workers compete for the lease
+    SCHEDULER_LEASE_SECONDS = int(os.environ.get("SCHEDULER_LEASE_SECONDS", 60))           # leader renews every third of this
+
+    # IndiaMART Pull API
+    INDIAMART_WINDOW_HOURS          = int(os.environ.get("INDIAMART_WINDOW_HOURS", 168))           # widest start/end range per call (API max 7 days)
+    INDIAMART_MAX_RESULTS_PER_CALL  = int(os.environ.get("INDIAMART_MAX_RESULTS_PER_CALL", 500))   # a window returning this many rows is split
+    INDIAMART_CALL_INTERVAL_SECONDS = int(os.environ.get("INDIAMART_CALL_INTERVAL_SECONDS", 300))  # token refill: one call per key per interval
+    INDIAMART_CALL_BURST            = int(os.environ.get("INDIAMART_CALL_BURST", 2))               # calls a key may make back to back
+    INDIAMART_INITIAL_LOOKBACK_HOURS = int(os.environ.get("INDIAMART_INITIAL_LOOKBACK_HOURS", 24)) # first sync without a checkpoint
+    INDIAMART_BACKFILL_MAX_DAYS     = int(os.environ.get("INDIAMART_BACKFILL_MAX_DAYS", 365))      # IndiaMART keeps a year of enquiries
+
+    # Email Portal IMAP (Magicbricks, 99acres, JustDial, Housing)
+    IMAP_BATCH_SIZE               = int(os.environ.get("IMAP_BATCH_SIZE", 100))                # mails per UID FETCH / ingest commit
+    IMAP_INITIAL_LOOKBACK_DAYS    = int(os.environ.get("IMAP_INITIAL_LOOKBACK_DAYS", 1))       # first scan without a checkpoint (no last sync)
+    IMAP_POOL_NOOP_AFTER_SECONDS  = int(os.environ.get("IMAP_POOL_NOOP_AFTER_SECONDS", 60))    # health-check pooled connections idle longer than this
+    IMAP_POOL_MAX_IDLE_SECONDS    = int(os.environ.get("IMAP_POOL_MAX_IDLE_SECONDS", 1500))    # drop pooled connections idle longer than this
+    IMAP_IDLE_ENABLED             = os.environ.get("IMAP_IDLE_ENABLED", "true").lower() == "true"  # push new mail via IMAP IDLE
+    IMAP_IDLE_TIMEOUT_SECONDS     = int(os.environ.get("IMAP_IDLE_TIMEOUT_SECONDS", 300))      # re-issue IDLE at least this often
+    IMAP_IDLE_MAX_WATCHERS        = int(os.environ.get("IMAP_IDLE_MAX_WATCHERS", 50))          # IDLE threads/connections per leader; other mailboxes are polled
+    IMAP_IDLE_STARTS_PER_RUN      = int(os.environ.get("IMAP_IDLE_STARTS_PER_RUN", 10))        # new watcher logins per 5-minute refresh
+    PROCESSED_EMAIL_RETENTION_DAYS = int(os.environ.get("PROCESSED_EMAIL_RETENTION_DAYS", 90))  # processed_emails rows older than this are pruned daily
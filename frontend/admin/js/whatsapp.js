@@ -12,6 +12,9 @@ class WhatsAppManager {
         this.templates = [];
         this.config = null;
         this.pollInterval = null;
+        this._streamAbort = null;    // AbortController of the open event stream
+        this._lastEventId = null;    // resume point (Last-Event-ID)
+        this._mediaUrls = {};        // message id -> { data, at } from /messages/<id>/media
     }
 
     /* ─────────────────────────────────────────
@@ -68,7 +71,14 @@ class WhatsAppManager {
     }
 
     _startPolling() {
+        // Live updates come from the SSE stream; polling only runs while it is down.
         this._stopPolling();
+        this._streamWanted = true;
+        this._openStream();
+    }
+
+    _startFallbackPolling() {
+        if (this.pollInterval) return;
         this.pollInterval = setInterval(() => {
             // Silently refresh inbox list if no active conversation, 
             // or refresh active conversation specifically to avoid jumping UI.
@@ -77,16 +87,102 @@ class WhatsAppManager {
             } else {
                 this.loadInbox(true); // true = silent
             }
-        }, 10000); // 10 seconds
+        }, 30000); // 30 seconds, only while the event stream is unavailable
     }
 
     _stopPolling() {
+        this._streamWanted = false;
+        if (this._streamAbort) {
+            this._streamAbort.abort();
+            this._streamAbort = null;
+        }
+        clearTimeout(this._streamRetry);
         if (this.pollInterval) {
             clearInterval(this.pollInterval);
             this.pollInterval = null;
         }
     }
 
+    /* ─────────────────────────────────────────
+       LIVE EVENTS (SSE over fetch, so the JWT header is sent)
+    ───────────────────────────────────────── */
+    async _openStream() {
+        if (!this._streamWanted || this._streamAbort) return;
+        const controller = new AbortController();
+        this._streamAbort = controller;
+        const headers = { 'Accept': 'text/event-stream' };
+        if (this._lastEventId) headers['Last-Event-ID'] = this._lastEventId;
+
+        try {
+            const res = await auth.makeAuthenticatedRequest('/api/whatsapp/events', {
+                method: 'GET', headers, signal: controller.signal,
+            });
+            if (!res || !res.ok || !res.body) throw new Error('event stream unavailable');
+            if (this.pollInterval) {
+                clearInterval(this.pollInterval);
+                this.pollInterval = null;
+                this._refreshFromEvent({ type: 'resync' });   // catch up on what polling missed
+            }
+
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            for (;;) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                let sep;
+                while ((sep = buffer.indexOf('\n\n')) >= 0) {
+                    this._handleStreamChunk(buffer.slice(0, sep));
+                    buffer = buffer.slice(sep + 2);
+                }
+            }
+            this._streamFailures = 0;
+        } catch (e) {
+            if (controller.signal.aborted) return;
+            this._streamFailures = (this._streamFailures || 0) + 1;
+            this._startFallbackPolling();
+        } finally {
+            if (this._streamAbort === controller) this._streamAbort = null;
+        }
+
+        if (this._streamWanted) {
+            // Streams end on purpose every few minutes; back off only on failures
+            const delay = Math.min(30000, 1000 * Math.pow(2, this._streamFailures || 0));
+            this._streamRetry = setTimeout(() => this._openStream(), delay);
+        }
+    }
+
+    _handleStreamChunk(chunk) {
+        const evt = { type: 'message', data: '' };
+        chunk.split('\n').forEach(line => {
+            if (line.startsWith(':')) return;   // keepalive
+            const idx = line.indexOf(':');
+            const field = idx < 0 ? line : line.slice(0, idx);
+            const value = idx < 0 ? '' : line.slice(idx + 1).replace(/^ /, '');
+            if (field === 'id') evt.id = value;
+            else if (field === 'event') evt.type = value;
+            else if (field === 'data') evt.data += value;
+        });
+        if (!evt.data) return;
+        if (evt.id) this._lastEventId = evt.id;
+        try { evt.data = JSON.parse(evt.data); } catch (e) { return; }
+        this._refreshFromEvent(evt);
+    }
+
+    _refreshFromEvent(evt) {
+        const convId = evt.data ? evt.data.conversation_id : null;
+        if (evt.type === 'status' && convId === this.activeConvId && this._applyStatusEvent(evt.data)) {
+            return;   // receipts only touch the open chat
+        }
+        if (this.activeConvId && (evt.type === 'resync' || convId === this.activeConvId)) {
+            this._silentlyRefreshActiveConversation();
+        }
+        // Coalesce bursts into one silent inbox refresh
+        clearTimeout(this._inboxRefreshTimer);
+        this._inboxRefreshTimer = setTimeout(() => this.loadInbox(true), 500);
+    }
+
     /* ─────────────────────────────────────────
        SETTINGS TAB
     ───────────────────────────────────────── */
@@ -523,6 +619,11 @@ class WhatsAppManager {
         const sendBtn = document.getElementById('waChatSendBtn');
         if (sendBtn) sendBtn.addEventListener('click', () => this._sendChatMessage());
 
+        const chatMessages = document.getElementById('waChatMessages');
+        if (chatMessages) chatMessages.addEventListener('scroll', () => {
+            if (chatMessages.scrollTop < 40) this._loadOlderMessages();
+        });
+
         const msgInput = document.getElementById('waChatMsgInput');
         if (msgInput) {
             msgInput.addEventListener('keydown', (e) => {
@@ -616,12 +717,14 @@ class WhatsAppManager {
         if (emptyState) emptyState.classList.add('hidden');
 
         try {
-            const res = await this._api('GET', `/api/whatsapp/conversations/${convId}/messages?per_page=100`);
+            const res = await this._api('GET', `/api/whatsapp/conversations/${convId}/messages?limit=50`);
             const data = await res.json();
 
             const conv = data.conversation || {};
             const contact = conv.contact || {};
             const msgs = data.messages || [];
+            this._messages = msgs;
+            this._cursors = data.cursors || {};
 
             // Set header
             const headerName = document.getElementById('waChatContactName');
@@ -647,10 +750,17 @@ class WhatsAppManager {
     async _silentlyRefreshActiveConversation() {
         if (!this.activeConvId) return;
         try {
-            const res = await this._api('GET', `/api/whatsapp/conversations/${this.activeConvId}/messages?per_page=100`);
+            // Delta sync: messages stored since the last sync (recent ones come again; merged by id)
+            const after = (this._cursors || {}).after;
+            const query = after ? `after=${encodeURIComponent(after)}` : 'limit=50';
+            const res = await this._api('GET', `/api/whatsapp/conversations/${this.activeConvId}/messages?${query}`);
             const data = await res.json();
-            if (data.messages) {
-                this._renderMessages(data.messages);
+            if (data.messages && data.messages.length) {
+                this._mergeMessages(data.messages);
+                this._renderMessages(this._messages);
+            }
+            if (data.cursors && data.cursors.after) {
+                this._cursors = { ...(this._cursors || {}), after: data.cursors.after };
             }
             
             // Refresh conversation list quietly as well to get unread badges for other threads
@@ -666,6 +776,42 @@ class WhatsAppManager {
         }
     }
 
+    async _loadOlderMessages() {
+        const before = (this._cursors || {}).before;
+        if (!this.activeConvId || !before || this._loadingOlder) return;
+        this._loadingOlder = true;
+        const container = document.getElementById('waChatMessages');
+        const prevHeight = container ? container.scrollHeight : 0;
+        try {
+            const res = await this._api('GET',
+                `/api/whatsapp/conversations/${this.activeConvId}/messages?limit=50&before=${encodeURIComponent(before)}`);
+            const data = await res.json();
+            this._mergeMessages(data.messages || []);
+            this._cursors = { ...(this._cursors || {}), before: (data.cursors || {}).before };
+            this._renderMessages(this._messages);
+            if (container) container.scrollTop = container.scrollHeight - prevHeight;   // keep the view in place
+        } catch (e) {
+            console.warn('Load older messages failed', e);
+        } finally {
+            this._loadingOlder = false;
+        }
+    }
+
+    _mergeMessages(msgs) {
+        const byId = new Map((this._messages || []).map(m => [m.id, m]));
+        msgs.forEach(m => byId.set(m.id, m));
+        this._messages = [...byId.values()].sort((a, b) =>
+            (a.created_at || '').localeCompare(b.created_at || '') || a.id - b.id);
+    }
+
+    _applyStatusEvent(data) {
+        const msg = (this._messages || []).find(m => m.id === data.message_id);
+        if (!msg) return false;
+        msg.status = data.status;
+        this._renderMessages(this._messages);
+        return true;
+    }
+
     _updateConvItemUnread(convId, count) {
         const item = document.querySelector(`[data-conv-id="${convId}"]`);
         if (!item) return;
@@ -742,6 +888,12 @@ class WhatsAppManager {
             if (m.message_type === 'audio') msgContent = '<i class="fas fa-microphone mr-1 text-purple-400"></i> Voice message';
             if (m.message_type === 'video') msgContent = '<i class="fas fa-video mr-1 text-red-400"></i> Video';
             if (m.message_type === 'document') msgContent = `<i class="fas fa-file mr-1 text-orange-400"></i> ${this._esc(m.media_filename || 'Document')}`;
+            if ((m.media_id || m.media_url) && m.message_type === 'image') {
+                msgContent = `<img data-wa-media="${m.id}" class="rounded-lg mb-1 max-h-60 cursor-pointer bg-gray-100" style="min-width:120px;min-height:80px" alt="Image">`
+                    + (m.caption ? `<div>${this._esc(m.caption)}</div>` : '');
+            } else if ((m.media_id || m.media_url) && ['audio', 'video', 'document', 'sticker'].includes(m.message_type)) {
+                msgContent = `<a data-wa-media="${m.id}" class="underline cursor-pointer">${msgContent}</a>`;
+            }
 
             const bubble = document.createElement('div');
             bubble.className = `flex ${isAgent ? 'justify-end' : 'justify-start'} mb-2`;
@@ -759,6 +911,7 @@ class WhatsAppManager {
                 </div>`;
             container.appendChild(bubble);
         });
+        this._hydrateMedia(container);
 
         // Scroll to bottom if we were already there
         if (isScrolledToBottom) {
@@ -766,6 +919,39 @@ class WhatsAppManager {
         }
     }
 
+    async _mediaFor(msgId) {
+        // Presigned URLs live an hour on the server; refresh ours well before that
+        const cached = this._mediaUrls[msgId];
+        if (cached && Date.now() - cached.at < 30 * 60 * 1000) return cached.data;
+        const res = await this._api('GET', `/api/whatsapp/messages/${msgId}/media`);
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || 'Media unavailable');
+        this._mediaUrls[msgId] = { data, at: Date.now() };
+        return data;
+    }
+
+    _hydrateMedia(container) {
+        container.querySelectorAll('img[data-wa-media]').forEach(img => {
+            const msgId = img.dataset.waMedia;
+            this._mediaFor(msgId)
+                .then(media => {
+                    img.src = media.thumbnail_url || media.url;
+                    img.onclick = () => window.open(media.url, '_blank');
+                })
+                .catch(() => { img.alt = 'Image unavailable'; });
+        });
+        container.querySelectorAll('a[data-wa-media]').forEach(link => {
+            link.onclick = async () => {
+                try {
+                    const media = await this._mediaFor(link.dataset.waMedia);
+                    window.open(media.url, '_blank');
+                } catch (e) {
+                    this._toast(e.message, 'error');
+                }
+            };
+        });
+    }
+
     _statusIcon(status) {
         if (status === 'read') return '<i class="fas fa-check-double text-blue-300"></i>';
         if (status === 'delivered') return '<i class="fas fa-check-double text-green-200"></i>';
@@ -0,0 +1,66 @@
+"""Add trigram search indexes
+
+Revision ID: a4f1c2d9e8b7
+Revises: 5eb77c1b3672
+Create Date: 2026-10-19 10:12:41.118203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f1c2d9e8b7'
+down_revision = '5eb77c1b3672'
+branch_labels = None
+depends_on = None
+
+
+TRIGRAM_INDEXES = [
+    ('ix_leads_name_trgm', 'leads', 'name'),
+    ('ix_leads_phone_trgm', 'leads', 'phone'),
+    ('ix_leads_email_trgm', 'leads', 'email'),
+    ('ix_leads_location_trgm', 'leads', 'location'),
+    ('ix_call_history_contact_name_trgm', 'call_history', 'contact_name'),
+    ('ix_call_history_phone_number_trgm', 'call_history', 'phone_number'),
+    ('ix_call_history_formatted_number_trgm', 'call_history', 'formatted_number'),
+    ('ix_users_name_trgm', 'users', 'name'),
+    ('ix_users_email_trgm', 'users', 'email'),
+    ('ix_wa_contacts_name_trgm', 'wa_contacts', 'name'),
+    ('ix_wa_contacts_profile_name_trgm', 'wa_contacts', 'profile_name'),
+    ('ix_wa_contacts_phone_number_trgm', 'wa_contacts', 'phone_number'),
+]
+
+# Digit-only phone searches match on regexp_replace(column, '\D', '', 'g')
+PHONE_DIGIT_INDEXES = [
+    ('ix_leads_phone_digits_trgm', 'leads', 'phone'),
+    ('ix_call_history_phone_number_digits_trgm', 'call_history', 'phone_number'),
+    ('ix_call_history_formatted_number_digits_trgm', 'call_history', 'formatted_number'),
+    ('ix_wa_contacts_phone_number_digits_trgm', 'wa_contacts', 'phone_number'),
+]
+
+
+def upgrade():
+    # pg_trgm is PostgreSQL only; SQLite dev/test databases keep LIKE scans.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for index_name, table, column in TRIGRAM_INDEXES:
+        op.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} '
+            f'ON {table} USING gin ({column} gin_trgm_ops)'
+        )
+    for index_name, table, column in PHONE_DIGIT_INDEXES:
+        op.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name} '
+            f"ON {table} USING gin ((regexp_replace({column}, '\\D', '', 'g')) gin_trgm_ops)"
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for index_name, _table, _column in reversed(TRIGRAM_INDEXES + PHONE_DIGIT_INDEXES):
+        op.execute(f'DROP INDEX IF EXISTS {index_name}')
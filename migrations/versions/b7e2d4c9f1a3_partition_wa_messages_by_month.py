@@ -0,0 +1,217 @@
+"""Partition wa_messages and wa_message_status_logs by month (online, batched copy)
+
+Revision ID: b7e2d4c9f1a3
+Revises: a4f1c2d9e8b7
+Create Date: 2026-10-19 16:40:08.512330
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d4c9f1a3'
+down_revision = 'a4f1c2d9e8b7'
+branch_labels = None
+depends_on = None
+
+
+# table -> (partition key, indexes created on the partitioned table)
+#
+# A unique index on a partitioned table must include the partition key, so
+# wa_messages.whatsapp_msg_id becomes unique per (admin_id, whatsapp_msg_id,
+# created_at) instead of globally. That still drops webhook redeliveries
+# (ON CONFLICT DO NOTHING): inbound created_at is Meta's timestamp, so every
+# retry of a message carries the same one. Outbound rows take the wamid Meta
+# returns for each send, so a retried send has a new wamid. Two rows with one
+# wamid and different created_at are no longer rejected by the database; the
+# inbound path checks (admin_id, wamid) before inserting.
+#
+# For the same reason nothing can reference wa_messages.id with a foreign key
+# any more: the status-log FK is dropped explicitly (message_id stays
+# indexed), and any other FK pointing at either table stops the migration.
+TABLES = {
+    'wa_messages': ('created_at', [
+        ('ix_wa_messages_conversation_id', 'conversation_id', False),
+        ('ix_wa_messages_admin_id', 'admin_id', False),
+        ('ix_wa_messages_created_at', 'created_at', False),
+        ('ix_wa_messages_whatsapp_msg_id', 'whatsapp_msg_id', False),
+        ('uq_wa_messages_admin_wamid_created', 'admin_id, whatsapp_msg_id, created_at', True),
+        ('idx_wamsg_conv_created', 'conversation_id, created_at', False),
+    ]),
+    'wa_message_status_logs': ('timestamp', [
+        ('ix_wa_message_status_logs_message_id', 'message_id', False),
+        ('ix_wa_message_status_logs_timestamp', 'timestamp', False),
+    ]),
+}
+
+# Foreign keys into the converted tables that are dropped on purpose
+DROPPED_FKS = {'wa_message_status_logs_message_id_fkey'}
+
+# Each table is rebuilt while the app keeps writing to it:
+#   1. a copy (<table>_rebuild) gets its partitions and indexes, and a trigger
+#      records the ids of live rows updated or deleted from then on (status
+#      receipts update wa_messages constantly)
+#   2. rows are copied in id batches, each committed on its own
+#   3. under an EXCLUSIVE lock (reads continue, writes wait) the rows added or
+#      changed during the copy are re-synced and the tables swap names
+# The downgrade rebuilds plain tables the same way.
+BATCH_SIZE = 50000
+MONTHS_AHEAD = 3
+
+
+def _months(first, last):
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _is_partitioned(bind, table):
+    return bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :t"
+    ), {"t": table}).first() is not None
+
+
+def _scalar(bind, sql):
+    return bind.execute(sa.text(sql)).scalar()
+
+
+def _select_list(bind, table, key):
+    """Column list of table; NULLs in the partition key (legacy or in-flight rows) take now()."""
+    columns = bind.execute(sa.text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :t ORDER BY ordinal_position"
+    ), {"t": table}).scalars().all()
+    return ', '.join(f'COALESCE("{c}", now())' if c == key else f'"{c}"' for c in columns)
+
+
+def _drop_referencing_fks(bind, table):
+    """Drops the expected FKs into table; any other one aborts instead of vanishing with the table."""
+    for name, referencing in bind.execute(sa.text(
+        "SELECT c.conname, r.relname FROM pg_constraint c "
+        "JOIN pg_class t ON t.oid = c.confrelid JOIN pg_class r ON r.oid = c.conrelid "
+        "WHERE c.contype = 'f' AND t.relname = :t AND r.relname <> :t"
+    ), {"t": table}).all():
+        if name not in DROPPED_FKS:
+            raise RuntimeError(f'{referencing}.{name} references {table}; drop or re-point it first')
+        op.execute(f'ALTER TABLE {referencing} DROP CONSTRAINT {name}')
+
+
+def _rebuild(bind, table, partitioned):
+    key, indexes = TABLES[table]
+    new = f'{table}_rebuild'
+    changes = f'{table}_changes'
+    trigger = f'{table}_track_change'
+    seq = f'{table}_id_seq'
+
+    # 1. Copy table, change tracking
+    if partitioned:
+        op.execute(f'UPDATE {table} SET "{key}" = now() WHERE "{key}" IS NULL')
+        op.execute(f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS) PARTITION BY RANGE ("{key}")')
+        op.execute(f'ALTER TABLE {new} ALTER COLUMN "{key}" SET NOT NULL')
+        first = _scalar(bind, f'SELECT COALESCE(MIN("{key}"), now()) FROM {table}')
+        last = _scalar(bind, f"SELECT now() + interval '{MONTHS_AHEAD} months'")
+        for year, month in _months(first, last):
+            nxt = (year + 1, 1) if month == 12 else (year, month + 1)
+            op.execute(
+                f'CREATE TABLE {table}_p{year:04d}{month:02d} PARTITION OF {new} '
+                f"FOR VALUES FROM ('{year:04d}-{month:02d}-01') TO ('{nxt[0]:04d}-{nxt[1]:02d}-01')"
+            )
+        op.execute(f'CREATE TABLE {table}_default PARTITION OF {new} DEFAULT')
+        op.execute(f'ALTER TABLE {new} ADD CONSTRAINT {new}_pkey PRIMARY KEY (id, "{key}")')
+    else:
+        op.execute(f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS)')
+        op.execute(f'ALTER TABLE {new} ALTER COLUMN "{key}" DROP NOT NULL')
+        op.execute(f'ALTER TABLE {new} ADD CONSTRAINT {new}_pkey PRIMARY KEY (id)')
+
+    # Outgoing FKs (conversation_id, admin_id) keep their names; added while the copy is empty
+    for name, definition in bind.execute(sa.text(
+        "SELECT c.conname, pg_get_constraintdef(c.oid) FROM pg_constraint c JOIN pg_class t ON t.oid = c.conrelid "
+        "WHERE c.contype = 'f' AND t.relname = :t"
+    ), {"t": table}).all():
+        if name not in DROPPED_FKS:
+            op.execute(f'ALTER TABLE {new} ADD CONSTRAINT {name} {definition}')
+
+    created = []
+    for name, columns, unique in indexes:
+        if unique and not partitioned:
+            continue   # the baseline's UNIQUE (whatsapp_msg_id) is restored below
+        op.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX {name}_new ON {new} ({columns})')
+        created.append(name)
+    if table == 'wa_messages' and not partitioned:
+        op.execute(f'ALTER TABLE {new} ADD CONSTRAINT {new}_whatsapp_msg_id_key UNIQUE (whatsapp_msg_id)')
+
+    op.execute(f'CREATE TABLE {changes} (id INTEGER PRIMARY KEY)')
+    op.execute(f'''
+        CREATE FUNCTION {trigger}() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO {changes} (id) VALUES (OLD.id) ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute(f'CREATE TRIGGER {trigger} AFTER UPDATE OR DELETE ON {table} FOR EACH ROW EXECUTE FUNCTION {trigger}()')
+
+    # 2. Batched copy, one commit per batch
+    columns = _select_list(bind, table, key)
+    copied = high = 0
+    with op.get_context().autocommit_block():
+        high = _scalar(bind, f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+        while copied < high:
+            bind.execute(sa.text(
+                f'INSERT INTO {new} SELECT {columns} FROM {table} WHERE id > :lo AND id <= :hi'
+            ), {"lo": copied, "hi": copied + BATCH_SIZE})
+            copied += BATCH_SIZE
+
+    # 3. Catch up and swap
+    op.execute(f'LOCK TABLE {table} IN EXCLUSIVE MODE')
+    op.execute(f'DELETE FROM {new} WHERE id IN (SELECT id FROM {changes})')
+    # The tail is re-checked: a slow transaction may commit an id below `high` late
+    op.execute(
+        f'INSERT INTO {new} SELECT {columns} FROM {table} t '
+        f'WHERE (t.id > {max(high - BATCH_SIZE, 0)} OR t.id IN (SELECT id FROM {changes})) '
+        f'AND NOT EXISTS (SELECT 1 FROM {new} n WHERE n.id = t.id)'
+    )
+    op.execute(f'DROP TRIGGER {trigger} ON {table}')
+    op.execute(f'DROP FUNCTION {trigger}()')
+    op.execute(f'DROP TABLE {changes}')
+
+    _drop_referencing_fks(bind, table)
+    op.execute(f'ALTER SEQUENCE {seq} OWNED BY NONE')   # survives the DROP of the old table
+    op.execute(f'DROP TABLE {table}')
+    op.execute(f'ALTER TABLE {new} RENAME TO {table}')
+    op.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {new}_pkey TO {table}_pkey')
+    if table == 'wa_messages' and not partitioned:
+        op.execute(f'ALTER TABLE {table} RENAME CONSTRAINT {new}_whatsapp_msg_id_key TO {table}_whatsapp_msg_id_key')
+    for name in created:
+        op.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+    op.execute(f'ALTER SEQUENCE {seq} OWNED BY {table}.id')
+
+
+def upgrade():
+    # Declarative partitioning is PostgreSQL only; SQLite keeps plain tables.
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    # Status logs first: their FK points at the wa_messages table being replaced
+    for table in ('wa_message_status_logs', 'wa_messages'):
+        if not _is_partitioned(bind, table):
+            _rebuild(bind, table, partitioned=True)
+
+
+def downgrade():
+    # Detached (archived) status-log partitions are not reattached.
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    for table in ('wa_messages', 'wa_message_status_logs'):
+        if _is_partitioned(bind, table):
+            _rebuild(bind, table, partitioned=False)
+
+    op.execute(
+        'ALTER TABLE wa_message_status_logs ADD CONSTRAINT wa_message_status_logs_message_id_fkey '
+        'FOREIGN KEY (message_id) REFERENCES wa_messages (id)'
+    )
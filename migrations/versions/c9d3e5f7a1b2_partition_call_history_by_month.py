@@ -0,0 +1,166 @@
+"""Partition call_history by month (online, batched copy)
+
+Revision ID: c9d3e5f7a1b2
+Revises: b7e2d4c9f1a3
+Create Date: 2026-10-19 18:05:27.204913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9d3e5f7a1b2'
+down_revision = 'b7e2d4c9f1a3'
+branch_labels = None
+depends_on = None
+
+
+# call_history is converted while the app keeps writing to it:
+#   1. a partitioned copy (call_history_partitioned) gets monthly partitions and
+#      the indexes of the live table, and a trigger records the ids of live rows
+#      updated or deleted from then on (recordings are attached to existing rows)
+#   2. rows are copied in id batches, each committed on its own
+#   3. under an EXCLUSIVE lock (reads continue, writes wait) the rows added or
+#      changed during the copy are re-synced and the tables swap names
+# The primary key becomes (id, timestamp); timestamp is the partition key and
+# so must be NOT NULL: legacy NULLs are backfilled with created_at before the
+# copy, and rows written with a NULL during it are coalesced the same way.
+BATCH_SIZE = 50000
+MONTHS_AHEAD = 3
+
+TABLE = 'call_history'
+NEW = 'call_history_partitioned'
+CHANGES = 'call_history_changes'
+
+
+def _months(first, last):
+    year, month = first.year, first.month
+    while (year, month) <= (last.year, last.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def _is_partitioned(bind, table):
+    return bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :t"
+    ), {"t": table}).first() is not None
+
+
+def _scalar(bind, sql):
+    return bind.execute(sa.text(sql)).scalar()
+
+
+def _select_list(bind):
+    """Column list of call_history; a NULL timestamp (row written during the copy) takes created_at."""
+    columns = bind.execute(sa.text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :t ORDER BY ordinal_position"
+    ), {"t": TABLE}).scalars().all()
+    return ', '.join(
+        'COALESCE("timestamp", created_at, now())' if c == 'timestamp' else f'"{c}"' for c in columns
+    )
+
+
+def upgrade():
+    # Declarative partitioning is PostgreSQL only; SQLite keeps a plain table.
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql' or _is_partitioned(bind, TABLE):
+        return
+
+    # 1. Partitioned twin, change tracking
+    op.execute(f'UPDATE {TABLE} SET "timestamp" = COALESCE(created_at, now()) WHERE "timestamp" IS NULL')
+    op.execute(f'CREATE TABLE {NEW} (LIKE {TABLE} INCLUDING DEFAULTS) PARTITION BY RANGE (timestamp)')
+    op.execute(f'ALTER TABLE {NEW} ALTER COLUMN timestamp SET NOT NULL')
+
+    first = _scalar(bind, f'SELECT COALESCE(MIN(timestamp), now()) FROM {TABLE}')
+    last = _scalar(bind, f"SELECT now() + interval '{MONTHS_AHEAD} months'")
+    for year, month in _months(first, last):
+        nxt = (year + 1, 1) if month == 12 else (year, month + 1)
+        op.execute(
+            f'CREATE TABLE {TABLE}_p{year:04d}{month:02d} PARTITION OF {NEW} '
+            f"FOR VALUES FROM ('{year:04d}-{month:02d}-01') TO ('{nxt[0]:04d}-{nxt[1]:02d}-01')"
+        )
+    op.execute(f'CREATE TABLE {TABLE}_default PARTITION OF {NEW} DEFAULT')
+
+    op.execute(f'ALTER TABLE {NEW} ADD CONSTRAINT {NEW}_pkey PRIMARY KEY (id, timestamp)')
+    op.execute(f'ALTER TABLE {NEW} ADD CONSTRAINT {NEW}_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)')
+    # Same indexes as the live table (btree and trigram), renamed after the swap
+    indexes = bind.execute(sa.text(
+        "SELECT i.relname, pg_get_indexdef(x.indexrelid) FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid JOIN pg_class t ON t.oid = x.indrelid "
+        "WHERE t.relname = :t AND NOT x.indisprimary AND NOT x.indisunique"
+    ), {"t": TABLE}).all()
+    for name, definition in indexes:
+        definition = definition.replace(f'INDEX {name} ON ', f'INDEX {name}_part ON ', 1)
+        definition = definition.replace(f' ON public.{TABLE} ', f' ON {NEW} ', 1).replace(f' ON {TABLE} ', f' ON {NEW} ', 1)
+        op.execute(definition)
+
+    op.execute(f'CREATE TABLE {CHANGES} (id INTEGER PRIMARY KEY)')
+    op.execute(f'''
+        CREATE FUNCTION call_history_track_change() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO {CHANGES} (id) VALUES (OLD.id) ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute(f'''
+        CREATE TRIGGER call_history_track_change AFTER UPDATE OR DELETE ON {TABLE}
+        FOR EACH ROW EXECUTE FUNCTION call_history_track_change()
+    ''')
+
+    # 2. Batched copy, one commit per batch
+    columns = _select_list(bind)
+    copied = high = 0
+    with op.get_context().autocommit_block():
+        high = _scalar(bind, f'SELECT COALESCE(MAX(id), 0) FROM {TABLE}')
+        while copied < high:
+            bind.execute(sa.text(
+                f'INSERT INTO {NEW} SELECT {columns} FROM {TABLE} WHERE id > :lo AND id <= :hi'
+            ), {"lo": copied, "hi": copied + BATCH_SIZE})
+            copied += BATCH_SIZE
+
+    # 3. Catch up and swap
+    op.execute(f'LOCK TABLE {TABLE} IN EXCLUSIVE MODE')
+    op.execute(f'DELETE FROM {NEW} WHERE id IN (SELECT id FROM {CHANGES})')
+    # The tail is re-checked: a slow transaction may commit an id below `high` late
+    op.execute(
+        f'INSERT INTO {NEW} SELECT {columns} FROM {TABLE} t '
+        f'WHERE (t.id > {max(high - BATCH_SIZE, 0)} OR t.id IN (SELECT id FROM {CHANGES})) '
+        f'AND NOT EXISTS (SELECT 1 FROM {NEW} n WHERE n.id = t.id)'
+    )
+    op.execute(f'DROP TRIGGER call_history_track_change ON {TABLE}')
+    op.execute('DROP FUNCTION call_history_track_change()')
+    op.execute(f'DROP TABLE {CHANGES}')
+
+    op.execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE')
+    op.execute(f'DROP TABLE {TABLE}')
+    op.execute(f'ALTER TABLE {NEW} RENAME TO {TABLE}')
+    op.execute(f'ALTER TABLE {TABLE} RENAME CONSTRAINT {NEW}_pkey TO {TABLE}_pkey')
+    op.execute(f'ALTER TABLE {TABLE} RENAME CONSTRAINT {NEW}_user_id_fkey TO {TABLE}_user_id_fkey')
+    for name, _definition in indexes:
+        op.execute(f'ALTER INDEX {name}_part RENAME TO {name}')
+    op.execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+
+
+def downgrade():
+    # Detached (archived) partitions are not reattached; their months stay in
+    # call_history_monthly_summaries and object storage.
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql' or not _is_partitioned(bind, TABLE):
+        return
+
+    op.execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY NONE')
+    op.execute(f'ALTER TABLE {TABLE} RENAME TO {NEW}')
+    op.execute(f'CREATE TABLE {TABLE} (LIKE {NEW} INCLUDING DEFAULTS)')
+    op.execute(f'ALTER TABLE {TABLE} ALTER COLUMN timestamp DROP NOT NULL')
+    op.execute(f'INSERT INTO {TABLE} SELECT * FROM {NEW}')
+    op.execute(f'DROP TABLE {NEW} CASCADE')
+    op.execute(f'ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id')
+    op.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id)')
+    op.execute(f'ALTER TABLE {TABLE} ADD FOREIGN KEY (user_id) REFERENCES users (id)')
+    op.execute(f'CREATE INDEX idx_call_history_timestamp ON {TABLE} (timestamp)')
+    op.execute(f'CREATE INDEX idx_call_history_phone ON {TABLE} (phone_number)')
+    op.execute(f'CREATE INDEX idx_call_history_call_type ON {TABLE} (call_type)')
+    op.execute(f'CREATE INDEX ix_call_history_created_at ON {TABLE} (created_at)')
@@ -1,7 +1,13 @@
 from app import create_app
+from app.services.scheduler_leader import start_scheduler
 
 app = create_app()
 
+# Every worker competes for the scheduler lease; only the holder runs jobs.
+# Set SCHEDULER_IN_WEB=false when a separate `flask run-scheduler` process is deployed.
+if app.config.get("SCHEDULER_IN_WEB"):
+    start_scheduler(app)
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
     
\ No newline at end of file
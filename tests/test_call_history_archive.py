@@ -0,0 +1,187 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import io
+import csv
+import gzip
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from app.models import db, Admin, User, CallHistory, CallHistoryMonthlySummary
+from app.routes.admin_call_analytics import bp as analytics_bp
+from app.routes.call_history import bp as call_history_bp
+from app.services import call_history_archive
+from app.utils.partitions import month_start
+
+
+class MemoryStorage:
+    """The parts of the boto3 S3 client the archive uses."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.objects[key] = fileobj.read()
+
+    def rows(self, key):
+        return list(csv.DictReader(io.StringIO(gzip.decompress(self.objects[key]).decode())))
+
+
+class TestCallHistoryArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "JWT_SECRET_KEY": "archive-test-secret-key-0123456789",
+            "WASABI_ACCESS_KEY": "key", "WASABI_SECRET_KEY": "secret", "WASABI_BUCKET_NAME": "bucket",
+            "CALL_HISTORY_ARCHIVE_AFTER_MONTHS": 3,
+        })
+        JWTManager(self.app)
+        self.app.register_blueprint(analytics_bp)
+        self.app.register_blueprint(call_history_bp)
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        self.admin_id = admin.id
+        self.ravi = User(name="Ravi", email="ravi@acme.test", password_hash="x", admin_id=admin.id)
+        self.asha = User(name="Asha", email="asha@acme.test", password_hash="x", admin_id=admin.id)
+        db.session.add_all([self.ravi, self.asha])
+        db.session.flush()
+
+        self.old = month_start(datetime.utcnow(), -5)       # archived
+        self.older = month_start(datetime.utcnow(), -7)     # archived
+        self.recent = datetime.utcnow() - timedelta(days=1)
+        self.call(self.ravi, "incoming", 60, self.old + timedelta(days=2))
+        self.call(self.ravi, "outgoing", 30, self.old + timedelta(days=3))
+        self.call(self.asha, "Missed", 0, self.old + timedelta(days=4))
+        self.call(self.ravi, "incoming", 100, self.older + timedelta(days=1))
+        self.call(self.ravi, "outgoing", 40, self.recent)
+        db.session.commit()
+
+        self.storage = MemoryStorage()
+        patcher = patch.object(call_history_archive, "_storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        token = create_access_token(identity=str(admin.id), additional_claims={"role": "admin"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def call(self, user, call_type, duration, ts):
+        db.session.add(CallHistory(user_id=user.id, phone_number=f"98{ts:%m%d%H%M%S}", call_type=call_type,
+                                   duration=duration, timestamp=ts))
+
+    def summary(self, user, month):
+        return CallHistoryMonthlySummary.query.filter_by(user_id=user.id, month=month.date()).one()
+
+    def test_old_months_are_exported_summarized_and_removed(self):
+        call_history_archive.maintain_call_history_job(self.app)
+
+        self.assertEqual([c.duration for c in CallHistory.query.all()], [40])
+        key = self.summary(self.ravi, self.old).object_key
+        self.assertTrue(key.startswith(f"call-history-archive/{self.old:%Y}/{self.old:%Y%m}-"))
+        rows = self.storage.rows(key)
+        self.assertEqual(sorted(r["call_type"] for r in rows), ["Missed", "incoming", "outgoing"])
+        self.assertEqual(len(self.storage.objects), 2)
+
+        ravi = self.summary(self.ravi, self.old)
+        self.assertEqual((ravi.total_calls, ravi.incoming_calls, ravi.outgoing_calls, ravi.total_duration,
+                          ravi.incoming_duration), (2, 1, 1, 90, 60))
+        self.assertEqual(self.summary(self.asha, self.old).missed_calls, 1)
+        self.assertEqual(self.summary(self.ravi, self.older).incoming_duration, 100)
+
+    def test_late_rows_add_to_an_archived_month(self):
+        call_history_archive.maintain_call_history_job(self.app)
+        self.call(self.ravi, "incoming", 20, self.old + timedelta(days=9))
+        db.session.commit()
+        call_history_archive.maintain_call_history_job(self.app)
+
+        ravi = self.summary(self.ravi, self.old)
+        self.assertEqual((ravi.total_calls, ravi.incoming_calls, ravi.incoming_duration), (3, 2, 80))
+        self.assertEqual(len(self.storage.rows(ravi.object_key)), 1)
+        self.assertEqual(len(self.storage.objects), 3)
+
+    def test_all_time_analytics_include_the_archive(self):
+        call_history_archive.maintain_call_history_job(self.app)
+
+        data = self.client.get("/api/admin/call-analytics", query_string={"period": "all"},
+                               headers=self.headers).get_json()
+        self.assertEqual((data["total_calls"], data["incoming"], data["outgoing"], data["missed"]), (5, 2, 2, 1))
+        self.assertEqual(data["total_duration"], 230)
+        self.assertEqual(data["avg_inbound_duration"], 80)
+        by_user = {u["user_name"]: u for u in data["user_summary"]}
+        self.assertEqual((by_user["Ravi"]["incoming"], by_user["Ravi"]["total_duration_seconds"]), (2, 230))
+
+        data = self.client.get(f"/api/admin/call-analytics/{self.ravi.id}", query_string={"period": "all"},
+                               headers=self.headers).get_json()
+        self.assertEqual((data["total_calls"], data["total_duration_seconds"]), (4, 230))
+
+        data = self.client.get("/api/admin/call-analytics", query_string={"period": "month"},
+                               headers=self.headers).get_json()
+        self.assertLessEqual(data["total_calls"], 1)   # live rows only
+
+    def test_ranges_add_the_archived_months_inside_them(self):
+        call_history_archive.maintain_call_history_job(self.app)
+        archived = call_history_archive.archived_totals
+
+        # Whole months: only the archived months inside the range count
+        ravi = archived([self.ravi.id], self.old, month_start(self.old, 1))[self.ravi.id]
+        self.assertEqual((ravi["total_calls"], ravi["total_duration"]), (2, 90))
+        ravi = archived([self.ravi.id], self.older, month_start(datetime.utcnow(), 1))[self.ravi.id]
+        self.assertEqual((ravi["total_calls"], ravi["total_duration"]), (3, 190))
+        self.assertEqual(archived([self.ravi.id], month_start(self.older, 1), self.old), {})
+        # A range of live months has no archived part
+        self.assertEqual(archived([self.ravi.id], month_start(datetime.utcnow(), -1), None), {})
+
+    def test_ranges_inside_an_archived_month_are_rejected(self):
+        call_history_archive.maintain_call_history_job(self.app)
+        with self.assertRaises(call_history_archive.ArchivedRangeError):
+            call_history_archive.archived_totals([self.ravi.id], self.old + timedelta(days=3), None)
+        with self.assertRaises(call_history_archive.ArchivedRangeError):
+            call_history_archive.archived_totals([self.ravi.id], self.older, self.old + timedelta(days=1))
+
+    def test_sync_refuses_calls_without_a_timestamp(self):
+        token = create_access_token(identity=str(self.asha.id), additional_claims={"role": "user"})
+        calls = [
+            {"phone_number": "9800000001", "call_type": "incoming", "duration": 5},
+            {"phone_number": "9800000002", "call_type": "incoming", "duration": 5, "timestamp": None},
+            {"phone_number": "9800000003", "call_type": "incoming", "duration": 5, "timestamp": "yesterday"},
+            {"phone_number": "9800000004", "call_type": "incoming", "duration": 5,
+             "timestamp": self.old.isoformat()},                                   # archived month: skipped
+            {"phone_number": "9800000005", "call_type": "incoming", "duration": 5,
+             "timestamp": self.recent.isoformat()},
+        ]
+        resp = self.client.post("/api/call-history/sync", json={"call_history": calls},
+                                headers={"Authorization": f"Bearer {token}"})
+        data = resp.get_json()
+        self.assertEqual((resp.status_code, data["records_saved"], len(data["errors"])), (200, 1, 3))
+        self.assertEqual(CallHistory.query.filter_by(user_id=self.asha.id, phone_number="9800000005").count(), 1)
+        self.assertEqual(CallHistory.query.filter(CallHistory.timestamp.is_(None)).count(), 0)
+
+    def test_nothing_is_removed_without_storage(self):
+        with patch.dict(self.app.config, {"WASABI_BUCKET_NAME": ""}):
+            call_history_archive.maintain_call_history_job(self.app)
+        self.assertEqual(CallHistory.query.count(), 5)
+        self.assertEqual(CallHistoryMonthlySummary.query.count(), 0)
+        self.assertEqual(call_history_archive.archive_cutoff(), month_start(datetime.utcnow(), -3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+
+import unittest
+import sys
+import os
+import json
+import glob
+import email
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.email_lead_parser import EmailLeadParser, LeadField, PARSERS, html_to_text, REQUIRED_SEP
+from app.services import magicbricks_service, ninety_nine_acres_service, justdial_service, housing_service
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "lead_emails")
+
+BUILDERS = {
+    "magicbricks": magicbricks_service.build_lead,
+    "99acres": ninety_nine_acres_service.build_lead,
+    "justdial": justdial_service.build_lead,
+    "housing": housing_service.build_lead,
+}
+
+
+def load_corpus():
+    """[(provider, path, email.message.Message, expected lead dict or None)]"""
+    samples = []
+    for path in sorted(glob.glob(os.path.join(CORPUS_DIR, "*", "*.eml"))):
+        provider = os.path.basename(os.path.dirname(path))
+        with open(path, "rb") as f:
+            msg = email.message_from_bytes(f.read())
+        with open(path[:-4] + ".json", encoding="utf-8") as f:
+            expected = json.load(f)
+        samples.append((provider, path, msg, expected))
+    return samples
+
+
+class TestEmailLeadParserCorpus(unittest.TestCase):
+    """Regression suite: every saved sample email must parse to its .json."""
+
+    def test_corpus(self):
+        samples = load_corpus()
+        self.assertTrue(samples)
+        for provider, path, msg, expected in samples:
+            with self.subTest(sample=os.path.relpath(path, CORPUS_DIR)):
+                self.assertEqual(BUILDERS[provider](msg), expected)
+
+    def test_every_provider_has_samples_and_a_parser(self):
+        providers = {provider for provider, _, _, _ in load_corpus()}
+        self.assertEqual(providers, set(BUILDERS))
+        self.assertTrue(set(BUILDERS) <= set(PARSERS))
+
+
+class TestEmailLeadParser(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = EmailLeadParser(
+            source="TEST", category="REAL_ESTATE", sep=REQUIRED_SEP, split_pipes=True,
+            fields=[
+                LeadField("name", r"Name|Customer Name"),
+                LeadField("phone", r"Mobile|Phone", value=r"\d+", prefix=r"(?:\+91-?)?"),
+                LeadField("location", r"City"),
+            ]
+        )
+
+    def test_fields_sharing_a_line(self):
+        data = self.parser.parse("Name : Ravi | Mobile : +91-9811122233 | City : Noida")
+        self.assertEqual((data["name"], data["phone"], data["location"]), ("Ravi", "9811122233", "Noida"))
+
+    def test_first_occurrence_wins(self):
+        data = self.parser.parse("Customer Name - First\nName - Second\nPhone - 9000000001\nMobile - 9000000002")
+        self.assertEqual((data["name"], data["phone"]), ("First", "9000000001"))
+
+    def test_labels_start_at_word_boundary(self):
+        data = self.parser.parse("Username : ravi_k\nName : Ravi\nMobile : 9811122233")
+        self.assertEqual(data["name"], "Ravi")
+
+    def test_phone_fallback_and_rejection(self):
+        self.assertEqual(self.parser.parse("call me on 9123456780")["phone"], "9123456780")
+        self.assertIsNone(self.parser.parse("Name : Nobody"))
+
+    def test_markers(self):
+        parser = EmailLeadParser("TEST", "X", [LeadField("email", r"Email")], markers=("Buyer Lead",))
+        self.assertIsNone(parser.parse("Email: a@b.test"))
+        self.assertEqual(parser.parse("Buyer Lead\nEmail: a@b.test")["email"], "a@b.test")
+
+    def test_html_to_text(self):
+        markup = (
+            "<style>td {color: red}</style><p>New <b>lead</b></p>"
+            "<table><tr><td>Name:</td><td>A &amp; B</td></tr><tr><th>Mobile</th><td>98</td></tr></table>"
+        )
+        self.assertEqual(html_to_text(markup), "New lead\nName: A & B\nMobile: 98")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,261 @@
+
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+import json
+import time
+from datetime import timedelta, timezone
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.pool import StaticPool
+from app.models import db, Admin, User, Lead, FacebookConnection, FacebookLeadForm, FacebookFormSync, now
+from app.utils.cache import TTLCache
+from app.services import facebook_leads
+from app.services.facebook_leads import LeadFetchQueue, process_leads, reconcile_admin_leads
+
+
+class FakeGraph:
+    """Answers Graph batch POSTs with leadgen objects and form names."""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, url, data=None, timeout=None):
+        requests_ = json.loads(data["batch"])
+        self.batches.append([r["relative_url"] for r in requests_])
+        answers = []
+        for r in requests_:
+            object_id, _, query = r["relative_url"].partition("?")
+            if object_id.startswith("form"):
+                body = {"id": object_id, "name": f"Form {object_id[4:]}"}
+            elif object_id == "gone":
+                answers.append({"code": 400, "body": json.dumps({"error": {"message": "Unsupported get request"}})})
+                continue
+            else:
+                body = {"id": object_id, "field_data": [
+                    {"name": "full_name", "values": [f"Person {object_id}"]},
+                    {"name": "phone_number", "values": [f"+9198{object_id.zfill(8)}"]},
+                    {"name": "city", "values": ["Pune"]},
+                ]}
+            answers.append({"code": 200, "body": json.dumps(body)})
+        return MagicMock(status_code=200, json=MagicMock(return_value=answers))
+
+
+@patch('app.services.lead_ingestor.POST_INSERT_HOOKS', [])
+class TestFacebookLeads(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "poolclass": StaticPool, "connect_args": {"check_same_thread": False}
+        }
+        self.app.config["SECRET_KEY"] = "test"
+        self.app.config["FB_LEAD_BATCH_WINDOW_MS"] = 100
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        db.session.add(User(name="Agent", email="a@acme.test", password_hash="x", admin_id=admin.id))
+        self.conn = FacebookConnection(admin_id=admin.id, page_id="page1", encrypted_system_token="")
+        self.conn.set_token("system-token")
+        db.session.add(self.conn)
+        db.session.commit()
+
+        facebook_leads._form_cache = None
+        self.graph = FakeGraph()
+        self.post = patch('app.services.facebook_leads.requests.post', side_effect=self.graph)
+        self.post.start()
+
+    def tearDown(self):
+        self.post.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_ttl_cache(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)          # evicts b, the least recently used
+        self.assertEqual((cache.get("a"), cache.get("b"), cache.get("c")), (1, None, 3))
+        cache.set("d", 4, ttl=0)
+        self.assertNotIn("d", cache)
+
+    def test_leads_and_forms_share_one_batch_call(self):
+        result = process_leads(self.conn, [("1", "form7"), ("2", "form7"), ("3", "form8"), ("1", "form7")])
+
+        self.assertEqual(result["added"], 3)
+        self.assertEqual(len(self.graph.batches), 1)
+        self.assertEqual(len(self.graph.batches[0]), 5)   # 3 leads + 2 forms
+        lead = Lead.query.filter_by(facebook_lead_id="3").one()
+        self.assertEqual(lead.name, "Person 3")
+        self.assertEqual(lead.custom_fields["form_name"], "Form 8")
+        self.assertEqual(lead.custom_fields["city"], "Pune")
+        self.assertEqual(FacebookLeadForm.query.count(), 2)
+
+    def test_form_names_come_from_memory_then_table(self):
+        process_leads(self.conn, [("1", "form7")])
+
+        process_leads(self.conn, [("2", "form7")])
+        self.assertEqual(self.graph.batches[-1], ["2?fields=id,created_time,form_id,field_data"])
+
+        # New process: memory is empty, the table still answers
+        facebook_leads._form_cache = None
+        process_leads(self.conn, [("3", "form7")])
+        self.assertEqual(len(self.graph.batches[-1]), 1)
+        self.assertEqual(Lead.query.filter_by(facebook_lead_id="3").one().custom_fields["form_name"], "Form 7")
+
+        # Stale rows are fetched again
+        FacebookLeadForm.query.update({"fetched_at": now() - timedelta(days=2)})
+        db.session.commit()
+        facebook_leads._form_cache = None
+        process_leads(self.conn, [("4", "form7")])
+        self.assertEqual(len(self.graph.batches[-1]), 2)
+
+    def test_known_and_failed_leads_are_skipped(self):
+        process_leads(self.conn, [("1", None)])
+        result = process_leads(self.conn, [("1", None), ("gone", None), ("5", None)])
+
+        self.assertEqual(self.graph.batches[-1], [
+            "gone?fields=id,created_time,form_id,field_data", "5?fields=id,created_time,form_id,field_data"
+        ])
+        self.assertEqual(result["added"], 1)
+        self.assertEqual(Lead.query.count(), 2)
+
+    def test_webhook_burst_is_coalesced(self):
+        queue = LeadFetchQueue()
+        for n in range(60):
+            queue.put(self.app, self.conn.id, str(n), "form1")
+
+        deadline = time.monotonic() + 5
+        while Lead.query.count() < 60 and time.monotonic() < deadline:
+            db.session.remove()
+            time.sleep(0.05)
+
+        self.assertEqual(Lead.query.count(), 60)
+        # 61 Graph requests (60 leads + 1 form) in two batch calls
+        self.assertEqual(sum(len(b) for b in self.graph.batches), 61)
+        self.assertEqual(len(self.graph.batches), 2)
+
+
+class FakeGraphEdges:
+    """Paged GET /{page}/leadgen_forms and /{form}/leads, honouring the time_created filter."""
+
+    def __init__(self, leads_by_form, page_size=2):
+        self.leads_by_form = leads_by_form   # form_id -> [(lead_id, created_at)]
+        self.page_size = page_size
+        self.calls = []
+
+    def __call__(self, url, params=None, timeout=None):
+        if params is None:   # paging.next URL
+            path, offset, since = url.split("|")
+            offset, since = int(offset), int(since)
+        else:
+            path = url.rsplit("/v24.0/", 1)[1]
+            offset = 0
+            since = json.loads(params["filtering"])[0]["value"] if "filtering" in params else 0
+        self.calls.append((path, offset, since))
+
+        if path.endswith("/leadgen_forms"):
+            rows = [{"id": form_id, "name": f"Form {form_id}"} for form_id in self.leads_by_form]
+        else:
+            rows = [
+                {"id": lead_id, "created_time": created.strftime("%Y-%m-%dT%H:%M:%S+0000"), "field_data": [
+                    {"name": "full_name", "values": [f"Person {lead_id}"]},
+                    {"name": "phone_number", "values": [f"98{lead_id.zfill(8)}"]},
+                ]}
+                for lead_id, created in self.leads_by_form[path.split("/")[0]]
+                if created.replace(tzinfo=timezone.utc).timestamp() > since - 1
+            ]
+        page = {"data": rows[offset:offset + self.page_size]}
+        if offset + self.page_size < len(rows):
+            page["paging"] = {"next": f"{path}|{offset + self.page_size}|{since}"}
+        return MagicMock(status_code=200, json=MagicMock(return_value=page))
+
+
+@patch('app.services.lead_ingestor.POST_INSERT_HOOKS', [])
+class TestFacebookReconcile(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        self.app.config["SECRET_KEY"] = "test"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        db.session.add(User(name="Agent", email="a@acme.test", password_hash="x", admin_id=admin.id))
+        self.conn = FacebookConnection(admin_id=admin.id, page_id="page1", encrypted_system_token="")
+        self.conn.set_token("system-token")
+        db.session.add(self.conn)
+        db.session.commit()
+        self.admin_id = admin.id
+        facebook_leads._form_cache = None
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def reconcile(self, graph):
+        with patch('app.services.facebook_leads.requests.get', side_effect=graph):
+            return reconcile_admin_leads(self.admin_id)
+
+    def test_recovers_missed_leads_across_pages(self):
+        base = now().replace(microsecond=0) - timedelta(hours=5)
+        graph = FakeGraphEdges({
+            "f1": [(str(n), base + timedelta(minutes=n)) for n in range(1, 6)],
+            "f2": [("9", base + timedelta(hours=1))],
+        })
+        # The webhook already delivered lead 2
+        db.session.add(Lead(admin_id=self.admin_id, facebook_lead_id="2", name="Person 2", source="facebook"))
+        db.session.commit()
+
+        result = self.reconcile(graph)
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["added"], 5)
+        self.assertEqual(Lead.query.count(), 6)
+        self.assertEqual([c[1] for c in graph.calls if c[0] == "f1/leads"], [0, 2, 4])
+
+        lead = Lead.query.filter_by(facebook_lead_id="5").one()
+        self.assertEqual(lead.created_at, base + timedelta(minutes=5))
+        self.assertEqual(lead.custom_fields["form_name"], "Form f1")
+        state = FacebookFormSync.query.filter_by(form_id="f1").one()
+        self.assertEqual(state.leads_synced_until, base + timedelta(minutes=5))
+
+    def test_next_run_starts_from_high_water_mark(self):
+        base = now().replace(microsecond=0) - timedelta(hours=5)
+        graph = FakeGraphEdges({"f1": [("1", base)]})
+        self.reconcile(graph)
+
+        graph.leads_by_form["f1"].append(("2", base + timedelta(hours=2)))
+        graph.calls.clear()
+        result = self.reconcile(graph)
+
+        self.assertEqual(result["added"], 1)
+        since = [c[2] for c in graph.calls if c[0] == "f1/leads"][0]
+        expected = (base - timedelta(minutes=15)).replace(tzinfo=timezone.utc).timestamp()
+        self.assertEqual(since, int(expected))
+
+    def test_skips_without_connection(self):
+        self.conn.status = "disconnected"
+        db.session.commit()
+        self.assertEqual(self.reconcile(FakeGraphEdges({}))["status"], "skipped")
+
+
+if __name__ == '__main__':
+    unittest.main()
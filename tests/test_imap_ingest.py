@@ -0,0 +1,309 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import re
+import imaplib
+import socket
+import threading
+import socketserver
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from app.models import db, Admin, User, Lead, MagicbricksSettings
+from app.services import imap_ingest
+from app.services.imap_ingest import sync_mailbox, idle_wait, uid_set, pool, refresh_mailbox_watchers
+from app.services.magicbricks_service import build_lead, SEARCH_CRITERIA
+
+
+def lead_mail(n):
+    return (
+        f"Message-ID: <lead{n}@magicbricks.test>\r\n"
+        f"Subject: Buyer Lead {n}\r\n"
+        f"\r\n"
+        f"Magicbricks Buyer Lead\r\n"
+        f"Buyer Name: Buyer {n}\r\n"
+        f"Contact Number: +91-98765432{n:02d}\r\n"
+    ).encode()
+
+
+# =========================================================
+# LOCAL IMAP STAND-IN
+# =========================================================
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """Just enough IMAP4rev1 (+IDLE) for the ingest service."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeImapHandler)
+        self.lock = threading.Lock()
+        self.messages = []          # [(uid, raw bytes)]
+        self.uidvalidity = 1
+        self.next_uid = 1
+        self.logins = 0
+        self.commands = []
+        self.idlers = []
+        self.handlers = []
+
+    def deliver(self, raw):
+        with self.lock:
+            self.messages.append((self.next_uid, raw))
+            self.next_uid += 1
+            exists = len(self.messages)
+            idlers = list(self.idlers)
+        for handler in idlers:
+            handler.send(f"* {exists} EXISTS")
+
+    def drop_connections(self):
+        for handler in list(self.handlers):
+            handler.connection.shutdown(socket.SHUT_RDWR)
+
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+
+    def send(self, line):
+        with self.server.lock:
+            self.wfile.write(line.encode() + b"\r\n")
+
+    def send_raw(self, data):
+        with self.server.lock:
+            self.wfile.write(data)
+
+    def handle(self):
+        server = self.server
+        server.handlers.append(self)
+        self.send("* OK [CAPABILITY IMAP4rev1 IDLE] fake ready")
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                tag, _, rest = line.decode().rstrip("\r\n").partition(" ")
+                command, _, args = rest.partition(" ")
+                command = command.upper()
+                server.commands.append(rest)
+
+                if command == "CAPABILITY":
+                    self.send("* CAPABILITY IMAP4rev1 IDLE")
+                    self.send(f"{tag} OK done")
+                elif command == "LOGIN":
+                    server.logins += 1
+                    self.send(f"{tag} OK logged in")
+                elif command in ("SELECT", "EXAMINE"):
+                    self.send(f"* {len(server.messages)} EXISTS")
+                    self.send(f"* OK [UIDVALIDITY {server.uidvalidity}]")
+                    self.send(f"* OK [UIDNEXT {server.next_uid}]")
+                    mode = "READ-ONLY" if command == "EXAMINE" else "READ-WRITE"
+                    self.send(f"{tag} OK [{mode}] selected")
+                elif command == "UID":
+                    self.handle_uid(tag, args)
+                elif command == "IDLE":
+                    server.idlers.append(self)
+                    self.send("+ idling")
+                    done = self.rfile.readline()
+                    server.idlers.remove(self)
+                    if not done:
+                        return
+                    self.send(f"{tag} OK IDLE terminated")
+                elif command in ("NOOP", "CLOSE"):
+                    self.send(f"{tag} OK done")
+                elif command == "LOGOUT":
+                    self.send("* BYE")
+                    self.send(f"{tag} OK bye")
+                    return
+                else:
+                    self.send(f"{tag} BAD unknown command")
+        except OSError:
+            return
+        finally:
+            server.handlers.remove(self)
+
+    def handle_uid(self, tag, args):
+        server = self.server
+        sub, _, args = args.partition(" ")
+        uids = [uid for uid, _ in server.messages]
+        if sub.upper() == "SEARCH":
+            start = int(re.search(r"UID (\d+):\*", args).group(1))
+            found = [u for u in uids if u >= start] or uids[-1:]
+            self.send("* SEARCH " + " ".join(str(u) for u in found))
+        elif sub.upper() == "FETCH":
+            uid_spec, _, _ = args.partition(" ")
+            wanted = set()
+            for part in uid_spec.split(","):
+                lo, _, hi = part.partition(":")
+                wanted.update(range(int(lo), int(hi or lo) + 1))
+            for seq, (uid, raw) in enumerate(server.messages, start=1):
+                if uid not in wanted:
+                    continue
+                header, _, text = raw.partition(b"\r\n\r\n")
+                header += b"\r\n\r\n"
+                self.send_raw(
+                    f"* {seq} FETCH (UID {uid} BODY[HEADER.FIELDS (MESSAGE-ID)] {{{len(header)}}}\r\n".encode()
+                    + header + f" BODY[TEXT] {{{len(text)}}}\r\n".encode() + text + b")\r\n"
+                )
+        self.send(f"{tag} OK done")
+
+
+@patch('app.services.lead_ingestor.POST_INSERT_HOOKS', [])
+class TestImapIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeImapServer()
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        self.app.config["IMAP_POOL_NOOP_AFTER_SECONDS"] = 0
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        db.session.add(User(name="Agent", email="a@acme.test", password_hash="x", admin_id=admin.id))
+        self.settings = MagicbricksSettings(
+            admin_id=admin.id, imap_host=f"127.0.0.1:{self.port}",
+            email_id="leads@acme.test", app_password="secret"
+        )
+        db.session.add(self.settings)
+        db.session.commit()
+
+    def tearDown(self):
+        pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def connect(self, settings):
+        mail = imaplib.IMAP4("127.0.0.1", self.port)
+        mail.login(settings.email_id, settings.app_password)
+        return mail
+
+    def sync(self):
+        return sync_mailbox(self.settings, "magicbricks", "MAGICBRICKS", SEARCH_CRITERIA, build_lead, self.connect)
+
+    def test_uid_set(self):
+        self.assertEqual(uid_set([9, 1, 2, 3, 7, 10]), "1:3,7,9:10")
+        self.assertEqual(uid_set([5]), "5")
+
+    def fetches(self):
+        return [c for c in self.server.commands if c.startswith("UID FETCH")]
+
+    def test_incremental_sync_on_pooled_connection(self):
+        for n in range(3):
+            self.server.deliver(lead_mail(n))
+
+        result = self.sync()
+        self.assertEqual(result["added"], 3)
+        self.assertEqual(self.settings.imap_last_uid, 3)
+        self.assertEqual(self.settings.imap_uidvalidity, 1)
+        # Read-only select, one FETCH of headers + text (never RFC822, never \Seen)
+        self.assertIn("EXAMINE inbox", self.server.commands)
+        self.assertEqual(len(self.fetches()), 1)
+        self.assertTrue(self.fetches()[0].startswith("UID FETCH 1:3 (UID BODY.PEEK[HEADER.FIELDS"))
+        self.assertIn("BODY.PEEK[TEXT]", self.fetches()[0])
+        lead = Lead.query.filter_by(phone="9876543200").one()
+        self.assertEqual(lead.name, "Buyer 0")
+
+        # Nothing new: UIDNEXT says so, no SEARCH/FETCH issued
+        self.server.commands.clear()
+        self.assertEqual(self.sync()["added"], 0)
+        self.assertFalse([c for c in self.server.commands if c.startswith("UID")])
+
+        self.server.deliver(lead_mail(3))
+        result = self.sync()
+        self.assertEqual(result["added"], 1)
+        self.assertEqual(self.settings.imap_last_uid, 4)
+        self.assertEqual(Lead.query.count(), 4)
+
+        # One login for all three passes
+        self.assertEqual(self.server.logins, 1)
+
+    def test_burst_is_fetched_in_batches(self):
+        self.app.config["IMAP_BATCH_SIZE"] = 2
+        for n in range(5):
+            self.server.deliver(lead_mail(n))
+
+        result = self.sync()
+        self.assertEqual(result["added"], 5)
+        self.assertEqual(self.settings.imap_last_uid, 5)
+        self.assertEqual([c.split(" ")[2] for c in self.fetches()], ["1:2", "3:4", "5"])
+
+    def test_uidvalidity_change_rescans_without_duplicates(self):
+        for n in range(2):
+            self.server.deliver(lead_mail(n))
+        self.sync()
+
+        # Mailbox rebuilt by the server: same mails, new UIDs
+        self.server.uidvalidity = 2
+        self.server.messages = [(uid + 10, raw) for uid, raw in self.server.messages]
+        self.server.next_uid = 13
+        self.server.deliver(lead_mail(2))
+
+        result = self.sync()
+        self.assertEqual(result["added"], 1)
+        self.assertEqual(result["skipped"], 2)
+        self.assertEqual(self.settings.imap_uidvalidity, 2)
+        self.assertEqual(self.settings.imap_last_uid, 13)
+        self.assertIn("SINCE", [c for c in self.server.commands if c.startswith("UID SEARCH")][-1])
+
+    def test_reconnects_after_dropped_connection(self):
+        self.server.deliver(lead_mail(0))
+        self.sync()
+        self.server.drop_connections()
+
+        self.server.deliver(lead_mail(1))
+        self.assertEqual(self.sync()["added"], 1)
+        self.assertEqual(self.server.logins, 2)
+
+    def test_idle_wakes_on_new_mail(self):
+        mail = self.connect(self.settings)
+        mail.select("inbox", readonly=True)
+
+        self.assertFalse(idle_wait(mail, 0.2))
+
+        timer = threading.Timer(0.2, self.server.deliver, args=[lead_mail(0)])
+        timer.start()
+        self.assertTrue(idle_wait(mail, 5))
+        timer.join()
+
+        # The connection is usable again after DONE
+        self.assertEqual(mail.noop()[0], "OK")
+        mail.logout()
+
+    def test_watchers_are_capped(self):
+        class Watcher:
+            def __init__(self, app, provider, admin_id):
+                self.unsupported = False
+            start = keep_alive = stop = lambda self: None
+            is_alive = lambda self: True
+
+        self.app.config.update({"IMAP_IDLE_MAX_WATCHERS": 5, "IMAP_IDLE_STARTS_PER_RUN": 3})
+        self.addCleanup(imap_ingest._watchers.clear)
+        with patch.object(imap_ingest, "MailboxWatcher", Watcher), \
+                patch.object(imap_ingest, "list_tenants", lambda name: [1, 2] if name == "magicbricks" else []):
+            self.assertEqual(refresh_mailbox_watchers(self.app), 2)
+            self.assertEqual(len(imap_ingest._watchers), 2)
+
+        tenants = lambda name: list(range(1, 10)) if name == "magicbricks" else []
+        with patch.object(imap_ingest, "MailboxWatcher", Watcher), \
+                patch.object(imap_ingest, "list_tenants", tenants):
+            refresh_mailbox_watchers(self.app)
+            self.assertEqual(len(imap_ingest._watchers), 5)   # 3 logins per run
+            self.assertIn(("magicbricks", 1), imap_ingest._watchers)
+            refresh_mailbox_watchers(self.app)
+            self.assertEqual(len(imap_ingest._watchers), 5)   # the rest are polled
+
+
+if __name__ == '__main__':
+    unittest.main()
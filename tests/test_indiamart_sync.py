@@ -0,0 +1,190 @@
+
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from app.models import db, Admin, User, Lead, IndiamartSettings, now
+from app.utils import rate_limit
+from app.utils.rate_limit import TokenBucket
+from app.services.indiamart_service import (
+    sync_admin_leads, sync_admin_backfill, start_backfill, time_slices, API_TIME_FORMAT, API_UTC_OFFSET
+)
+
+
+class FakeCrmListing:
+    """Stand-in for the crmListing endpoint: filters enquiries by the IST window."""
+
+    def __init__(self, query_times, cap=None):
+        self.query_times = query_times     # naive UTC
+        self.cap = cap
+        self.calls = []
+        self.rate_limited = False
+
+    def __call__(self, url, json=None, timeout=None):
+        start = datetime.strptime(json["start_time"], API_TIME_FORMAT) - API_UTC_OFFSET
+        end = datetime.strptime(json["end_time"], API_TIME_FORMAT) - API_UTC_OFFSET
+        self.calls.append((start, end))
+
+        resp = MagicMock(status_code=200)
+        if self.rate_limited:
+            resp.json.return_value = {"STATUS": "FAILURE", "CODE": "429", "MESSAGE": "Try after 5 minutes"}
+            return resp
+
+        rows = [
+            {
+                "UNIQUE_QUERY_ID": str(i),
+                "SENDER_NAME": f"Buyer {i}",
+                "SENDER_MOBILE": f"+91-98765{i:05d}",
+                "QUERY_TIME": (t + API_UTC_OFFSET).strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            for i, t in enumerate(self.query_times) if start <= t <= end
+        ]
+        if not rows:
+            resp.json.return_value = {"STATUS": "FAILURE", "CODE": "204", "MESSAGE": "No Data Found"}
+        else:
+            resp.json.return_value = {"STATUS": "SUCCESS", "CODE": "200", "RESPONSE": rows[:self.cap]}
+        return resp
+
+
+class TestIndiamartSync(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        self.app.config["SECRET_KEY"] = "test"
+        self.app.config["INDIAMART_WINDOW_HOURS"] = 24
+        self.app.config["INDIAMART_CALL_BURST"] = 10
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        db.session.add(User(name="Agent", email="a@acme.test", password_hash="x", admin_id=admin.id))
+        self.settings = IndiamartSettings(admin_id=admin.id, mobile_number="9000000000")
+        self.settings.set_api_key("key")
+        db.session.add(self.settings)
+        db.session.commit()
+        self.admin_id = admin.id
+
+        rate_limit._buckets.clear()
+        self.hooks = patch('app.services.lead_ingestor.POST_INSERT_HOOKS', [])
+        self.hooks.start()
+
+    def tearDown(self):
+        self.hooks.stop()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def sync(self, api, func=sync_admin_leads):
+        with patch('app.services.indiamart_service.requests.post', side_effect=api):
+            return func(self.admin_id)
+
+    def test_time_slices(self):
+        start = datetime(2026, 1, 1)
+        self.assertEqual(
+            time_slices(start, start + timedelta(hours=50), timedelta(hours=24)),
+            [(start, start + timedelta(hours=24)),
+             (start + timedelta(hours=24), start + timedelta(hours=48)),
+             (start + timedelta(hours=48), start + timedelta(hours=50))]
+        )
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=0.001, capacity=2)
+        self.assertTrue(bucket.try_acquire(reserve=1))
+        self.assertFalse(bucket.try_acquire(reserve=1))
+        self.assertTrue(bucket.try_acquire())
+        self.assertFalse(bucket.try_acquire())
+
+    def test_gap_is_split_into_windows(self):
+        self.settings.last_sync_time = now() - timedelta(hours=60)
+        db.session.commit()
+        api = FakeCrmListing([now() - timedelta(hours=h) for h in (50, 30, 2)])
+
+        result = self.sync(api)
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(result["added"], 3)
+        self.assertFalse(result["pending"])
+        self.assertEqual(len(api.calls), 3)
+        self.assertTrue(all(end - start <= timedelta(hours=24) for start, end in api.calls))
+        self.assertEqual(Lead.query.filter_by(source="indiamart").count(), 3)
+
+    def test_capped_window_is_split(self):
+        self.settings.last_sync_time = now() - timedelta(hours=10)
+        db.session.commit()
+        self.app.config["INDIAMART_MAX_RESULTS_PER_CALL"] = 3
+        api = FakeCrmListing([now() - timedelta(hours=h) for h in (9, 8, 3, 1)], cap=3)
+
+        result = self.sync(api)
+        self.assertEqual(result["added"], 4)
+        self.assertEqual(len(api.calls), 3)  # full window, then both halves
+
+    def test_resumes_from_checkpoint_when_out_of_calls(self):
+        self.app.config["INDIAMART_CALL_BURST"] = 1
+        self.settings.last_sync_time = now() - timedelta(hours=40)
+        db.session.commit()
+        api = FakeCrmListing([now() - timedelta(hours=h) for h in (30, 2)])
+
+        result = self.sync(api)
+        self.assertEqual(result["added"], 1)
+        self.assertTrue(result["pending"])
+        checkpoint = self.settings.last_sync_time
+        self.assertLess(checkpoint, now() - timedelta(hours=10))
+
+        rate_limit._buckets.clear()
+        result = self.sync(api)
+        self.assertEqual(result["added"], 1)
+        self.assertFalse(result["pending"])
+        # The API takes whole seconds
+        self.assertEqual(api.calls[1][0], (checkpoint - timedelta(minutes=5)).replace(microsecond=0))
+
+    def test_rate_limit_reply_stops_without_moving_checkpoint(self):
+        self.settings.last_sync_time = now() - timedelta(hours=1)
+        db.session.commit()
+        before = self.settings.last_sync_time
+        api = FakeCrmListing([])
+        api.rate_limited = True
+
+        result = self.sync(api)
+        self.assertTrue(result["pending"])
+        self.assertEqual(self.settings.last_sync_time, before)
+
+    def test_backfill_keeps_query_time_and_spares_a_call(self):
+        self.app.config["INDIAMART_CALL_BURST"] = 2
+        start = now() - timedelta(days=3)
+        api = FakeCrmListing([now() - timedelta(hours=h) for h in (70, 50, 20)])
+        start_backfill(self.settings, start, now() - timedelta(hours=1))
+
+        result = self.sync(api, sync_admin_backfill)
+        self.assertEqual(result["message"], "Backfill in progress")
+        self.assertEqual(len(api.calls), 1)   # one token left for the regular sync
+        self.assertTrue(self.settings.backfill_active)
+
+        rate_limit._buckets.clear()
+        self.app.config["INDIAMART_CALL_BURST"] = 10
+        result = self.sync(api, sync_admin_backfill)
+        self.assertEqual(result["message"], "Backfill complete")
+        self.assertFalse(self.settings.backfill_active)
+
+        leads = Lead.query.order_by(Lead.created_at).all()
+        self.assertEqual(len(leads), 3)
+        self.assertLess(leads[0].created_at, now() - timedelta(hours=69))
+
+    def test_backfill_range_validation(self):
+        with self.assertRaises(ValueError):
+            start_backfill(self.settings, now(), now() - timedelta(days=1))
+        with self.assertRaises(ValueError):
+            start_backfill(self.settings, now() - timedelta(days=400), now())
+
+
+if __name__ == '__main__':
+    unittest.main()
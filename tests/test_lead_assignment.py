@@ -0,0 +1,125 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+from collections import Counter
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from app.models import db, Admin, User, Lead, LeadAssignmentCursor
+from app.services.lead_assignment import (
+    assign_leads, assign_lead, update_assignment_config, _weighted_sequence
+)
+
+
+class TestLeadAssignment(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(self.admin)
+        db.session.flush()
+
+        self.agents = []
+        for i in range(3):
+            agent = User(name=f"Agent {i}", email=f"a{i}@acme.test", password_hash="x", admin_id=self.admin.id)
+            db.session.add(agent)
+            self.agents.append(agent)
+        blocked = User(name="Blocked", email="b@acme.test", password_hash="x",
+                       admin_id=self.admin.id, status="blocked")
+        db.session.add(blocked)
+        db.session.commit()
+        self.ids = [a.id for a in self.agents]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_round_robin_batch_and_continuation(self):
+        first = assign_leads(self.admin.id, 4, source="magicbricks")
+        db.session.commit()
+        second = assign_leads(self.admin.id, 2)
+        db.session.commit()
+
+        self.assertEqual(first, [self.ids[0], self.ids[1], self.ids[2], self.ids[0]])
+        self.assertEqual(second, [self.ids[1], self.ids[2]])
+
+        cursor = LeadAssignmentCursor.query.filter_by(admin_id=self.admin.id).one()
+        self.assertEqual(cursor.position, 6)
+        self.assertEqual(cursor.last_agent_id, self.ids[2])
+
+    def test_cursor_resumes_after_last_assigned_lead(self):
+        db.session.add(Lead(admin_id=self.admin.id, name="Old", assigned_to=self.ids[1]))
+        db.session.commit()
+
+        self.assertEqual(assign_lead(self.admin.id), self.ids[2])
+
+    def test_failed_assignment_keeps_the_transaction_usable(self):
+        def broken(cursor, agent_ids, count, source, admin_id):
+            cursor.position = 99
+            db.session.flush()
+            raise RuntimeError("strategy failed")
+
+        db.session.add(Lead(admin_id=self.admin.id, name="Before"))
+        with patch.dict("app.services.lead_assignment.STRATEGIES", {"round_robin": broken}):
+            self.assertIsNone(assign_lead(self.admin.id))
+        db.session.add(Lead(admin_id=self.admin.id, name="After"))
+        db.session.commit()
+
+        self.assertEqual(Lead.query.count(), 2)
+        self.assertIsNone(LeadAssignmentCursor.query.filter_by(admin_id=self.admin.id).first())
+
+    def test_no_agents_leaves_leads_unassigned(self):
+        User.query.update({User.status: "blocked"})
+        db.session.commit()
+        self.assertEqual(assign_leads(self.admin.id, 2), [None, None])
+
+    def test_weighted(self):
+        update_assignment_config(self.admin.id, strategy="weighted",
+                                 weights={str(self.ids[0]): 2, str(self.ids[1]): 1, str(self.ids[2]): 0})
+        counts = Counter(assign_leads(self.admin.id, 30))
+        self.assertEqual(counts[self.ids[0]], 20)
+        self.assertEqual(counts[self.ids[1]], 10)
+        self.assertEqual(counts[self.ids[2]], 0)
+
+    def test_weighted_sequence_interleaves(self):
+        self.assertEqual(_weighted_sequence([1, 2], {"1": 2, "2": 1}), [1, 2, 1])
+
+    def test_least_loaded(self):
+        for _ in range(3):
+            db.session.add(Lead(admin_id=self.admin.id, assigned_to=self.ids[0], status="new"))
+        db.session.add(Lead(admin_id=self.admin.id, assigned_to=self.ids[1], status="new"))
+        # Closed leads do not count towards load
+        db.session.add(Lead(admin_id=self.admin.id, assigned_to=self.ids[2], status="Won"))
+        db.session.commit()
+
+        update_assignment_config(self.admin.id, strategy="least_loaded")
+        self.assertEqual(assign_leads(self.admin.id, 3), [self.ids[2], self.ids[1], self.ids[2]])
+
+    def test_by_source(self):
+        update_assignment_config(self.admin.id, strategy="by_source",
+                                 source_rules={"Facebook": [self.ids[2], self.ids[1]]})
+        self.assertEqual(assign_leads(self.admin.id, 3, source="facebook"),
+                         [self.ids[2], self.ids[1], self.ids[2]])
+        # Sources without a rule fall back to round robin over everyone
+        self.assertEqual(assign_leads(self.admin.id, 1, source="housing"), [self.ids[0]])
+
+    def test_rejects_unknown_strategy_and_agents(self):
+        with self.assertRaises(ValueError):
+            update_assignment_config(self.admin.id, strategy="random")
+        with self.assertRaises(ValueError):
+            update_assignment_config(self.admin.id, weights={"9999": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from app.models import db, Admin, User, Lead, LeadStatusHistory, ProcessedEmail
+from app.services.lead_ingestor import LeadIngestor, ingest_email_leads, record_initial_status
+from app.services.ninety_nine_acres_service import build_lead
+
+
+def make_email(body, subject="New Lead"):
+    msg = EmailMessage()
+    msg["Subject"] = subject
+    msg.set_content(body)
+    return msg
+
+
+@patch('app.services.lead_ingestor.POST_INSERT_HOOKS', [])
+class TestLeadIngestor(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(self.admin)
+        db.session.flush()
+        self.agents = [
+            User(name=f"Agent {i}", email=f"a{i}@acme.test", password_hash="x", admin_id=self.admin.id)
+            for i in range(2)
+        ]
+        db.session.add_all(self.agents)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_batch_insert_assigns_round_robin(self):
+        result = LeadIngestor(self.admin.id, "indiamart").ingest([
+            {"facebook_lead_id": "IM_1", "name": "A", "phone": "9000000001", "_ref": "1"},
+            {"facebook_lead_id": "IM_2", "name": "B", "phone": "9000000002", "_ref": "2"},
+            {"facebook_lead_id": "IM_3", "name": "C", "phone": "9000000003", "_ref": "3"},
+        ])
+
+        self.assertEqual(result["added"], 3)
+        leads = Lead.query.order_by(Lead.id).all()
+        self.assertEqual([l.id for l in leads], result["lead_ids"])
+        self.assertEqual([l.assigned_to for l in leads],
+                         [self.agents[0].id, self.agents[1].id, self.agents[0].id])
+        self.assertTrue(all(l.source == "indiamart" and l.status == "new" for l in leads))
+        self.assertEqual([r["ref"] for r in result["results"]], ["1", "2", "3"])
+
+    def test_dedupes_external_id_and_phone_per_day(self):
+        LeadIngestor(self.admin.id, "99acres").ingest([
+            {"facebook_lead_id": "X_1", "phone": "9876543210"},
+        ])
+
+        result = LeadIngestor(self.admin.id, "99acres").ingest([
+            {"facebook_lead_id": "X_1", "phone": "9111111111", "_ref": "same-id"},
+            {"phone": "+91 98765-43210", "_ref": "same-phone-today"},
+            {"phone": "9876543210", "created_at": datetime.utcnow() + timedelta(days=1), "_ref": "tomorrow"},
+            {"phone": "9222222222", "_ref": "new"},
+            {"phone": "9222222222", "_ref": "dup-in-batch"},
+        ])
+
+        statuses = {r["ref"]: r["status"] for r in result["results"]}
+        self.assertEqual(statuses, {
+            "same-id": "duplicate",
+            "same-phone-today": "duplicate",
+            "tomorrow": "inserted",
+            "new": "inserted",
+            "dup-in-batch": "duplicate",
+        })
+        self.assertEqual(Lead.query.count(), 3)
+
+    def test_phone_dedupe_is_per_source(self):
+        LeadIngestor(self.admin.id, "housing").ingest([{"phone": "9876543210"}])
+        result = LeadIngestor(self.admin.id, "justdial").ingest([{"phone": "9876543210"}])
+        self.assertEqual(result["added"], 1)
+
+    def test_initial_status_hook(self):
+        result = LeadIngestor(self.admin.id, "facebook").ingest([{"facebook_lead_id": "fb1"}])
+        record_initial_status(self.admin.id, result["lead_ids"])
+        history = LeadStatusHistory.query.all()
+        self.assertEqual(len(history), 1)
+        self.assertEqual(history[0].new_status, "new")
+
+    def test_ingest_email_leads(self):
+        body = "Name: Test User\nMobile: +91-9999999999\nLocation: Pune"
+        messages = [
+            ("<m1@99acres>", make_email(body)),
+            ("<m1@99acres>", make_email(body)),            # same Message-ID twice in one fetch
+            ("<m2@99acres>", make_email("Hello, no lead here")),
+        ]
+        result = ingest_email_leads(self.admin.id, "99acres", "99ACRES", messages, build_lead)
+
+        self.assertEqual(result["added"], 1)
+        self.assertEqual(result["skipped"], 1)
+        self.assertEqual(result["ignored"], 1)
+        lead = Lead.query.one()
+        self.assertEqual(lead.phone, "9999999999")
+        self.assertEqual(lead.location, "Pune")
+        self.assertEqual([p.message_id for p in ProcessedEmail.query.all()], ["<m1@99acres>"])
+
+        # Second sync of the same mailbox is a no-op
+        again = ingest_email_leads(self.admin.id, "99acres", "99ACRES", messages[:1], build_lead)
+        self.assertEqual((again["added"], again["skipped"]), (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import datetime
+import email
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from app.models import db, Admin, User, ProcessedEmail, now
+from app.services import processed_email_cache
+from app.services.processed_email_cache import BloomFilter, warm, find_processed, prune_processed_emails
+from app.services.lead_ingestor import ingest_email_leads
+
+
+def lead_message(n):
+    return email.message_from_string(f"Buyer Name: Buyer {n}\nContact Number: 98765432{n:02d}\n")
+
+
+def build_lead(msg):
+    body = msg.get_payload()
+    return {"name": body.split("\n")[0].split(": ")[1], "phone": body.split("\n")[1].split(": ")[1]}
+
+
+@patch('app.services.lead_ingestor.POST_INSERT_HOOKS', [])
+class TestProcessedEmailCache(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        self.app.config["PROCESSED_EMAIL_RETENTION_DAYS"] = 30
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        db.session.add(User(name="Agent", email="a@acme.test", password_hash="x", admin_id=admin.id))
+        db.session.commit()
+        self.admin_id = admin.id
+        processed_email_cache.forget()
+
+        self.statements = []
+        event.listen(db.engine, "before_cursor_execute", self._record)
+
+    def tearDown(self):
+        event.remove(db.engine, "before_cursor_execute", self._record)
+        processed_email_cache.forget()
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def _record(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def processed_lookups(self):
+        return [s for s in self.statements if s.lstrip().startswith("SELECT processed_emails.message_id")]
+
+    def record(self, message_id, days_ago=0):
+        db.session.add(ProcessedEmail(
+            admin_id=self.admin_id, message_id=message_id, lead_source="MAGICBRICKS",
+            processed_at=now() - datetime.timedelta(days=days_ago)
+        ))
+        db.session.commit()
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000)
+        for n in range(1000):
+            bloom.add(f"<{n}@portal.test>")
+        self.assertTrue(all(f"<{n}@portal.test>" in bloom for n in range(1000)))
+        false_positives = sum(f"<other{n}@portal.test>" in bloom for n in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_new_batch_needs_no_lookup(self):
+        for n in range(5):
+            self.record(f"<old{n}@portal.test>")
+        warm(self.admin_id)
+
+        self.statements.clear()
+        self.assertEqual(find_processed(self.admin_id, [f"<new{n}@portal.test>" for n in range(50)]), set())
+        self.assertEqual(self.processed_lookups(), [])
+
+        found = find_processed(self.admin_id, ["<old1@portal.test>", "<new1@portal.test>", "<old3@portal.test>"])
+        self.assertEqual(found, {"<old1@portal.test>", "<old3@portal.test>"})
+        self.assertEqual(len(self.processed_lookups()), 1)
+
+    def test_cold_tenant_checks_database(self):
+        self.record("<old@portal.test>")
+        self.assertEqual(find_processed(self.admin_id, ["<old@portal.test>", "<new@portal.test>"]), {"<old@portal.test>"})
+        self.assertEqual(len(self.processed_lookups()), 1)
+
+    def test_refresh_picks_up_rows_from_other_processes(self):
+        warm(self.admin_id)
+        self.record("<elsewhere@portal.test>")
+        self.assertEqual(find_processed(self.admin_id, ["<elsewhere@portal.test>"]), set())
+
+        warm(self.admin_id)
+        self.assertEqual(find_processed(self.admin_id, ["<elsewhere@portal.test>"]), {"<elsewhere@portal.test>"})
+
+    def test_ingest_skips_processed_and_remembers_new(self):
+        warm(self.admin_id)
+        messages = [(f"<m{n}@portal.test>", lead_message(n)) for n in range(3)]
+
+        result = ingest_email_leads(self.admin_id, "magicbricks", "MAGICBRICKS", messages, build_lead)
+        self.assertEqual(result["added"], 3)
+
+        self.statements.clear()
+        result = ingest_email_leads(self.admin_id, "magicbricks", "MAGICBRICKS", messages, build_lead)
+        self.assertEqual(result["added"], 0)
+        self.assertEqual(result["skipped"], 3)
+        self.assertEqual(len(self.processed_lookups()), 1)
+
+    def test_unpruned_old_rows_are_still_skipped(self):
+        self.record("<m0@portal.test>", days_ago=45)   # past retention, not pruned yet
+        warm(self.admin_id)
+        self.assertEqual(find_processed(self.admin_id, ["<m0@portal.test>"]), {"<m0@portal.test>"})
+
+        # Recorded by another process after the filter was loaded
+        self.record("<m1@portal.test>")
+        messages = [(f"<m{n}@portal.test>", lead_message(n)) for n in range(3)]
+        result = ingest_email_leads(self.admin_id, "magicbricks", "MAGICBRICKS", messages, build_lead)
+        self.assertEqual((result["added"], result["skipped"]), (1, 2))
+        self.assertEqual(ProcessedEmail.query.count(), 3)
+
+    def test_prune_removes_rows_past_retention(self):
+        self.record("<recent@portal.test>", days_ago=5)
+        self.record("<old@portal.test>", days_ago=45)
+        self.record("<older@portal.test>", days_ago=400)
+
+        self.assertEqual(prune_processed_emails(self.app), 2)
+        self.assertEqual([p.message_id for p in ProcessedEmail.query.all()], ["<recent@portal.test>"])
+
+
+if __name__ == '__main__':
+    unittest.main()
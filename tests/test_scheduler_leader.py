@@ -0,0 +1,72 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+from datetime import timedelta
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from app.models import db, SchedulerLease, now
+from app.services.scheduler_leader import acquire_lease, release_lease, SchedulerLeader
+
+
+class TestSchedulerLease(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        self.app.config["SCHEDULER_LEASE_SECONDS"] = 60
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_single_holder(self):
+        self.assertTrue(acquire_lease("web-1", 60))
+        self.assertFalse(acquire_lease("web-2", 60))
+        # The holder renews
+        self.assertTrue(acquire_lease("web-1", 60))
+        self.assertEqual(SchedulerLease.query.one().holder, "web-1")
+
+    def test_expired_lease_is_taken_over(self):
+        acquire_lease("web-1", 60)
+        lease = SchedulerLease.query.one()
+        lease.expires_at = now() - timedelta(seconds=1)
+        db.session.commit()
+
+        self.assertTrue(acquire_lease("web-2", 60))
+        self.assertFalse(acquire_lease("web-1", 60))
+
+    def test_release_hands_over(self):
+        acquire_lease("web-1", 60)
+        release_lease("web-2")  # not the holder: no-op
+        self.assertFalse(acquire_lease("web-2", 60))
+        release_lease("web-1")
+        self.assertTrue(acquire_lease("web-2", 60))
+
+    @patch("app.scheduler")
+    def test_leader_pauses_and_resumes_jobs(self, scheduler):
+        leader = SchedulerLeader(self.app, holder="web-1")
+        follower = SchedulerLeader(self.app, holder="web-2")
+
+        self.assertTrue(leader.tick())
+        scheduler.resume.assert_called_once()
+        self.assertFalse(follower.tick())
+        scheduler.pause.assert_not_called()
+
+        leader.step_down()
+        scheduler.pause.assert_called_once()
+        self.assertTrue(follower.tick())
+        self.assertEqual(scheduler.resume.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+
+import unittest
+import sys
+import os
+from datetime import datetime
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from app.models import db, Admin, User, Lead, CallHistory, WAContact
+from app.services.search_service import unified_search, phone_digits, apply_search
+
+
+class TestSearchSqliteFallback(unittest.TestCase):
+    """Runs the search service against SQLite (LIKE fallback, no pg_trgm)."""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        self.other_admin = Admin(name="Other", email="admin@other.test", password_hash="x")
+        db.session.add_all([self.admin, self.other_admin])
+        db.session.flush()
+
+        self.agent = User(name="Ravi Kumar", email="ravi@acme.test", password_hash="x", admin_id=self.admin.id)
+        other_agent = User(name="Zed", email="zed@other.test", password_hash="x", admin_id=self.other_admin.id)
+        db.session.add_all([self.agent, other_agent])
+        db.session.flush()
+
+        db.session.add_all([
+            Lead(admin_id=self.admin.id, name="Priya Sharma", phone="9876543210", email="priya_s@mail.test",
+                 location="Whitefield", assigned_to=self.agent.id),
+            Lead(admin_id=self.admin.id, name="Sharma Traders", phone="9123498765", location="Pune"),
+            Lead(admin_id=self.other_admin.id, name="Priya Other", phone="9876543211"),
+            CallHistory(user_id=self.agent.id, phone_number="+919876543210", contact_name="Priya Sharma",
+                        call_type="outgoing", timestamp=datetime(2026, 1, 5, 10, 0)),
+            CallHistory(user_id=other_agent.id, phone_number="9876543210", contact_name="Priya",
+                        call_type="incoming", timestamp=datetime(2026, 1, 5, 11, 0)),
+            WAContact(admin_id=self.admin.id, phone_number="919876543210", profile_name="Priya S"),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_phone_digits(self):
+        self.assertEqual(phone_digits("+91 98765 43210"), "9876543210")
+        self.assertEqual(phone_digits("98765"), "98765")
+        self.assertIsNone(phone_digits("priya"))
+        self.assertIsNone(phone_digits("12"))
+
+    def test_results_are_tenant_scoped(self):
+        results = unified_search(self.admin.id, "priya")
+        names = [r["name"] for r in results["leads"]]
+        self.assertEqual(names, ["Priya Sharma"])
+        self.assertEqual(len(results["calls"]), 1)
+        self.assertEqual(results["calls"][0]["user_name"], "Ravi Kumar")
+        self.assertEqual(len(results["contacts"]), 1)
+
+    def test_phone_prefix_ranks_first(self):
+        results = unified_search(self.admin.id, "98765", types=("leads",))
+        phones = [r["phone"] for r in results["leads"]]
+        # Both contain 98765; the prefix match must rank above the infix match
+        self.assertEqual(phones, ["9876543210", "9123498765"])
+
+    def test_formatted_phone_matches_digits(self):
+        results = unified_search(self.admin.id, "+91 98765-43210", types=("leads", "contacts"))
+        self.assertEqual([r["phone"] for r in results["leads"]], ["9876543210"])
+        self.assertEqual(len(results["contacts"]), 1)
+
+    def test_digits_match_formatted_stored_phones(self):
+        db.session.add_all([
+            Lead(admin_id=self.admin.id, name="Anil", phone="+91 99887 76655"),
+            CallHistory(user_id=self.agent.id, phone_number="99887-76655", call_type="incoming",
+                        timestamp=datetime(2026, 1, 6, 9, 0)),
+        ])
+        db.session.commit()
+
+        results = unified_search(self.admin.id, "9988776655", types=("leads", "calls"))
+        self.assertEqual([r["phone"] for r in results["leads"]], ["+91 99887 76655"])
+        self.assertEqual([r["phone_number"] for r in results["calls"]], ["99887-76655"])
+        self.assertGreaterEqual(results["leads"][0]["score"], 80)
+
+    def test_agent_scope_excludes_contacts_and_other_leads(self):
+        results = unified_search(self.admin.id, "sharma", agent_id=self.agent.id)
+        self.assertEqual([r["name"] for r in results["leads"]], ["Priya Sharma"])
+        self.assertNotIn("contacts", results)
+
+    def test_like_wildcards_are_literal(self):
+        query = apply_search(Lead.query, "priya_s", [Lead.email])
+        self.assertEqual(query.count(), 1)
+        query = apply_search(Lead.query, "%", [Lead.name])
+        self.assertEqual(query.count(), 0)
+
+    def test_short_term_returns_nothing(self):
+        self.assertEqual(unified_search(self.admin.id, "p"), {})
+        self.assertEqual(unified_search(self.admin.id, "pr"), {})   # below the trigram minimum
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+
+import unittest
+import sys
+import os
+import time
+import threading
+from datetime import timedelta
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy.pool import StaticPool
+from app.models import db, Admin, MagicbricksSettings, TenantSyncState, now
+from app.services import sync_orchestrator
+from app.services.sync_orchestrator import (
+    register_provider, submit_tenant_sync, list_tenants, get_sync_status, _claim
+)
+
+
+class TestSyncOrchestrator(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "poolclass": StaticPool, "connect_args": {"check_same_thread": False}
+        }
+        self.app.config["SYNC_PROVIDER_CONCURRENCY"] = 1
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.admins = []
+        for i, active in enumerate([True, True, False]):
+            admin = Admin(name=f"A{i}", email=f"a{i}@x.test", password_hash="x", is_active=active)
+            db.session.add(admin)
+            db.session.flush()
+            db.session.add(MagicbricksSettings(admin_id=admin.id, email_id="m@x.test",
+                                               app_password="x", is_active=True))
+            self.admins.append(admin)
+        db.session.commit()
+
+        sync_orchestrator._queues.clear()
+        sync_orchestrator._active.clear()
+
+    def tearDown(self):
+        sync_orchestrator.PROVIDERS.pop("test", None)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_list_tenants_skips_inactive_admins(self):
+        self.assertEqual(list_tenants("magicbricks"), [self.admins[0].id, self.admins[1].id])
+
+    def test_unknown_provider(self):
+        with self.assertRaises(ValueError):
+            submit_tenant_sync(self.app, "nope", 1)
+
+    def test_runs_tenant_and_records_state(self):
+        release = threading.Event()
+        done = threading.Event()
+
+        def fake_sync(admin_id):
+            release.wait(5)
+            done.set()
+            return {"status": "success", "added": 2}
+
+        register_provider("test", MagicbricksSettings, MagicbricksSettings.is_active, fake_sync)
+        admin_id = self.admins[0].id
+
+        self.assertTrue(submit_tenant_sync(self.app, "test", admin_id))
+        # Same tenant again while the first run is in flight
+        self.assertFalse(submit_tenant_sync(self.app, "test", admin_id))
+
+        release.set()
+        self.assertTrue(done.wait(5))
+        for _ in range(100):
+            if ("test", admin_id) not in sync_orchestrator._active:
+                break
+            time.sleep(0.05)
+
+        db.session.expire_all()
+        state = TenantSyncState.query.filter_by(provider="test", admin_id=admin_id).one()
+        self.assertFalse(state.in_flight)
+        self.assertEqual(state.last_outcome, "success")
+        self.assertEqual(state.last_added, 2)
+        self.assertEqual(state.run_count, 1)
+
+        status = get_sync_status(admin_id)
+        self.assertEqual(len(status["tenants"]), 1)
+        self.assertEqual(status["queues"]["test"]["pending"], 0)
+
+    def test_claim_respects_in_flight_until_stale(self):
+        admin_id = self.admins[0].id
+        self.assertTrue(_claim(self.app, "test", admin_id))
+        self.assertFalse(_claim(self.app, "test", admin_id))
+
+        state = TenantSyncState.query.filter_by(provider="test", admin_id=admin_id).one()
+        state.last_started_at = now() - timedelta(hours=2)
+        db.session.commit()
+        self.assertTrue(_claim(self.app, "test", admin_id))
+
+
+if __name__ == '__main__':
+    unittest.main()
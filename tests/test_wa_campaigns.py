@@ -0,0 +1,243 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import io
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from app.models import (
+    db, Admin, Lead, WhatsAppConfig, WATemplate, WACampaign, WACampaignRecipient, WAConversation, WAMessage
+)
+from app.routes.whatsapp import bp as whatsapp_bp
+from app.services import wa_campaigns, wa_tenants
+from app.utils import rate_limit
+
+INVALID_PHONE = "919800000099"
+
+
+class BrandmoStandIn(BaseHTTPRequestHandler):
+    """Answers template sends like Brandmo: throttles the first `throttle` calls, rejects INVALID_PHONE."""
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.calls.append(body)
+            throttled = server.throttle > 0
+            server.throttle -= throttled
+            n = len(server.calls)
+        if throttled:
+            self.reply(429, {"error": {"code": 130429, "message": "Rate limit hit"}})
+        elif body["to"] == INVALID_PHONE:
+            self.reply(400, {"error": {"code": 131026, "message": "Message undeliverable"}})
+        else:
+            self.reply(200, {"messages": [{"id": f"wamid.{n}"}]})
+
+    def reply(self, code, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestWACampaigns(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), BrandmoStandIn)
+        self.server.lock, self.server.calls, self.server.throttle = threading.Lock(), [], 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.app = Flask(__name__)
+        self.app.config.update({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_ENGINE_OPTIONS": {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}},
+            "SECRET_KEY": "test",
+            "JWT_SECRET_KEY": "campaign-test-secret-key-0123456789",
+            "BRANDMO_BASE_URL": f"http://127.0.0.1:{self.server.server_port}/api/meta",
+            "WA_CAMPAIGN_RATE_PER_SECOND": 1000,
+            "WA_CAMPAIGN_BATCH_SIZE": 2,
+            "WA_CAMPAIGN_RETRY_BACKOFF_SECONDS": 0.01,
+        })
+        JWTManager(self.app)
+        self.app.register_blueprint(whatsapp_bp)
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        self.admin_id = admin.id
+        cfg = WhatsAppConfig(admin_id=admin.id, phone_number_id="pn-1", waba_id="waba-1", is_active=True)
+        cfg.set_token("wa-token")
+        db.session.add_all([cfg, WATemplate(admin_id=admin.id, name="offer", language="en_US",
+                                            status="APPROVED", body_text="Hi {{1}}, new homes in {{2}}")])
+        for name, phone, status in [("Ravi", "9800000001", "new"), ("Asha", "9800000002", "new"),
+                                    ("Bad", INVALID_PHONE, "new"), ("Nophone", "", "new"),
+                                    ("Old", "9800000005", "junk")]:
+            db.session.add(Lead(admin_id=admin.id, name=name, phone=phone, status=status, location="Pune"))
+        db.session.commit()
+
+        wa_tenants._tenants = wa_tenants._phones = None
+        rate_limit._buckets.clear()
+        patcher = patch.object(wa_campaigns.dispatcher, "notify")   # dispatch synchronously below
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        token = create_access_token(identity=str(admin.id), additional_claims={"role": "admin"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create(self, **body):
+        body = dict({"name": "Launch", "template_name": "offer",
+                     "parameters": ["{{lead_name}}", "{{lead_location}}"]}, **body)
+        resp = self.client.post("/api/whatsapp/campaigns", json=body, headers=self.headers)
+        self.assertEqual(resp.status_code, 201, resp.get_json())
+        return resp.get_json()
+
+    def status(self, campaign_id, **params):
+        resp = self.client.get(f"/api/whatsapp/campaigns/{campaign_id}", query_string=params, headers=self.headers)
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_json()
+
+    def test_segment_campaign_end_to_end(self):
+        created = self.create(segment={"status": "new"}, start=True)
+        self.assertEqual((created["campaign"]["total"], created["skipped"]), (3, 1))   # no phone -> skipped
+        wa_campaigns.dispatcher.notify.assert_called_once()
+
+        self.assertEqual(wa_campaigns.dispatch(self.app), 1)
+
+        campaign = self.status(created["campaign"]["id"], recipients="failed")
+        self.assertEqual(campaign["campaign"]["status"], "completed")
+        self.assertEqual((campaign["campaign"]["sent"], campaign["campaign"]["failed"]), (2, 1))
+        self.assertEqual(campaign["campaign"]["progress"], 100.0)
+        self.assertEqual([r["error"] for r in campaign["recipients"]], ["Message undeliverable"])
+
+        sent = {c["to"]: [p["text"] for p in c["template"]["components"][0]["parameters"]] for c in self.server.calls}
+        self.assertEqual(sent["919800000001"], ["Ravi", "Pune"])
+        self.assertNotIn("919800000005", sent)
+
+        # Sent templates show up in the inbox, ready for receipts and replies
+        previews = {m.message_text for m in WAMessage.query.all()}
+        self.assertEqual(previews, {"Hi Ravi, new homes in Pune", "Hi Asha, new homes in Pune"})
+        self.assertEqual(WAConversation.query.filter(WAConversation.last_message_status == "sent").count(), 2)
+
+    def test_throttled_sends_are_retried(self):
+        self.server.throttle = 2
+        campaign_id = self.create(segment={"status": "new"}, start=True)["campaign"]["id"]
+        wa_campaigns.dispatch(self.app)
+
+        campaign = self.status(campaign_id)["campaign"]
+        self.assertEqual((campaign["sent"], campaign["failed"]), (2, 1))
+        self.assertEqual(len(self.server.calls), 3 + 2)
+        self.assertEqual(sum(r.attempts for r in WACampaignRecipient.query.all()), 5)
+
+    def test_progress_is_written_per_batch(self):
+        for n in range(6, 10):
+            db.session.add(Lead(admin_id=self.admin_id, name=f"L{n}", phone=f"980000000{n}", status="new"))
+        db.session.commit()
+        self.create(segment={"status": "new"}, start=True)   # 7 recipients, batches of 2
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            wa_campaigns.dispatch(self.app)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+
+        counters = [s for s in statements if s.startswith("UPDATE wa_campaigns SET sent_count")]
+        recipients = [s for s in statements if s.startswith("UPDATE wa_campaign_recipients SET status=?, attempts")]
+        self.assertEqual((len(counters), len(recipients)), (4, 4))
+        self.assertEqual(WACampaign.query.one().sent_count, 6)
+
+    def test_upload_with_custom_columns(self):
+        csv_body = "phone,name,city\n98000 00011,Meera,Nashik\n+91 9800000011,Meera again,Nashik\nabc,Nobody,\n"
+        resp = self.client.post("/api/whatsapp/campaigns", headers=self.headers, data={
+            "name": "Upload", "template_name": "offer", "parameters": json.dumps(["{{name}}", "{{city}}"]),
+            "file": (io.BytesIO(csv_body.encode()), "list.csv"),
+        }, content_type="multipart/form-data")
+        self.assertEqual(resp.status_code, 201, resp.get_json())
+        data = resp.get_json()
+        self.assertEqual((data["campaign"]["status"], data["campaign"]["total"], data["skipped"]), ("draft", 1, 2))
+        self.assertEqual(WACampaignRecipient.query.one().params, ["Meera", "Nashik"])
+
+        self.assertEqual(wa_campaigns.dispatch(self.app), 0)   # drafts are not sent
+        resp = self.client.post(f"/api/whatsapp/campaigns/{data['campaign']['id']}/start", headers=self.headers)
+        self.assertEqual(resp.status_code, 200)
+        wa_campaigns.dispatch(self.app)
+        self.assertEqual([c["to"] for c in self.server.calls], ["919800000011"])
+
+    def test_cancel_and_interrupted_sends(self):
+        campaign_id = self.create(segment={"status": "new"})["campaign"]["id"]
+        # A dispatcher died mid-batch: its in-flight recipient must not be messaged twice
+        first = WACampaignRecipient.query.order_by(WACampaignRecipient.id).first()
+        first.status = "sending"
+        db.session.commit()
+
+        self.client.post(f"/api/whatsapp/campaigns/{campaign_id}/start", headers=self.headers)
+        resp = self.client.post(f"/api/whatsapp/campaigns/{campaign_id}/cancel", headers=self.headers)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(wa_campaigns.dispatch(self.app), 0)   # cancelled before it was claimed
+
+        self.client.post(f"/api/whatsapp/campaigns/{campaign_id}/start", headers=self.headers)
+        wa_campaigns.dispatch(self.app)
+        db.session.expire_all()
+        self.assertNotIn(first.phone, [c["to"] for c in self.server.calls])
+        campaign = self.status(campaign_id)["campaign"]
+        self.assertEqual((campaign["status"], campaign["sent"], campaign["failed"]), ("completed", 1, 2))
+
+    def test_one_running_campaign_per_admin(self):
+        ids = []
+        for name in ("First", "Second"):
+            ids.append(self.create(name=name, segment={"status": "new"})["campaign"]["id"])
+            self.client.post(f"/api/whatsapp/campaigns/{ids[-1]}/start", headers=self.headers)
+        raced = []
+
+        def other_dispatcher(conn, cursor, statement, parameters, *args):
+            # Claims the first campaign between our read and our UPDATE
+            if statement.startswith("UPDATE wa_campaigns") and not raced:
+                raced.append(True)
+                cursor.execute("UPDATE wa_campaigns SET status = 'running', heartbeat_at = ? WHERE id = ?",
+                               (str(wa_campaigns.now()), ids[0]))
+
+        event.listen(db.engine, "before_cursor_execute", other_dispatcher)
+        try:
+            self.assertIsNone(wa_campaigns.claim_campaign(300))
+        finally:
+            event.remove(db.engine, "before_cursor_execute", other_dispatcher)
+        db.session.expire_all()
+        self.assertEqual([db.session.get(WACampaign, i).status for i in ids], ["running", "queued"])
+
+    def test_unknown_segment_filter(self):
+        resp = self.client.post("/api/whatsapp/campaigns", headers=self.headers, json={
+            "name": "x", "template_name": "offer", "segment": {"stage": "new"}})
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(WACampaign.query.count(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
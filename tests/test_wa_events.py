@@ -0,0 +1,168 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy.pool import StaticPool
+from app.models import db, Admin, WhatsAppConfig, WAConversation, WAMessage
+from app.routes.whatsapp import bp as whatsapp_bp
+from app.services import wa_events, wa_inbox, wa_tenants
+from app.services.wa_events import EventBus, new_event
+
+
+def inbound(wamid, sender, ts):
+    return {"entry": [{"changes": [{"value": {
+        "metadata": {"phone_number_id": "pn-1"},
+        "messages": [{"id": wamid, "from": sender, "timestamp": str(ts), "type": "text", "text": {"body": "hi"}}],
+    }}]}]}
+
+
+def parse(chunk):
+    fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n"))
+    return fields.get("event"), json.loads(fields["data"]), fields.get("id")
+
+
+class TestWAEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "poolclass": StaticPool, "connect_args": {"check_same_thread": False}
+        }
+        self.app.config["WA_EVENTS_KEEPALIVE_SECONDS"] = 0.05
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        self.admin_id = admin.id
+        db.session.add(WhatsAppConfig(admin_id=admin.id, phone_number_id="pn-1", is_active=True))
+        db.session.commit()
+        wa_tenants._tenants = wa_tenants._phones = None
+
+        self.bus = EventBus(backlog=3)
+        patcher = patch.object(wa_events, "bus", self.bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_events_publish_on_commit_only(self):
+        sub, _ = self.bus.subscribe(self.admin_id)
+        wa_events.emit(self.admin_id, "lock", {"conversation_id": 1})
+        self.assertTrue(sub.queue.empty())
+        db.session.commit()
+        self.assertEqual(sub.queue.get_nowait()["type"], "lock")
+
+        wa_events.emit(self.admin_id, "lock", {"conversation_id": 2})
+        db.session.rollback()
+        db.session.commit()
+        self.assertTrue(sub.queue.empty())
+
+    def test_drain_publishes_messages_and_statuses(self):
+        sub, _ = self.bus.subscribe(self.admin_id)
+        other, _ = self.bus.subscribe(self.admin_id + 1)
+        wa_inbox.enqueue(inbound("wamid.1", "919800000001", 1700000000))
+        db.session.commit()
+        wa_inbox.drain(self.app)
+
+        evt = sub.queue.get_nowait()
+        self.assertEqual(evt["type"], "message")
+        self.assertEqual((evt["data"]["sender_type"], evt["data"]["preview"]), ("customer", "hi"))
+        self.assertTrue(other.queue.empty())
+
+        conv = WAConversation.query.one()
+        db.session.add(WAMessage(conversation_id=conv.id, admin_id=self.admin_id, whatsapp_msg_id="wamid.out",
+                                 sender_type="agent", status="read"))
+        db.session.commit()
+        for status in ("delivered", "failed"):
+            wa_inbox.enqueue({"entry": [{"changes": [{"value": {"metadata": {"phone_number_id": "pn-1"}, "statuses": [
+                {"id": "wamid.out", "status": status, "timestamp": "1700000100"}
+            ]}}]}]})
+            db.session.commit()
+            wa_inbox.drain(self.app)
+        # "delivered" would move the message backwards, so only "failed" is pushed
+        evt = sub.queue.get_nowait()
+        self.assertEqual((evt["type"], evt["data"]["status"]), ("status", "failed"))
+        self.assertTrue(sub.queue.empty())
+
+    def test_resume_from_last_event_id(self):
+        events = [new_event(self.admin_id, "message", {"n": n}) for n in range(4)]
+        for evt in events:
+            self.bus.deliver(evt)
+
+        _, replay = self.bus.subscribe(self.admin_id, events[1]["id"])
+        self.assertEqual([e["data"]["n"] for e in replay], [2, 3])
+        _, replay = self.bus.subscribe(self.admin_id, events[0]["id"])   # fell out of the buffer
+        self.assertIsNone(replay)
+
+    def test_stream_replays_then_streams(self):
+        first = new_event(self.admin_id, "message", {"conversation_id": 7})
+        self.bus.deliver(first)
+        self.bus.deliver(new_event(self.admin_id, "status", {"conversation_id": 7, "status": "read"}))
+
+        stream = wa_events.open_stream(self.app, self.admin_id, first["id"])
+        self.assertTrue(next(stream).startswith("retry:"))
+        self.assertEqual(parse(next(stream))[:2], ("status", {"conversation_id": 7, "status": "read"}))
+        self.assertEqual(next(stream), ": keepalive\n\n")
+
+        self.bus.deliver(new_event(self.admin_id, "lock", {"conversation_id": 7}))
+        self.assertEqual(parse(next(stream))[0], "lock")
+        stream.close()
+        self.assertEqual(self.bus._subscribers, {})
+
+    def test_unknown_last_event_id_asks_for_resync(self):
+        stream = wa_events.open_stream(self.app, self.admin_id, "gone")
+        next(stream)
+        self.assertEqual(parse(next(stream))[0], "resync")
+        stream.close()
+
+    def test_open_streams_are_capped(self):
+        self.app.config["WA_EVENTS_MAX_STREAMS"] = 2
+        first = wa_events.open_stream(self.app, self.admin_id)
+        second = wa_events.open_stream(self.app, self.admin_id + 1)
+        self.assertTrue(next(second).startswith("retry:"))
+        with self.assertRaises(wa_events.StreamLimitReached):
+            wa_events.open_stream(self.app, self.admin_id)
+
+        # A client that left before the first chunk still frees its slot
+        first.close()
+        second.close()
+        second.close()
+        wa_events.open_stream(self.app, self.admin_id).close()
+        self.assertEqual(self.bus._open, 0)
+
+    def test_full_worker_answers_503_with_retry(self):
+        self.app.config.update({"WA_EVENTS_MAX_STREAMS": 0, "JWT_SECRET_KEY": "events-test-secret-key-0123456789"})
+        JWTManager(self.app)
+        self.app.register_blueprint(whatsapp_bp)
+        token = create_access_token(identity=str(self.admin_id), additional_claims={"role": "admin"})
+
+        resp = self.app.test_client().get("/api/whatsapp/events", headers={"Authorization": f"Bearer {token}"})
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.get_data(as_text=True), "retry: 3000\n\n")
+        self.assertEqual(resp.headers["Retry-After"], "3")
+
+    def test_notify_payload_fits_postgres_limit(self):
+        evt = new_event(self.admin_id, "message", {"conversation_id": 7, "message_id": 9, "preview": "x" * 9000})
+        payload = json.loads(wa_events._notify_payload(evt))
+        self.assertEqual(payload["data"], {"conversation_id": 7, "message_id": 9, "truncated": True})
+        self.assertEqual(payload["id"], evt["id"])
+
+
+if __name__ == '__main__':
+    unittest.main()
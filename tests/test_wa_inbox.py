@@ -0,0 +1,332 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import json
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.dialects import postgresql
+from app.models import (
+    db, Admin, User, WhatsAppConfig, WAContact, WAConversation, WAConversationLock, WAMessage,
+    WAMessageStatusLog, WAWebhookInbox
+)
+from app.routes.whatsapp import bp as whatsapp_bp, inbox_page
+from app.services import wa_inbox, wa_tenants
+from app.services.wa_inbox import drain
+
+
+def inbound(phone_number_id, wamid, sender, ts, text="hi", name=None):
+    value = {
+        "metadata": {"phone_number_id": phone_number_id},
+        "messages": [{"id": wamid, "from": sender, "timestamp": str(ts), "type": "text", "text": {"body": text}}],
+    }
+    if name:
+        value["contacts"] = [{"profile": {"name": name}, "wa_id": sender}]
+    return {"entry": [{"changes": [{"field": "messages", "value": value}]}]}
+
+
+def receipt(phone_number_id, wamid, status, ts, **extra):
+    status_obj = dict({"id": wamid, "status": status, "timestamp": str(ts)}, **extra)
+    return {"entry": [{"changes": [{"value": {"metadata": {"phone_number_id": phone_number_id},
+                                               "statuses": [status_obj]}}]}]}
+
+
+class TestWAInbox(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "poolclass": StaticPool, "connect_args": {"check_same_thread": False}
+        }
+        self.app.config["WA_INBOX_MAX_ATTEMPTS"] = 2
+        self.app.register_blueprint(whatsapp_bp)
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        self.admins = []
+        for i, phone_id in enumerate(["pn-1", "pn-2"]):
+            admin = Admin(name=f"A{i}", email=f"a{i}@x.test", password_hash="x")
+            db.session.add(admin)
+            db.session.flush()
+            db.session.add(WhatsAppConfig(admin_id=admin.id, phone_number_id=phone_id, is_active=True))
+            self.admins.append(admin.id)
+        db.session.commit()
+        wa_tenants._tenants = wa_tenants._phones = None
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def post(self, payload):
+        with patch("app.services.wa_inbox.drainer.notify") as notify:
+            resp = self.client.post("/api/whatsapp/webhook", json=payload)
+        self.assertEqual(resp.status_code, 200)
+        return notify
+
+    def test_webhook_only_enqueues(self):
+        notify = self.post(inbound("pn-1", "wamid.1", "919800000001", 1700000000))
+        notify.assert_called_once()
+
+        row = WAWebhookInbox.query.one()
+        self.assertEqual(row.status, "pending")
+        self.assertEqual(row.payload["entry"][0]["changes"][0]["value"]["messages"][0]["id"], "wamid.1")
+        self.assertEqual(WAMessage.query.count(), 0)
+
+    def test_drain_batches_messages(self):
+        t0 = 1700000000
+        conv = None
+        self.post(inbound("pn-1", "wamid.1", "919800000001", t0, name="Ravi"))
+        self.post(inbound("pn-1", "wamid.2", "919800000001", t0 + 60))
+        self.post(inbound("pn-1", "wamid.1", "919800000001", t0))           # redelivery
+        self.post(inbound("pn-2", "wamid.3", "919800000001", t0 + 5))       # same phone, other admin
+        self.post(inbound("pn-unknown", "wamid.4", "919800000009", t0))     # no config: dropped
+
+        # An existing closed conversation is reopened and its counters added to
+        contact = WAContact(admin_id=self.admins[1], phone_number="919800000001")
+        db.session.add(contact)
+        db.session.flush()
+        conv = WAConversation(admin_id=self.admins[1], contact_id=contact.id, status="closed", unread_count=3)
+        db.session.add(conv)
+        db.session.commit()
+
+        self.assertEqual(drain(self.app), 5)
+        self.assertEqual(WAWebhookInbox.query.count(), 0)
+        self.assertEqual(sorted(m.whatsapp_msg_id for m in WAMessage.query.all()), ["wamid.1", "wamid.2", "wamid.3"])
+
+        first = WAConversation.query.filter_by(admin_id=self.admins[0]).one()
+        self.assertEqual(first.unread_count, 2)
+        self.assertEqual(first.last_message_at, datetime.utcfromtimestamp(t0 + 60))
+        self.assertEqual(first.last_customer_msg_at, datetime.utcfromtimestamp(t0 + 60))
+        self.assertEqual(first.contact.profile_name, "Ravi")
+
+        reopened = db.session.get(WAConversation, conv.id)
+        self.assertEqual((reopened.status, reopened.unread_count), ("open", 4))
+        self.assertEqual(WAContact.query.count(), 2)
+
+        # A later batch with the same messages adds nothing
+        self.post(inbound("pn-1", "wamid.2", "919800000001", t0 + 60))
+        drain(self.app)
+        self.assertEqual(WAConversation.query.filter_by(admin_id=self.admins[0]).one().unread_count, 2)
+
+    def test_same_wamid_for_two_admins(self):
+        t0 = 1700000000
+        self.post(inbound("pn-1", "wamid.shared", "919800000001", t0))
+        drain(self.app)
+        # Same wamid under another admin, in one batch with a redelivery to the first
+        self.post(inbound("pn-2", "wamid.shared", "919800000001", t0))
+        self.post(inbound("pn-1", "wamid.shared", "919800000001", t0))
+        self.post(inbound("pn-2", "wamid.shared", "919800000001", t0))
+
+        drain(self.app)
+        self.assertEqual(sorted(m.admin_id for m in WAMessage.query.filter_by(whatsapp_msg_id="wamid.shared")),
+                         sorted(self.admins))
+        self.assertEqual([c.unread_count for c in WAConversation.query.order_by(WAConversation.admin_id)], [1, 1])
+
+    def test_statuses_stay_within_the_receiving_admin(self):
+        t0 = 1700000000
+        self.post(inbound("pn-1", "wamid.shared", "919800000001", t0))
+        self.post(inbound("pn-2", "wamid.shared", "919800000001", t0))
+        drain(self.app)
+        for msg in WAMessage.query.filter_by(whatsapp_msg_id="wamid.shared"):
+            msg.status = "sent"
+        db.session.commit()
+
+        self.post(receipt("pn-1", "wamid.shared", "read", t0 + 10))
+        self.post(receipt("pn-2", "wamid.shared", "delivered", t0 + 5))
+        self.post(receipt("pn-unknown", "wamid.shared", "failed", t0 + 20))   # no tenant: ignored
+        drain(self.app)
+
+        db.session.expire_all()
+        by_admin = {m.admin_id: m for m in WAMessage.query.filter_by(whatsapp_msg_id="wamid.shared")}
+        self.assertEqual([by_admin[a].status for a in self.admins], ["read", "delivered"])
+        logs = {(l.message_id, l.status) for l in WAMessageStatusLog.query.all()}
+        self.assertEqual(logs, {(by_admin[self.admins[0]].id, "read"), (by_admin[self.admins[1]].id, "delivered")})
+
+    def test_insert_ignore_drops_duplicate_rows(self):
+        # What two drainers racing past the (admin_id, wamid) check would insert
+        self.post(inbound("pn-1", "wamid.1", "919800000001", 1700000000))
+        drain(self.app)
+        msg = WAMessage.query.one()
+        row = {"conversation_id": msg.conversation_id, "admin_id": msg.admin_id, "whatsapp_msg_id": "wamid.1",
+               "sender_type": "customer", "status": "received", "created_at": msg.created_at}
+
+        saved = db.session.execute(wa_inbox._insert_ignore(WAMessage).returning(WAMessage.id), [row]).all()
+        self.assertEqual(saved, [])
+        # The guarantee is per (admin_id, wamid, created_at): another timestamp is a new row
+        saved = db.session.execute(wa_inbox._insert_ignore(WAMessage).returning(WAMessage.id),
+                                   [dict(row, created_at=msg.created_at + timedelta(seconds=1))]).all()
+        self.assertEqual(len(saved), 1)
+
+    def test_drain_applies_statuses_with_precedence(self):
+        self.post(inbound("pn-1", "wamid.in", "919800000001", 1700000000))
+        drain(self.app)
+        conv = WAConversation.query.one()
+        db.session.add(WAMessage(conversation_id=conv.id, admin_id=self.admins[0], whatsapp_msg_id="wamid.out",
+                                 sender_type="agent", status="sent"))
+        db.session.commit()
+
+        self.post(receipt("pn-1", "wamid.out", "read", 1700000100))
+        self.post(receipt("pn-1", "wamid.out", "delivered", 1700000090))   # late, lower precedence
+        self.post(receipt("pn-1", "wamid.unknown", "read", 1700000100))
+        drain(self.app)
+
+        msg = WAMessage.query.filter_by(whatsapp_msg_id="wamid.out").one()
+        self.assertEqual(msg.status, "read")
+        self.assertEqual(sorted(l.status for l in WAMessageStatusLog.query.all()), ["delivered", "read"])
+
+        self.post(receipt("pn-1", "wamid.out", "failed", 1700000200, errors=[{"code": 131047, "message": "Re-engagement"}]))
+        drain(self.app)
+        msg = WAMessage.query.filter_by(whatsapp_msg_id="wamid.out").one()
+        self.assertEqual((msg.status, msg.error_code), ("failed", "131047"))
+
+    def test_statuses_are_coalesced_per_message(self):
+        self.post(inbound("pn-1", "wamid.in", "919800000001", 1700000000))
+        drain(self.app)
+        conv = WAConversation.query.one()
+        for wamid in ("wamid.a", "wamid.b"):
+            db.session.add(WAMessage(conversation_id=conv.id, admin_id=self.admins[0], whatsapp_msg_id=wamid,
+                                     sender_type="agent", status="sent"))
+        db.session.commit()
+
+        self.post({"entry": [{"changes": [{"value": {"metadata": {"phone_number_id": "pn-1"}, "statuses": [
+            {"id": "wamid.a", "status": "delivered", "timestamp": "1700000010"},
+            {"id": "wamid.b", "status": "delivered", "timestamp": "1700000011"},
+            {"id": "wamid.a", "status": "read", "timestamp": "1700000020"},
+        ]}}]}]})
+        self.post(receipt("pn-1", "wamid.a", "read", 1700000020))          # redelivered
+        self.post(receipt("pn-1", "wamid.b", "delivered", 1700000011))     # redelivered
+        with patch("app.services.wa_inbox._status_update", wraps=wa_inbox._status_update) as status_update:
+            drain(self.app)
+
+        status_update.assert_called_once()
+        self.assertEqual(sorted(r["status"] for r in status_update.call_args[0][0]), ["delivered", "read"])
+        db.session.expire_all()
+        self.assertEqual(WAMessage.query.filter_by(whatsapp_msg_id="wamid.a").one().status, "read")
+        logs = WAMessageStatusLog.query.order_by(WAMessageStatusLog.id).all()
+        self.assertEqual([l.status for l in logs], ["delivered", "delivered", "read"])
+        self.assertEqual(json.loads(logs[0].raw_payload), {"id": "wamid.a", "status": "delivered", "timestamp": "1700000010"})
+
+        # With sampling off, only the status is logged
+        self.app.config["WA_STATUS_RAW_SAMPLE_RATE"] = 0
+        self.post(receipt("pn-1", "wamid.b", "read", 1700000030))
+        drain(self.app)
+        log = WAMessageStatusLog.query.order_by(WAMessageStatusLog.id.desc()).first()
+        self.assertEqual((log.status, log.raw_payload), ("read", None))
+
+    def test_raw_payload_sampling_keeps_failures(self):
+        status_obj = {"id": "wamid.a", "status": "read", "timestamp": "1700000020"}
+        self.assertEqual(wa_inbox._raw_payload(status_obj, 1.0), '{"id":"wamid.a","status":"read","timestamp":"1700000020"}')
+        self.assertIsNone(wa_inbox._raw_payload(status_obj, 0))
+        self.assertIsNotNone(wa_inbox._raw_payload(dict(status_obj, status="failed"), 0))
+
+    def test_postgres_status_update_is_one_statement(self):
+        executed = []
+        with patch.object(db.session, "get_bind") as get_bind, patch.object(db.session, "execute", executed.append):
+            get_bind.return_value.dialect.name = "postgresql"
+            wa_inbox._status_update([
+                {"id": 1, "created_at": datetime(2026, 9, 30), "status": "read",
+                 "error_code": None, "error_message": None},
+                {"id": 2, "created_at": datetime(2026, 10, 2), "status": "failed",
+                 "error_code": "131047", "error_message": "x"},
+            ])
+        compiled = executed[0].compile(dialect=postgresql.dialect())
+        sql = str(compiled)
+        self.assertRegex(sql, r"UPDATE wa_messages SET .* FROM \(VALUES .*\) AS v \(id, status, error_code, error_message\)")
+        # Bounded to the batch's created_at range, so other monthly partitions are pruned
+        self.assertIn("wa_messages.created_at BETWEEN", sql)
+        self.assertIn(datetime(2026, 9, 30), compiled.params.values())
+
+    def test_inbox_row_follows_latest_message(self):
+        self.post(inbound("pn-1", "wamid.2", "919800000001", 1700000060, text="second", name="Ravi"))
+        self.post(inbound("pn-1", "wamid.1", "919800000001", 1700000000, text="first"))   # arrives late
+        drain(self.app)
+
+        conv = WAConversation.query.one()
+        second = WAMessage.query.filter_by(whatsapp_msg_id="wamid.2").one()
+        self.assertEqual((conv.last_message_id, conv.last_message_preview, conv.last_message_type),
+                         (second.id, "second", "text"))
+        self.assertEqual(conv.contact_display_name, "Ravi")
+
+        # Outbound send, then its receipt reaches the inbox row
+        out = WAMessage(conversation_id=conv.id, admin_id=self.admins[0], whatsapp_msg_id="wamid.out",
+                        sender_type="agent", message_type="image", caption="Brochure", status="sent")
+        db.session.add(out)
+        conv.record_message(out)
+        db.session.commit()
+        self.post(receipt("pn-1", "wamid.out", "read", 1700000100))
+        drain(self.app)
+        db.session.expire_all()
+        conv = WAConversation.query.one()
+        self.assertEqual((conv.last_message_preview, conv.last_message_type, conv.last_message_status),
+                         ("Brochure", "image", "read"))
+
+    def test_inbox_page_takes_two_queries(self):
+        for n in range(5):
+            self.post(inbound("pn-1", f"wamid.{n}", f"91980000000{n}", 1700000000 + n, text=f"hello {n}"))
+        drain(self.app)
+        agent = User(name="Agent", email="agent@x.test", password_hash="x", admin_id=self.admins[0])
+        db.session.add(agent)
+        db.session.flush()
+        convs = WAConversation.query.order_by(WAConversation.id).all()
+        convs[0].assigned_agent_id = agent.id
+        db.session.add_all([
+            WAConversationLock(conversation_id=convs[0].id, agent_id=agent.id),
+            WAConversationLock(conversation_id=convs[1].id, agent_id=agent.id,
+                               expires_at=datetime.utcnow() - timedelta(minutes=1)),
+        ])
+        db.session.commit()
+        db.session.expire_all()
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            items, total = inbox_page(self.admins[0], "open", 1, 3)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(total, 5)
+        self.assertEqual([i["last_message"]["message_text"] for i in items], ["hello 4", "hello 3", "hello 2"])
+        self.assertEqual(inbox_page(self.admins[0], "open", 3, 3), ([], 5))
+
+        by_id = {i["id"]: i for i in inbox_page(self.admins[0], "all", 1, 10)[0]}
+        self.assertEqual((by_id[convs[0].id]["locked_by_name"], by_id[convs[0].id]["assigned_agent_name"]),
+                         ("Agent", "Agent"))
+        self.assertIsNone(by_id[convs[1].id]["locked_by"])   # expired
+        self.assertEqual(by_id[convs[2].id]["contact"]["phone_number"], "919800000002")
+
+    def test_bad_payload_is_isolated_and_parked(self):
+        self.post(inbound("pn-1", "wamid.1", "919800000001", 1700000000))
+        self.post(inbound("pn-1", "wamid.bad", "919800000002", "not-a-time"))
+        self.post(inbound("pn-1", "wamid.2", "919800000003", 1700000001))
+
+        drain(self.app)
+        self.assertEqual(WAMessage.query.count(), 2)
+        bad = WAWebhookInbox.query.one()
+        self.assertEqual((bad.status, bad.attempts), ("processing", 1))
+
+        # Retried once its claim is stale
+        self.assertEqual(drain(self.app), 0)
+        self.app.config["WA_INBOX_STALE_SECONDS"] = -1
+        drain(self.app)
+        db.session.expire_all()
+        bad = WAWebhookInbox.query.one()
+        self.assertEqual((bad.status, bad.attempts), ("failed", 2))
+        self.assertIn("invalid literal", bad.error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import datetime
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from app.models import db, Admin, User, WAContact, WAConversation, WAConversationLock
+from app.routes.whatsapp import bp as whatsapp_bp
+from app.services import wa_events, wa_locks, wa_tenants
+from app.services.wa_events import EventBus
+
+
+class TestWALocks(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SECRET_KEY": "test",
+            "JWT_SECRET_KEY": "locks-test-secret-key-0123456789",
+            "WA_LOCK_TTL_SECONDS": 60,
+        })
+        JWTManager(self.app)
+        self.app.register_blueprint(whatsapp_bp)
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme Admin", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        self.admin_id = admin.id
+        # Same id as the admin: only holder_type tells them apart
+        self.agent = User(id=admin.id, name="Agent", email="a@acme.test", password_hash="x", admin_id=admin.id)
+        self.convs = []
+        for n in range(3):
+            contact = WAContact(admin_id=admin.id, phone_number=f"91980000000{n}")
+            db.session.add(contact)
+            db.session.flush()
+            self.convs.append(WAConversation(admin_id=admin.id, contact_id=contact.id, status="open"))
+        db.session.add_all([self.agent] + self.convs)
+        db.session.commit()
+        wa_tenants._tenants = wa_tenants._phones = None
+
+        self.bus = EventBus()
+        patcher = patch.object(wa_events, "bus", self.bus)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.events, _ = self.bus.subscribe(self.admin_id)
+
+        token = create_access_token(identity=str(admin.id), additional_claims={"role": "admin"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def drain_events(self):
+        events = []
+        while not self.events.queue.empty():
+            evt = self.events.queue.get_nowait()
+            events.append((evt["data"]["conversation_id"], evt["data"]["action"], evt["data"]["holder_type"]))
+        return events
+
+    def expire(self, conv_id):
+        WAConversationLock.query.filter_by(conversation_id=conv_id).update(
+            {"expires_at": datetime.datetime.utcnow() - datetime.timedelta(seconds=1)})
+        db.session.commit()
+
+    def test_acquire_renew_and_takeover(self):
+        conv_id = self.convs[0].id
+        acquired, lock = wa_locks.acquire(self.admin_id, conv_id, self.agent.id, "user")
+        db.session.commit()
+        self.assertTrue(acquired)
+        self.assertEqual(lock["name"], "Agent")
+
+        # The admin with the same id is a different holder
+        acquired, holder = wa_locks.acquire(self.admin_id, conv_id, self.admin_id, "admin")
+        self.assertFalse(acquired)
+        self.assertEqual((holder["holder_type"], holder["name"]), ("user", "Agent"))
+
+        acquired, _ = wa_locks.acquire(self.admin_id, conv_id, self.agent.id, "user", ttl_seconds=600)
+        db.session.commit()
+        self.assertTrue(acquired)   # renewed, no new event
+        self.assertEqual(self.drain_events(), [(conv_id, "taken", "user")])
+
+        self.expire(conv_id)
+        acquired, lock = wa_locks.acquire(self.admin_id, conv_id, self.admin_id, "admin")
+        db.session.commit()
+        self.assertTrue(acquired)
+        self.assertEqual(WAConversationLock.query.one().agent.name, "Acme Admin")
+        self.assertEqual(self.drain_events(), [(conv_id, "taken", "admin")])
+
+    def test_routes_and_bulk_state(self):
+        conv_a, conv_b, conv_c = (c.id for c in self.convs)
+        resp = self.client.post(f"/api/whatsapp/conversations/{conv_a}/lock", headers=self.headers)
+        self.assertEqual(resp.status_code, 200)
+        wa_locks.acquire(self.admin_id, conv_b, self.agent.id, "user")
+        db.session.commit()
+
+        resp = self.client.post(f"/api/whatsapp/conversations/{conv_b}/lock", headers=self.headers)
+        self.assertEqual((resp.status_code, resp.get_json()["locked_by_name"]), (409, "Agent"))
+
+        resp = self.client.get("/api/whatsapp/conversations/locks", headers=self.headers,
+                               query_string={"ids": f"{conv_a},{conv_b},{conv_c}"})
+        locks = resp.get_json()["locks"]
+        self.assertEqual(sorted(locks), [str(conv_a), str(conv_b)])
+        self.assertEqual(locks[str(conv_a)]["holder_type"], "admin")
+
+        inbox = self.client.get("/api/whatsapp/conversations", headers=self.headers).get_json()
+        by_id = {c["id"]: c for c in inbox["conversations"]}
+        self.assertEqual((by_id[conv_b]["locked_by_name"], by_id[conv_b]["locked_by_type"]), ("Agent", "user"))
+        self.assertIsNone(by_id[conv_c]["locked_by"])
+
+        resp = self.client.delete(f"/api/whatsapp/conversations/{conv_a}/lock", headers=self.headers)
+        self.assertTrue(resp.get_json()["released"])
+        resp = self.client.delete(f"/api/whatsapp/conversations/{conv_b}/lock", headers=self.headers)
+        self.assertFalse(resp.get_json()["released"])   # held by the agent
+        self.assertEqual(WAConversationLock.query.count(), 1)
+
+    def test_sweeper_deletes_only_expired_locks(self):
+        for conv in self.convs:
+            wa_locks.acquire(self.admin_id, conv.id, self.agent.id, "user")
+        db.session.commit()
+        self.drain_events()
+        self.expire(self.convs[0].id)
+        self.expire(self.convs[1].id)
+
+        wa_locks.sweep_expired_locks_job(self.app)
+        self.assertEqual([l.conversation_id for l in WAConversationLock.query.all()], [self.convs[2].id])
+        self.assertEqual(sorted(self.drain_events()), [(self.convs[0].id, "expired", None),
+                                                       (self.convs[1].id, "expired", None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
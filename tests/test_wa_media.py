@@ -0,0 +1,226 @@
+
+import unittest
+from unittest.mock import patch
+import sys
+import os
+import io
+import json
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from PIL import Image
+from sqlalchemy.pool import StaticPool
+from app.models import db, Admin, WhatsAppConfig, WAContact, WAConversation, WAMedia, WAMessage
+from app.routes.whatsapp import bp as whatsapp_bp
+from app.services import wa_media, wa_tenants
+
+
+def png_bytes(size=(800, 600)):
+    out = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(out, "PNG")
+    return out.getvalue()
+
+
+PNG = png_bytes()
+PDF = b"%PDF-1.4 quote"
+
+
+class BrandmoMediaStandIn(BaseHTTPRequestHandler):
+    """Media metadata under /api/meta/v19.0/<media_id>, bytes under /files/<media_id> (token required)."""
+
+    files = {"media-png": ("image/png", PNG), "media-png-again": ("image/png", PNG), "media-pdf": ("application/pdf", PDF)}
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.calls.append(self.path)
+        if self.headers.get("Authorization") != "Bearer wa-token":
+            return self.reply(401, "application/json", b"{}")
+        media_id = self.path.rsplit("/", 1)[-1]
+        if media_id not in self.files:
+            return self.reply(404, "application/json", json.dumps({"error": {"message": "expired"}}).encode())
+        mime_type, data = self.files[media_id]
+        if self.path.startswith("/files/"):
+            return self.reply(200, mime_type, data)
+        port = self.server.server_port
+        self.reply(200, "application/json", json.dumps({
+            "url": f"http://127.0.0.1:{port}/files/{media_id}", "mime_type": mime_type, "id": media_id,
+        }).encode())
+
+    def reply(self, code, content_type, data):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class MemoryStorage:
+    """The parts of the boto3 S3 client the media service uses."""
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.objects[key] = fileobj.read()
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        # n changes as objects are added, so a regenerated URL differs from a cached one
+        return f"https://storage.test/{Params['Key']}?expires={ExpiresIn}&n={len(self.objects)}"
+
+
+class TestWAMedia(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), BrandmoMediaStandIn)
+        self.server.lock, self.server.calls = threading.Lock(), []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.app = Flask(__name__)
+        self.app.config.update({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_ENGINE_OPTIONS": {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}},
+            "SECRET_KEY": "test",
+            "JWT_SECRET_KEY": "media-test-secret-key-0123456789",
+            "BRANDMO_BASE_URL": f"http://127.0.0.1:{self.server.server_port}/api/meta",
+            "WASABI_ACCESS_KEY": "key", "WASABI_SECRET_KEY": "secret", "WASABI_BUCKET_NAME": "bucket",
+            "WA_MEDIA_THUMBNAIL_PROCESSES": 1,
+        })
+        JWTManager(self.app)
+        self.app.register_blueprint(whatsapp_bp)
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        self.admin_id = admin.id
+        cfg = WhatsAppConfig(admin_id=admin.id, phone_number_id="pn-1", waba_id="waba-1", is_active=True)
+        cfg.set_token("wa-token")
+        contact = WAContact(admin_id=admin.id, phone_number="919800000001")
+        db.session.add_all([cfg, contact])
+        db.session.flush()
+        self.conv = WAConversation(admin_id=admin.id, contact_id=contact.id, status="open")
+        db.session.add(self.conv)
+        db.session.flush()
+        self.messages = {}
+        for media_id, msg_type in [("media-png", "image"), ("media-png-again", "image"),
+                                   ("media-pdf", "document"), ("media-gone", "image")]:
+            msg = WAMessage(conversation_id=self.conv.id, admin_id=admin.id, sender_type="customer",
+                            message_type=msg_type, media_id=media_id)
+            db.session.add(msg)
+            self.messages[media_id] = msg
+        db.session.commit()
+
+        wa_tenants._tenants = wa_tenants._phones = None
+        wa_media._urls = wa_media._failed = None
+        self.storage = MemoryStorage()
+        patcher = patch.object(wa_media, "_storage", self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        token = create_access_token(identity=str(admin.id), additional_claims={"role": "admin"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def media(self, media_id):
+        return self.client.get(f"/api/whatsapp/messages/{self.messages[media_id].id}/media", headers=self.headers)
+
+    def test_image_is_stored_once_with_thumbnail(self):
+        resp = self.media("media-png")
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        data = resp.get_json()
+        digest = hashlib.sha256(PNG).hexdigest()
+        key = f"wa-media/{digest[:2]}/{digest}.png"
+        self.assertTrue(data["url"].startswith(f"https://storage.test/{key}?"))
+        self.assertIn("/thumbs/", data["thumbnail_url"])
+        self.assertEqual(self.storage.objects[key], PNG)
+        thumb = Image.open(io.BytesIO(self.storage.objects[WAMedia.query.one().thumbnail_key]))
+        self.assertEqual(max(thumb.size), 320)
+
+        # Second view: no download, same (cached) URL
+        calls = len(self.server.calls)
+        self.assertEqual(self.media("media-png").get_json()["url"], data["url"])
+        self.assertEqual(len(self.server.calls), calls)
+
+        # Same bytes under another media id: downloaded, but stored once
+        self.assertEqual(self.media("media-png-again").get_json()["url"], data["url"])
+        self.assertEqual(len(self.storage.objects), 2)
+        self.assertEqual(WAMedia.query.count(), 2)
+
+    def test_documents_and_missing_media(self):
+        data = self.media("media-pdf").get_json()
+        self.assertIsNone(data["thumbnail_url"])
+        self.assertEqual((data["mime_type"], data["size_bytes"]), ("application/pdf", len(PDF)))
+
+        self.assertEqual(self.media("media-gone").status_code, 502)
+        with patch.dict(self.app.config, {"WASABI_BUCKET_NAME": ""}):
+            self.assertEqual(self.media("media-png").status_code, 503)
+
+    def test_concurrent_views_download_once(self):
+        msg = self.messages["media-png"]
+        key = (msg.admin_id, msg.media_id)
+        gate, stores = threading.Event(), []
+
+        def slow_store(admin_id, media_id, fallback_mime):
+            stores.append(media_id)
+            gate.wait(5)
+            row = WAMedia(admin_id=admin_id, media_id=media_id, sha256="x", object_key="k", mime_type="image/png")
+            db.session.add(row)
+            db.session.commit()
+            return row
+
+        def view():
+            with self.app.app_context():
+                wa_media.media_for_message(db.session.get(WAMessage, msg.id))
+
+        with patch.object(wa_media, "_store", slow_store):
+            threads = [threading.Thread(target=view) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for _ in range(500):   # until one is downloading and two are waiting
+                if wa_media._downloads.get(key, [None, 0])[1] == 3:
+                    break
+                threading.Event().wait(0.01)
+            gate.set()
+            for t in threads:
+                t.join(5)
+
+        self.assertEqual(stores, ["media-png"])
+        self.assertNotIn(key, wa_media._downloads)
+
+    def test_prefetch_warms_open_conversations(self):
+        self.assertEqual(wa_media.prefetch(self.app), 3)   # media-gone has expired upstream
+        self.assertEqual(WAMedia.query.count(), 3)
+
+        calls = len(self.server.calls)
+        self.assertEqual(wa_media.prefetch(self.app), 0)   # failures are not retried right away
+        self.assertEqual(len(self.server.calls), calls)
+
+        self.conv.status = "closed"
+        db.session.commit()
+        self.assertEqual(wa_media.pending_prefetch(50, 24), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+import datetime
+import itertools
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy.pool import StaticPool
+from app.models import (
+    db, Admin, User, Lead, WhatsAppConfig, WATemplate, WALeadAssignConfig, WAMessage, WAOutboxEvent
+)
+from app.routes.pipeline import pipeline_bp
+from app.services import wa_outbox, wa_tenants
+from app.services.lead_ingestor import LeadIngestor
+
+
+_wamids = itertools.count(1)
+
+
+def brandmo_reply(ok=True, wamid=None):
+    if ok:
+        wamid = wamid or f"wamid.{next(_wamids)}"
+        return MagicMock(ok=True, status_code=200, headers={"Content-Type": "application/json"}, text="{}",
+                         json=MagicMock(return_value={"messages": [{"id": wamid}]}),
+                         raise_for_status=MagicMock())
+    from requests import HTTPError
+    resp = MagicMock(ok=False, status_code=500, headers={"Content-Type": "application/json"}, text="boom",
+                     json=MagicMock(return_value={"error": {"message": "boom"}}))
+    resp.raise_for_status = MagicMock(side_effect=HTTPError("500", response=resp))
+    return resp
+
+
+@patch('app.services.lead_ingestor.POST_INSERT_HOOKS', [])
+@patch("app.services.whatsapp_service.requests.request")
+class TestWAOutbox(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SQLALCHEMY_ENGINE_OPTIONS": {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}},
+            "SECRET_KEY": "test",
+            "JWT_SECRET_KEY": "outbox-test-secret-key-0123456789",
+            "WA_OUTBOX_RETRY_SECONDS": 60,
+            "WA_OUTBOX_MAX_ATTEMPTS": 2,
+        })
+        JWTManager(self.app)
+        self.app.register_blueprint(pipeline_bp)
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        self.admin_id = admin.id
+        cfg = WhatsAppConfig(admin_id=admin.id, phone_number_id="pn-1", waba_id="waba-1", is_active=True)
+        cfg.set_token("wa-token")
+        self.agent = User(name="Agent", email="a@acme.test", password_hash="x", admin_id=admin.id, phone="9811111111")
+        self.other = User(name="Other", email="o@acme.test", password_hash="x", admin_id=admin.id, phone="9822222222")
+        db.session.add_all([
+            cfg, self.agent, self.other,
+            WATemplate(admin_id=admin.id, name="welcome", language="en_US", status="APPROVED", body_text="Hi {{1}}"),
+            WALeadAssignConfig(admin_id=admin.id, is_enabled=True, agent_template_name="welcome",
+                               agent_params=["{{agent_name}}"], lead_template_name="welcome",
+                               lead_params=["{{lead_name}}"]),
+        ])
+        db.session.commit()
+
+        wa_tenants._tenants = wa_tenants._phones = None
+        patcher = patch.object(wa_outbox.dispatcher, "notify")
+        self.notify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        token = create_access_token(identity=str(admin.id), additional_claims={"role": "admin"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def sent_to(self, request):
+        return [c.kwargs["json"]["to"] for c in request.call_args_list]
+
+    def test_create_lead_does_not_wait_for_brandmo(self, request):
+        resp = self.client.post("/api/pipeline/leads", headers=self.headers, json={
+            "name": "Ravi", "phone": "9876543210", "assigned_to": self.agent.id})
+        self.assertEqual(resp.status_code, 201)
+        request.assert_not_called()
+        self.notify.assert_called_once()
+        event = WAOutboxEvent.query.one()
+        self.assertEqual(event.payload["targets"], ["agent", "lead"])
+
+        request.side_effect = lambda *args, **kwargs: brandmo_reply()
+        self.assertEqual(wa_outbox.drain(self.app), 1)
+        self.assertEqual(self.sent_to(request), ["919811111111", "919876543210"])
+        self.assertEqual(WAOutboxEvent.query.count(), 0)
+        self.assertEqual(WAMessage.query.count(), 2)
+
+    def test_failed_side_is_retried_alone(self, request):
+        self.client.post("/api/pipeline/leads", headers=self.headers, json={
+            "name": "Ravi", "phone": "9876543210", "assigned_to": self.agent.id})
+        request.side_effect = [brandmo_reply(ok=False), brandmo_reply(wamid="wamid.lead")]
+        self.assertEqual(wa_outbox.drain(self.app), 0)
+
+        event = WAOutboxEvent.query.one()
+        self.assertEqual((event.status, event.attempts, event.payload["targets"]), ("pending", 1, ["agent"]))
+        self.assertIn("agent: ", event.error)
+
+        self.assertGreater(event.next_attempt_at, datetime.datetime.utcnow())
+        self.assertEqual(wa_outbox.drain(self.app), 0)   # not due yet
+        event.next_attempt_at = datetime.datetime.utcnow()
+        db.session.commit()
+
+        request.reset_mock()
+        request.side_effect = [brandmo_reply(ok=False)]
+        wa_outbox.drain(self.app)
+        db.session.expire_all()
+        self.assertEqual(self.sent_to(request), ["919811111111"])
+        self.assertEqual(WAOutboxEvent.query.one().status, "failed")   # WA_OUTBOX_MAX_ATTEMPTS reached
+
+    def test_reassignment_and_stale_events(self, request):
+        lead = Lead(admin_id=self.admin_id, name="Asha", phone="9876500000", assigned_to=self.agent.id)
+        db.session.add(lead)
+        db.session.commit()
+
+        for agent_id in (self.other.id, self.agent.id):
+            resp = self.client.put(f"/api/pipeline/leads/{lead.id}", headers=self.headers,
+                                   json={"assigned_to": agent_id})
+            self.assertEqual(resp.status_code, 200)
+        self.client.put(f"/api/pipeline/leads/{lead.id}", headers=self.headers, json={"name": "Asha K"})
+        self.assertEqual(WAOutboxEvent.query.count(), 2)
+
+        request.side_effect = lambda *args, **kwargs: brandmo_reply()
+        wa_outbox.drain(self.app)
+        # The event for the superseded assignment to "Other" is dropped unsent
+        self.assertEqual(self.sent_to(request), ["919811111111", "919876500000"])
+        self.assertEqual(WAOutboxEvent.query.count(), 0)
+
+    def test_ingest_stages_events_with_the_leads(self, request):
+        LeadIngestor(self.admin_id, "indiamart").ingest([
+            {"name": "A", "phone": "9800000001", "assigned_to": self.agent.id},
+            {"name": "B", "phone": "9800000002", "assigned_to": self.other.id},
+        ])
+        self.assertEqual(WAOutboxEvent.query.count(), 2)
+        request.assert_not_called()
+
+        WALeadAssignConfig.query.update({"is_enabled": False})
+        db.session.commit()
+        LeadIngestor(self.admin_id, "indiamart").ingest([{"name": "C", "phone": "9800000003"}])
+        self.assertEqual(WAOutboxEvent.query.count(), 2)
+
+    def test_rolled_back_lead_leaves_no_event(self, request):
+        lead = Lead(admin_id=self.admin_id, name="Gone", phone="9800000009")
+        db.session.add(lead)
+        db.session.flush()
+        wa_outbox.enqueue_lead_assignments(self.admin_id, [(lead.id, self.agent.id)])
+        db.session.rollback()
+        db.session.commit()
+        self.notify.assert_not_called()
+        self.assertEqual(WAOutboxEvent.query.count(), 0)
+
+    def test_stale_claims_are_retried(self, request):
+        db.session.add(WAOutboxEvent(admin_id=self.admin_id, event_type="lead_assigned", status="processing",
+                                     attempts=1, payload={"lead_id": 999, "agent_id": self.agent.id},
+                                     claimed_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1)))
+        db.session.commit()
+        self.assertEqual(wa_outbox.drain(self.app), 1)   # lead is gone: nothing to send, event done
+        request.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+
+import unittest
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from app.models import db, Admin, WAContact, WAConversation, WAMessage, WAMessageStatusLog
+from app.services import wa_retention
+from app.utils import partitions
+
+
+class TestWARetention(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "WA_STATUS_COMPACT_AFTER_MINUTES": 60,
+            "WA_STATUS_LOG_RETENTION_DAYS": 90,
+            "WA_STATUS_COMPACT_BATCH": 2,   # several rounds
+        })
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        contact = WAContact(admin_id=admin.id, phone_number="919800000001")
+        db.session.add(contact)
+        db.session.flush()
+        conv = WAConversation(admin_id=admin.id, contact_id=contact.id)
+        db.session.add(conv)
+        db.session.flush()
+
+        self.now = datetime.utcnow()
+        self.messages = {}
+        for name, status in [("read", "read"), ("failed", "failed"), ("delivered", "delivered"),
+                             ("old", "delivered"), ("fresh", "read")]:
+            msg = WAMessage(conversation_id=conv.id, admin_id=admin.id, sender_type="agent",
+                            whatsapp_msg_id=f"wamid.{name}", status=status)
+            db.session.add(msg)
+            self.messages[name] = msg
+        db.session.flush()
+
+        hours = lambda h: self.now - timedelta(hours=h)
+        self.log("read", ("sent", hours(5)), ("delivered", hours(4)), ("delivered", hours(3)), ("read", hours(2)))
+        self.log("failed", ("sent", hours(5)), ("failed", hours(5)))
+        self.log("delivered", ("sent", hours(5)), ("delivered", hours(4)))       # not terminal: kept
+        self.log("old", ("sent", hours(24 * 100)), ("delivered", hours(3)))     # past retention: summarized
+        self.log("fresh", ("sent", hours(0.5)), ("read", hours(0.2)))           # too recent to compact
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def log(self, name, *events):
+        for status, ts in events:
+            db.session.add(WAMessageStatusLog(message_id=self.messages[name].id, status=status, timestamp=ts))
+
+    def remaining(self, name):
+        return sorted(l.status for l in WAMessageStatusLog.query.filter_by(message_id=self.messages[name].id))
+
+    def summary(self, name):
+        db.session.expire_all()
+        return db.session.get(WAMessage, self.messages[name].id).status_timestamps
+
+    def test_terminal_messages_are_compacted(self):
+        wa_retention.maintain_wa_storage_job(self.app)
+
+        self.assertEqual(self.summary("read"), {
+            "sent": (self.now - timedelta(hours=5)).isoformat(),
+            "delivered": (self.now - timedelta(hours=4)).isoformat(),   # first one seen
+            "read": (self.now - timedelta(hours=2)).isoformat(),
+        })
+        self.assertEqual(sorted(self.summary("failed")), ["failed", "sent"])
+        self.assertEqual((self.remaining("read"), self.remaining("failed")), ([], []))
+
+        self.assertIsNone(self.summary("delivered"))
+        self.assertEqual(self.remaining("delivered"), ["delivered", "sent"])
+        self.assertEqual(self.remaining("fresh"), ["read", "sent"])
+        self.assertEqual(db.session.get(WAMessage, self.messages["read"].id).to_dict()["status_timestamps"]["read"],
+                         (self.now - timedelta(hours=2)).isoformat())
+
+    def test_retention_summarizes_then_deletes_old_logs(self):
+        wa_retention.maintain_wa_storage_job(self.app)
+        self.assertEqual(list(self.summary("old")), ["sent"])
+        self.assertEqual(self.remaining("old"), ["delivered"])
+
+    def test_late_receipt_merges_into_summary(self):
+        horizon = self.now - timedelta(hours=1)
+        wa_retention.compact_all(horizon)
+        first_read = self.summary("read")["read"]
+
+        self.log("read", ("read", self.now - timedelta(hours=1.5)),        # later duplicate
+                 ("sent", self.now - timedelta(hours=6)))                   # earlier than the summary
+        db.session.commit()
+        self.assertEqual(wa_retention.compact_all(horizon), 1)
+
+        summary = self.summary("read")
+        self.assertEqual((summary["read"], summary["sent"]),
+                         (first_read, (self.now - timedelta(hours=6)).isoformat()))
+        self.assertEqual(self.remaining("read"), [])
+
+    def test_partitions_are_postgres_only(self):
+        self.assertFalse(partitions.is_partitioned(db.session, "wa_messages"))
+        self.assertEqual(wa_retention.ensure_partitions(3), 0)
+        self.assertEqual(partitions.month_start(datetime(2026, 11, 19), 2), datetime(2027, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
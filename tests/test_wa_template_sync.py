@@ -0,0 +1,126 @@
+
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+import datetime
+import requests
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from app.models import db, Admin, WhatsAppConfig, WATemplate
+from app.services import sync_orchestrator, wa_tenants
+from app.services.whatsapp_service import BrandmoService, sync_admin_templates
+
+
+def template(name, status="APPROVED", body="Hi {{1}}", language="en_US"):
+    return {"id": f"tid-{name}", "name": name, "language": language, "status": status, "category": "MARKETING",
+            "components": [{"type": "HEADER", "format": "IMAGE"}, {"type": "BODY", "text": body}]}
+
+
+def listing(templates, etag=None, next_url=None, status=200):
+    headers = {"Content-Type": "application/json"}
+    if etag:
+        headers["ETag"] = etag
+    payload = {"data": templates, "paging": {"next": next_url} if next_url else {}}
+    return MagicMock(ok=status < 400, status_code=status, headers=headers, content=b"{...}", text="{}",
+                     json=MagicMock(return_value=payload))
+
+
+@patch("app.services.whatsapp_service.requests.request")
+class TestWATemplateSync(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "SECRET_KEY": "test",
+        })
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        self.admin_id = admin.id
+        self.cfg = WhatsAppConfig(admin_id=admin.id, phone_number_id="pn-1", waba_id="waba-1", is_active=True)
+        self.cfg.set_token("wa-token")
+        db.session.add(self.cfg)
+        db.session.commit()
+        wa_tenants._tenants = wa_tenants._phones = None
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def sync(self):
+        return BrandmoService(self.cfg).sync_templates()
+
+    def test_only_changed_rows_are_written(self, request):
+        request.return_value = listing([template("welcome"), template("offer"), template("old")])
+        self.assertEqual(self.sync(), {"synced": 3, "added": 3, "updated": 0, "deleted": 0, "not_modified": False})
+        welcome = WATemplate.query.filter_by(name="welcome").one()
+        self.assertEqual((welcome.header_type, welcome.variable_count), ("IMAGE", 1))
+
+        request.return_value = listing([template("welcome"), template("offer", status="PAUSED"), template("new")])
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            stats = self.sync()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+
+        self.assertEqual(stats, {"synced": 3, "added": 1, "updated": 1, "deleted": 1, "not_modified": False})
+        self.assertEqual(len([s for s in statements if s.startswith("SELECT wa_templates")]), 1)
+        self.assertEqual({(t.name, t.status) for t in WATemplate.query.all()},
+                         {("welcome", "APPROVED"), ("offer", "PAUSED"), ("new", "APPROVED")})
+
+    def test_unchanged_listing_is_not_refetched(self, request):
+        request.return_value = listing([template("welcome")], etag='"v1"')
+        self.sync()
+        self.assertNotIn("If-None-Match", request.call_args.kwargs["headers"])
+        self.assertEqual(db.session.get(WhatsAppConfig, self.cfg.id).templates_etag, '"v1"')
+
+        request.return_value = MagicMock(status_code=304, content=b"", text="", headers={})
+        self.assertEqual(self.sync(), {"synced": 1, "added": 0, "updated": 0, "deleted": 0, "not_modified": True})
+        self.assertEqual(request.call_args.kwargs["headers"]["If-None-Match"], '"v1"')
+        self.assertEqual(WATemplate.query.count(), 1)
+
+    def test_multi_page_listing_keeps_no_etag(self, request):
+        request.side_effect = [
+            listing([template("a")], etag='"p1"', next_url="https://brandmo.test/page2"),
+            listing([template("b")]),
+        ]
+        self.assertEqual(self.sync()["synced"], 2)
+        self.assertIsNone(db.session.get(WhatsAppConfig, self.cfg.id).templates_etag)
+
+    def test_failed_listing_keeps_local_templates(self, request):
+        request.return_value = listing([template("welcome")])
+        self.sync()
+        request.return_value = listing([], status=500)
+        with self.assertRaises(requests.HTTPError):
+            self.sync()
+        self.assertEqual(WATemplate.query.count(), 1)
+
+    def test_scheduled_sync_skips_expired_admins(self, request):
+        self.assertEqual(sync_orchestrator.list_tenants("wa_templates"), [self.admin_id])
+
+        request.return_value = listing([template("welcome")])
+        self.assertEqual(sync_admin_templates(self.admin_id), {"status": "success", "added": 1})
+
+        Admin.query.update({"expiry_date": datetime.datetime.utcnow() - datetime.timedelta(days=1)})
+        db.session.commit()
+        request.reset_mock()
+        self.assertEqual(sync_admin_templates(self.admin_id)["status"], "skipped")
+        request.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
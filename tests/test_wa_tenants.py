@@ -0,0 +1,117 @@
+
+import unittest
+from unittest.mock import patch, MagicMock
+import sys
+import os
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import event
+from app.models import db, Admin, User, Lead, WhatsAppConfig, WATemplate, WALeadAssignConfig, WAMessage
+from app.routes.whatsapp import send_lead_assignment_whatsapp
+from app.services import wa_tenants
+from app.utils import security
+
+
+class TestWATenants(unittest.TestCase):
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        self.app.config["SECRET_KEY"] = "test"
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        self.admin_id = admin.id
+        self.cfg = WhatsAppConfig(admin_id=admin.id, phone_number_id="pn-1", waba_id="waba-1", is_active=True)
+        self.cfg.set_token("wa-token")
+        db.session.add(self.cfg)
+        db.session.add(WATemplate(admin_id=admin.id, name="welcome", language="en_US", status="APPROVED",
+                                  body_text="Hi {{1}}"))
+        db.session.commit()
+
+        wa_tenants._tenants = wa_tenants._phones = None
+        self.statements = []
+        event.listen(db.engine, "before_cursor_execute", self.count)
+
+    def tearDown(self):
+        event.remove(db.engine, "before_cursor_execute", self.count)
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def test_phone_routes_are_cached(self):
+        self.assertEqual(wa_tenants.admin_ids_for_phones({"pn-1", "pn-x"}), {"pn-1": self.admin_id})
+        queries = len(self.statements)
+        self.assertEqual(wa_tenants.admin_ids_for_phones({"pn-1", "pn-x"}), {"pn-1": self.admin_id})
+        self.assertEqual(len(self.statements), queries)
+
+    def test_tenant_holds_client_and_templates(self):
+        tenant = wa_tenants.get(self.admin_id)
+        self.assertEqual(tenant.client.token, "wa-token")
+        self.assertEqual(tenant.template("welcome").language, "en_US")
+        self.assertIsNone(tenant.template("missing"))
+
+        queries = len(self.statements)
+        with patch("app.utils.security.decrypt_value") as decrypt:
+            self.assertIs(wa_tenants.get(self.admin_id), tenant)
+        decrypt.assert_not_called()
+        self.assertEqual(len(self.statements), queries)
+
+    def test_invalidate_on_disconnect_and_new_number(self):
+        wa_tenants.admin_ids_for_phones({"pn-1", "pn-2"})
+        wa_tenants.get(self.admin_id)
+
+        self.cfg.phone_number_id = "pn-2"
+        db.session.commit()
+        wa_tenants.invalidate(self.admin_id, "pn-1", "pn-2")
+        self.assertEqual(wa_tenants.admin_ids_for_phones({"pn-1", "pn-2"}), {"pn-2": self.admin_id})
+        self.assertEqual(wa_tenants.get(self.admin_id).phone_number_id, "pn-2")
+
+        self.cfg.is_active = False
+        db.session.commit()
+        self.assertIsNotNone(wa_tenants.get(self.admin_id))   # until invalidated
+        wa_tenants.invalidate(self.admin_id, "pn-2")
+        self.assertIsNone(wa_tenants.get(self.admin_id))
+        self.assertEqual(wa_tenants.admin_ids_for_phones({"pn-2"}), {})
+
+    def test_incomplete_config_is_not_a_tenant(self):
+        self.cfg.waba_id = ""
+        db.session.commit()
+        self.assertIsNone(wa_tenants.get(self.admin_id))
+
+    def test_fernet_is_built_once_per_key(self):
+        self.assertIs(security._get_fernet(), security._get_fernet())
+        self.assertEqual(security.decrypt_value(security.encrypt_value("abc")), "abc")
+
+    @patch("app.services.whatsapp_service.requests.request")
+    def test_lead_assignment_sends_with_cached_client(self, request):
+        request.return_value = MagicMock(ok=True, status_code=200, headers={"Content-Type": "application/json"},
+                                         text="{}", json=MagicMock(return_value={"messages": [{"id": "wamid.1"}]}))
+        agent = User(name="Agent", email="a@acme.test", password_hash="x", admin_id=self.admin_id)
+        db.session.add_all([agent, WALeadAssignConfig(admin_id=self.admin_id, is_enabled=True,
+                                                      lead_template_name="welcome", lead_params=["{{lead_name}}"])])
+        lead = Lead(admin_id=self.admin_id, name="Ravi", phone="9876543210", source="facebook")
+        db.session.add(lead)
+        db.session.commit()
+
+        wa_tenants.get(self.admin_id)
+        with patch("app.services.whatsapp_service.BrandmoService.__init__") as init:
+            result = send_lead_assignment_whatsapp(self.admin_id, lead, agent)
+        init.assert_not_called()
+        self.assertEqual(result["lead"]["status"], "sent")
+        self.assertEqual(WAMessage.query.one().message_text, "Hi Ravi")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+
+import unittest
+import sys
+import os
+from datetime import datetime, timedelta
+
+# Add parent directory to path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from unittest.mock import patch
+from flask import Flask
+from flask_jwt_extended import JWTManager, create_access_token
+from sqlalchemy import event
+from app.models import db, Admin, WAContact, WAConversation, WAMessage
+from app.routes.whatsapp import bp as whatsapp_bp
+
+
+class TestWATimeline(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("app.routes.whatsapp.time")
+        self.clock = patcher.start().time
+        self.clock.return_value = 1000
+        self.addCleanup(patcher.stop)
+
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
+        self.app.config["JWT_SECRET_KEY"] = "timeline-test-secret-key-0123456789"
+        self.app.config["WA_MESSAGES_DELTA_OVERLAP_SECONDS"] = 30
+        JWTManager(self.app)
+        self.app.register_blueprint(whatsapp_bp)
+        db.init_app(self.app)
+        self.ctx = self.app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+        admin = Admin(name="Acme", email="admin@acme.test", password_hash="x")
+        db.session.add(admin)
+        db.session.flush()
+        contact = WAContact(admin_id=admin.id, phone_number="919800000001")
+        db.session.add(contact)
+        db.session.flush()
+        self.conv = WAConversation(admin_id=admin.id, contact_id=contact.id, unread_count=3)
+        db.session.add(self.conv)
+        db.session.flush()
+
+        self.t0 = datetime(2026, 1, 1, 10, 0)
+        for n in range(7):
+            self.add_message(n, self.t0 + timedelta(minutes=n))
+        db.session.commit()
+
+        token = create_access_token(identity=str(admin.id), additional_claims={"role": "admin"})
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def add_message(self, n, created_at):
+        db.session.add(WAMessage(conversation_id=self.conv.id, admin_id=self.conv.admin_id, sender_type="customer",
+                                 whatsapp_msg_id=f"wamid.{n}", message_text=f"m{n}", created_at=created_at))
+
+    def get(self, **params):
+        resp = self.client.get(f"/api/whatsapp/conversations/{self.conv.id}/messages",
+                               query_string=params, headers=self.headers)
+        self.assertEqual(resp.status_code, 200, resp.get_json())
+        return resp.get_json()
+
+    def texts(self, data):
+        return [m["message_text"] for m in data["messages"]]
+
+    def test_newest_page_then_older_pages(self):
+        data = self.get(limit=3)
+        self.assertEqual(self.texts(data), ["m4", "m5", "m6"])
+        self.assertTrue(data["has_more"])
+
+        data = self.get(limit=3, before=data["cursors"]["before"])
+        self.assertEqual(self.texts(data), ["m1", "m2", "m3"])
+        self.assertIsNone(data["cursors"]["after"])
+
+        data = self.get(limit=3, before=data["cursors"]["before"])
+        self.assertEqual(self.texts(data), ["m0"])
+        self.assertFalse(data["has_more"])
+        self.assertIsNone(data["cursors"]["before"])
+
+    def test_delta_includes_late_messages(self):
+        self.clock.return_value = 1000
+        after = self.get(limit=3)["cursors"]["after"]
+        self.assertEqual(self.texts(self.get(after=after)), ["m5", "m6"])   # the page's ids, re-read
+
+        self.add_message(7, self.t0 + timedelta(minutes=10))
+        self.add_message(8, self.t0 + timedelta(minutes=2))   # delivered late, older timestamp
+        db.session.commit()
+        data = self.get(after=after)
+        self.assertEqual(self.texts(data), ["m8", "m5", "m6", "m7"])
+        self.assertEqual(data["cursors"]["after"], after)
+
+        # Once the overlap has passed, ids up to the newest seen are settled
+        self.clock.return_value = 1000 + 30
+        after = self.get(after=after)["cursors"]["after"]
+        self.assertEqual(self.texts(self.get(after=after)), ["m8", "m7"])
+        self.clock.return_value = 1000 + 60
+        after = self.get(after=after)["cursors"]["after"]
+        self.assertEqual(self.get(after=after)["messages"], [])
+
+    def test_delta_picks_up_lower_id_committed_late(self):
+        self.clock.return_value = 1000
+        after = self.get(limit=50)["cursors"]["after"]   # ids 1..7
+        self.clock.return_value = 1000 + 30
+        after = self.get(after=after)["cursors"]["after"]
+
+        # Another drainer took id 8 first but commits after id 9 is visible
+        db.session.add(WAMessage(id=9, conversation_id=self.conv.id, admin_id=self.conv.admin_id,
+                                 sender_type="customer", message_text="m9", created_at=self.t0))
+        db.session.commit()
+        self.clock.return_value = 1000 + 35
+        data = self.get(after=after)
+        self.assertEqual(self.texts(data), ["m9"])
+        db.session.add(WAMessage(id=8, conversation_id=self.conv.id, admin_id=self.conv.admin_id,
+                                 sender_type="customer", message_text="m8", created_at=self.t0))
+        db.session.commit()
+
+        data = self.get(after=data["cursors"]["after"])
+        self.assertEqual(self.texts(data), ["m8", "m9"])
+        self.clock.return_value = 1000 + 70
+        after = self.get(after=data["cursors"]["after"])["cursors"]["after"]
+        self.assertEqual(self.texts(self.get(after=after)), ["m8", "m9"])   # seen after 1030: one more window
+        self.clock.return_value = 1000 + 100
+        after = self.get(after=after)["cursors"]["after"]
+        self.assertEqual(self.get(after=after)["messages"], [])
+
+    def test_bare_id_cursor_still_works(self):
+        self.assertEqual(self.texts(self.get(after=5)), ["m5", "m6"])
+
+    def test_unread_reset_only_when_needed(self):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            self.get(limit=3)
+            self.assertEqual(sum(s.startswith("UPDATE wa_conversations") for s in statements), 1)
+            statements.clear()
+            self.get(limit=3)
+            self.get(after=1)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+
+        self.assertFalse([s for s in statements if s.startswith("UPDATE") or "count(" in s.lower()])
+        db.session.expire_all()
+        self.assertEqual(db.session.get(WAConversation, self.conv.id).unread_count, 0)
+
+    def test_newest_page_reads_hot_window_first(self):
+        recent = datetime.utcnow() - timedelta(hours=1)
+        for n in range(7, 10):
+            self.add_message(n, recent + timedelta(minutes=n))
+        db.session.commit()
+
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, "before_cursor_execute", listener)
+        try:
+            data = self.get(limit=2)
+            self.assertEqual(self.texts(data), ["m8", "m9"])
+            self.assertEqual(sum("wa_messages.conversation_id = ?" in s for s in statements), 1)
+
+            # Fewer hot messages than the page: falls back to the unbounded query
+            data = self.get(limit=5)
+            self.assertEqual(self.texts(data), ["m5", "m6", "m7", "m8", "m9"])
+            self.assertTrue(data["has_more"])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", listener)
+
+        self.assertEqual(self.texts(self.get(limit=5, before=data["cursors"]["before"])), ["m0", "m1", "m2", "m3", "m4"])
+
+    def test_bad_cursor(self):
+        resp = self.client.get(f"/api/whatsapp/conversations/{self.conv.id}/messages?before=nope",
+                               headers=self.headers)
+        self.assertEqual(resp.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()